@@ -11,14 +11,29 @@ try:
 except Exception:
     _date_condition = None
 
+try:
+    from query_plan import QueryPlan
+except ImportError:
+    from htma_dashboard.query_plan import QueryPlan
+
+try:
+    from stock_latest import stock_source
+except ImportError:
+    from htma_dashboard.stock_latest import stock_source
+
 
 def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
-    """基于数据生成智能分析建议。drill_context 可选：下钻时的 {category, brand, product_name, drill_brands, drill_styles, drill_sku_rank}，用于生成「当前品类/品牌下」维度的建议。"""
-    insights = []
-    cur = conn.cursor()
+    """基于数据生成智能分析建议。drill_context 可选：下钻时的 {category, brand, product_name, drill_brands, drill_styles, drill_sku_rank}，用于生成「当前品类/品牌下」维度的建议。
+    各项查询互不依赖，经 QueryPlan 并发执行（见 query_plan）。"""
+    plan = QueryPlan(conn)
+    declare_insight_queries(plan, store_id)
+    return compose_insights(plan.run(), store_id, drill_context)
 
-    # 1. 品类毛利率分析
-    cur.execute("""
+
+def declare_insight_queries(plan, store_id="沈阳超级仓", ns=""):
+    """把 build_insights 的查询（含比价预警）登记到 plan，任务名加前缀 ns，便于与其他报告的查询合并到同一计划。"""
+    stock = stock_source(plan.conn, store_id)
+    plan.query(ns + "cats", """
         SELECT COALESCE(category, '未分类') AS category,
                SUM(total_sale) AS total_sale, SUM(total_profit) AS total_profit,
                SUM(total_profit)/NULLIF(SUM(total_sale),0)*100 AS margin_pct
@@ -27,7 +42,64 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
         GROUP BY category
         HAVING SUM(total_sale) > 1000
     """, (store_id,))
-    cats = cur.fetchall()
+    plan.query(ns + "low_stock", f"""
+        SELECT COUNT(DISTINCT sku_code) AS cnt
+        FROM {stock}
+        WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
+        AND stock_qty < 50 AND stock_qty >= 0
+    """, (store_id, store_id), one=True)
+    plan.query(ns + "neg_profit", """
+        SELECT COUNT(*) AS cnt FROM t_htma_profit
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+        AND total_profit < 0 AND total_sale > 0
+    """, (store_id,), one=True)
+    plan.query(ns + "sale_30", """
+        SELECT COUNT(DISTINCT sku_code) AS sku_cnt, SUM(sale_qty) AS total_qty
+        FROM t_htma_sale
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+    """, (store_id,), one=True)
+    plan.query(ns + "last_date", "SELECT MAX(data_date) AS d FROM t_htma_sale WHERE store_id = %s", (store_id,), one=True)
+    plan.query(ns + "rg", """
+        SELECT COALESCE(SUM(sale_amount), 0) AS total_sale, COALESCE(SUM(return_amount), 0) AS return_amt,
+               COALESCE(SUM(gift_amount), 0) AS gift_amt
+        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+    """, (store_id,), one=True)
+    plan.query(ns + "top_brands", """
+        SELECT COALESCE(NULLIF(TRIM(brand_name), ''), '未填') AS brand_name, SUM(sale_amount) AS sale
+        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+        GROUP BY brand_name HAVING SUM(sale_amount) > 0 ORDER BY SUM(sale_amount) DESC LIMIT 5
+    """, (store_id,))
+    plan.query(ns + "stock_row", f"""
+        SELECT COALESCE(SUM(stock_amount), 0) AS total_stock
+        FROM {stock} WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
+    """, (store_id, store_id), one=True)
+    plan.query(ns + "sale_row", """
+        SELECT COALESCE(SUM(sale_amount), 0) AS sale, COALESCE(SUM(sale_cost), 0) AS cost
+        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+    """, (store_id,), one=True)
+    plan.query(ns + "missing_cost", """
+        SELECT COUNT(*) AS cnt FROM t_htma_sale
+        WHERE store_id = %s AND (sale_cost IS NULL OR sale_cost = 0) AND sale_amount > 0
+    """, (store_id,), one=True)
+    plan.query(ns + "missing_price", """
+        SELECT COUNT(*) AS cnt FROM t_htma_sale
+        WHERE store_id = %s AND (sale_price IS NULL OR sale_price = 0) AND sale_qty > 0
+    """, (store_id,), one=True)
+    plan.query(ns + "inconsistent", """
+        SELECT COUNT(*) AS cnt FROM (
+            SELECT sku_code FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code HAVING COUNT(DISTINCT COALESCE(category, '')) > 1
+        ) t
+    """, (store_id,), one=True)
+    plan.call(ns + "price_alerts", _get_price_compare_insights, store_id, fallback=[])
+    return plan
+
+
+def compose_insights(res, store_id="沈阳超级仓", drill_context=None, ns=""):
+    """由 plan.run() 的结果生成建议列表（口径同 build_insights）。"""
+    insights = []
+
+    # 1. 品类毛利率分析
+    cats = res[ns + "cats"]
     total_sale = sum(float(c["total_sale"] or 0) for c in cats)
     total_profit = sum(float(c["total_profit"] or 0) for c in cats)
     avg_margin = (total_profit / total_sale * 100) if total_sale > 0 else 0
@@ -82,13 +154,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
         })
 
     # 3. 低库存预警
-    cur.execute("""
-        SELECT COUNT(DISTINCT sku_code) AS cnt
-        FROM t_htma_stock
-        WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
-        AND stock_qty < 50 AND stock_qty >= 0
-    """, (store_id, store_id))
-    low_stock = cur.fetchone()["cnt"] or 0
+    low_stock = res[ns + "low_stock"]["cnt"] or 0
     if low_stock > 20:
         insights.append({
             "type": "warning",
@@ -102,12 +168,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
         })
 
     # 4. 负毛利/零销售异常
-    cur.execute("""
-        SELECT COUNT(*) AS cnt FROM t_htma_profit
-        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        AND total_profit < 0 AND total_sale > 0
-    """, (store_id,))
-    neg_profit = cur.fetchone()["cnt"] or 0
+    neg_profit = res[ns + "neg_profit"]["cnt"] or 0
     if neg_profit > 0:
         insights.append({
             "type": "warning",
@@ -145,12 +206,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
         })
 
     # 6. 好特卖临期折扣特色：周转与动销
-    cur.execute("""
-        SELECT COUNT(DISTINCT sku_code) AS sku_cnt, SUM(sale_qty) AS total_qty
-        FROM t_htma_sale
-        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-    """, (store_id,))
-    sale_30 = cur.fetchone()
+    sale_30 = res[ns + "sale_30"]
     sku_cnt = sale_30["sku_cnt"] or 0
     total_qty = sale_30["total_qty"] or 0
     if sku_cnt > 100 and total_qty > 0:
@@ -179,8 +235,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
             })
 
     # 7. 数据新鲜度
-    cur.execute("SELECT MAX(data_date) AS d FROM t_htma_sale WHERE store_id = %s", (store_id,))
-    last_date = cur.fetchone()["d"]
+    last_date = res[ns + "last_date"]["d"]
     if last_date:
         from datetime import date
         today = date.today()
@@ -200,12 +255,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
             })
 
     # 8. 退货/赠送（精细化：损耗与赠品占比）
-    cur.execute("""
-        SELECT COALESCE(SUM(sale_amount), 0) AS total_sale, COALESCE(SUM(return_amount), 0) AS return_amt,
-               COALESCE(SUM(gift_amount), 0) AS gift_amt
-        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-    """, (store_id,))
-    rg = cur.fetchone()
+    rg = res[ns + "rg"]
     sale_30 = float(rg["total_sale"] or 0)
     return_amt = float(rg["return_amt"] or 0)
     gift_amt = float(rg["gift_amt"] or 0)
@@ -247,12 +297,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
             })
 
     # 9. 品牌/供应商集中度（精细化：供应链与品牌结构）
-    cur.execute("""
-        SELECT COALESCE(NULLIF(TRIM(brand_name), ''), '未填') AS brand_name, SUM(sale_amount) AS sale
-        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        GROUP BY brand_name HAVING SUM(sale_amount) > 0 ORDER BY SUM(sale_amount) DESC LIMIT 5
-    """, (store_id,))
-    top_brands = cur.fetchall()
+    top_brands = res[ns + "top_brands"]
     if top_brands and sale_30 > 0:
         top3_sale = sum(float(b["sale"] or 0) for b in top_brands[:3])
         top3_pct = top3_sale / sale_30 * 100
@@ -270,16 +315,8 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
             })
 
     # 10. 库存周转（精细化：资金占用与周转效率）
-    cur.execute("""
-        SELECT COALESCE(SUM(stock_amount), 0) AS total_stock
-        FROM t_htma_stock WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
-    """, (store_id, store_id))
-    stock_row = cur.fetchone()
-    cur.execute("""
-        SELECT COALESCE(SUM(sale_amount), 0) AS sale, COALESCE(SUM(sale_cost), 0) AS cost
-        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-    """, (store_id,))
-    sale_row = cur.fetchone()
+    stock_row = res[ns + "stock_row"]
+    sale_row = res[ns + "sale_row"]
     total_stock = float(stock_row["total_stock"] or 0)
     cost_30 = float(sale_row["cost"] or 0)
     daily_cost = cost_30 / 30 if cost_30 > 0 else 0
@@ -309,22 +346,9 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
             })
 
     # 11. 数据质量（精细化：数据可信度与整改优先级）
-    cur.execute("""
-        SELECT COUNT(*) AS cnt FROM t_htma_sale
-        WHERE store_id = %s AND (sale_cost IS NULL OR sale_cost = 0) AND sale_amount > 0
-    """, (store_id,))
-    missing_cost = cur.fetchone()["cnt"] or 0
-    cur.execute("""
-        SELECT COUNT(*) AS cnt FROM t_htma_sale
-        WHERE store_id = %s AND (sale_price IS NULL OR sale_price = 0) AND sale_qty > 0
-    """, (store_id,))
-    missing_price = cur.fetchone()["cnt"] or 0
-    cur.execute("""
-        SELECT COUNT(*) AS cnt FROM (
-            SELECT sku_code FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code HAVING COUNT(DISTINCT COALESCE(category, '')) > 1
-        ) t
-    """, (store_id,))
-    inconsistent = cur.fetchone()["cnt"] or 0
+    missing_cost = res[ns + "missing_cost"]["cnt"] or 0
+    missing_price = res[ns + "missing_price"]["cnt"] or 0
+    inconsistent = res[ns + "inconsistent"]["cnt"] or 0
     if missing_cost > 100 or missing_price > 100 or inconsistent > 50:
         parts = []
         if missing_cost > 100:
@@ -388,12 +412,7 @@ def build_insights(conn, store_id="沈阳超级仓", drill_context=None):
                     })
 
     # 比价预警（t_price_compare 近 7 天：降价、价差）
-    try:
-        insights.extend(_get_price_compare_insights(conn, store_id))
-    except Exception:
-        pass
-
-    cur.close()
+    insights.extend(res[ns + "price_alerts"] or [])
     return insights
 
 
@@ -402,8 +421,68 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
     返回增强后的分析卡片数据（结构化），供前端 /api/enhanced_insights 渲染。
     包含：高毛利品类、销售集中度、低库存预警、毛利率表现、动销、退货Top3、库存周转、数据质量、新品（可选）。
     """
-    cur = conn.cursor()
+    stock = stock_source(conn, store_id)
+    plan = QueryPlan(conn)
+    plan.query("rows", """
+        SELECT COALESCE(category, '未分类') AS category,
+               SUM(total_sale) AS total_sale, SUM(total_profit) AS total_profit,
+               SUM(total_profit)/NULLIF(SUM(total_sale),0)*100 AS margin_pct
+        FROM t_htma_profit
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
+        GROUP BY category
+        HAVING SUM(total_sale) > 5000 AND SUM(total_profit)/NULLIF(SUM(total_sale),0)*100 >= 35
+        ORDER BY margin_pct DESC
+        LIMIT 5
+    """, (store_id,))
+    plan.query("cats", """
+        SELECT COALESCE(category, '未分类') AS category, SUM(total_sale) AS total_sale
+        FROM t_htma_profit
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
+        GROUP BY category HAVING SUM(total_sale) > 0
+    """, (store_id,))
+    plan.query("r3", f"""
+        SELECT COUNT(DISTINCT s.sku_code) AS cnt
+        FROM {stock} s
+        INNER JOIN (SELECT sku_code FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY) GROUP BY sku_code) sale ON sale.sku_code = s.sku_code
+        WHERE s.store_id = %s AND s.data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
+        AND s.stock_qty < 50 AND s.stock_qty >= 0
+    """, (store_id, store_id, store_id), one=True)
+    plan.query("r3b", f"""
+        SELECT COUNT(DISTINCT sku_code) AS cnt FROM {stock}
+        WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
+        AND stock_qty < 50 AND stock_qty >= 0
+    """, (store_id, store_id), one=True)
+    plan.query("r90", """
+        SELECT SUM(total_sale) AS s, SUM(total_profit) AS p FROM t_htma_profit
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
+    """, (store_id,), one=True)
+    plan.query("r30", """
+        SELECT SUM(total_sale) AS s, SUM(total_profit) AS p FROM t_htma_profit
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+    """, (store_id,), one=True)
+    plan.query("r_prev", """
+        SELECT SUM(total_sale) AS s, SUM(total_profit) AS p FROM t_htma_profit
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 60 DAY) AND data_date < DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+    """, (store_id,), one=True)
+    plan.query("active_row", """
+        SELECT COUNT(DISTINCT sku_code) AS cnt FROM t_htma_sale
+        WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+    """, (store_id,), one=True)
+    plan.query("total_row", "SELECT COUNT(DISTINCT sku_code) AS cnt FROM t_htma_product_master WHERE store_id = %s", (store_id,), one=True, fallback=None)
+    plan.query("return_rows", """
+        SELECT COALESCE(category, '未分类') AS category,
+               COALESCE(SUM(return_amount), 0) AS return_amt, COALESCE(SUM(sale_amount), 0) AS sale_amt
+        FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+        GROUP BY category HAVING SUM(sale_amount) > 0
+    """, (store_id,))
+    plan.query("stock_row", f"SELECT COALESCE(SUM(stock_amount), 0) AS total FROM {stock} WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)", (store_id, store_id), one=True)
+    plan.query("sale_row", "SELECT COALESCE(SUM(sale_amount), 0) AS sale FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)", (store_id,), one=True)
+    plan.query("mc", "SELECT COUNT(*) AS cnt FROM t_htma_sale WHERE store_id = %s AND (sale_cost IS NULL OR sale_cost = 0) AND sale_amount > 0", (store_id,), one=True)
+    plan.query("mp", "SELECT COUNT(*) AS cnt FROM t_htma_sale WHERE store_id = %s AND (sale_price IS NULL OR sale_price = 0) AND sale_qty > 0", (store_id,), one=True)
+    plan.query("mcat", "SELECT COUNT(*) AS cnt FROM (SELECT sku_code FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code HAVING COUNT(DISTINCT COALESCE(category, '')) > 1) t", (store_id,), one=True)
+    plan.call("price_compare_alerts", _get_price_compare_insights, store_id, fallback=[])
     try:
+        res = plan.run()
         out = {}
         params = [store_id]
         cat_cond = ""
@@ -412,18 +491,7 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
             params.extend([category_large.strip(), category_large.strip()])
 
         # 1. 高毛利优势品类 Top5（毛利率>35% 且 销售额>5000）
-        cur.execute("""
-            SELECT COALESCE(category, '未分类') AS category,
-                   SUM(total_sale) AS total_sale, SUM(total_profit) AS total_profit,
-                   SUM(total_profit)/NULLIF(SUM(total_sale),0)*100 AS margin_pct
-            FROM t_htma_profit
-            WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
-            GROUP BY category
-            HAVING SUM(total_sale) > 5000 AND SUM(total_profit)/NULLIF(SUM(total_sale),0)*100 >= 35
-            ORDER BY margin_pct DESC
-            LIMIT 5
-        """, (store_id,))
-        rows = cur.fetchall()
+        rows = res["rows"]
         out["high_margin_cats"] = [
             {"name": _row(r, "category"), "margin_pct": round(float(r.get("margin_pct") or 0), 2),
              "sale_amount": round(float(r.get("total_sale") or 0), 2), "profit_amount": round(float(r.get("total_profit") or 0), 2)}
@@ -431,13 +499,7 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
         ] if rows else []
 
         # 2. 销售集中度：前 N 个品类贡献 80%
-        cur.execute("""
-            SELECT COALESCE(category, '未分类') AS category, SUM(total_sale) AS total_sale
-            FROM t_htma_profit
-            WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
-            GROUP BY category HAVING SUM(total_sale) > 0
-        """, (store_id,))
-        cats = cur.fetchall()
+        cats = res["cats"]
         total_sale = sum(float(c.get("total_sale") or 0) for c in cats)
         sorted_cats = sorted(cats, key=lambda x: float(x.get("total_sale") or 0), reverse=True)
         core_n = 0
@@ -450,46 +512,22 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
         out["sales_concentration"] = {"total_cats": len(sorted_cats), "core_cats_80": core_n or len(sorted_cats)}
 
         # 3. 低库存预警：库存<50 的 SKU 数，其中有动销的（断货风险）
-        cur.execute("""
-            SELECT COUNT(DISTINCT s.sku_code) AS cnt
-            FROM t_htma_stock s
-            INNER JOIN (SELECT sku_code FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY) GROUP BY sku_code) sale ON sale.sku_code = s.sku_code
-            WHERE s.store_id = %s AND s.data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
-            AND s.stock_qty < 50 AND s.stock_qty >= 0
-        """, (store_id, store_id, store_id))
-        r3 = cur.fetchone()
+        r3 = res["r3"]
         with_risk = int(r3.get("cnt") or 0) if r3 else 0
-        cur.execute("""
-            SELECT COUNT(DISTINCT sku_code) AS cnt FROM t_htma_stock
-            WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
-            AND stock_qty < 50 AND stock_qty >= 0
-        """, (store_id, store_id))
-        r3b = cur.fetchone()
+        r3b = res["r3b"]
         total_low = int(r3b.get("cnt") or 0) if r3b else 0
         out["low_stock_alert"] = {"total_low": total_low, "with_sale_risk": with_risk, "est_loss": None}
 
         # 4. 毛利率表现：近90天/30天平均，环比
-        cur.execute("""
-            SELECT SUM(total_sale) AS s, SUM(total_profit) AS p FROM t_htma_profit
-            WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
-        """, (store_id,))
-        r90 = cur.fetchone()
-        cur.execute("""
-            SELECT SUM(total_sale) AS s, SUM(total_profit) AS p FROM t_htma_profit
-            WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        """, (store_id,))
-        r30 = cur.fetchone()
+        r90 = res["r90"]
+        r30 = res["r30"]
         s90 = float(r90.get("s") or 0) if r90 else 0
         p90 = float(r90.get("p") or 0) if r90 else 0
         s30 = float(r30.get("s") or 0) if r30 else 0
         p30 = float(r30.get("p") or 0) if r30 else 0
         avg_90 = (p90 / s90 * 100) if s90 > 0 else None
         avg_30 = (p30 / s30 * 100) if s30 > 0 else None
-        cur.execute("""
-            SELECT SUM(total_sale) AS s, SUM(total_profit) AS p FROM t_htma_profit
-            WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 60 DAY) AND data_date < DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        """, (store_id,))
-        r_prev = cur.fetchone()
+        r_prev = res["r_prev"]
         s_prev = float(r_prev.get("s") or 0) if r_prev else 0
         p_prev = float(r_prev.get("p") or 0) if r_prev else 0
         avg_prev = (p_prev / s_prev * 100) if s_prev > 0 else None
@@ -498,30 +536,16 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
         out["margin_trend"] = {"avg_margin_90": round(avg_90, 2) if avg_90 is not None else None, "avg_margin_30": round(avg_30, 2) if avg_30 is not None else None, "trend": trend, "vs_last_month": round(vs_last, 2) if vs_last is not None else None}
 
         # 5. 动销表现：动销SKU、总SKU、滞销数
-        cur.execute("""
-            SELECT COUNT(DISTINCT sku_code) AS cnt FROM t_htma_sale
-            WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        """, (store_id,))
-        active_row = cur.fetchone()
+        active_row = res["active_row"]
         active_sku = int(active_row.get("cnt") or 0) if active_row else 0
-        try:
-            cur.execute("SELECT COUNT(DISTINCT sku_code) AS cnt FROM t_htma_product_master WHERE store_id = %s", (store_id,))
-            total_row = cur.fetchone()
-            total_sku = int(total_row.get("cnt") or 0) if total_row else 0
-        except Exception:
-            total_sku = active_sku
+        total_row = res["total_row"]  # 主数据表不存在时为 None
+        total_sku = int(total_row.get("cnt") or 0) if total_row else active_sku
         stale_sku = max(0, total_sku - active_sku) if total_sku else 0
         rate = (active_sku / total_sku * 100) if total_sku else 0
         out["sell_through"] = {"active_sku": active_sku, "total_sku": total_sku, "stale_sku": stale_sku, "rate_pct": round(rate, 2)}
 
         # 6. 退货 Top3 品类
-        cur.execute("""
-            SELECT COALESCE(category, '未分类') AS category,
-                   COALESCE(SUM(return_amount), 0) AS return_amt, COALESCE(SUM(sale_amount), 0) AS sale_amt
-            FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-            GROUP BY category HAVING SUM(sale_amount) > 0
-        """, (store_id,))
-        return_rows = cur.fetchall()
+        return_rows = res["return_rows"]
         total_sale_30 = sum(float(r.get("sale_amt") or 0) for r in return_rows)
         total_return = sum(float(r.get("return_amt") or 0) for r in return_rows)
         return_rate = (total_return / total_sale_30 * 100) if total_sale_30 > 0 else 0
@@ -533,10 +557,8 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
         }
 
         # 7. 库存周转
-        cur.execute("SELECT COALESCE(SUM(stock_amount), 0) AS total FROM t_htma_stock WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)", (store_id, store_id))
-        stock_row = cur.fetchone()
-        cur.execute("SELECT COALESCE(SUM(sale_amount), 0) AS sale FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)", (store_id,))
-        sale_row = cur.fetchone()
+        stock_row = res["stock_row"]
+        sale_row = res["sale_row"]
         total_stock = float(stock_row.get("total") or 0) if stock_row else 0
         sale_30 = float(sale_row.get("sale") or 0) if sale_row else 0
         daily_sale = sale_30 / 30 if sale_30 > 0 else 0
@@ -544,12 +566,9 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
         out["turnover"] = {"turnover_days": round(turnover_days, 1) if turnover_days is not None else None, "stock_amount": round(total_stock, 2)}
 
         # 8. 数据质量
-        cur.execute("SELECT COUNT(*) AS cnt FROM t_htma_sale WHERE store_id = %s AND (sale_cost IS NULL OR sale_cost = 0) AND sale_amount > 0", (store_id,))
-        mc = cur.fetchone()
-        cur.execute("SELECT COUNT(*) AS cnt FROM t_htma_sale WHERE store_id = %s AND (sale_price IS NULL OR sale_price = 0) AND sale_qty > 0", (store_id,))
-        mp = cur.fetchone()
-        cur.execute("SELECT COUNT(*) AS cnt FROM (SELECT sku_code FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code HAVING COUNT(DISTINCT COALESCE(category, '')) > 1) t", (store_id,))
-        mcat = cur.fetchone()
+        mc = res["mc"]
+        mp = res["mp"]
+        mcat = res["mcat"]
         out["data_quality"] = {
             "missing_cost": int(mc.get("cnt") or 0) if mc else 0,
             "missing_price": int(mp.get("cnt") or 0) if mp else 0,
@@ -557,18 +576,9 @@ def build_enhanced_insights(conn, store_id="沈阳超级仓", period_days=30, ca
         }
 
         # 比价预警（供 AI 分析卡片展示）
-        try:
-            out["price_compare_alerts"] = _get_price_compare_insights(conn, store_id)
-        except Exception:
-            out["price_compare_alerts"] = []
-
-        cur.close()
+        out["price_compare_alerts"] = res["price_compare_alerts"] or []
         return out
     except Exception as e:
-        try:
-            cur.close()
-        except Exception:
-            pass
         return {"error": str(e)}
 
 
@@ -842,82 +852,75 @@ def _neg_diagnosis_hint(name, sale, profit):
 
 def build_marketing_report(conn, store_id="沈阳超级仓", days=30, mode="market_expansion"):
     """进销存营销分析报告。
-    mode: internal=传统进销存复盘 | market_expansion=市场拓展+异业合作决策报告（可执行洞察）"""
-    cur = conn.cursor()
+    mode: internal=传统进销存复盘 | market_expansion=市场拓展+异业合作决策报告（可执行洞察）
+    各项查询互不依赖，经 QueryPlan 并发执行（见 query_plan）。"""
+    plan = QueryPlan(conn)
+    declare_marketing_queries(plan, store_id, days)
+    return compose_marketing_report(plan.run(), days, mode)
+
+
+def declare_marketing_queries(plan, store_id="沈阳超级仓", days=30, ns="", optional=False):
+    """把 build_marketing_report 的查询登记到 plan，任务名加前缀 ns。optional=True 时查询出错不影响同一计划的其他任务（结果为 None）。"""
+    opt = {"fallback": None} if optional else {}
+    stock = stock_source(plan.conn, store_id)
     date_cond = "data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)"
     s_date_cond = "s.data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)"
     base_params = (store_id, days)
     exc_sale_cond, exc_sale_params = _excluded_cond_sale()
     exc_stock_cond, exc_stock_params = _excluded_cond_stock()
-    report = []
 
     # 基础数据
-    cur.execute(f"""
+    plan.query(ns + "row", f"""
         SELECT COALESCE(SUM(sale_amount), 0) AS total_sale, COALESCE(SUM(gross_profit), 0) AS total_profit,
                COALESCE(SUM(sale_qty), 0) AS total_qty, COUNT(DISTINCT sku_code) AS sku_cnt
         FROM t_htma_sale WHERE store_id = %s AND {date_cond}
-    """, base_params)
-    row = cur.fetchone()
-    total_sale = float(row["total_sale"] or 0)
-    total_profit = float(row["total_profit"] or 0)
-    total_qty = int(row["total_qty"] or 0)
-    sku_cnt = int(row["sku_cnt"] or 0)
-    avg_margin = (total_profit / total_sale * 100) if total_sale > 0 else 0
-
-    cur.execute("""
+    """, base_params, one=True, **opt)
+    plan.query(ns + "total_stock", f"""
         SELECT COALESCE(SUM(stock_amount), 0) AS total_stock
-        FROM t_htma_stock WHERE store_id = %s AND data_date = (
-            SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s
+        FROM {stock} WHERE store_id = %s AND data_date = (
+            SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s
         )
-    """, (store_id, store_id))
-    total_stock = float(cur.fetchone()["total_stock"] or 0)
-
+    """, (store_id, store_id), one=True, **opt)
     # 动销 Top（品类去重）
-    cur.execute(f"""
+    plan.query(ns + "top_sale_rows", f"""
         SELECT s.category, SUM(s.sale_qty) AS qty, SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.category
         HAVING SUM(s.sale_qty) > 0 AND SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) >= {_MIN_UNIT_PRICE}
         ORDER BY SUM(s.sale_qty) DESC
         LIMIT 15
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    top_sale_rows = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 低库存畅销
-    cur.execute(f"""
+    plan.query(ns + "low_stock_rows", f"""
         SELECT s.category, SUM(s.sale_qty) AS sale_qty, SUM(s.sale_amount) AS sale_amt
         FROM t_htma_sale s
-        INNER JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        INNER JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
           AND st.stock_qty < 50 AND st.stock_qty >= 0
         GROUP BY s.category
         HAVING SUM(s.sale_qty) >= 5 AND SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) >= {_MIN_UNIT_PRICE}
         ORDER BY SUM(s.sale_qty) DESC
         LIMIT 10
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    low_stock_rows = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 负毛利
-    cur.execute(f"""
+    plan.query(ns + "neg_rows", f"""
         SELECT s.sku_code, COALESCE(st.product_name, s.sku_code) AS name, s.category,
                SUM(s.sale_qty) AS qty, SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.sku_code, st.product_name, s.category
         HAVING SUM(s.sale_amount) > 500 AND SUM(s.gross_profit) < 0
         ORDER BY SUM(s.gross_profit) ASC
         LIMIT 8
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    neg_rows = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 大类贡献
-    cur.execute(f"""
+    plan.query(ns + "large_rows", f"""
         SELECT COALESCE(NULLIF(TRIM(category_large), ''), '未分类') AS cat,
                SUM(sale_amount) AS sale, SUM(gross_profit) AS profit
         FROM t_htma_sale
@@ -929,13 +932,11 @@ def build_marketing_report(conn, store_id="沈阳超级仓", days=30, mode="mark
         HAVING SUM(sale_amount) > 10000
         ORDER BY SUM(sale_amount) DESC
         LIMIT 8
-    """, (store_id, days) + tuple(f"%{kw}%" for kw in _EXCLUDED_CATEGORY_KEYWORDS))
-    large_rows = cur.fetchall()
-
+    """, (store_id, days) + tuple(f"%{kw}%" for kw in _EXCLUDED_CATEGORY_KEYWORDS), **opt)
     # 品类毛利 Top
     profit_exc = " AND ".join(f"COALESCE(category,'') NOT LIKE %s" for _ in _EXCLUDED_CATEGORY_KEYWORDS)
     profit_exc_params = [f"%{kw}%" for kw in _EXCLUDED_CATEGORY_KEYWORDS]
-    cur.execute(f"""
+    plan.query(ns + "profit_rows", f"""
         SELECT COALESCE(category, '未分类') AS cat,
                SUM(total_sale) AS sale, SUM(total_profit) AS profit,
                SUM(total_profit)/NULLIF(SUM(total_sale),0)*100 AS margin_pct
@@ -945,99 +946,114 @@ def build_marketing_report(conn, store_id="沈阳超级仓", days=30, mode="mark
         HAVING SUM(total_sale) > 5000
         ORDER BY SUM(total_profit) DESC
         LIMIT 8
-    """, (store_id, days) + tuple(profit_exc_params))
-    profit_rows = cur.fetchall()
-
+    """, (store_id, days) + tuple(profit_exc_params), **opt)
     # 动销 Top10（按商品 SKU 明细：品名、规格、销量、销售额、利润总额、利润率）
-    cur.execute(f"""
+    plan.query(ns + "top10_sale_sku", f"""
         SELECT s.sku_code, COALESCE(st.product_name, s.product_name, s.sku_code) AS name,
                COALESCE(st.spec, s.spec, '') AS spec, s.category,
                SUM(s.sale_qty) AS qty, SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit,
                SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 AS margin_pct
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.sku_code, st.product_name, s.product_name, st.spec, s.spec, s.category
         HAVING SUM(s.sale_qty) > 0 AND SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) >= {_MIN_UNIT_PRICE}
         ORDER BY SUM(s.sale_qty) DESC
         LIMIT 10
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    top10_sale_sku = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 高毛利 Top10（毛利率≥35% 且销售额>500，按商品）
-    cur.execute(f"""
+    plan.query(ns + "top10_high_margin_sku", f"""
         SELECT s.sku_code, COALESCE(st.product_name, s.product_name, s.sku_code) AS name,
                COALESCE(st.spec, s.spec, '') AS spec, s.category,
                SUM(s.sale_qty) AS qty, SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit,
                SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 AS margin_pct
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.sku_code, st.product_name, s.product_name, st.spec, s.spec, s.category
         HAVING SUM(s.sale_amount) > 500 AND SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 >= 35
         ORDER BY SUM(s.gross_profit) DESC
         LIMIT 10
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    top10_high_margin_sku = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 黄金商品（销量≥10 且毛利率≥30%，动销好+毛利高）
-    cur.execute(f"""
+    plan.query(ns + "golden_sku", f"""
         SELECT s.sku_code, COALESCE(st.product_name, s.product_name, s.sku_code) AS name,
                COALESCE(st.spec, s.spec, '') AS spec, s.category,
                SUM(s.sale_qty) AS qty, SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit,
                SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 AS margin_pct
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.sku_code, st.product_name, s.product_name, st.spec, s.spec, s.category
         HAVING SUM(s.sale_qty) >= 10 AND SUM(s.sale_amount) > 0
           AND SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 >= 30
         ORDER BY SUM(s.gross_profit) DESC
         LIMIT 15
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    golden_sku = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 需补货（畅销但库存不足：近 N 天有销且库存<50）
-    cur.execute(f"""
+    plan.query(ns + "need_replenish_sku", f"""
         SELECT s.sku_code, COALESCE(st.product_name, s.product_name, s.sku_code) AS name,
                COALESCE(st.spec, s.spec, '') AS spec, st.stock_qty, s.category,
                SUM(s.sale_qty) AS sale_qty, SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit,
                SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 AS margin_pct
         FROM t_htma_sale s
-        INNER JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        INNER JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
           AND st.stock_qty < 50 AND st.stock_qty >= 0
         GROUP BY s.sku_code, st.product_name, s.product_name, st.spec, s.spec, st.stock_qty, s.category
         HAVING SUM(s.sale_qty) >= 5 AND SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) >= {_MIN_UNIT_PRICE}
         ORDER BY SUM(s.sale_qty) DESC
         LIMIT 10
-    """, (store_id, store_id, days) + tuple(exc_sale_params))
-    need_replenish_sku = cur.fetchall()
-
+    """, (store_id, store_id, days) + tuple(exc_sale_params), **opt)
     # 滞销高库存（库存≥100 且近 N 天销量<3）
-    cur.execute(f"""
+    plan.query(ns + "slow_high_stock_sku", f"""
         SELECT st.sku_code, COALESCE(st.product_name, st.sku_code) AS name,
                COALESCE(st.spec, '') AS spec, st.stock_qty, st.stock_amount,
                COALESCE(agg.sale_qty, 0) AS sale_qty, COALESCE(agg.sale_amount, 0) AS sale,
                COALESCE(agg.profit, 0) AS profit
-        FROM t_htma_stock st
+        FROM {stock} st
         LEFT JOIN (
             SELECT sku_code, SUM(sale_qty) AS sale_qty, SUM(sale_amount) AS sale_amount, SUM(gross_profit) AS profit
             FROM t_htma_sale
             WHERE store_id = %s AND {date_cond}
             GROUP BY sku_code
         ) agg ON agg.sku_code = st.sku_code
-        WHERE st.store_id = %s AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        WHERE st.store_id = %s AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
           AND st.stock_qty >= 100 AND COALESCE(agg.sale_qty, 0) < 3
           AND {exc_stock_cond}
         ORDER BY st.stock_qty DESC
         LIMIT 10
-    """, (store_id, days, store_id, store_id) + tuple(exc_stock_params))
-    slow_high_stock_sku = cur.fetchall()
+    """, (store_id, days, store_id, store_id) + tuple(exc_stock_params), **opt)
+    return plan
+
+
+def compose_marketing_report(res, days=30, mode="market_expansion", ns=""):
+    """由 plan.run() 的结果生成报告正文（口径同 build_marketing_report）。"""
+    report = []
+
+    # 基础数据
+    row = res[ns + "row"]
+    total_sale = float(row["total_sale"] or 0)
+    total_profit = float(row["total_profit"] or 0)
+    total_qty = int(row["total_qty"] or 0)
+    sku_cnt = int(row["sku_cnt"] or 0)
+    avg_margin = (total_profit / total_sale * 100) if total_sale > 0 else 0
+    total_stock = float(res[ns + "total_stock"]["total_stock"] or 0)
+
+    top_sale_rows = res[ns + "top_sale_rows"]
+    low_stock_rows = res[ns + "low_stock_rows"]
+    neg_rows = res[ns + "neg_rows"]
+    large_rows = res[ns + "large_rows"]
+    profit_rows = res[ns + "profit_rows"]
+    top10_sale_sku = res[ns + "top10_sale_sku"]
+    top10_high_margin_sku = res[ns + "top10_high_margin_sku"]
+    golden_sku = res[ns + "golden_sku"]
+    need_replenish_sku = res[ns + "need_replenish_sku"]
+    slow_high_stock_sku = res[ns + "slow_high_stock_sku"]
 
     # 断货损失估算（低库存畅销品的预估损失）
     out_of_stock_loss = sum(float(r.get("sale_amt") or 0) for r in low_stock_rows if float(r.get("sale_qty") or 0) >= 100)
@@ -1211,7 +1227,6 @@ def build_marketing_report(conn, store_id="沈阳超级仓", days=30, mode="mark
             report.append("")
 
     report.append(f"--- 报告生成时间 {datetime.now().strftime('%Y-%m-%d %H:%M')} ---")
-    cur.close()
     return "\n".join(report)
 
 
@@ -1238,6 +1253,7 @@ def category_rank_data(rows, total_sale, total_profit):
 
 def _ai_fetch_context(conn, store_id="沈阳超级仓", days=30, include_monthly=False):
     """拉取 AI 对话所需的数据上下文。include_monthly=True 时拉取近3个月按月毛利"""
+    stock = stock_source(conn, store_id)
     cur = conn.cursor()
     date_cond = "data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)"
     s_date_cond = "s.data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)"
@@ -1261,8 +1277,8 @@ def _ai_fetch_context(conn, store_id="沈阳超级仓", days=30, include_monthly
         SELECT s.sku_code, COALESCE(st.product_name, s.sku_code) AS name, s.category,
                SUM(s.sale_amount) AS sale, SUM(s.gross_profit) AS profit
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.sku_code, st.product_name, s.category
         HAVING SUM(s.sale_amount) > 500 AND SUM(s.gross_profit) < 0
@@ -1293,8 +1309,8 @@ def _ai_fetch_context(conn, store_id="沈阳超级仓", days=30, include_monthly
     cur.execute(f"""
         SELECT s.category, SUM(s.sale_qty) AS qty, SUM(s.sale_amount) AS sale
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.category
         HAVING SUM(s.sale_qty) > 0 AND SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) >= {_MIN_UNIT_PRICE}
@@ -1307,8 +1323,8 @@ def _ai_fetch_context(conn, store_id="沈阳超级仓", days=30, include_monthly
     cur.execute(f"""
         SELECT s.category, SUM(s.sale_qty) AS sale_qty, SUM(s.sale_amount) AS sale_amt
         FROM t_htma_sale s
-        INNER JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        INNER JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
           AND st.stock_qty < 50 AND st.stock_qty >= 0
         GROUP BY s.category
@@ -1325,8 +1341,8 @@ def _ai_fetch_context(conn, store_id="沈阳超级仓", days=30, include_monthly
                SUM(s.gross_profit)/NULLIF(SUM(s.sale_amount),0)*100 AS margin_pct,
                SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) AS unit_price
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND {s_date_cond} AND {exc_sale_cond}
         GROUP BY s.sku_code, st.product_name, s.category
         HAVING SUM(s.sale_amount) > 500 AND SUM(s.sale_qty) >= 5
@@ -1364,9 +1380,9 @@ def _ai_fetch_context(conn, store_id="沈阳超级仓", days=30, include_monthly
     ctx["top_suppliers"] = cur.fetchall()
 
     # 库存周转天数（按近 period 销速估算）
-    cur.execute("""
+    cur.execute(f"""
         SELECT COALESCE(SUM(stock_amount), 0) AS total_stock
-        FROM t_htma_stock WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+        FROM {stock} WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
     """, (store_id, store_id))
     total_stock = float(cur.fetchone()["total_stock"] or 0)
     cur.execute(f"""
@@ -1824,11 +1840,12 @@ def advanced_search_consumer_insight(
         WHERE store_id = %s AND """ + date_cond + """
         GROUP BY sku_code
     """
-    stock_subquery = """
+    stock = stock_source(conn, store_id)
+    stock_subquery = f"""
         SELECT sku_code, stock_qty
-        FROM t_htma_stock
+        FROM {stock}
         WHERE store_id = %s AND data_date = (
-            SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+            SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
         )
     """
     base_params = [store_id] + list(date_params)
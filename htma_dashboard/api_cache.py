@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+只读 /api/* 接口的响应缓存：进程内 LRU，按内存上限淘汰，条目各自 TTL。
+
+- key = 路径 + 规范化查询串（参数排序）+ 门店数据版本号（data_version），导入提交后版本号变化即整体失效；
+- 结束日期早于今天的自定义区间结果不会再变，不设 TTL（仍受 LRU 与版本号约束）；
+- 路由以 @cached_api() 接入（放在 @app.route 之下），仅缓存 200 的 JSON 响应，响应头带 X-Cache: HIT/MISS；
+- 二级缓存见 shared_cache（默认同机 SQLite，可选 Redis 协议）：读 进程内 LRU -> 共享后端 -> 计算，写入两级，
+  多 worker 之间复用结果；版本号含本进程未落库的 bump 时只用进程内缓存。
+"""
+import functools
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from datetime import date, datetime
+
+from flask import Response, make_response, request
+
+try:
+    from data_version import get_data_version
+    from shared_cache import decode_entry, encode_entry, get_shared_backend
+except ImportError:
+    from htma_dashboard.data_version import get_data_version
+    from htma_dashboard.shared_cache import decode_entry, encode_entry, get_shared_backend
+
+CACHE_ENABLED = os.environ.get("HTMA_API_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+CACHE_TTL = int(os.environ.get("HTMA_API_CACHE_TTL", "60"))  # 秒
+CACHE_MAX_BYTES = int(float(os.environ.get("HTMA_API_CACHE_MAX_MB", "64")) * 1024 * 1024)
+CACHE_MAX_ENTRIES = int(os.environ.get("HTMA_API_CACHE_MAX_ENTRIES", "2000"))
+
+
+class LRUCache:
+    """线程安全的 LRU：超过条目数或字节数上限时淘汰最久未用条目；ttl=None 表示不过期。"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, default_ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()  # key -> (value, size, expire_at|None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            value, size, expire = item
+            if expire is not None and time.time() > expire:
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl="default", size=None):
+        """写入。ttl 缺省用 default_ttl，None 表示不过期；size 为估算字节数（缺省按 len(value)）。"""
+        if ttl == "default":
+            ttl = self.default_ttl
+        size = size if size is not None else len(value)
+        if size > self.max_bytes:
+            return False
+        expire = None if ttl is None else time.time() + ttl
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expire)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                old_key = next(iter(self._data))
+                self._remove(old_key)
+                self._stats["evictions"] += 1
+        return True
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes, "max_entries": self.max_entries})
+        return out
+
+
+_cache = LRUCache()
+_shared_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+
+def get_cache():
+    return _cache
+
+
+def cache_stats():
+    """缓存状态（供 /api/health 展示）。"""
+    out = _cache.stats()
+    out["enabled"] = CACHE_ENABLED
+    backend = get_shared_backend()
+    out["shared"] = dict(_shared_stats, backend=backend.name if backend else None)
+    return out
+
+
+def _shared_get(backend, key):
+    try:
+        blob = backend.get(key)
+    except Exception:
+        _shared_stats["errors"] += 1
+        return None
+    if blob is None:
+        _shared_stats["misses"] += 1
+        return None
+    try:
+        entry = decode_entry(blob)
+    except Exception:
+        _shared_stats["errors"] += 1
+        return None
+    _shared_stats["hits"] += 1
+    return entry
+
+
+def _shared_set(backend, key, entry, ttl):
+    try:
+        backend.set(key, encode_entry(*entry), ttl=ttl)
+    except Exception:
+        _shared_stats["errors"] += 1
+
+
+def normalized_query():
+    """当前请求的规范化查询串：去掉空值、按参数名和值排序，参数顺序不同视为同一请求。"""
+    items = sorted((k, v.strip()) for k, v in request.args.items(multi=True) if v is not None and v.strip() != "")
+    return urllib.parse.urlencode(items)
+
+
+def _parse_day(s):
+    try:
+        return datetime.strptime((s or "").strip()[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def ttl_for_request(default_ttl):
+    """自定义区间且结束日期早于今天：结果不再变化，返回 None（不过期）；否则返回 default_ttl。"""
+    start = _parse_day(request.args.get("start_date"))
+    end = _parse_day(request.args.get("end_date"))
+    if start and end and max(start, end) < date.today():
+        return None
+    return default_ttl
+
+
+def cache_key(store_id, prefix=None, version=None):
+    if version is None:
+        version = get_data_version(store_id)
+    return "%s|%s|v%s|%s" % (prefix or request.path, store_id or "", version, normalized_query())
+
+
+def cached_api(store_id, ttl=None, prefix=None, methods=("GET",)):
+    """
+    只读接口缓存装饰器（置于 @app.route 之下）。methods 内的请求参与缓存（缺省仅 GET，
+    参数须全部来自查询串）；视图返回 200 JSON 时写入进程内 LRU 与共享后端。
+    ttl 缺省用 HTMA_API_CACHE_TTL；结束日期早于今天的自定义区间不过期。
+    """
+    def deco(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED or request.method not in methods:
+                return view(*args, **kwargs)
+            version = get_data_version(store_id)
+            key = cache_key(store_id, prefix, version)
+            # 版本号 ".0" 结尾表示与库内版本一致，各 worker 的 key 含义相同，可共用二级缓存
+            backend = get_shared_backend() if version.endswith(".0") else None
+            entry_ttl = ttl_for_request(CACHE_TTL if ttl is None else ttl)
+            hit = _cache.get(key)
+            source = "HIT"
+            if hit is None and backend is not None:
+                hit = _shared_get(backend, key)
+                if hit is not None:
+                    source = "HIT-SHARED"
+                    _cache.set(key, hit, ttl=entry_ttl, size=len(hit[0]) + len(key))
+            if hit is not None:
+                body, status, mimetype = hit
+                resp = Response(body, status=status, mimetype=mimetype)
+                resp.headers["X-Cache"] = source
+                return resp
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code == 200 and resp.mimetype == "application/json" and not resp.direct_passthrough:
+                body = resp.get_data()
+                entry = (body, resp.status_code, resp.mimetype)
+                _cache.set(key, entry, ttl=entry_ttl, size=len(body) + len(key))
+                if backend is not None:
+                    _shared_set(backend, key, entry, entry_ttl)
+            resp.headers["X-Cache"] = "MISS"
+            return resp
+        return wrapper
+    return deco
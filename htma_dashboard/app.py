@@ -127,17 +127,28 @@ for _p in (_env_path, os.path.join(os.getcwd(), ".env"), os.path.abspath(os.path
     _load_env_from_file(_p)
 import csv
 import io
+import shutil
 import subprocess
 import tempfile
 import threading
-import time
 import pymysql
-from db_config import DB_CONFIG, get_conn
+from db_config import DB_CONFIG, get_conn, pool_stats, warm_pool
+from api_cache import cache_stats, cached_api
+from data_version import bump_data_version
 from flask import Flask, Response, jsonify, send_from_directory, request, session, redirect
 from werkzeug.utils import secure_filename
 
-from import_logic import import_sale_daily, import_sale_summary, import_stock, import_category, import_profit, import_tax_burden, refresh_profit, refresh_category_from_sale, sync_products_table, sync_category_table, preview_sale_excel, import_labor_cost, import_labor_cost_from_image, refresh_labor_cost_analysis, import_product_master, _ensure_product_master_distribution_mode, _read_excel_safe
-from analytics import build_insights, build_enhanced_insights, build_structured_report, build_marketing_report, category_rank_data, advanced_search_consumer_insight
+from import_jobs import begin_file, get_import_job, stage as job_stage, store_import_lock, submit_import_job
+from column_profiles import delete_profile, list_profiles, pin_profile
+from import_manifest import file_digest, find_import, record_import
+from parallel_import import import_excel_files
+from parsed_cache import PARSED_CACHE_TTL, load_parsed, parsed_token_kind, store_parsed
+from consumer_insight import INSIGHT_SINGLE_SCAN, build_consumer_insight
+from query_plan import QueryPlan
+from dashboard_panels import category_large_rank_rows, category_pie, category_rank_rows, dow_sales, fetch_profit_scan, fetch_sale_scan, profit_summary_rows, profit_totals, sale_totals, trend_points
+from export_stream import CSV_MIMETYPE, XLSX_MIMETYPE, close_stream as close_export_stream, csv_chunks as export_csv_chunks, iter_rows as iter_export_rows, open_stream_cursor as open_export_cursor, xlsx_chunks as export_xlsx_chunks
+from import_logic import import_parsed_sale, import_sale_daily, import_sale_summary, import_stock, import_category, import_profit, import_tax_burden, refresh_profit, refresh_category_from_sale, sync_products_table, sync_category_table, preview_sale_excel, import_labor_cost, import_labor_cost_from_image, refresh_labor_cost_analysis, import_product_master, _ensure_product_master_distribution_mode, _read_excel_safe
+from analytics import build_insights, build_enhanced_insights, build_structured_report, build_marketing_report, category_rank_data, advanced_search_consumer_insight, compose_insights, compose_marketing_report, declare_insight_queries, declare_marketing_queries
 from channel_hongbeilou import (
     query_catalog_rows,
     EXPORT_SIMPLE_COLUMNS,
@@ -145,23 +156,15 @@ from channel_hongbeilou import (
     build_selection_logic_meta,
     rows_to_simple_export,
 )
-from query_layer import date_condition as _ql_date_condition, query_filters_from_request as _ql_query_filters, query_filters_from_params as _ql_query_filters_from_params
+from sale_rollup import refresh_sale_rollup, sale_source, profit_filled_expr
+from sku_dim import SKU_CATEGORY_COLUMNS, sku_dim_subquery
+from stock_latest import stock_source
+from query_layer import date_condition as _ql_date_condition, query_filters_from_request as _ql_query_filters, query_filters_from_params as _ql_query_filters_from_params, sale_filter_conds as _ql_sale_filter_conds
 
-# 简单内存缓存：key -> (value, expire_at)，用于 date_range / kpi 等只读接口
-_api_cache = {}
-_CACHE_TTL = 60  # 秒
-
-def _cache_get(key):
-    if key not in _api_cache:
-        return None
-    val, expire = _api_cache[key]
-    if time.time() > expire:
-        del _api_cache[key]
-        return None
-    return val
+# MySQL 配置由 db_config 统一从 .env 读取
+STORE_ID = "沈阳超级仓"
 
-def _cache_set(key, value, ttl=None):
-    _api_cache[key] = (value, time.time() + (ttl or _CACHE_TTL))
+# 只读接口响应缓存：LRU + 门店数据版本号失效（见 api_cache.py），路由以 @cached_api(STORE_ID) 接入
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024  # 200MB，避免大 Excel 413
@@ -320,6 +323,7 @@ def add_cors_headers(response):
 
 
 @app.route("/api/category_rank_mid", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_category_rank_mid():
     """品类排行-中类列表：按大类返回中类汇总（羽绒服、夹克等）。需传 category_large_code 或 category_large"""
     category_large_code = request.args.get("category_large_code", "").strip() or request.args.get("category_large", "").strip()
@@ -363,6 +367,7 @@ def api_category_rank_mid():
 
 
 @app.route("/api/category_rank_small", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_category_rank_small():
     """品类排行-小类列表：按大类+中类返回小类明细。需传 category_large_code、category_mid_code 或 category_mid"""
     category_large_code = request.args.get("category_large_code", "").strip() or request.args.get("category_large", "").strip()
@@ -409,6 +414,7 @@ def api_category_rank_small():
 
 
 @app.route("/api/category_rank_brands", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_category_rank_brands():
     """品类排行-品牌列表：按大类+中类+小类返回品牌汇总。用于小类下钻到品牌。"""
     category_large_code = request.args.get("category_large_code", "").strip() or request.args.get("category_large", "").strip()
@@ -419,22 +425,18 @@ def api_category_rank_brands():
     date_cond, date_params, _, category_cond, _ = _query_filters()
     params = list((STORE_ID,) + date_params)
     conds = [f" store_id = %s AND {date_cond} "]
-    conds.append(" AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)")
-    params.extend([category_large_code, category_large_code])
-    if category_mid_code:
-        conds.append(" AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)")
-        params.extend([category_mid_code, category_mid_code])
-    if category_small_code:
-        conds.append(" AND (COALESCE(TRIM(category_small_code), '') = %s OR COALESCE(TRIM(category_small), '') = %s OR COALESCE(TRIM(category), '') = %s)")
-        params.extend([category_small_code, category_small_code, category_small_code])
+    cond, cat_params = _ql_sale_filter_conds(None, None, category_large_code, category_mid_code, category_small_code)
+    conds.append(cond)
+    params.extend(cat_params)
     cat_cond = "".join(conds)
     conn = get_conn()
     try:
+        src = _sale_source(conn)
         with conn.cursor() as cur:
             cur.execute(f"""
                 SELECT COALESCE(NULLIF(TRIM(brand_name), ''), '未分类') AS brand,
-                       SUM(sale_amount) AS total_sale, SUM(COALESCE(gross_profit, sale_amount - sale_cost, 0)) AS total_profit
-                FROM t_htma_sale
+                       SUM(sale_amount) AS total_sale, SUM({profit_filled_expr(src)}) AS total_profit
+                FROM {src}
                 WHERE {cat_cond}
                 GROUP BY brand
                 ORDER BY total_sale DESC
@@ -459,6 +461,7 @@ def api_category_rank_brands():
 
 
 @app.route("/api/category_rank_products", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_category_rank_products():
     """品类排行-商品列表：按大类+中类+小类+品牌返回 SKU 汇总。用于品牌下钻到商品。"""
     category_large_code = request.args.get("category_large_code", "").strip() or request.args.get("category_large", "").strip()
@@ -470,16 +473,9 @@ def api_category_rank_products():
     date_cond, date_params, _, _, _ = _query_filters()
     params = list((STORE_ID,) + date_params)
     conds = [f" store_id = %s AND {date_cond} "]
-    conds.append(" AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)")
-    params.extend([category_large_code, category_large_code])
-    if category_mid_code:
-        conds.append(" AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)")
-        params.extend([category_mid_code, category_mid_code])
-    if category_small_code:
-        conds.append(" AND (COALESCE(TRIM(category_small_code), '') = %s OR COALESCE(TRIM(category_small), '') = %s OR COALESCE(TRIM(category), '') = %s)")
-        params.extend([category_small_code, category_small_code, category_small_code])
-    conds.append(" AND COALESCE(TRIM(brand_name), '') = %s")
-    params.append(brand)
+    cond, cat_params = _ql_sale_filter_conds(None, brand, category_large_code, category_mid_code, category_small_code)
+    conds.append(cond)
+    params.extend(cat_params)
     cat_cond = "".join(conds)
     conn = get_conn()
     try:
@@ -513,6 +509,7 @@ def api_category_rank_products():
 
 
 @app.route("/api/consumer_insight", methods=["GET", "POST", "HEAD", "OPTIONS"])
+@cached_api(STORE_ID, methods=("GET", "POST"))
 def api_consumer_insight():
     """消费洞察：概览、品类/品牌/价格带/经销方式/新品。GET/POST 均支持，参数从 query 取，便于代理只放行 POST 时使用。"""
     if request.method in ("OPTIONS", "HEAD"):
@@ -944,9 +941,8 @@ def api_tax_burden_export():
     return jsonify({"success": False, "error": "format 仅支持 csv 或 pdf"}), 400
 
 
-def _get_consumer_insight_data(param_override=None):
-    """消费洞察：概览 KPI、品类贡献、品牌贡献、价格带、经销方式、新品表现。与经营分析/税率同周期。
-    param_override: 可选 dict，含 period/start_date/end_date/category/brand/product_name，用于非 request 调用（如结构化报告）。"""
+def _consumer_insight_filters(param_override=None):
+    """消费洞察筛选条件 (date_cond, date_params, params, category_cond)；param_override 同 _get_consumer_insight_data。"""
     if param_override:
         date_cond, date_params, params, category_cond, _ = _ql_query_filters_from_params(
             period=param_override.get("period") or "recent30",
@@ -962,6 +958,63 @@ def _get_consumer_insight_data(param_override=None):
             params = (STORE_ID,) + tuple(params[1:])
     else:
         date_cond, date_params, params, category_cond, _ = _query_filters()
+    return date_cond, date_params, params, category_cond
+
+
+def _consumer_insight_date_range(param_override=None):
+    """日期范围文案（与税率计算一致：自定义用 start_date~end_date，否则用 period 标签）"""
+    if param_override:
+        start_d = (param_override.get("start_date") or "").strip()
+        end_d = (param_override.get("end_date") or "").strip()
+        period = (param_override.get("period") or "recent30").strip()
+    else:
+        start_d = (request.args.get("start_date") or "").strip()
+        end_d = (request.args.get("end_date") or "").strip()
+        period = request.args.get("period", "recent30")
+    return f"{start_d} ~ {end_d}" if (start_d and end_d) else {"day": "今日", "week": "本周", "month": "本月", "recent30": "近30天"}.get(period, "近30天")
+
+
+def _consumer_insight_drill(param_override=None):
+    """下钻层级参数 (category, brand, product_name)：品类 → 品牌 → 款式(品名) → 货号明细"""
+    src = param_override if param_override else request.args
+    return tuple((src.get(k) or "").strip() for k in ("category", "brand", "product_name"))
+
+
+def _get_consumer_insight_data(param_override=None):
+    """消费洞察：概览 KPI、品类贡献、品牌贡献、价格带、经销方式、新品表现。与经营分析/税率同周期。
+    param_override: 可选 dict，含 period/start_date/end_date/category/brand/product_name，用于非 request 调用（如结构化报告）。
+    默认走单次扫描（consumer_insight.build_consumer_insight）；HTMA_INSIGHT_SINGLE_SCAN=0 或扫描失败时逐面板查询。"""
+    if not INSIGHT_SINGLE_SCAN:
+        return _get_consumer_insight_data_multi(param_override)
+    date_cond, date_params, params, category_cond = _consumer_insight_filters(param_override)
+    category_name, brand_name, product_name = _consumer_insight_drill(param_override)
+    conn = get_conn()
+    try:
+        _ensure_product_master_distribution_mode(conn)
+    except Exception:
+        pass
+    try:
+        cur = conn.cursor(pymysql.cursors.DictCursor)
+        data = build_consumer_insight(
+            cur, STORE_ID, date_cond, date_params, params, category_cond,
+            drill={"category": category_name, "brand": brand_name, "product_name": product_name},
+            stock=stock_source(conn, STORE_ID),
+        )
+    except Exception:
+        app.logger.exception("消费洞察单次扫描失败，回退逐面板查询")
+        data = None
+    finally:
+        conn.close()
+    if data is None:
+        return _get_consumer_insight_data_multi(param_override)
+    data["date_range"] = _consumer_insight_date_range(param_override)
+    data["bi_insight"] = _build_bi_insight(data["overview"], data["period_over_period"], data["category_matrix"], data["return_rate_pct"], data["distribution"], data["date_range"])
+    return data
+
+
+def _get_consumer_insight_data_multi(param_override=None):
+    """消费洞察逐面板查询版（每个面板一条 SQL），单次扫描关闭或失败时使用，也作为 scripts/bench_consumer_insight.py 的对照。"""
+    date_cond, date_params, params, category_cond = _consumer_insight_filters(param_override)
     date_only_params = (STORE_ID,) + tuple(date_params)
     conn = get_conn()
     try:
@@ -969,6 +1022,7 @@ def _get_consumer_insight_data(param_override=None):
     except Exception:
         pass
     try:
+        stock = stock_source(conn, STORE_ID)
         cur = conn.cursor(pymysql.cursors.DictCursor)
         category_matrix = []
         discount_band = []
@@ -1002,7 +1056,7 @@ def _get_consumer_insight_data(param_override=None):
         avg_retail_price = round(float(r_retail.get("avg_retail") or 0), 2) if r_retail and r_retail.get("avg_retail") else None
         # 库存周转天数（近期库存/日均销量）
         try:
-            cur.execute("SELECT COALESCE(SUM(stock_qty), 0) AS total_stock FROM t_htma_stock WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)", (STORE_ID, STORE_ID))
+            cur.execute(f"SELECT COALESCE(SUM(stock_qty), 0) AS total_stock FROM {stock} WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)", (STORE_ID, STORE_ID))
             stock_row = cur.fetchone()
             total_stock = float(stock_row.get("total_stock") or 0)
             interval_days = max(1, int(date_params[0]) if date_params and isinstance(date_params[0], (int, float)) else 30)
@@ -1457,30 +1511,14 @@ def _get_consumer_insight_data(param_override=None):
                 period_over_period = {"prev_sale": round(prev_sale, 2), "pct_change": pct_change}
         except Exception:
             period_over_period = {}
-        # 日期范围文案（与税率计算一致：自定义用 start_date~end_date，否则用 period 标签）
-        if param_override:
-            start_d = (param_override.get("start_date") or "").strip()
-            end_d = (param_override.get("end_date") or "").strip()
-            period = (param_override.get("period") or "recent30").strip()
-        else:
-            start_d = (request.args.get("start_date") or "").strip()
-            end_d = (request.args.get("end_date") or "").strip()
-            period = request.args.get("period", "recent30")
-        date_range = f"{start_d} ~ {end_d}" if (start_d and end_d) else {"day": "今日", "week": "本周", "month": "本月", "recent30": "近30天"}.get(period, "近30天")
+        date_range = _consumer_insight_date_range(param_override)
         bi_insight = _build_bi_insight(overview, period_over_period, category_matrix, return_rate_pct, distribution, date_range)
         # 下钻层级：品类 → 品牌 → 款式(品名) → 货号明细
         drill_brands = []
         drill_styles = []
         drill_subcategory = []
         drill_sku_rank = []
-        if param_override:
-            category_name = (param_override.get("category") or "").strip()
-            brand_name = (param_override.get("brand") or "").strip()
-            product_name = (param_override.get("product_name") or "").strip()
-        else:
-            category_name = (request.args.get("category") or "").strip()
-            brand_name = (request.args.get("brand") or "").strip()
-            product_name = (request.args.get("product_name") or "").strip()
+        category_name, brand_name, product_name = _consumer_insight_drill(param_override)
         try:
             if category_name:
                 # 二级：该品类下品牌列表（点击品牌进入三级）
@@ -1623,8 +1661,6 @@ def json_error(e):
         return "Not Found", 404
     raise
 
-# MySQL 配置由 db_config 统一从 .env 读取
-STORE_ID = "沈阳超级仓"
 DEFAULT_DAYS = 30
 FEISHU_WEBHOOK = os.environ.get(
     "FEISHU_WEBHOOK_URL",
@@ -2706,11 +2742,15 @@ def api_tax_analysis_uninvoiced_goods_analysis():
 
 # 本接口仅处理销售/库存/品类/毛利/税率，不读写人力、商品档案表；各模块数据隔离。
 IMPORT_ALLOWED_KEYS = ("sale_daily", "sale_summary", "stock", "category", "profit", "tax_burden")
+# 导入接口缺省是否走后台任务（导入页显式传 async=1）；0 时保持同步返回结果，兼容脚本调用
+IMPORT_ASYNC_DEFAULT = os.environ.get("HTMA_IMPORT_ASYNC", "0").strip().lower() in ("1", "true", "yes", "on")
 
 
 @app.route("/api/import", methods=["POST"])
 def api_import():
-    """上传 Excel，导入 MySQL。仅处理销售日报/销售汇总/库存/品类/毛利/税率，不触碰人力与商品档案。preview_only=1 时仅预览销售表结构，不导入"""
+    """上传 Excel，导入 MySQL。仅处理销售日报/销售汇总/库存/品类/毛利/税率，不触碰人力与商品档案。preview_only=1 时仅预览销售表结构，不导入。
+    预览返回的 preview_token 可代替销售日报/汇总文件提交（表单 preview_token，可多个），直接写入预览时解析好的数据。
+    async=1 时文件落盘后入队后台任务，立即返回 202 与 job_id，进度与结果见 /api/import_jobs/<job_id>"""
     if _auth_enabled() and not _has_module_access("import"):
         return jsonify({"success": False, "message": "无权访问数据导入模块，请联系管理员"}), 403
     preview_only = request.form.get("preview_only", "").strip() in ("1", "true", "yes")
@@ -2722,7 +2762,7 @@ def api_import():
                     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
                         file.save(tmp.name)
                         try:
-                            out = preview_sale_excel(tmp.name, is_summary=(key == "sale_summary"))
+                            out = _preview_with_token(tmp.name, key, file.filename)
                             return jsonify({"success": True, "preview": out})
                         finally:
                             try:
@@ -2732,6 +2772,19 @@ def api_import():
                 return jsonify({"success": False, "error": "仅支持 .xls / .xlsx"}), 400
         return jsonify({"success": False, "error": "请选择销售日报或销售汇总文件"}), 400
 
+    # 预览时缓存的解析结果：同类型已上传文件时以文件为准
+    tokens = []
+    for token in request.form.getlist("preview_token"):
+        token = token.strip()
+        if not token:
+            continue
+        kind = parsed_token_kind(token)
+        if kind is None:
+            return jsonify({"success": False, "message": "预览结果已过期或不存在，请重新选择文件导入"}), 400
+        f = request.files.get(kind)
+        if not (f and f.filename):
+            tokens.append((kind, token))
+
     # 至少有一个已选中的文件（有 filename），且仅处理白名单 key，避免误操作其他模块
     def _has_any_file():
         for key in IMPORT_ALLOWED_KEYS:
@@ -2739,105 +2792,171 @@ def api_import():
             if f and getattr(f, "filename", None) and str(f.filename).strip():
                 return True
         return False
-    if not _has_any_file():
+    if not tokens and not _has_any_file():
         return jsonify({"success": False, "message": "请至少上传一个 Excel 文件（销售日报/销售汇总/库存/品类/毛利/税率之一）"}), 400
 
+    # 上传文件先落到本次导入的临时目录，同步导入结束或后台任务结束后整体删除
+    job_dir = tempfile.mkdtemp(prefix="htma_import_")
+    uploads, errors = [], []
+    for key, file in request.files.items():
+        if key not in IMPORT_ALLOWED_KEYS:
+            continue
+        if not file or file.filename == "":
+            continue
+        if not (file.filename.lower().endswith(".xls") or file.filename.lower().endswith(".xlsx")):
+            errors.append(f"{key}: 仅支持 .xls / .xlsx")
+            continue
+        path = os.path.join(job_dir, key + os.path.splitext(file.filename)[1].lower())
+        file.save(path)
+        uploads.append((key, path))
+    # 表单的 amount_as_total/cost_as_total 不再读取：金额、成本列本就按总额导入
+    swap = _import_form_flag("swap_amount_cost")
+    run = lambda: _run_upload_import(uploads, swap=swap, errors=errors, tokens=tokens)
+    if _wants_async_import():
+        return _enqueue_import("upload", run, files=[k for k, _ in tokens + uploads], cleanup=lambda: shutil.rmtree(job_dir, ignore_errors=True))
+    try:
+        body, status = _with_store_import_lock(run)
+    except Exception as e:  # 门店锁超时（RuntimeError）为 409，连接失败等为 500
+        return jsonify({"success": False, "message": str(e), "data_import_target": "server"}), 409 if isinstance(e, RuntimeError) else 500
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    return jsonify(body), status
+
+
+def _preview_with_token(path, kind, file_name=None):
+    """预览销售表，同时缓存整表解析结果（parsed_cache），返回值多 preview_token（有效期 preview_token_ttl 秒）。"""
+    out = preview_sale_excel(path, is_summary=(kind == "sale_summary"), parse=True)
+    parsed = out.pop("parsed", None)
+    if out.get("ok") and parsed:
+        out["preview_token"] = store_parsed(kind, file_digest(path), parsed, file_name)
+        out["preview_token_ttl"] = PARSED_CACHE_TTL
+    return out
+
+
+def _import_form_flag(name):
+    return (request.form.get(name) or request.args.get(name) or "").strip().lower() in ("1", "true", "yes")
+
+
+def _wants_async_import():
+    """表单或查询参数 async=1/0 显式指定；缺省取 HTMA_IMPORT_ASYNC。"""
+    v = (request.form.get("async") or request.args.get("async") or "").strip().lower()
+    if v:
+        return v in ("1", "true", "yes")
+    return IMPORT_ASYNC_DEFAULT
+
+
+def _with_store_import_lock(fn):
+    """持门店导入锁执行 fn（跨 worker 互斥，见 import_jobs.store_import_lock）；锁占用单独连接，导入中的连接开关不影响锁。"""
+    lock_conn = get_conn()
+    try:
+        with store_import_lock(lock_conn, STORE_ID):
+            return fn()
+    finally:
+        try:
+            lock_conn.close()
+        except Exception:
+            pass
+
+
+def _enqueue_import(kind, run, files=(), cleanup=None):
+    """run() 返回 (响应体, 状态码)；入队后台任务，立即返回 202 与 job_id，结果体存入任务记录。"""
+    job = submit_import_job(STORE_ID, kind, lambda: _with_store_import_lock(run)[0], files=files, cleanup=cleanup)
+    return jsonify({
+        "success": True,
+        "async": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/import_jobs/{job.id}",
+        "data_import_target": "server",
+    }), 202
+
+
+@app.route("/api/import_jobs/<job_id>", methods=["GET"])
+def api_import_job(job_id):
+    """后台导入任务状态：status（queued/running/done/failed）、当前阶段、各文件分阶段耗时；结束后 result 为与同步导入相同的结果体。"""
+    if _auth_enabled() and not _has_module_access("import"):
+        return jsonify({"success": False, "message": "无权访问数据导入模块，请联系管理员"}), 403
+    job = get_import_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "导入任务不存在或已过期"}), 404
+    return jsonify({"success": True, "job": job})
+
+
+def _run_upload_import(uploads, swap=False, errors=(), tokens=()):
+    """导入已落盘的上传文件 [(key, path)] 与预览缓存 [(key, preview_token)]，并刷新派生表、统计当前数据；
+    返回 (结果体, 状态码)。同步接口与后台任务共用。"""
     conn = None
-    result = {"sale_daily": 0, "sale_summary": 0, "stock": 0, "category": 0, "profit": 0, "profit_refreshed": 0, "tax_burden": 0, "errors": []}
+    result = {"sale_daily": 0, "sale_summary": 0, "stock": 0, "category": 0, "profit": 0, "profit_refreshed": 0, "tax_burden": 0, "errors": list(errors)}
 
     try:
         conn = get_conn()
         _ensure_product_master_distribution_mode(conn)
         cur = conn.cursor()
 
-        # 仅当有合法 Excel 文件时才清空表（避免无效文件导致误清空）
-        def _has_valid_file(keys):
-            for k in keys:
-                f = request.files.get(k)
-                if f and f.filename and (f.filename.lower().endswith(".xls") or f.filename.lower().endswith(".xlsx")):
-                    return True
-            return False
-
         # 销售/库存/毛利导入改为**增量**：不再在导入前全表清空，依赖 ON DUPLICATE KEY 去重与覆盖。
         # 如需全量重建，请使用专门的脚本（如 scripts/run_full_import.py），避免误删历史数据。
 
         # 品类附表：import_category 内部会 TRUNCATE（维表可安全重建）
-        # 毛利列映射：swap=对调, amount_as_total=金额已是总金额, cost_as_total=进价已是总成本
-        swap = request.form.get("swap_amount_cost", "").strip().lower() in ("1", "true", "yes")
-        amount_total = request.form.get("amount_as_total", "").strip().lower() in ("1", "true", "yes")
-        cost_total = request.form.get("cost_as_total", "").strip().lower() in ("1", "true", "yes")
-        _orig_swap = os.environ.get("HTMA_SWAP_AMOUNT_COST")
-        _orig_amt = os.environ.get("HTMA_AMOUNT_AS_TOTAL")
-        _orig_cost = os.environ.get("HTMA_COST_AS_TOTAL")
-        if swap:
-            os.environ["HTMA_SWAP_AMOUNT_COST"] = "1"
-        if amount_total:
-            os.environ["HTMA_AMOUNT_AS_TOTAL"] = "1"
-        if cost_total:
-            os.environ["HTMA_COST_AS_TOTAL"] = "1"
-        try:
-            for key, file in request.files.items():
-                if key not in IMPORT_ALLOWED_KEYS:
-                    continue
-                if not file or file.filename == "":
-                    continue
-                if not (file.filename.lower().endswith(".xls") or file.filename.lower().endswith(".xlsx")):
-                    result["errors"].append(f"{key}: 仅支持 .xls / .xlsx")
-                    continue
-                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-                    file.save(tmp.name)
-                    try:
-                        if key == "sale_daily":
-                            cnt, diag = import_sale_daily(tmp.name, conn)
-                            result["sale_daily"] = cnt
-                            if diag:
-                                result.setdefault("diagnostics", []).append(diag)
-                        elif key == "sale_summary":
-                            # 销售汇总始终按(日期,货号)覆盖不累加，避免与日报重复或单独导入时在已有数据上累加导致翻倍
-                            cnt, diag = import_sale_summary(tmp.name, conn, overwrite_on_duplicate=True)
-                            result["sale_summary"] = cnt
-                            if diag:
-                                result.setdefault("diagnostics", []).append(diag)
-                        elif key == "stock":
-                            cnt, diag = import_stock(tmp.name, conn)
-                            result["stock"] = cnt
-                            if diag:
-                                result.setdefault("diagnostics", []).append(diag)
-                        elif key == "category":
-                            result["category"] = import_category(tmp.name, conn)
-                        elif key == "tax_burden":
-                            result["tax_burden"] = import_tax_burden(tmp.name, conn)
-                        elif key == "profit":
-                            cnt, diag = import_profit(tmp.name, conn)
-                            result["profit"] = cnt
-                            if diag:
-                                result.setdefault("diagnostics", []).append(diag)
-                    except Exception as e:
-                        result["errors"].append(f"{key}: {str(e)}")
-                    finally:
-                        os.unlink(tmp.name)
-        finally:
-            if swap:
-                os.environ.pop("HTMA_SWAP_AMOUNT_COST", None)
-                if _orig_swap is not None:
-                    os.environ["HTMA_SWAP_AMOUNT_COST"] = _orig_swap
-            if amount_total:
-                os.environ.pop("HTMA_AMOUNT_AS_TOTAL", None)
-                if _orig_amt is not None:
-                    os.environ["HTMA_AMOUNT_AS_TOTAL"] = _orig_amt
-            if cost_total:
-                os.environ.pop("HTMA_COST_AS_TOTAL", None)
-                if _orig_cost is not None:
-                    os.environ["HTMA_COST_AS_TOTAL"] = _orig_cost
+        # 毛利列映射：swap=对调金额/成本列，作为参数传给各导入函数（不改进程环境变量，并发导入互不影响）
+        sale_parts = set()  # 本次销售导入写入的 (store_id, data_date)，毛利表只重算这些日期
+        for key, path, token in [(k, None, t) for k, t in tokens] + [(k, p, None) for k, p in uploads]:
+            begin_file(key)
+            try:
+                if token:
+                    # 预览时已解析：直接写库，不再读 Excel
+                    hit = load_parsed(token)
+                    if hit is None:
+                        raise ValueError("预览结果已过期，请重新选择文件导入")
+                    if swap:
+                        raise ValueError("预览结果按原列映射解析，对调金额/进价列时请重新选择文件导入")
+                    cnt, diag, parts = import_parsed_sale(hit[1], conn, overwrite_on_duplicate=True)
+                    sale_parts |= parts
+                    result[key] = cnt
+                    if diag:
+                        result.setdefault("diagnostics", []).append(diag)
+                elif key == "sale_daily":
+                    cnt, diag, parts = import_sale_daily(path, conn, swap_amount_cost=swap)
+                    sale_parts |= parts
+                    result["sale_daily"] = cnt
+                    if diag:
+                        result.setdefault("diagnostics", []).append(diag)
+                elif key == "sale_summary":
+                    # 销售汇总始终按(日期,货号)覆盖不累加，避免与日报重复或单独导入时在已有数据上累加导致翻倍
+                    cnt, diag, parts = import_sale_summary(path, conn, overwrite_on_duplicate=True, swap_amount_cost=swap)
+                    sale_parts |= parts
+                    result["sale_summary"] = cnt
+                    if diag:
+                        result.setdefault("diagnostics", []).append(diag)
+                elif key == "stock":
+                    cnt, diag = import_stock(path, conn)
+                    result["stock"] = cnt
+                    if diag:
+                        result.setdefault("diagnostics", []).append(diag)
+                elif key == "category":
+                    job_stage("insert")  # 小表不细分阶段
+                    result["category"] = import_category(path, conn)
+                elif key == "tax_burden":
+                    job_stage("insert")
+                    result["tax_burden"] = import_tax_burden(path, conn)
+                elif key == "profit":
+                    job_stage("insert")
+                    cnt, diag = import_profit(path, conn, swap_amount_cost=swap)
+                    result["profit"] = cnt
+                    if diag:
+                        result.setdefault("diagnostics", []).append(diag)
+            except Exception as e:
+                result["errors"].append(f"{key}: {str(e)}")
 
         # 导入后自动化更新：毛利表 → 品类主数据 → 商品表 → 品类毛利表，确保统计口径一致
+        begin_file(None)
+        job_stage("refresh")
         # 1) 只要有销售日报/汇总导入，就从 t_htma_sale 同步刷新 t_htma_profit（与展示统一用 sale 表，profit 表仅作兼容/导出）
         if result["sale_daily"] > 0 or result["sale_summary"] > 0:
-            result["profit_refreshed"] = refresh_profit(conn)
+            result["profit_refreshed"] = refresh_profit(conn, sale_parts)
         # 2) 从销售表透视生成品类主数据 t_htma_category（大类/中类/小类）
         if result["sale_daily"] > 0 or result["sale_summary"] > 0:
             try:
-                result["category_refreshed"] = refresh_category_from_sale(conn)
+                result["category_refreshed"] = refresh_category_from_sale(conn, sale_parts)
             except Exception as e:
                 result.setdefault("errors", []).append(f"品类表刷新: {str(e)}")
         # 3) 同步商品表 t_htma_products（供导出与比价）
@@ -2863,10 +2982,11 @@ def api_import():
             result["sale_total_amount"] = 0.0
         cur.execute("SELECT COUNT(*) FROM t_htma_stock")
         result["stock_total"] = cur.fetchone()["COUNT(*)"]
+        stock = stock_source(conn, STORE_ID)
         try:
-            cur.execute("""
-                SELECT COALESCE(SUM(stock_amount), 0) AS v FROM t_htma_stock
-                WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+            cur.execute(f"""
+                SELECT COALESCE(SUM(stock_amount), 0) AS v FROM {stock}
+                WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
             """, (STORE_ID, STORE_ID))
             row = cur.fetchone()
             result["stock_total_amount"] = round(float((row.get("v") if isinstance(row, dict) else row[0]) or 0), 2)
@@ -2895,7 +3015,7 @@ def api_import():
         if result.get("sale_total", 0) > 0 or result.get("stock_total", 0) > 0:
             msg = f"好特卖数据导入完成\n销售表: {result.get('sale_total', 0)} 条\n库存表: {result.get('stock_total', 0)} 条\n毛利表: {result.get('profit_total', 0)} 条\n日期范围: {result.get('date_range', '-')}"
             _notify_feishu(msg)
-        return jsonify(result)
+        return result, 200
     except Exception as e:
         import traceback
         if conn:
@@ -2904,12 +3024,12 @@ def api_import():
             except Exception:
                 pass
         tb = traceback.format_exc()
-        return jsonify({
+        return {
             "success": False,
             "message": str(e),
             "data_import_target": "server",
             "traceback": tb[-2000:] if len(tb) > 2000 else tb  # 限制长度，避免响应过大导致前端超时
-        }), 500
+        }, 500
 
 
 # ---------- 收益评估（加盟商分账）API ----------
@@ -4125,6 +4245,7 @@ def _product_master_analysis(conn, store_id=None):
     # ---------- 品类层级（大类，来自销售表与档案 JOIN，含价格与近30天销售，供前端 大类→中类→小类→品牌→商品 下钻）----------
     by_category_large = []
     try:
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_large_code", "category_large"))
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_large_code), ''), '未分类') AS large_code,
@@ -4137,8 +4258,7 @@ def _product_master_analysis(conn, store_id=None):
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large
-                FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4214,6 +4334,8 @@ def api_product_master_category_mid():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, None, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_mid_code", "category_mid"), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_mid_code), ''), '未分类') AS mid_code,
@@ -4221,14 +4343,11 @@ def api_product_master_category_mid():
                 COUNT(DISTINCT p.sku_code) AS sku_count
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid
-                FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             WHERE p.store_id = %s
             GROUP BY mid_code, mid_name ORDER BY sku_count DESC LIMIT 100
-        """, [store_id, large_code, large_code, store_id])
+        """, [store_id, *dim_params, store_id])
         rows = [{"mid_code": (r.get("mid_code") or "").strip(), "mid_name": (r.get("mid_name") or "未分类").strip(), "sku_count": int(r.get("sku_count") or 0)} for r in cur.fetchall()]
         return jsonify({"success": True, "category_large_code": large_code, "items": rows})
     finally:
@@ -4248,6 +4367,8 @@ def api_product_master_category_small():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, mid_code, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_small_code", "category_small", "category"), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_small_code), ''), '未分类') AS small_code,
@@ -4255,15 +4376,11 @@ def api_product_master_category_small():
                 COUNT(DISTINCT p.sku_code) AS sku_count
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                  AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             WHERE p.store_id = %s
             GROUP BY small_code, small_name ORDER BY sku_count DESC LIMIT 100
-        """, [store_id, large_code, large_code, mid_code, mid_code, store_id])
+        """, [store_id, *dim_params, store_id])
         rows = [{"small_code": (r.get("small_code") or "").strip(), "small_name": (r.get("small_name") or "未分类").strip(), "sku_count": int(r.get("sku_count") or 0)} for r in cur.fetchall()]
         return jsonify({"success": True, "category_large_code": large_code, "category_mid_code": mid_code, "items": rows})
     finally:
@@ -4292,18 +4409,10 @@ def api_product_master_drill():
             cond += " AND TRIM(COALESCE(p.category_name,'')) = %s "
             params.append(category)
         if category_small_code:
-            sku_sub = " SELECT sku_code FROM t_htma_sale WHERE store_id = %s "
-            sub_params = [store_id]
-            if category_large_code:
-                sku_sub += " AND (COALESCE(TRIM(category_large_code),'') = %s OR COALESCE(TRIM(category_large),'') = %s) "
-                sub_params.extend([category_large_code, category_large_code])
-            if category_mid_code:
-                sku_sub += " AND (COALESCE(TRIM(category_mid_code),'') = %s OR COALESCE(TRIM(category_mid),'') = %s) "
-                sub_params.extend([category_mid_code, category_mid_code])
-            sku_sub += " AND (COALESCE(TRIM(category_small_code),'') = %s OR COALESCE(TRIM(category_small),'') = %s OR COALESCE(TRIM(category),'') = %s) GROUP BY sku_code "
-            sub_params.extend([category_small_code, category_small_code, category_small_code])
+            dim_cond, sub_params = _ql_sale_filter_conds(None, None, category_large_code, category_mid_code, category_small_code, conn=conn)
+            sku_sub = sku_dim_subquery(conn, store_id, (), dim_cond)
             cond += " AND p.sku_code IN (" + sku_sub + ") "
-            params.extend(sub_params)
+            params.extend([store_id, *sub_params])
         if brand:
             cond += " AND TRIM(COALESCE(p.brand_name,'')) = %s "
             params.append(brand)
@@ -4411,6 +4520,7 @@ def api_product_master_drill_large():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_large_code", "category_large"))
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_large_code), ''), '未分类') AS code,
@@ -4421,8 +4531,7 @@ def api_product_master_drill_large():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large
-                FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4450,6 +4559,8 @@ def api_product_master_drill_mid():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, None, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_mid_code", "category_mid"), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_mid_code), ''), '未分类') AS code,
@@ -4460,10 +4571,7 @@ def api_product_master_drill_mid():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid
-                FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4471,7 +4579,7 @@ def api_product_master_drill_mid():
             ) sale ON sale.sku_code = p.sku_code
             WHERE p.store_id = %s
             GROUP BY s.category_mid_code, s.category_mid ORDER BY sku_count DESC LIMIT 200
-        """, [store_id, large_code, large_code, store_id, store_id])
+        """, [store_id, *dim_params, store_id, store_id])
         rows = _format_drill_rows(cur.fetchall(), "code", "name")
         return jsonify({"success": True, "large_code": large_code, "items": rows})
     finally:
@@ -4492,6 +4600,8 @@ def api_product_master_drill_small():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, mid_code, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_small_code", "category_small", "category"), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_small_code), ''), '未分类') AS code,
@@ -4502,11 +4612,7 @@ def api_product_master_drill_small():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                  AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4514,7 +4620,7 @@ def api_product_master_drill_small():
             ) sale ON sale.sku_code = p.sku_code
             WHERE p.store_id = %s
             GROUP BY s.category_small_code, s.category_small, s.category ORDER BY sku_count DESC LIMIT 200
-        """, [store_id, large_code, large_code, mid_code, mid_code, store_id, store_id])
+        """, [store_id, *dim_params, store_id, store_id])
         rows = _format_drill_rows(cur.fetchall(), "code", "name")
         return jsonify({"success": True, "large_code": large_code, "mid_code": mid_code, "items": rows})
     finally:
@@ -4536,6 +4642,8 @@ def api_product_master_drill_brands():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, mid_code, small_code, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id",), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(p.brand_name), ''), '未填') AS name,
@@ -4545,11 +4653,7 @@ def api_product_master_drill_brands():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                  AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)
-                  AND (COALESCE(TRIM(category_small_code), '') = %s OR COALESCE(TRIM(category_small), '') = %s OR COALESCE(TRIM(category), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4557,7 +4661,7 @@ def api_product_master_drill_brands():
             ) sale ON sale.sku_code = p.sku_code
             WHERE p.store_id = %s
             GROUP BY p.brand_name ORDER BY sku_count DESC LIMIT 200
-        """, [store_id, large_code, large_code, mid_code, mid_code, small_code, small_code, small_code, store_id, store_id])
+        """, [store_id, *dim_params, store_id, store_id])
         rows = _format_drill_rows(cur.fetchall(), "name", "name")
         return jsonify({"success": True, "large_code": large_code, "mid_code": mid_code, "small_code": small_code, "items": rows})
     finally:
@@ -4582,20 +4686,10 @@ def api_product_master_drill_skus():
         cond = " WHERE p.store_id = %s "
         params = [store_id]
         if large_code or mid_code or small_code:
-            sku_sub = """ SELECT sku_code FROM t_htma_sale WHERE store_id = %s """
-            sub_p = [store_id]
-            if large_code:
-                sku_sub += " AND (COALESCE(TRIM(category_large_code),'') = %s OR COALESCE(TRIM(category_large),'') = %s) "
-                sub_p.extend([large_code, large_code])
-            if mid_code:
-                sku_sub += " AND (COALESCE(TRIM(category_mid_code),'') = %s OR COALESCE(TRIM(category_mid),'') = %s) "
-                sub_p.extend([mid_code, mid_code])
-            if small_code:
-                sku_sub += " AND (COALESCE(TRIM(category_small_code),'') = %s OR COALESCE(TRIM(category_small),'') = %s OR COALESCE(TRIM(category),'') = %s) "
-                sub_p.extend([small_code, small_code, small_code])
-            sku_sub += " GROUP BY sku_code "
+            dim_cond, sub_p = _ql_sale_filter_conds(None, None, large_code, mid_code, small_code, conn=conn)
+            sku_sub = sku_dim_subquery(conn, store_id, (), dim_cond)
             cond += " AND p.sku_code IN (" + sku_sub + ") "
-            params.extend(sub_p)
+            params.extend([store_id, *sub_p])
         if brand:
             cond += " AND TRIM(COALESCE(p.brand_name,'')) = %s "
             params.append(brand)
@@ -4682,6 +4776,7 @@ def api_product_master_brand_large():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_large_code", "category_large"))
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_large_code), ''), '未分类') AS code,
@@ -4692,8 +4787,7 @@ def api_product_master_brand_large():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large
-                FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4722,6 +4816,8 @@ def api_product_master_brand_mid():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, None, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_mid_code", "category_mid"), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_mid_code), ''), '未分类') AS code,
@@ -4732,10 +4828,7 @@ def api_product_master_brand_mid():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid
-                FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4743,7 +4836,7 @@ def api_product_master_brand_mid():
             ) sale ON sale.sku_code = p.sku_code
             WHERE p.store_id = %s AND TRIM(COALESCE(p.brand_name,'')) = %s
             GROUP BY s.category_mid_code, s.category_mid ORDER BY sku_count DESC LIMIT 200
-        """, [store_id, large_code, large_code, store_id, store_id, brand])
+        """, [store_id, *dim_params, store_id, store_id, brand])
         rows = _format_drill_rows(cur.fetchall(), "code", "name")
         return jsonify({"success": True, "brand": brand, "large_code": large_code, "items": rows})
     finally:
@@ -4765,6 +4858,8 @@ def api_product_master_brand_small():
     conn = get_conn()
     try:
         cur = conn.cursor(pymysql.cursors.DictCursor)
+        dim_cond, dim_params = _ql_sale_filter_conds(None, None, large_code, mid_code, conn=conn)
+        dim_sql = sku_dim_subquery(conn, store_id, ("store_id", "category_small_code", "category_small", "category"), dim_cond)
         cur.execute("""
             SELECT
                 COALESCE(NULLIF(TRIM(s.category_small_code), ''), '未分类') AS code,
@@ -4775,11 +4870,7 @@ def api_product_master_brand_small():
                 COALESCE(SUM(sale.sale_qty), 0) AS sales_quantity
             FROM t_htma_product_master p
             INNER JOIN (
-                SELECT sku_code, MAX(store_id) AS store_id, MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                FROM t_htma_sale WHERE store_id = %s
-                  AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)
-                  AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)
-                GROUP BY sku_code
+                """ + dim_sql + """
             ) s ON p.sku_code = s.sku_code AND p.store_id = s.store_id
             LEFT JOIN (
                 SELECT sku_code, SUM(sale_amount) AS sale_amount, SUM(sale_qty) AS sale_qty
@@ -4787,7 +4878,7 @@ def api_product_master_brand_small():
             ) sale ON sale.sku_code = p.sku_code
             WHERE p.store_id = %s AND TRIM(COALESCE(p.brand_name,'')) = %s
             GROUP BY s.category_small_code, s.category_small, s.category ORDER BY sku_count DESC LIMIT 200
-        """, [store_id, large_code, large_code, mid_code, mid_code, store_id, store_id, brand])
+        """, [store_id, *dim_params, store_id, store_id, brand])
         rows = _format_drill_rows(cur.fetchall(), "code", "name")
         return jsonify({"success": True, "brand": brand, "large_code": large_code, "mid_code": mid_code, "items": rows})
     finally:
@@ -6409,7 +6500,8 @@ def _find_excel_files_in_dir(directory):
 
 @app.route("/api/import_from_downloads", methods=["POST", "OPTIONS"])
 def api_import_from_downloads():
-    """从配置的下载目录自动导入销售日报/销售汇总/库存/商品档案，并执行去重与刷新。仅处理上述表，不触碰人力成本表。"""
+    """从配置的下载目录自动导入销售日报/销售汇总/库存/商品档案，并执行去重与刷新。仅处理上述表，不触碰人力成本表。
+    async=1 时入队后台任务，同 /api/import。内容已成功导入过的文件直接跳过（见 import_manifest），force=1 强制重新导入。"""
     if request.method == "OPTIONS":
         return "", 204
     directory = _import_downloads_directory()
@@ -6426,42 +6518,64 @@ def api_import_from_downloads():
             "hint": "该目录为服务器上的路径。请将 Excel 放入服务器该目录后重试，或使用本页「上传」按钮直接上传文件。",
         }), 400
 
+    force = _import_form_flag("force")
+    run = lambda: _run_downloads_import(directory, files, force=force)
+    if _wants_async_import():
+        return _enqueue_import("downloads", run, files=sorted(files))
+    try:
+        body, status = _with_store_import_lock(run)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e), "data_import_target": "server", "from_downloads": True, "directory": directory}), 409 if isinstance(e, RuntimeError) else 500
+    return jsonify(body), status
+
+
+def _run_downloads_import(directory, files, force=False):
+    """导入下载目录中找到的文件 {key: path}，刷新、去重并统计；返回 (结果体, 状态码)。同步接口与后台任务共用。
+    已导入过的文件跳过（记入 skipped）；全部跳过时不再刷新、去重。"""
     conn = None
     result = {"sale_daily": 0, "sale_summary": 0, "stock": 0, "product_master": 0, "profit_refreshed": 0, "errors": [], "from_downloads": True, "directory": directory}
     try:
         conn = get_conn()
         _ensure_product_master_distribution_mode(conn)
         cur = conn.cursor()
-        has_sale_daily = "sale_daily" in files
-        has_sale_summary = "sale_summary" in files
-        if has_sale_daily:
-            cnt, diag = import_sale_daily(files["sale_daily"], conn)
-            result["sale_daily"] = cnt
-            if diag:
-                result.setdefault("diagnostics", []).append(diag)
-        if has_sale_summary:
-            cnt, diag = import_sale_summary(files["sale_summary"], conn, overwrite_on_duplicate=True)
-            result["sale_summary"] = cnt
-            if diag:
-                result.setdefault("diagnostics", []).append(diag)
-        if "stock" in files:
-            cnt, diag = import_stock(files["stock"], conn)
-            result["stock"] = cnt
-            if diag:
-                result.setdefault("diagnostics", []).append(diag)
+        # 销售日报/汇总/库存：进程池并行解析、按文件顺序串行写库，日汇总只刷新一次（见 parallel_import）
+        batch = import_excel_files(conn, [(k, files[k]) for k in ("sale_daily", "sale_summary", "stock") if k in files], force=force)
+        result.update(batch["counts"])
+        result["skipped"] = [k for k, _ in batch["skipped"]]
+        sale_parts = batch["partitions"]
+        result["errors"].extend(batch["errors"])
+        if batch["diagnostics"]:
+            result.setdefault("diagnostics", []).extend(batch["diagnostics"])
         if "product_master" in files:
-            try:
-                cnt, diag = import_product_master(files["product_master"], conn)
-                result["product_master"] = cnt
-                if diag:
-                    result.setdefault("diagnostics", []).append("商品档案: " + str(diag))
-            except Exception as e:
-                result["errors"].append("分店商品档案导入: " + str(e))
+            begin_file("product_master")
+            job_stage("insert")
+            pm_path = files["product_master"]
+            pm_digest = file_digest(pm_path)
+            if not force and find_import(conn, pm_digest, "product_master", STORE_ID):
+                result["skipped"].append("product_master")
+            else:
+                try:
+                    cnt, diag = import_product_master(pm_path, conn)
+                    result["product_master"] = cnt
+                    if diag:
+                        result.setdefault("diagnostics", []).append("商品档案: " + str(diag))
+                    record_import(conn, pm_digest, "product_master", pm_path, STORE_ID, cnt, status="ok" if cnt else "failed", message=diag and str(diag))
+                except Exception as e:
+                    result["errors"].append("分店商品档案导入: " + str(e))
+                    record_import(conn, pm_digest, "product_master", pm_path, STORE_ID, status="failed", message=str(e))
+        if result["skipped"] and len(result["skipped"]) == len(files):
+            # 全部文件都已导入过：不必刷新、去重，毫秒级返回
+            conn.close()
+            conn = None
+            result.update({"success": True, "data_import_target": "server", "message": "下载目录中的文件均已导入过，未重复导入（force=1 可强制重新导入）"})
+            return result, 200
 
+        begin_file(None)
+        job_stage("refresh")  # 含去重与统计
         if result["sale_daily"] > 0 or result["sale_summary"] > 0:
-            result["profit_refreshed"] = refresh_profit(conn)
+            result["profit_refreshed"] = refresh_profit(conn, sale_parts)
             try:
-                result["category_refreshed"] = refresh_category_from_sale(conn)
+                result["category_refreshed"] = refresh_category_from_sale(conn, sale_parts)
             except Exception as e:
                 result["errors"].append(f"品类表刷新: {str(e)}")
             try:
@@ -6503,10 +6617,11 @@ def api_import_from_downloads():
         cur.execute("SELECT COUNT(*) AS c FROM t_htma_stock")
         row = cur.fetchone()
         result["stock_total"] = row["c"] if isinstance(row, dict) else row[0]
+        stock = stock_source(conn, STORE_ID)
         try:
-            cur.execute("""
-                SELECT COALESCE(SUM(stock_amount), 0) AS v FROM t_htma_stock
-                WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+            cur.execute(f"""
+                SELECT COALESCE(SUM(stock_amount), 0) AS v FROM {stock}
+                WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
             """, (STORE_ID, STORE_ID))
             row = cur.fetchone()
             result["stock_total_amount"] = round(float(row.get("v", 0) or 0 if isinstance(row, dict) else (row[0] or 0)), 2)
@@ -6540,7 +6655,7 @@ def api_import_from_downloads():
                 send_feishu(msg, at_user_id="ou_8db735f2", at_user_name="余为军", title="好特卖数据导入完成")
             except Exception:
                 _notify_feishu(msg)
-        return jsonify(result)
+        return result, 200
     except Exception as e:
         import traceback
         if conn:
@@ -6548,19 +6663,19 @@ def api_import_from_downloads():
                 conn.close()
             except Exception:
                 pass
-        return jsonify({
+        return {
             "success": False,
             "message": str(e),
             "data_import_target": "server",
             "from_downloads": True,
             "directory": directory,
             "traceback": traceback.format_exc()[-2000:],
-        }), 500
+        }, 500
 
 
 @app.route("/api/import_preview", methods=["POST"])
 def api_import_preview():
-    """预览销售 Excel 结构，用于调试导入问题"""
+    """预览销售 Excel 结构，用于调试导入问题；返回的 preview_token 可提交给 /api/import 直接导入，无需再次上传。"""
     try:
         if "file" not in request.files:
             return jsonify({"ok": False, "error": "请上传文件"}), 400
@@ -6573,7 +6688,7 @@ def api_import_preview():
         with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
             file.save(tmp.name)
             try:
-                out = preview_sale_excel(tmp.name, is_summary=is_summary)
+                out = _preview_with_token(tmp.name, "sale_summary" if is_summary else "sale_daily", file.filename)
                 return jsonify(out)
             finally:
                 try:
@@ -6585,6 +6700,41 @@ def api_import_preview():
         return jsonify({"ok": False, "error": str(e), "traceback": traceback.format_exc()}), 500
 
 
+@app.route("/api/column_profiles", methods=["GET", "POST"])
+def api_column_profiles():
+    """
+    Excel 列映射档案（见 column_profiles）。GET 列出（?kind= 过滤）；POST 手动固定档案，JSON：
+    kind、fingerprint（/api/import_preview 返回）、cols（要覆盖的列，如 {"amount": 29, "cost": 38}；该指纹尚无档案时传完整映射）、
+    swap_amount_cost（对调金额/成本列）、name（可选）。固定后同版式文件导入直接使用该映射。
+    """
+    if _auth_enabled() and not _has_module_access("import"):
+        return jsonify({"success": False, "message": "无权访问数据导入模块，请联系管理员"}), 403
+    if request.method == "GET":
+        return jsonify({"success": True, "profiles": list_profiles(request.args.get("kind") or None)})
+    body = request.get_json(silent=True) or {}
+    kind, fingerprint = (body.get("kind") or "").strip(), (body.get("fingerprint") or "").strip()
+    if not kind or not fingerprint:
+        return jsonify({"success": False, "message": "缺少 kind 或 fingerprint"}), 400
+    try:
+        profile = pin_profile(
+            kind, fingerprint, cols=body.get("cols") or None, name=(body.get("name") or "").strip() or None,
+            header=body.get("header"), swap_amount_cost=bool(body.get("swap_amount_cost")),
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "profile": profile})
+
+
+@app.route("/api/column_profiles/<fingerprint>", methods=["DELETE"])
+def api_column_profile_delete(fingerprint):
+    """删除档案，同版式文件下次导入重新检测列。"""
+    if _auth_enabled() and not _has_module_access("import"):
+        return jsonify({"success": False, "message": "无权访问数据导入模块，请联系管理员"}), 403
+    if not delete_profile(fingerprint):
+        return jsonify({"success": False, "message": "档案不存在"}), 404
+    return jsonify({"success": True})
+
+
 @app.route("/api/categories")
 def api_categories():
     """获取品类列表。优先从 t_htma_category（品类主数据）级联；无则从 t_htma_sale、t_htma_profit 兜底。
@@ -7197,152 +7347,137 @@ def api_sale_detail():
 
 @app.route("/api/export")
 def api_export():
-    """导出：商品从 t_htma_products，品类从 t_htma_category_profit。支持 period、start_date、end_date、category、sku_code、export_type=category|product"""
-    from flask import Response
-    import csv
-    import io
-
+    """
+    导出：商品从 t_htma_products，品类从 t_htma_category_profit。支持 period、start_date、end_date、category、brand、
+    category_large_code/mid/small、sku_code、export_type=category|product、format=csv|xlsx。
+    服务端游标流式输出（export_stream），商品主表按品类/品牌/SKU 筛选（快照表无日期维度，日期只作用于明细降级路径）。
+    """
     export_type = request.args.get("export_type", "product").strip() or "product"
+    fmt = (request.args.get("format") or "csv").strip().lower() or "csv"
+    if fmt not in ("csv", "xlsx"):
+        return jsonify({"success": False, "message": f"不支持的导出格式: {fmt}"}), 400
     include_sku = export_type == "product"
     date_cond, date_params, params, category_cond, sku_cond = _query_filters(include_sku=include_sku)
 
+    def _d(v):
+        return v.strftime("%Y-%m-%d") if hasattr(v, "strftime") else str(v)
+
+    def _rate(r):
+        rate = float(r["profit_rate"] or 0) * 100 if r["profit_rate"] else 0
+        return f"{rate:.2f}%"
+
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            if export_type == "category":
-                # 品类：优先从 t_htma_category_profit，无则从 t_htma_profit 汇总
-                try:
-                    cur.execute("""
-                        SELECT category, category_large, category_mid, category_small,
-                               total_sale, total_profit, profit_rate, sale_count, period_start, period_end
-                        FROM t_htma_category_profit
-                        WHERE store_id = %s
-                        ORDER BY total_sale DESC
-                    """, (STORE_ID,))
-                    rows = cur.fetchall()
-                    headers = ["品类", "大类", "中类", "小类", "总销售额", "总毛利", "毛利率", "销售笔数", "周期起", "周期止"]
-                    data_rows = []
-                    for r in rows:
-                        rate = float(r["profit_rate"] or 0) * 100 if r["profit_rate"] else 0
-                        data_rows.append([
-                            r["category"] or "未分类",
-                            r["category_large"] or "",
-                            r["category_mid"] or "",
-                            r["category_small"] or "",
-                            str(round(float(r["total_sale"] or 0), 2)),
-                            str(round(float(r["total_profit"] or 0), 2)),
-                            f"{rate:.2f}%",
-                            str(r["sale_count"] or 0),
-                            str(r["period_start"]) if r.get("period_start") else "",
-                            str(r["period_end"]) if r.get("period_end") else "",
-                        ])
-                except Exception:
-                    profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
-                    export_params = (STORE_ID,) + date_params + profit_cat_params
-                    cur.execute(f"""
-                        SELECT data_date, COALESCE(category, '未分类') AS category,
-                               total_sale, total_profit, profit_rate
-                        FROM t_htma_profit
-                        WHERE store_id = %s AND {date_cond}{profit_cat_cond}
-                        ORDER BY data_date DESC, total_sale DESC
-                    """, export_params)
-                    rows = cur.fetchall()
-                    headers = ["日期", "品类", "销售额", "毛利", "毛利率"]
-                    data_rows = []
-                    for r in rows:
-                        rate = float(r["profit_rate"] or 0) * 100 if r["profit_rate"] else 0
-                        data_rows.append([
-                            r["data_date"].strftime("%Y-%m-%d") if hasattr(r["data_date"], "strftime") else str(r["data_date"]),
-                            r["category"] or "未分类",
-                            str(round(float(r["total_sale"] or 0), 2)),
-                            str(round(float(r["total_profit"] or 0), 2)),
-                            f"{rate:.2f}%",
-                        ])
-            else:
-                # 商品：优先从 t_htma_products（含条码），无则从 t_htma_sale 汇总
-                try:
-                    cat_cond = ""
-                    cat_params = [STORE_ID]
-                    if params and len(params) > 2:
-                        for i, p in enumerate(params[2:], 2):
-                            if "category" in str(request.args):
-                                break
-                        # 简化：仅 store_id 筛选
-                    cur.execute("""
-                        SELECT sku_code, product_name, raw_name, spec, barcode, brand_name,
-                               category, category_large, category_mid, category_small,
-                               unit_price, sale_qty, sale_amount, gross_profit
-                        FROM t_htma_products
-                        WHERE store_id = %s
-                        ORDER BY sale_amount DESC
-                    """, (STORE_ID,))
-                    rows = cur.fetchall()
-                    headers = ["商品编码", "品名", "规格", "条码", "品牌", "品类", "大类", "中类", "小类", "售价", "销量", "销售额", "毛利"]
-                    data_rows = []
-                    for r in rows:
-                        data_rows.append([
-                            r["sku_code"] or "",
-                            (r["product_name"] or r["raw_name"] or "")[:64],
-                            r["spec"] or "",
-                            r["barcode"] or "",
-                            r["brand_name"] or "",
-                            r["category"] or "未分类",
-                            r["category_large"] or "",
-                            r["category_mid"] or "",
-                            r["category_small"] or "",
-                            str(round(float(r["unit_price"] or 0), 2)),
-                            str(float(r["sale_qty"] or 0)),
-                            str(round(float(r["sale_amount"] or 0), 2)),
-                            str(round(float(r["gross_profit"] or 0), 2)),
-                        ])
-                except Exception:
-                    cur.execute(f"""
-                        SELECT data_date, sku_code, COALESCE(category, '未分类') AS category,
-                               sale_qty, sale_amount, sale_cost, gross_profit
-                        FROM t_htma_sale
-                        WHERE store_id = %s AND {date_cond}{category_cond}{sku_cond}
-                        ORDER BY data_date DESC, sale_amount DESC
-                    """, params)
-                    rows = cur.fetchall()
-                    headers = ["日期", "商品编码", "品类", "销售数量", "销售额", "成本", "毛利"]
-                    data_rows = []
-                    for r in rows:
-                        data_rows.append([
-                            r["data_date"].strftime("%Y-%m-%d") if hasattr(r["data_date"], "strftime") else str(r["data_date"]),
-                            r["sku_code"] or "",
-                            r["category"] or "未分类",
-                            str(float(r["sale_qty"] or 0)),
-                            str(round(float(r["sale_amount"] or 0), 2)),
-                            str(round(float(r["sale_cost"] or 0), 2)),
-                            str(round(float(r["gross_profit"] or 0), 2)),
-                        ])
-
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(headers)
-        for row in data_rows:
-            writer.writerow(row)
-
-        buf = io.BytesIO()
-        buf.write(output.getvalue().encode("utf-8-sig"))
-        buf.seek(0)
-        fname = "htma_category.csv" if export_type == "category" else "htma_products.csv"
-        return Response(
-            buf.getvalue(),
-            mimetype="text/csv; charset=utf-8-sig",
-            headers={"Content-Disposition": f"attachment; filename={fname}"},
-        )
-    finally:
+        cur = open_export_cursor(conn)
+        if export_type == "category":
+            # 品类：优先从 t_htma_category_profit，无则从 t_htma_profit 汇总
+            profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
+            try:
+                cur.execute(f"""
+                    SELECT category, category_large, category_mid, category_small,
+                           total_sale, total_profit, profit_rate, sale_count, period_start, period_end
+                    FROM t_htma_category_profit
+                    WHERE store_id = %s{profit_cat_cond}
+                    ORDER BY total_sale DESC
+                """, (STORE_ID,) + profit_cat_params)
+                headers = ["品类", "大类", "中类", "小类", "总销售额", "总毛利", "毛利率", "销售笔数", "周期起", "周期止"]
+                format_row = lambda r: [
+                    r["category"] or "未分类",
+                    r["category_large"] or "",
+                    r["category_mid"] or "",
+                    r["category_small"] or "",
+                    round(float(r["total_sale"] or 0), 2),
+                    round(float(r["total_profit"] or 0), 2),
+                    _rate(r),
+                    int(r["sale_count"] or 0),
+                    _d(r["period_start"]) if r.get("period_start") else "",
+                    _d(r["period_end"]) if r.get("period_end") else "",
+                ]
+            except Exception:
+                cur.close()
+                cur = open_export_cursor(conn)
+                cur.execute(f"""
+                    SELECT data_date, COALESCE(category, '未分类') AS category,
+                           total_sale, total_profit, profit_rate
+                    FROM t_htma_profit
+                    WHERE store_id = %s AND {date_cond}{profit_cat_cond}
+                    ORDER BY data_date DESC, total_sale DESC
+                """, (STORE_ID,) + date_params + profit_cat_params)
+                headers = ["日期", "品类", "销售额", "毛利", "毛利率"]
+                format_row = lambda r: [
+                    _d(r["data_date"]),
+                    r["category"] or "未分类",
+                    round(float(r["total_sale"] or 0), 2),
+                    round(float(r["total_profit"] or 0), 2),
+                    _rate(r),
+                ]
+        else:
+            # 商品：优先从 t_htma_products（含条码），无则从 t_htma_sale 明细；两者都按品类/品牌/SKU 筛选
+            try:
+                cur.execute(f"""
+                    SELECT sku_code, product_name, raw_name, spec, barcode, brand_name,
+                           category, category_large, category_mid, category_small,
+                           unit_price, sale_qty, sale_amount, gross_profit
+                    FROM t_htma_products
+                    WHERE store_id = %s{category_cond}{sku_cond}
+                    ORDER BY sale_amount DESC
+                """, (STORE_ID,) + tuple(params[1 + len(date_params):]))
+                headers = ["商品编码", "品名", "规格", "条码", "品牌", "品类", "大类", "中类", "小类", "售价", "销量", "销售额", "毛利"]
+                format_row = lambda r: [
+                    r["sku_code"] or "",
+                    (r["product_name"] or r["raw_name"] or "")[:64],
+                    r["spec"] or "",
+                    r["barcode"] or "",
+                    r["brand_name"] or "",
+                    r["category"] or "未分类",
+                    r["category_large"] or "",
+                    r["category_mid"] or "",
+                    r["category_small"] or "",
+                    round(float(r["unit_price"] or 0), 2),
+                    float(r["sale_qty"] or 0),
+                    round(float(r["sale_amount"] or 0), 2),
+                    round(float(r["gross_profit"] or 0), 2),
+                ]
+            except Exception:
+                cur.close()
+                cur = open_export_cursor(conn)
+                cur.execute(f"""
+                    SELECT data_date, sku_code, COALESCE(category, '未分类') AS category,
+                           sale_qty, sale_amount, sale_cost, gross_profit
+                    FROM t_htma_sale
+                    WHERE store_id = %s AND {date_cond}{category_cond}{sku_cond}
+                    ORDER BY data_date DESC, sale_amount DESC
+                """, params)
+                headers = ["日期", "商品编码", "品类", "销售数量", "销售额", "成本", "毛利"]
+                format_row = lambda r: [
+                    _d(r["data_date"]),
+                    r["sku_code"] or "",
+                    r["category"] or "未分类",
+                    float(r["sale_qty"] or 0),
+                    round(float(r["sale_amount"] or 0), 2),
+                    round(float(r["sale_cost"] or 0), 2),
+                    round(float(r["gross_profit"] or 0), 2),
+                ]
+    except Exception:
         conn.close()
+        raise
+
+    # 游标与连接交给生成器，读完（或客户端断开）后关闭；响应体未被迭代（HEAD、中途出错）时由 call_on_close 兜底
+    batches = iter_export_rows(cur, conn, format_row)
+    fname = "htma_category" if export_type == "category" else "htma_products"
+    if fmt == "xlsx":
+        body, mimetype = export_xlsx_chunks(headers, batches, "品类" if export_type == "category" else "商品"), XLSX_MIMETYPE
+    else:
+        body, mimetype = export_csv_chunks(headers, batches), CSV_MIMETYPE
+    resp = Response(body, mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={fname}.{fmt}"})
+    resp.call_on_close(lambda: close_export_stream(cur, conn))
+    return resp
 
 
 @app.route("/api/date_range")
+@cached_api(STORE_ID)
 def api_date_range():
-    """返回自定义日期选择器的可选范围；起止默认值为库中有数据的最早/最晚日期（销售表）。缓存 60 秒。"""
-    cache_key = "date_range:" + (STORE_ID or "")
-    cached = _cache_get(cache_key)
-    if cached is not None:
-        return jsonify(cached)
+    """返回自定义日期选择器的可选范围；起止默认值为库中有数据的最早/最晚日期（销售表）。导入后随数据版本号失效。"""
     out = {"min_date": "2010-01-01", "max_date": "2030-12-31", "data_min_date": None, "data_max_date": None}
     try:
         conn = get_conn()
@@ -7358,107 +7493,82 @@ def api_date_range():
             out["data_max_date"] = row["max_d"].strftime("%Y-%m-%d") if hasattr(row["max_d"], "strftime") else str(row["max_d"])[:10]
     except Exception:
         pass
-    _cache_set(cache_key, out)
     return jsonify(out)
 
 
 @app.route("/api/kpi")
+@cached_api(STORE_ID)
 def api_kpi():
-    """4 个 KPI：总销售额、总毛利、平均毛利率、库存总额。支持 period、start_date、end_date、category 及 hierarchy。非自定义周期时缓存 60 秒。"""
+    """4 个 KPI：总销售额、总毛利、平均毛利率、库存总额。支持 period、start_date、end_date、category 及 hierarchy。"""
+    conn = get_conn()
+    try:
+        return jsonify(_panel_kpi(_DashboardScan(conn)))
+    finally:
+        conn.close()
+
+
+def _panel_kpi(scan):
+    """KPI 面板：销售额、毛利取自销售扫描（与手工统计、导入明细一致，避免与 t_htma_profit 不同步导致显示不一致）；库存另查最新快照。"""
     period = request.args.get("period", "recent30")
     start_d = request.args.get("start_date", "").strip()
     end_d = request.args.get("end_date", "").strip()
-    use_cache = (period != "custom" and not (start_d and end_d))
-    if use_cache:
-        cache_key = "kpi:%s:%s:%s:%s:%s:%s" % (
-            STORE_ID or "", period,
-            request.args.get("category_large_code", ""),
-            request.args.get("category_mid_code", ""),
-            request.args.get("category_small_code", ""),
-            request.args.get("sku_code", ""),
-        )
-        cached = _cache_get(cache_key)
-        if cached is not None:
-            return jsonify(cached)
-    date_cond, date_params, params, sale_cat_cond, sku_cond = _query_filters()
-    # 总销售额、总毛利直接从 t_htma_sale 聚合，与手工统计、导入明细一致，避免与 t_htma_profit 不同步导致显示不一致
-    profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
-    params_inv = (STORE_ID,) + date_params + profit_cat_params
+    sale, profit = sale_totals(scan.sale_rows())
+    total_sale = float(sale)
+    total_profit = float(profit)
+    avg_rate = (total_profit / total_sale * 100) if total_sale > 0 else 0
     inv_cond, inv_params, need_join = _inv_category_cond_and_params()
     sku_code = request.args.get("sku_code", "").strip()
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(f"""
-                SELECT COALESCE(SUM(sale_amount), 0) AS total_sale_amount,
-                       COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS total_gross_profit
-                FROM t_htma_sale
-                WHERE store_id = %s AND {date_cond}{sale_cat_cond}{sku_cond}
-            """, params)
-            row = cur.fetchone()
-            total_sale = float(row["total_sale_amount"] or 0)
-            total_profit = float(row["total_gross_profit"] or 0)
-            avg_rate = (total_profit / total_sale * 100) if total_sale > 0 else 0
-
-            if need_join or sku_code:
-                sku_cond = " AND st.sku_code = %s" if sku_code else ""
-                stock_params = (STORE_ID, STORE_ID, STORE_ID)
-                if sku_code:
-                    stock_params = stock_params + (sku_code,)
-                if need_join:
-                    stock_params = stock_params + inv_params
-                if need_join:
-                    cur.execute(f"""
-                        SELECT COALESCE(SUM(st.stock_amount), 0) AS total_stock_amount
-                        FROM t_htma_stock st
-                        INNER JOIN (
-                            SELECT sku_code,
-                                   MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                                   MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                                   MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                            FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
-                        ) s ON st.sku_code = s.sku_code
-                        WHERE st.store_id = %s AND st.data_date = (
-                            SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
-                        ){sku_cond}{inv_cond}
-                    """, stock_params)
-                else:
-                    cur.execute(f"""
-                        SELECT COALESCE(SUM(stock_amount), 0) AS total_stock_amount
-                        FROM t_htma_stock
-                        WHERE store_id = %s AND data_date = (
-                            SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
-                        ){sku_cond.replace('st.', '')}
-                    """, (STORE_ID, STORE_ID) + ((sku_code,) if sku_code else ()))
-                stock_row = cur.fetchone()
-                total_stock = float(stock_row["total_stock_amount"] or 0)
+    stock = stock_source(scan.conn, STORE_ID)
+    sku_dim = sku_dim_subquery(scan.conn, STORE_ID, SKU_CATEGORY_COLUMNS)
+    with scan.conn.cursor() as cur:
+        if need_join or sku_code:
+            sku_cond = " AND st.sku_code = %s" if sku_code else ""
+            stock_params = (STORE_ID, STORE_ID, STORE_ID)
+            if sku_code:
+                stock_params = stock_params + (sku_code,)
+            if need_join:
+                stock_params = stock_params + inv_params
+            if need_join:
+                cur.execute(f"""
+                    SELECT COALESCE(SUM(st.stock_amount), 0) AS total_stock_amount
+                    FROM {stock} st
+                    INNER JOIN (
+                        {sku_dim}
+                    ) s ON st.sku_code = s.sku_code
+                    WHERE st.store_id = %s AND st.data_date = (
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
+                    ){sku_cond}{inv_cond}
+                """, stock_params)
             else:
-                cur.execute("""
+                cur.execute(f"""
                     SELECT COALESCE(SUM(stock_amount), 0) AS total_stock_amount
-                    FROM t_htma_stock
+                    FROM {stock}
                     WHERE store_id = %s AND data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
-                    )
-                """, (STORE_ID, STORE_ID))
-                stock_row = cur.fetchone()
-                total_stock = float(stock_row["total_stock_amount"] or 0)
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
+                    ){sku_cond.replace('st.', '')}
+                """, (STORE_ID, STORE_ID) + ((sku_code,) if sku_code else ()))
+        else:
+            cur.execute(f"""
+                SELECT COALESCE(SUM(stock_amount), 0) AS total_stock_amount
+                FROM {stock}
+                WHERE store_id = %s AND data_date = (
+                    SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
+                )
+            """, (STORE_ID, STORE_ID))
+        stock_row = cur.fetchone()
+        total_stock = float(stock_row["total_stock_amount"] or 0)
 
-        period_label = f"{start_d} ~ {end_d}" if (start_d and end_d) else {"day": "今日", "week": "本周", "month": "本月", "recent30": "近30天"}.get(period, "近30天")
-        out = {
-            "total_sale_amount": round(total_sale, 2),
-            "total_gross_profit": round(total_profit, 2),
-            "avg_profit_rate_pct": round(avg_rate, 2),
-            "total_stock_amount": round(total_stock, 2),
-            "period": period,
-            "period_label": period_label,
-            "start_date": start_d or None,
-            "end_date": end_d or None,
-        }
-        if use_cache:
-            _cache_set(cache_key, out)
-        return jsonify(out)
-    finally:
-        conn.close()
+    period_label = f"{start_d} ~ {end_d}" if (start_d and end_d) else {"day": "今日", "week": "本周", "month": "本月", "recent30": "近30天"}.get(period, "近30天")
+    return {
+        "total_sale_amount": round(total_sale, 2),
+        "total_gross_profit": round(total_profit, 2),
+        "avg_profit_rate_pct": round(avg_rate, 2),
+        "total_stock_amount": round(total_stock, 2),
+        "period": period,
+        "period_label": period_label,
+        "start_date": start_d or None,
+        "end_date": end_d or None,
+    }
 
 
 def _date_condition(period, start_date=None, end_date=None):
@@ -7504,15 +7614,56 @@ def _period_over_period_ranges(period, start_date_str=None, end_date_str=None):
     return curr_start, curr_end, prev_start, prev_end, f"{curr_start}~{curr_end}", f"{prev_start}~{prev_end}"
 
 
-def _query_filters(include_sku=False):
-    """从 request 解析筛选条件。返回 (date_cond, date_params, params, sale_category_cond, sku_cond)。委托 query_layer 实现，保持兼容。"""
-    date_cond, date_params, params, sale_category_cond, sku_cond = _ql_query_filters(include_sku=include_sku)
+def _query_filters(include_sku=False, conn=None):
+    """从 request 解析筛选条件。返回 (date_cond, date_params, params, sale_category_cond, sku_cond)。委托 query_layer 实现，保持兼容；已持有连接时传 conn 供品类查找表复用。"""
+    date_cond, date_params, params, sale_category_cond, sku_cond = _ql_query_filters(include_sku=include_sku, conn=conn)
     # query_layer 返回的 params 首项为占位 None，替换为 STORE_ID
     if params and params[0] is None:
         params = (STORE_ID,) + tuple(params[1:])
     return date_cond, date_params, params, sale_category_cond, sku_cond
 
 
+def _sale_source(conn, sku_cond=""):
+    """汇总类接口读销售数据的表：销售日汇总表已构建且无 SKU 筛选时读 t_htma_sale_daily_agg，否则读明细 t_htma_sale。"""
+    return sale_source(conn, STORE_ID, sku_cond)
+
+
+class _DashboardScan:
+    """
+    一次请求内看板面板共用的筛选条件与扫描结果（见 dashboard_panels）：销售扫描、毛利扫描各自首次用到时读一次。
+    by_category=True 时销售扫描带 category 维度（品类占比需要），其余面板照常在其上派生。
+    """
+
+    def __init__(self, conn, by_category=False):
+        self.conn = conn
+        self.by_category = by_category
+        self.date_cond, self.date_params, self.params, self.sale_cat_cond, _ = _query_filters(conn=conn)
+        self.cat_params = tuple(self.params[1 + len(self.date_params):])
+        self._src = None
+        self._sale = None
+        self._profit = None
+
+    @property
+    def src(self):
+        if self._src is None:
+            self._src = _sale_source(self.conn)
+        return self._src
+
+    def sale_rows(self, by_category=False):
+        if self._sale is None or (by_category and not self.by_category):
+            self.by_category = self.by_category or by_category
+            with self.conn.cursor() as cur:
+                self._sale = fetch_sale_scan(cur, self.src, self.date_cond, self.sale_cat_cond, self.params, self.by_category)
+        return self._sale
+
+    def profit_rows(self):
+        if self._profit is None:
+            profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(self.date_cond, self.date_params)
+            with self.conn.cursor() as cur:
+                self._profit = fetch_profit_scan(cur, self.date_cond, profit_cat_cond, (STORE_ID,) + self.date_params + profit_cat_params)
+        return self._profit
+
+
 def _profit_category_cond_and_params(date_cond, date_params_tuple):
     """返回用于 t_htma_profit 的 category 条件与参数。支持编码或名称匹配（级联选择器可能传名称）"""
     category_large_code = request.args.get("category_large_code", "").strip()
@@ -7534,41 +7685,29 @@ def _profit_category_cond_and_params(date_cond, date_params_tuple):
 
 
 @app.route("/api/category_pie")
+@cached_api(STORE_ID)
 def api_category_pie():
     """品类销售额占比（Top10 + 其他），支持 period、start_date、end_date、category 及 hierarchy"""
-    date_cond, _, params, category_cond, _ = _query_filters()
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(f"""
-                WITH cs AS (
-                    SELECT COALESCE(category, '未分类') AS category, SUM(sale_amount) AS sale_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{category_cond}
-                    GROUP BY category
-                ),
-                ranked AS (
-                    SELECT category, sale_amount, ROW_NUMBER() OVER (ORDER BY sale_amount DESC) AS rn FROM cs
-                )
-                SELECT CASE WHEN rn <= 10 THEN category ELSE '其他' END AS category,
-                       SUM(sale_amount) AS sale_amount
-                FROM ranked
-                GROUP BY CASE WHEN rn <= 10 THEN category ELSE '其他' END
-                ORDER BY sale_amount DESC
-            """, params)
-            rows = cur.fetchall()
-        return jsonify([{"category": r["category"], "sale_amount": float(r["sale_amount"])} for r in rows])
+        return jsonify(_panel_category_pie(_DashboardScan(conn, by_category=True)))
     finally:
         conn.close()
 
 
+def _panel_category_pie(scan):
+    return [{"category": r["category"], "sale_amount": float(r["sale_amount"])} for r in category_pie(scan.sale_rows(by_category=True))]
+
+
 @app.route("/api/daily_trend")
+@cached_api(STORE_ID)
 def api_daily_trend():
     """日销售额趋势（兼容旧接口）"""
     return api_sales_trend("day")
 
 
 @app.route("/api/sales_trend")
+@cached_api(STORE_ID)
 def api_sales_trend_route():
     """销售额/毛利趋势，支持 granularity、start_date、end_date、category"""
     g = request.args.get("granularity", "day")
@@ -7577,73 +7716,36 @@ def api_sales_trend_route():
 
 def api_sales_trend(granularity):
     """按日/周/月聚合销售额与毛利趋势。与 KPI 一致，均从 t_htma_sale 聚合。"""
-    date_cond, date_params, params, category_cond, sku_cond = _query_filters()
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            if granularity == "day":
-                cur.execute(f"""
-                    SELECT data_date AS x_date,
-                           COALESCE(SUM(sale_amount), 0) AS sale_amount,
-                           COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{category_cond}{sku_cond}
-                    GROUP BY data_date ORDER BY data_date
-                """, params)
-                rows = cur.fetchall()
-                out = [_format_trend_row(r, "day") for r in rows]
-            elif granularity == "week":
-                cur.execute(f"""
-                    SELECT MIN(data_date) AS week_start,
-                           CONCAT(YEAR(MIN(data_date)), '-W', LPAD(WEEK(MIN(data_date), 3), 2, '0')) AS x_date,
-                           COALESCE(SUM(sale_amount), 0) AS sale_amount,
-                           COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{category_cond}{sku_cond}
-                    GROUP BY YEAR(data_date), WEEK(data_date, 3)
-                    ORDER BY MIN(data_date)
-                """, params)
-                rows = cur.fetchall()
-                out = [_format_trend_row(r, "week") for r in rows]
-            else:  # month
-                cur.execute(f"""
-                    SELECT DATE_FORMAT(MIN(data_date), '%%Y-%%m') AS x_date,
-                           COALESCE(SUM(sale_amount), 0) AS sale_amount,
-                           COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{category_cond}{sku_cond}
-                    GROUP BY YEAR(data_date), MONTH(data_date)
-                    ORDER BY MIN(data_date)
-                """, params)
-                rows = cur.fetchall()
-                out = [_format_trend_row(r, "month") for r in rows]
-            data_source = "sale"
-        if not out:
-            return jsonify({
-                "data": [],
-                "dates": [],
-                "sales": [],
-                "gross_profit": [],
-                "data_source": None,
-                "empty_hint": "所选条件下无销售数据，请调整周期或品类筛选后再试。",
-            })
-        dates = [r["x_date"] for r in out]
-        sales = [r["sale_amount"] for r in out]
-        gross_profit_list = [r["profit_amount"] for r in out]
-        return jsonify({
-            "data": out,
-            "dates": dates,
-            "sales": sales,
-            "gross_profit": gross_profit_list,
-            "data_source": data_source,
-            "empty_hint": None,
-        })
+        return jsonify(_panel_sales_trend(_DashboardScan(conn), granularity))
     except Exception as e:
         return jsonify({"error": str(e), "data": [], "data_source": None, "empty_hint": "请求异常，请稍后重试。"}), 500
     finally:
         conn.close()
 
 
+def _panel_sales_trend(scan, granularity):
+    out = [_format_trend_row(r, granularity) for r in trend_points(scan.sale_rows(), granularity)]
+    if not out:
+        return {
+            "data": [],
+            "dates": [],
+            "sales": [],
+            "gross_profit": [],
+            "data_source": None,
+            "empty_hint": "所选条件下无销售数据，请调整周期或品类筛选后再试。",
+        }
+    return {
+        "data": out,
+        "dates": [r["x_date"] for r in out],
+        "sales": [r["sale_amount"] for r in out],
+        "gross_profit": [r["profit_amount"] for r in out],
+        "data_source": "sale",
+        "empty_hint": None,
+    }
+
+
 def _format_trend_row(r, granularity):
     """安全格式化趋势行，避免日期/空值导致的异常"""
     x_date = r.get("x_date")
@@ -7665,213 +7767,152 @@ def _format_trend_row(r, granularity):
 
 
 @app.route("/api/trend_analysis")
+@cached_api(STORE_ID)
 def api_trend_analysis():
-    """走势分析：环比（与 KPI 周期联动）、同比、趋势描述。数据与 KPI 一致，均从 t_htma_sale 聚合。"""
-    granularity = request.args.get("granularity", "day")
+    """走势分析：环比（与 KPI 周期联动）、同比、趋势描述。数据与 KPI 一致，均从销售表聚合。"""
+    conn = get_conn()
+    try:
+        return jsonify(_panel_trend_analysis(_DashboardScan(conn), request.args.get("granularity", "day")))
+    finally:
+        conn.close()
+
+
+def _panel_trend_analysis(scan, granularity):
     period = request.args.get("period", "recent30")
-    date_cond, date_params, params, sale_cat_cond, sku_cond = _query_filters()
-    profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
     start_date = request.args.get("start_date", "").strip()
     end_date = request.args.get("end_date", "").strip()
-    params_ta = params  # 与 KPI 一致：从 t_htma_sale 查，用 sale_cat_cond
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            curr_start, curr_end, prev_start, prev_end, curr_label, prev_label = _period_over_period_ranges(
-                period, start_date or None, end_date or None
-            )
-            cat_params = tuple(params[1 + len(date_params):]) if len(params) > 1 + len(date_params) else ()
-            cur.execute(
-                """SELECT COALESCE(SUM(sale_amount), 0) AS sale_amount, COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                   FROM t_htma_sale WHERE store_id = %s AND data_date BETWEEN %s AND %s """ + sale_cat_cond,
-                (STORE_ID, curr_start, curr_end) + cat_params,
-            )
-            curr_row = cur.fetchone()
+    curr_start, curr_end, prev_start, prev_end, curr_label, prev_label = _period_over_period_ranges(
+        period, start_date or None, end_date or None
+    )
+    with scan.conn.cursor() as cur:
+        totals = []
+        for start, end in ((curr_start, curr_end), (prev_start, prev_end)):
             cur.execute(
-                """SELECT COALESCE(SUM(sale_amount), 0) AS sale_amount, COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                   FROM t_htma_sale WHERE store_id = %s AND data_date BETWEEN %s AND %s """ + sale_cat_cond,
-                (STORE_ID, prev_start, prev_end) + cat_params,
+                f"""SELECT COALESCE(SUM(sale_amount), 0) AS sale_amount, COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
+                   FROM {scan.src} WHERE store_id = %s AND data_date BETWEEN %s AND %s """ + scan.sale_cat_cond,
+                (STORE_ID, start, end) + scan.cat_params,
             )
-            prev_row = cur.fetchone()
-            _curr_sale = float(curr_row["sale_amount"] or 0)
-            _curr_profit = float(curr_row["profit_amount"] or 0)
-            _prev_sale = float(prev_row["sale_amount"] or 0)
-            _prev_profit = float(prev_row["profit_amount"] or 0)
-            _sale_chg = ((_curr_sale - _prev_sale) / _prev_sale * 100) if _prev_sale > 0 else 0
-            _profit_chg = ((_curr_profit - _prev_profit) / _prev_profit * 100) if _prev_profit > 0 else 0
-            pop = {
-                "current_period": curr_label,
-                "prev_period": prev_label,
-                "current_sale": round(_curr_sale, 2),
-                "prev_sale": round(_prev_sale, 2),
-                "current_profit": round(_curr_profit, 2),
-                "prev_profit": round(_prev_profit, 2),
-                "sale_change_pct": round(_sale_chg, 2),
-                "profit_change_pct": round(_profit_chg, 2),
-            }
-
-            if granularity == "day":
-                cur.execute(f"""
-                    SELECT data_date, COALESCE(SUM(sale_amount), 0) AS sale_amount, COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{sale_cat_cond}{sku_cond}
-                    GROUP BY data_date ORDER BY data_date
-                """, params_ta)
-            elif granularity == "week":
-                cur.execute(f"""
-                    SELECT YEAR(data_date) AS y, WEEK(data_date, 3) AS w,
-                           MIN(data_date) AS week_start,
-                           COALESCE(SUM(sale_amount), 0) AS sale_amount, COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{sale_cat_cond}{sku_cond}
-                    GROUP BY YEAR(data_date), WEEK(data_date, 3)
-                    ORDER BY week_start
-                """, params_ta)
-            else:
-                cur.execute(f"""
-                    SELECT YEAR(data_date) AS y, MONTH(data_date) AS m,
-                           DATE_FORMAT(MIN(data_date), '%%Y-%%m') AS month_key,
-                           COALESCE(SUM(sale_amount), 0) AS sale_amount, COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
-                    FROM t_htma_sale
-                    WHERE store_id = %s AND {date_cond}{sale_cat_cond}{sku_cond}
-                    GROUP BY YEAR(data_date), MONTH(data_date)
-                    ORDER BY MIN(data_date)
-                """, params_ta)
-
-            rows = cur.fetchall()
-            if not rows:
-                return jsonify({"message": "数据不足", "period_over_period": pop, "year_over_year": None, "trend": "neutral", "trend_summary": None})
-
-            # 转为列表便于索引
-            data_list = []
-            for r in rows:
-                if granularity == "day":
-                    data_list.append({
-                        "key": r["data_date"].strftime("%Y-%m-%d") if hasattr(r["data_date"], "strftime") else str(r["data_date"]),
-                        "sale_amount": float(r["sale_amount"]),
-                        "profit_amount": float(r["profit_amount"]),
-                    })
-                elif granularity == "week":
-                    data_list.append({
-                        "key": f"{r['y']}-W{r['w']:02d}",
-                        "sale_amount": float(r["sale_amount"]),
-                        "profit_amount": float(r["profit_amount"]),
-                    })
-                else:
-                    data_list.append({
-                        "key": r["month_key"] or "",
-                        "sale_amount": float(r["sale_amount"]),
-                        "profit_amount": float(r["profit_amount"]),
-                    })
+            totals.append(cur.fetchone())
+    curr_row, prev_row = totals
+    _curr_sale = float(curr_row["sale_amount"] or 0)
+    _curr_profit = float(curr_row["profit_amount"] or 0)
+    _prev_sale = float(prev_row["sale_amount"] or 0)
+    _prev_profit = float(prev_row["profit_amount"] or 0)
+    _sale_chg = ((_curr_sale - _prev_sale) / _prev_sale * 100) if _prev_sale > 0 else 0
+    _profit_chg = ((_curr_profit - _prev_profit) / _prev_profit * 100) if _prev_profit > 0 else 0
+    pop = {
+        "current_period": curr_label,
+        "prev_period": prev_label,
+        "current_sale": round(_curr_sale, 2),
+        "prev_sale": round(_prev_sale, 2),
+        "current_profit": round(_curr_profit, 2),
+        "prev_profit": round(_prev_profit, 2),
+        "sale_change_pct": round(_sale_chg, 2),
+        "profit_change_pct": round(_profit_chg, 2),
+    }
 
-            # 同比：本期 vs 去年同期（月粒度需13期；周粒度需53期；日粒度需366期）
-            yoy = None
-            idx_last_year = {"month": 13, "week": 53, "day": 366}.get(granularity, 13)
-            if len(data_list) >= idx_last_year:
-                curr = data_list[-1]
-                same_last_year = data_list[-idx_last_year]
-                curr_sale, last_sale = curr["sale_amount"], same_last_year["sale_amount"]
-                curr_profit, last_profit = curr["profit_amount"], same_last_year["profit_amount"]
-                sale_yoy = ((curr_sale - last_sale) / last_sale * 100) if last_sale > 0 else 0
-                profit_yoy = ((curr_profit - last_profit) / last_profit * 100) if last_profit > 0 else 0
-                yoy = {
-                    "current_period": curr["key"],
-                    "same_period_last_year": same_last_year["key"],
-                    "sale_change_pct": round(sale_yoy, 2),
-                    "profit_change_pct": round(profit_yoy, 2),
-                }
+    points = trend_points(scan.sale_rows(), granularity)
+    if not points:
+        return {"message": "数据不足", "period_over_period": pop, "year_over_year": None, "trend": "neutral", "trend_summary": None}
+
+    # 转为列表便于索引
+    data_list = [{
+        "key": r["x_date"].strftime("%Y-%m-%d") if granularity == "day" else r["x_date"],
+        "sale_amount": float(r["sale_amount"]),
+        "profit_amount": float(r["profit_amount"]),
+    } for r in points]
+
+    # 同比：本期 vs 去年同期（月粒度需13期；周粒度需53期；日粒度需366期）
+    yoy = None
+    idx_last_year = {"month": 13, "week": 53, "day": 366}.get(granularity, 13)
+    if len(data_list) >= idx_last_year:
+        curr = data_list[-1]
+        same_last_year = data_list[-idx_last_year]
+        curr_sale, last_sale = curr["sale_amount"], same_last_year["sale_amount"]
+        curr_profit, last_profit = curr["profit_amount"], same_last_year["profit_amount"]
+        sale_yoy = ((curr_sale - last_sale) / last_sale * 100) if last_sale > 0 else 0
+        profit_yoy = ((curr_profit - last_profit) / last_profit * 100) if last_profit > 0 else 0
+        yoy = {
+            "current_period": curr["key"],
+            "same_period_last_year": same_last_year["key"],
+            "sale_change_pct": round(sale_yoy, 2),
+            "profit_change_pct": round(profit_yoy, 2),
+        }
 
-            # 趋势：最近5期简单线性趋势（斜率正负）
-            trend = "neutral"
-            if len(data_list) >= 5:
-                recent = [x["sale_amount"] for x in data_list[-5:]]
-                n = len(recent)
-                x_mean = (n - 1) / 2
-                y_mean = sum(recent) / n
-                numer = sum((i - x_mean) * (recent[i] - y_mean) for i in range(n))
-                denom = sum((i - x_mean) ** 2 for i in range(n))
-                slope = (numer / denom) if denom > 0 else 0
-                trend = "up" if slope > 0 else "down" if slope < 0 else "neutral"
-
-            # 走势数据摘要：供「走势与同比」卡片展示近期销售额/毛利；自定义区间时 latest_date 不超出请求的 end_date
-            trend_summary = None
-            if data_list:
-                take = min(5, len(data_list))
-                recent_list = data_list[-take:]
-                recent_sale = sum(x["sale_amount"] for x in recent_list)
-                recent_profit = sum(x["profit_amount"] for x in recent_list)
-                last = data_list[-1]
-                latest_date_val = last["key"]
-                req_end = request.args.get("end_date", "").strip()
-                if req_end and latest_date_val and latest_date_val > req_end:
-                    latest_date_val = req_end  # 仅限制展示日期不超出所选区间，金额仍用结果集最后一条
-                trend_summary = {
-                    "recent_days": take,
-                    "recent_sale": round(recent_sale, 2),
-                    "recent_profit": round(recent_profit, 2),
-                    "latest_date": latest_date_val,
-                    "latest_sale": round(last["sale_amount"], 2),
-                    "latest_profit": round(last["profit_amount"], 2),
-                }
+    # 趋势：最近5期简单线性趋势（斜率正负）
+    trend = "neutral"
+    if len(data_list) >= 5:
+        recent = [x["sale_amount"] for x in data_list[-5:]]
+        n = len(recent)
+        x_mean = (n - 1) / 2
+        y_mean = sum(recent) / n
+        numer = sum((i - x_mean) * (recent[i] - y_mean) for i in range(n))
+        denom = sum((i - x_mean) ** 2 for i in range(n))
+        slope = (numer / denom) if denom > 0 else 0
+        trend = "up" if slope > 0 else "down" if slope < 0 else "neutral"
+
+    # 走势数据摘要：供「走势与同比」卡片展示近期销售额/毛利；自定义区间时 latest_date 不超出请求的 end_date
+    take = min(5, len(data_list))
+    recent_list = data_list[-take:]
+    recent_sale = sum(x["sale_amount"] for x in recent_list)
+    recent_profit = sum(x["profit_amount"] for x in recent_list)
+    last = data_list[-1]
+    latest_date_val = last["key"]
+    if end_date and latest_date_val and latest_date_val > end_date:
+        latest_date_val = end_date  # 仅限制展示日期不超出所选区间，金额仍用结果集最后一条
+    trend_summary = {
+        "recent_days": take,
+        "recent_sale": round(recent_sale, 2),
+        "recent_profit": round(recent_profit, 2),
+        "latest_date": latest_date_val,
+        "latest_sale": round(last["sale_amount"], 2),
+        "latest_profit": round(last["profit_amount"], 2),
+    }
 
-        # 同比所需最少期数说明
-        yoy_required = {"month": 13, "week": 53, "day": 366}.get(granularity, 13)
-        yoy_reason = None
-        if not yoy and len(data_list) > 0:
-            yoy_reason = f"同比需至少{yoy_required}期数据（{'月' if granularity=='month' else '周' if granularity=='week' else '日'}粒度），当前仅{len(data_list)}期"
-        return jsonify({
-            "granularity": granularity,
-            "period_over_period": pop,
-            "year_over_year": yoy,
-            "trend": trend,
-            "data_points": len(data_list),
-            "trend_summary": trend_summary,
-            "yoy_reason": yoy_reason,
-        })
-    finally:
-        conn.close()
+    # 同比所需最少期数说明
+    yoy_reason = None
+    if not yoy:
+        yoy_reason = f"同比需至少{idx_last_year}期数据（{'月' if granularity=='month' else '周' if granularity=='week' else '日'}粒度），当前仅{len(data_list)}期"
+    return {
+        "granularity": granularity,
+        "period_over_period": pop,
+        "year_over_year": yoy,
+        "trend": trend,
+        "data_points": len(data_list),
+        "trend_summary": trend_summary,
+        "yoy_reason": yoy_reason,
+    }
 
 
 DOW_NAMES = {1: "周日", 2: "周一", 3: "周二", 4: "周三", 5: "周四", 6: "周五", 7: "周六"}
 
 
 @app.route("/api/dow_sales")
+@cached_api(STORE_ID)
 def api_dow_sales():
-    """周几对比：与 KPI 一致，仅从 t_htma_sale 按星期几汇总，保证与总销售额、趋势图口径一致"""
-    date_cond, date_params, params, sale_cat_cond, sku_cond = _query_filters()
+    """周几对比：与 KPI 一致，仅从销售表按星期几汇总，保证与总销售额、趋势图口径一致"""
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(f"""
-                SELECT DAYOFWEEK(data_date) AS dow,
-                       MAX(CASE DAYOFWEEK(data_date)
-                         WHEN 1 THEN '周日' WHEN 2 THEN '周一' WHEN 3 THEN '周二' WHEN 4 THEN '周三'
-                         WHEN 5 THEN '周四' WHEN 6 THEN '周五' WHEN 7 THEN '周六' ELSE '周日' END) AS dow_name,
-                       COALESCE(SUM(sale_amount), 0) AS sale_amount,
-                       COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount,
-                       COUNT(DISTINCT data_date) AS day_count
-                FROM t_htma_sale
-                WHERE store_id = %s AND {date_cond}{sale_cat_cond}{sku_cond}
-                GROUP BY DAYOFWEEK(data_date)
-                ORDER BY dow
-            """, params)
-            rows = cur.fetchall()
-        by_dow = {int(r["dow"]): r for r in rows}
-        out = []
-        for dow in range(1, 8):
-            r = by_dow.get(dow, {})
-            out.append({
-                "dow": dow,
-                "dow_name": r.get("dow_name") or DOW_NAMES.get(dow, "周?"),
-                "sale_amount": round(float(r.get("sale_amount") or 0), 2),
-                "profit_amount": round(float(r.get("profit_amount") or 0), 2),
-                "day_count": int(r.get("day_count") or 0),
-            })
-        return jsonify(out)
+        return jsonify(_panel_dow_sales(_DashboardScan(conn)))
     finally:
         conn.close()
 
 
+def _panel_dow_sales(scan):
+    by_dow = dow_sales(scan.sale_rows())
+    out = []
+    for dow in range(1, 8):
+        r = by_dow.get(dow, {})
+        out.append({
+            "dow": dow,
+            "dow_name": DOW_NAMES.get(dow, "周?"),
+            "sale_amount": round(float(r.get("sale_amount") or 0), 2),
+            "profit_amount": round(float(r.get("profit_amount") or 0), 2),
+            "day_count": int(r.get("day_count") or 0),
+        })
+    return out
+
+
 def _inv_category_cond_and_params():
     """低库存：通过 sku 关联 sale 表获取品类层级，支持 category_large/mid/small 筛选"""
     category_large_code = request.args.get("category_large_code", "").strip()
@@ -7893,6 +7934,7 @@ def _inv_category_cond_and_params():
 
 
 @app.route("/api/inv_alert_by_category")
+@cached_api(STORE_ID)
 def api_inv_alert_by_category():
     """低库存按品类层级汇总：level=large 按大类，level=mid 按中类，level=small 按小类。支持 category_large_code/mid 筛选"""
     level = request.args.get("level", "large").strip() or "large"
@@ -7901,6 +7943,8 @@ def api_inv_alert_by_category():
     inv_cond, inv_params, need_join = _inv_category_cond_and_params()
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
+        sku_dim = sku_dim_subquery(conn, STORE_ID, SKU_CATEGORY_COLUMNS)
         with conn.cursor() as cur:
             if level == "large":
                 if need_join:
@@ -7909,36 +7953,28 @@ def api_inv_alert_by_category():
                                COALESCE(NULLIF(TRIM(s.category_large_code), ''), NULLIF(TRIM(s.category_large), ''), '') AS category_large_code,
                                COUNT(DISTINCT st.sku_code) AS alert_sku_count,
                                COALESCE(SUM(st.stock_amount), 0) AS stock_amount
-                        FROM t_htma_stock st
+                        FROM {stock} st
                         LEFT JOIN (
-                            SELECT sku_code,
-                                   MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                                   MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                                   MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                            FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                            {sku_dim}
                         ) s ON st.sku_code = s.sku_code
                         WHERE st.store_id = %s AND st.data_date = (
-                            SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                            SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                         ) AND st.stock_qty < 50 AND st.stock_qty >= 0 {inv_cond}
                         GROUP BY category_large, category_large_code
                         ORDER BY alert_sku_count DESC
                     """, (STORE_ID, STORE_ID, STORE_ID) + inv_params)
                 else:
-                    cur.execute("""
+                    cur.execute(f"""
                         SELECT COALESCE(NULLIF(TRIM(s.category_large), ''), NULLIF(TRIM(s.category_large_code), ''), COALESCE(NULLIF(TRIM(st.category_name), ''), COALESCE(NULLIF(TRIM(st.category), ''), '未分类'))) AS category_large,
                                COALESCE(NULLIF(TRIM(s.category_large_code), ''), NULLIF(TRIM(s.category_large), ''), '') AS category_large_code,
                                COUNT(DISTINCT st.sku_code) AS alert_sku_count,
                                COALESCE(SUM(st.stock_amount), 0) AS stock_amount
-                        FROM t_htma_stock st
+                        FROM {stock} st
                         LEFT JOIN (
-                            SELECT sku_code,
-                                   MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                                   MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                                   MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                            FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                            {sku_dim}
                         ) s ON st.sku_code = s.sku_code
                         WHERE st.store_id = %s AND st.data_date = (
-                            SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                            SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                         ) AND st.stock_qty < 50 AND st.stock_qty >= 0
                         GROUP BY category_large, category_large_code
                         ORDER BY alert_sku_count DESC
@@ -7950,16 +7986,12 @@ def api_inv_alert_by_category():
                            COALESCE(NULLIF(TRIM(s.category_mid_code), ''), NULLIF(TRIM(s.category_mid), ''), '') AS category_mid_code,
                            COUNT(DISTINCT st.sku_code) AS alert_sku_count,
                            COALESCE(SUM(st.stock_amount), 0) AS stock_amount
-                    FROM t_htma_stock st
+                    FROM {stock} st
                     INNER JOIN (
-                        SELECT sku_code,
-                               MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                               MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                               MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                        FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                        {sku_dim}
                     ) s ON st.sku_code = s.sku_code
                     WHERE st.store_id = %s AND st.data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND st.stock_qty < 50 AND st.stock_qty >= 0 {large_cond}
                     GROUP BY category_mid, category_mid_code
                     ORDER BY alert_sku_count DESC
@@ -7971,16 +8003,12 @@ def api_inv_alert_by_category():
                            COALESCE(NULLIF(TRIM(s.category_small_code), ''), NULLIF(TRIM(s.category), ''), '') AS category_small_code,
                            COUNT(DISTINCT st.sku_code) AS alert_sku_count,
                            COALESCE(SUM(st.stock_amount), 0) AS stock_amount
-                    FROM t_htma_stock st
+                    FROM {stock} st
                     INNER JOIN (
-                        SELECT sku_code,
-                               MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                               MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                               MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                        FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                        {sku_dim}
                     ) s ON st.sku_code = s.sku_code
                     WHERE st.store_id = %s AND st.data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND st.stock_qty < 50 AND st.stock_qty >= 0
                     AND (COALESCE(TRIM(s.category_large_code), '') = %s OR COALESCE(TRIM(s.category_large), '') = %s) {mid_cond}
                     GROUP BY category_small, category_small_code
@@ -8002,33 +8030,32 @@ def api_inv_alert_by_category():
 
 
 @app.route("/api/inv_alert")
+@cached_api(STORE_ID)
 def api_inv_alert():
     """低库存预警 SKU 数，支持 category_large_code/mid/small 筛选"""
     inv_cond, inv_params, need_join = _inv_category_cond_and_params()
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
+        sku_dim = sku_dim_subquery(conn, STORE_ID, SKU_CATEGORY_COLUMNS)
         with conn.cursor() as cur:
             if need_join:
                 cur.execute(f"""
                     SELECT COUNT(DISTINCT st.sku_code) AS alert_sku_count
-                    FROM t_htma_stock st
+                    FROM {stock} st
                     INNER JOIN (
-                        SELECT sku_code,
-                               MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                               MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                               MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                        FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                        {sku_dim}
                     ) s ON st.sku_code = s.sku_code
                     WHERE st.store_id = %s AND st.data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND st.stock_qty < 50 AND st.stock_qty >= 0 {inv_cond}
                 """, (STORE_ID, STORE_ID, STORE_ID) + inv_params)
             else:
-                cur.execute("""
+                cur.execute(f"""
                     SELECT COUNT(DISTINCT sku_code) AS alert_sku_count
-                    FROM t_htma_stock
+                    FROM {stock}
                     WHERE store_id = %s AND data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND stock_qty < 50 AND stock_qty >= 0
                 """, (STORE_ID, STORE_ID))
             row = cur.fetchone()
@@ -8038,40 +8065,30 @@ def api_inv_alert():
 
 
 @app.route("/api/profit_summary")
+@cached_api(STORE_ID)
 def api_profit_summary():
     """品类汇总：按时间段合并，大类/中类/小类、销售额、毛利、毛利率。支持 period、start_date、end_date、category 及 hierarchy"""
-    date_cond, date_params, _, _, _ = _query_filters()
-    profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
-    params = (STORE_ID,) + date_params + profit_cat_params
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(f"""
-                SELECT COALESCE(category, '未分类') AS category,
-                       MAX(COALESCE(category_large, '')) AS category_large,
-                       MAX(COALESCE(category_mid, '')) AS category_mid,
-                       MAX(COALESCE(category_small, '')) AS category_small,
-                       SUM(total_sale) AS total_sale, SUM(total_profit) AS total_profit
-                FROM t_htma_profit
-                WHERE store_id = %s AND {date_cond}{profit_cat_cond}
-                GROUP BY category
-                ORDER BY total_sale DESC
-            """, params)
-            rows = cur.fetchall()
-        return jsonify([{
-            "category": r["category"] or "未分类",
-            "category_large": r.get("category_large") or "",
-            "category_mid": r.get("category_mid") or "",
-            "category_small": r.get("category_small") or "",
-            "total_sale": round(float(r["total_sale"] or 0), 2),
-            "total_profit": round(float(r["total_profit"] or 0), 2),
-            "profit_rate": round((float(r["total_profit"] or 0) / float(r["total_sale"] or 1) * 100), 2) if r["total_sale"] else 0,
-        } for r in rows])
+        return jsonify(_panel_profit_summary(_DashboardScan(conn)))
     finally:
         conn.close()
 
 
+def _panel_profit_summary(scan):
+    return [{
+        "category": r["category"] or "未分类",
+        "category_large": r.get("category_large") or "",
+        "category_mid": r.get("category_mid") or "",
+        "category_small": r.get("category_small") or "",
+        "total_sale": round(float(r["total_sale"] or 0), 2),
+        "total_profit": round(float(r["total_profit"] or 0), 2),
+        "profit_rate": round((float(r["total_profit"] or 0) / float(r["total_sale"] or 1) * 100), 2) if r["total_sale"] else 0,
+    } for r in profit_summary_rows(scan.profit_rows())]
+
+
 @app.route("/api/sale_summary")
+@cached_api(STORE_ID)
 def api_sale_summary():
     """商品汇总：按时间段合并，SKU、品名、品类、销量、销售额、成本、毛利、毛利率。支持 period、start_date、end_date、category、page、page_size"""
     date_cond, _, params, category_cond, sku_cond = _query_filters(include_sku=True)
@@ -8125,6 +8142,7 @@ def api_sale_summary():
 
 
 @app.route("/api/profit_detail")
+@cached_api(STORE_ID)
 def api_profit_detail():
     """毛利明细表：日期、品类、销售额、毛利、毛利率。支持 period、start_date、end_date、category 及 hierarchy、expand_category（展开某品类时传）、page、page_size"""
     date_cond, date_params, _, _, _ = _query_filters()
@@ -8174,6 +8192,7 @@ def api_profit_detail():
 
 
 @app.route("/api/inv_alert_list")
+@cached_api(STORE_ID)
 def api_inv_alert_list():
     """低库存明细：SKU、品类、库存数量、库存金额。支持 page、page_size、category_large/mid/small"""
     inv_cond, inv_params, need_join = _inv_category_cond_and_params()
@@ -8182,53 +8201,47 @@ def api_inv_alert_list():
     offset = (page - 1) * page_size
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
+        sku_dim = sku_dim_subquery(conn, STORE_ID, SKU_CATEGORY_COLUMNS)
         with conn.cursor() as cur:
             if need_join:
                 cur.execute(f"""
                     SELECT COUNT(*) AS total
-                    FROM t_htma_stock st
+                    FROM {stock} st
                     INNER JOIN (
-                        SELECT sku_code,
-                               MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                               MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                               MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                        FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                        {sku_dim}
                     ) s ON st.sku_code = s.sku_code
                     WHERE st.store_id = %s AND st.data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND st.stock_qty < 50 AND st.stock_qty >= 0 AND (st.stock_qty != 0 OR st.stock_amount != 0) {inv_cond}
                 """, (STORE_ID, STORE_ID, STORE_ID) + inv_params)
                 total = cur.fetchone()["total"] or 0
                 cur.execute(f"""
                     SELECT st.sku_code, COALESCE(st.category, s.category, '') AS category,
                            COALESCE(st.product_name, '') AS product_name, st.stock_qty, st.stock_amount, st.data_date
-                    FROM t_htma_stock st
+                    FROM {stock} st
                     INNER JOIN (
-                        SELECT sku_code,
-                               MAX(category_large_code) AS category_large_code, MAX(category_large) AS category_large,
-                               MAX(category_mid_code) AS category_mid_code, MAX(category_mid) AS category_mid,
-                               MAX(category_small_code) AS category_small_code, MAX(category_small) AS category_small, MAX(category) AS category
-                        FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code
+                        {sku_dim}
                     ) s ON st.sku_code = s.sku_code
                     WHERE st.store_id = %s AND st.data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND st.stock_qty < 50 AND st.stock_qty >= 0 AND (st.stock_qty != 0 OR st.stock_amount != 0) {inv_cond}
                     ORDER BY st.stock_qty ASC
                     LIMIT %s OFFSET %s
                 """, (STORE_ID, STORE_ID, STORE_ID) + inv_params + (page_size, offset))
             else:
-                cur.execute("""
-                    SELECT COUNT(*) AS total FROM t_htma_stock
+                cur.execute(f"""
+                    SELECT COUNT(*) AS total FROM {stock}
                     WHERE store_id = %s AND data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND stock_qty < 50 AND stock_qty >= 0 AND (stock_qty != 0 OR stock_amount != 0)
                 """, (STORE_ID, STORE_ID))
                 total = cur.fetchone()["total"] or 0
-                cur.execute("""
+                cur.execute(f"""
                     SELECT sku_code, category, COALESCE(product_name, '') AS product_name, stock_qty, stock_amount, data_date
-                    FROM t_htma_stock
+                    FROM {stock}
                     WHERE store_id = %s AND data_date = (
-                        SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s
+                        SELECT MAX(data_date) FROM {stock} WHERE store_id = %s
                     ) AND stock_qty < 50 AND stock_qty >= 0 AND (stock_qty != 0 OR stock_amount != 0)
                     ORDER BY stock_qty ASC
                     LIMIT %s OFFSET %s
@@ -8281,6 +8294,7 @@ def api_data_status():
 # ---------- 经营性分析 API（见 docs/现有数据还能做哪些经营性分析.md） ----------
 
 @app.route("/api/return_gift_summary")
+@cached_api(STORE_ID)
 def api_return_gift_summary():
     """退货与赠送汇总：退货/赠送金额与件数占比，支持 period/start_date/end_date"""
     date_cond, _, params, category_cond, _ = _query_filters()
@@ -8322,16 +8336,18 @@ def api_return_gift_summary():
 
 
 @app.route("/api/brand_summary")
+@cached_api(STORE_ID)
 def api_brand_summary():
     """品牌贡献：按品牌汇总销售额、毛利、销量、毛利率、贡献占比。支持 period/start_date/end_date"""
     date_cond, _, params, category_cond, _ = _query_filters()
     conn = get_conn()
     try:
+        src = _sale_source(conn)
         with conn.cursor() as cur:
             cur.execute(f"""
                 SELECT COALESCE(NULLIF(TRIM(brand_name), ''), '未填') AS brand_name,
                        SUM(sale_amount) AS sale_amount, SUM(gross_profit) AS profit, SUM(sale_qty) AS qty
-                FROM t_htma_sale WHERE store_id = %s AND {date_cond}{category_cond}
+                FROM {src} WHERE store_id = %s AND {date_cond}{category_cond}
                 GROUP BY brand_name
                 HAVING SUM(sale_amount) > 0
                 ORDER BY SUM(sale_amount) DESC
@@ -8340,7 +8356,7 @@ def api_brand_summary():
             rows = cur.fetchall()
             cur.execute(f"""
                 SELECT COALESCE(SUM(sale_amount), 0) AS total_sale, COALESCE(SUM(gross_profit), 0) AS total_profit
-                FROM t_htma_sale WHERE store_id = %s AND {date_cond}{category_cond}
+                FROM {src} WHERE store_id = %s AND {date_cond}{category_cond}
             """, params)
             tot = cur.fetchone()
         total_sale = float(tot["total_sale"] or 0)
@@ -8365,6 +8381,7 @@ def api_brand_summary():
 
 
 @app.route("/api/brand_categories", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_brand_categories():
     """经营分析-品牌下钻：按品牌返回涉及的大类/中类/小类及销售额、毛利。用于品牌行展开后展示品类明细。"""
     brand = (request.args.get("brand") or request.args.get("brand_name") or "").strip()
@@ -8377,6 +8394,7 @@ def api_brand_categories():
         params.append(brand)
         conn = get_conn()
         try:
+            src = _sale_source(conn)
             with conn.cursor() as cur:
                 cur.execute(f"""
                     SELECT
@@ -8387,8 +8405,8 @@ def api_brand_categories():
                         COALESCE(NULLIF(TRIM(category_small), ''), NULLIF(TRIM(category), ''), '未分类') AS category_small,
                         COALESCE(NULLIF(TRIM(category_small_code), ''), NULLIF(TRIM(category_small), ''), NULLIF(TRIM(category), ''), '') AS category_small_code,
                         SUM(sale_amount) AS sale_amount,
-                        SUM(COALESCE(gross_profit, sale_amount - sale_cost, 0)) AS profit_amount
-                    FROM t_htma_sale
+                        SUM({profit_filled_expr(src)}) AS profit_amount
+                    FROM {src}
                     WHERE store_id = %s AND {date_cond}{category_cond}{brand_cond}
                     GROUP BY category_large, category_large_code, category_mid, category_mid_code, category_small, category_small_code
                     ORDER BY sale_amount DESC
@@ -8420,16 +8438,18 @@ def api_brand_categories():
 
 
 @app.route("/api/supplier_summary")
+@cached_api(STORE_ID)
 def api_supplier_summary():
     """供应商贡献：按供应商汇总销售额、毛利、销量、毛利率、贡献占比"""
     date_cond, _, params, category_cond, _ = _query_filters()
     conn = get_conn()
     try:
+        src = _sale_source(conn)
         with conn.cursor() as cur:
             cur.execute(f"""
                 SELECT COALESCE(NULLIF(TRIM(supplier_name), ''), '未填') AS supplier_name,
                        SUM(sale_amount) AS sale_amount, SUM(gross_profit) AS profit, SUM(sale_qty) AS qty
-                FROM t_htma_sale WHERE store_id = %s AND {date_cond}{category_cond}
+                FROM {src} WHERE store_id = %s AND {date_cond}{category_cond}
                 GROUP BY supplier_name
                 HAVING SUM(sale_amount) > 0
                 ORDER BY SUM(sale_amount) DESC
@@ -8438,7 +8458,7 @@ def api_supplier_summary():
             rows = cur.fetchall()
             cur.execute(f"""
                 SELECT COALESCE(SUM(sale_amount), 0) AS total_sale, COALESCE(SUM(gross_profit), 0) AS total_profit
-                FROM t_htma_sale WHERE store_id = %s AND {date_cond}{category_cond}
+                FROM {src} WHERE store_id = %s AND {date_cond}{category_cond}
             """, params)
             tot = cur.fetchone()
         total_sale = float(tot["total_sale"] or 0)
@@ -8463,6 +8483,7 @@ def api_supplier_summary():
 
 
 @app.route("/api/supplier_categories", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_supplier_categories():
     """经营分析-供应商下钻：按供应商返回供应的品类（大类/中类/小类）及销售额、毛利。"""
     supplier = (request.args.get("supplier") or request.args.get("supplier_name") or "").strip()
@@ -8475,6 +8496,7 @@ def api_supplier_categories():
         params.append(supplier)
         conn = get_conn()
         try:
+            src = _sale_source(conn)
             with conn.cursor() as cur:
                 cur.execute(f"""
                     SELECT
@@ -8485,8 +8507,8 @@ def api_supplier_categories():
                         COALESCE(NULLIF(TRIM(category_small), ''), NULLIF(TRIM(category), ''), '未分类') AS category_small,
                         COALESCE(NULLIF(TRIM(category_small_code), ''), NULLIF(TRIM(category_small), ''), NULLIF(TRIM(category), ''), '') AS category_small_code,
                         SUM(sale_amount) AS sale_amount,
-                        SUM(COALESCE(gross_profit, sale_amount - sale_cost, 0)) AS profit_amount
-                    FROM t_htma_sale
+                        SUM({profit_filled_expr(src)}) AS profit_amount
+                    FROM {src}
                     WHERE store_id = %s AND {date_cond}{category_cond}{supplier_cond}
                     GROUP BY category_large, category_large_code, category_mid, category_mid_code, category_small, category_small_code
                     ORDER BY sale_amount DESC
@@ -8518,6 +8540,7 @@ def api_supplier_categories():
 
 
 @app.route("/api/supplier_products", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_supplier_products():
     """经营分析-供应商下钻：按供应商+品类（大类/中类/小类）返回商品汇总。用于品类行展开后展示商品。"""
     supplier = (request.args.get("supplier") or request.args.get("supplier_name") or "").strip()
@@ -8573,6 +8596,7 @@ def api_supplier_products():
 
 
 @app.route("/api/price_band_summary")
+@cached_api(STORE_ID)
 def api_price_band_summary():
     """价格带分布：按件单价分段（0-10/10-30/30-50/50-100/100+）的销售额、销量、消费笔数及占比"""
     date_cond, _, params, category_cond, _ = _query_filters()
@@ -8648,6 +8672,7 @@ def _price_band_unit_cond(band):
 
 
 @app.route("/api/price_band_categories", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_price_band_categories():
     """经营分析-价格带下钻：按价格带返回涉及的品类（大类/中类/小类）及销售额、毛利。"""
     band = (request.args.get("band") or "").strip()
@@ -8702,6 +8727,7 @@ def api_price_band_categories():
 
 
 @app.route("/api/price_band_products", methods=["GET", "HEAD"])
+@cached_api(STORE_ID)
 def api_price_band_products():
     """经营分析-价格带下钻：按价格带+品类返回商品汇总。用于品类行展开后展示商品。"""
     band = (request.args.get("band") or "").strip()
@@ -8754,12 +8780,14 @@ def api_price_band_products():
 
 
 @app.route("/api/sku_turnover")
+@cached_api(STORE_ID)
 def api_sku_turnover():
     """SKU 周转：近 N 天销量、最新库存、周转天数（库存/日均销量）。limit 默认 100"""
     date_cond, _, params, category_cond, _ = _query_filters()
     limit = min(int(request.args.get("limit", 100)), 500)
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
         with conn.cursor() as cur:
             cur.execute(f"""
                 SELECT s.sku_code,
@@ -8771,8 +8799,8 @@ def api_sku_turnover():
                 FROM t_htma_sale s
                 LEFT JOIN (
                     SELECT sku_code, stock_qty, product_name
-                    FROM t_htma_stock
-                    WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+                    FROM {stock}
+                    WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
                 ) st ON st.sku_code = s.sku_code
                 WHERE s.store_id = %s AND {date_cond}{category_cond}
                 GROUP BY s.sku_code, st.product_name, s.product_name, s.category, st.stock_qty
@@ -8815,12 +8843,14 @@ def api_sku_turnover():
 
 
 @app.route("/api/sku_abc")
+@cached_api(STORE_ID)
 def api_sku_abc():
     """SKU ABC 分类：按销售额累计占比 A(前80%)/B(80-95%)/C(其余)。返回每类数量及明细（可 limit）"""
     date_cond, _, params, category_cond, _ = _query_filters()
     limit = min(int(request.args.get("limit", 200)), 500)
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
         with conn.cursor() as cur:
             cur.execute(f"""
                 SELECT s.sku_code,
@@ -8830,8 +8860,8 @@ def api_sku_abc():
                        SUM(s.gross_profit) AS profit
                 FROM t_htma_sale s
                 LEFT JOIN (
-                    SELECT sku_code, product_name FROM t_htma_stock
-                    WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+                    SELECT sku_code, product_name FROM {stock}
+                    WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
                 ) st ON st.sku_code = s.sku_code
                 WHERE s.store_id = %s AND {date_cond}{category_cond}
                 GROUP BY s.sku_code, st.product_name, s.product_name, s.category
@@ -8875,12 +8905,14 @@ def api_sku_abc():
 
 
 @app.route("/api/negative_margin_detail")
+@cached_api(STORE_ID)
 def api_negative_margin_detail():
     """负毛利明细：销售额>0 且毛利<0 的 SKU 列表。format=csv 时返回 CSV 下载"""
     date_cond, _, params, category_cond, _ = _query_filters()
     limit = min(int(request.args.get("limit", 200)), 1000)
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
         with conn.cursor() as cur:
             cur.execute(f"""
                 SELECT s.sku_code,
@@ -8892,8 +8924,8 @@ def api_negative_margin_detail():
                        SUM(s.gross_profit) AS profit
                 FROM t_htma_sale s
                 LEFT JOIN (
-                    SELECT sku_code, product_name FROM t_htma_stock
-                    WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+                    SELECT sku_code, product_name FROM {stock}
+                    WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
                 ) st ON st.sku_code = s.sku_code
                 WHERE s.store_id = %s AND {date_cond}{category_cond}
                 GROUP BY s.sku_code, st.product_name, s.product_name, s.category
@@ -8936,6 +8968,7 @@ def api_negative_margin_detail():
 
 
 @app.route("/api/category_structure_trend")
+@cached_api(STORE_ID)
 def api_category_structure_trend():
     """品类结构趋势：按周或月汇总各品类销售额、毛利及占比。granularity=week|month，默认 week"""
     granularity = request.args.get("granularity", "week")
@@ -8999,16 +9032,18 @@ def api_category_structure_trend():
 
 
 @app.route("/api/inventory_turnover_summary")
+@cached_api(STORE_ID)
 def api_inventory_turnover_summary():
     """库存周转汇总：期末库存金额、周期内销售成本（或销售额）、周转天数"""
     date_cond, _, params, category_cond, _ = _query_filters()
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
         with conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 SELECT COALESCE(SUM(stock_amount), 0) AS total_stock
-                FROM t_htma_stock
-                WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+                FROM {stock}
+                WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
             """, (STORE_ID, STORE_ID))
             stock_row = cur.fetchone()
             cur.execute(f"""
@@ -9041,6 +9076,7 @@ def api_inventory_turnover_summary():
 
 
 @app.route("/api/inventory_turnover_by_category")
+@cached_api(STORE_ID)
 def api_inventory_turnover_by_category():
     """库存周转按品类：按大类汇总期末库存金额、周期销售成本、周转天数，与 summary 口径一致"""
     date_cond, _, params, category_cond, _ = _query_filters()
@@ -9054,12 +9090,13 @@ def api_inventory_turnover_by_category():
             pass
     conn = get_conn()
     try:
+        stock = stock_source(conn, STORE_ID)
         with conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 SELECT COALESCE(NULLIF(TRIM(st.category_large), ''), NULLIF(TRIM(st.category), ''), '未分类') AS category_large,
                        COALESCE(SUM(st.stock_amount), 0) AS stock_amount
-                FROM t_htma_stock st
-                WHERE st.store_id = %s AND st.data_date = (SELECT MAX(data_date) FROM t_htma_stock WHERE store_id = %s)
+                FROM {stock} st
+                WHERE st.store_id = %s AND st.data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)
                 GROUP BY category_large
                 HAVING stock_amount > 0
             """, (STORE_ID, STORE_ID))
@@ -9128,57 +9165,43 @@ def api_data_quality():
 
 
 @app.route("/api/category_rank_by_large")
+@cached_api(STORE_ID)
 def api_category_rank_by_large():
     """品类排行按大类汇总：大类名称、销售额、毛利、毛利率、贡献度。支持 start_date、end_date、category 及 hierarchy"""
-    date_cond, date_params, _, _, _ = _query_filters()
-    profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
-    params = (STORE_ID,) + date_params + profit_cat_params
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(f"""
-                SELECT COALESCE(NULLIF(TRIM(category_large), ''), NULLIF(TRIM(category_large_code), ''), '未分类') AS category_large,
-                       COALESCE(NULLIF(TRIM(category_large_code), ''), NULLIF(TRIM(category_large), ''), '') AS category_large_code,
-                       SUM(total_sale) AS total_sale, SUM(total_profit) AS total_profit
-                FROM t_htma_profit
-                WHERE store_id = %s AND {date_cond}{profit_cat_cond}
-                  AND (COALESCE(TRIM(category_large), '') != '' OR COALESCE(TRIM(category_large_code), '') != '')
-                GROUP BY category_large, category_large_code
-                ORDER BY total_sale DESC
-                LIMIT 50
-            """, params)
-            rows = cur.fetchall()
-            cur.execute(f"""
-                SELECT COALESCE(SUM(total_sale), 0) AS total_sale, COALESCE(SUM(total_profit), 0) AS total_profit
-                FROM t_htma_profit
-                WHERE store_id = %s AND {date_cond}{profit_cat_cond}
-            """, params)
-            tot = cur.fetchone()
-        total_sale = float(tot["total_sale"] or 0)
-        total_profit = float(tot["total_profit"] or 0)
-        out = []
-        for i, r in enumerate(rows, 1):
-            sale = float(r["total_sale"] or 0)
-            profit = float(r["total_profit"] or 0)
-            contrib_sale = (sale / total_sale * 100) if total_sale > 0 else 0
-            contrib_profit = (profit / total_profit * 100) if total_profit > 0 else 0
-            margin = (profit / sale * 100) if sale > 0 else 0
-            out.append({
-                "rank": i,
-                "category_large": r["category_large"] or "未分类",
-                "category_large_code": r.get("category_large_code") or "",
-                "sale_amount": round(sale, 2),
-                "profit_amount": round(profit, 2),
-                "margin_pct": round(margin, 2),
-                "sale_contrib_pct": round(contrib_sale, 2),
-                "profit_contrib_pct": round(contrib_profit, 2),
-            })
-        return jsonify(out)
+        return jsonify(_panel_category_rank_by_large(_DashboardScan(conn)))
     finally:
         conn.close()
 
 
+def _panel_category_rank_by_large(scan):
+    rows = scan.profit_rows()
+    tot_sale, tot_profit = profit_totals(rows)
+    total_sale = float(tot_sale)
+    total_profit = float(tot_profit)
+    out = []
+    for i, r in enumerate(category_large_rank_rows(rows), 1):
+        sale = float(r["total_sale"] or 0)
+        profit = float(r["total_profit"] or 0)
+        contrib_sale = (sale / total_sale * 100) if total_sale > 0 else 0
+        contrib_profit = (profit / total_profit * 100) if total_profit > 0 else 0
+        margin = (profit / sale * 100) if sale > 0 else 0
+        out.append({
+            "rank": i,
+            "category_large": r["category_large"] or "未分类",
+            "category_large_code": r.get("category_large_code") or "",
+            "sale_amount": round(sale, 2),
+            "profit_amount": round(profit, 2),
+            "margin_pct": round(margin, 2),
+            "sale_contrib_pct": round(contrib_sale, 2),
+            "profit_contrib_pct": round(contrib_profit, 2),
+        })
+    return out
+
+
 @app.route("/api/category_rank_detail")
+@cached_api(STORE_ID)
 def api_category_rank_detail():
     """品类排行明细：按大类下的中类/小类（扁平列表，兼容旧用）。需传 category_large_code 或 category_large"""
     category_large_code = request.args.get("category_large_code", "").strip() or request.args.get("category_large", "").strip()
@@ -9224,34 +9247,58 @@ def api_category_rank_detail():
 
 
 @app.route("/api/category_rank")
+@cached_api(STORE_ID)
 def api_category_rank():
     """品类排行：销售、毛利、毛利率、贡献度。支持 start_date、end_date、category 及 hierarchy"""
-    date_cond, date_params, _, _, _ = _query_filters()
-    profit_cat_cond, profit_cat_params = _profit_category_cond_and_params(date_cond, date_params)
-    params = (STORE_ID,) + date_params + profit_cat_params
     conn = get_conn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(f"""
-                SELECT COALESCE(category, '未分类') AS category,
-                       SUM(total_sale) AS total_sale, SUM(total_profit) AS total_profit
-                FROM t_htma_profit
-                WHERE store_id = %s AND {date_cond}{profit_cat_cond}
-                GROUP BY category
-                ORDER BY total_sale DESC
-                LIMIT 50
-            """, params)
-            rows = cur.fetchall()
-            cur.execute(f"""
-                SELECT COALESCE(SUM(total_sale), 0) AS total_sale, COALESCE(SUM(total_profit), 0) AS total_profit
-                FROM t_htma_profit
-                WHERE store_id = %s AND {date_cond}{profit_cat_cond}
-            """, params)
-            tot = cur.fetchone()
-        total_sale = float(tot["total_sale"] or 0)
-        total_profit = float(tot["total_profit"] or 0)
-        out = category_rank_data(rows, total_sale, total_profit)
-        return jsonify(out)
+        return jsonify(_panel_category_rank(_DashboardScan(conn)))
+    finally:
+        conn.close()
+
+
+def _panel_category_rank(scan):
+    rows = scan.profit_rows()
+    total_sale, total_profit = profit_totals(rows)
+    return category_rank_data(category_rank_rows(rows), float(total_sale), float(total_profit))
+
+
+# 首页看板面板：名称 -> 派生函数(scan)；单个面板接口与 /api/dashboard_bundle 共用，避免两套口径
+DASHBOARD_PANELS = {
+    "kpi": _panel_kpi,
+    "category_pie": _panel_category_pie,
+    "sales_trend": lambda scan: _panel_sales_trend(scan, request.args.get("granularity", "day")),
+    "trend_analysis": lambda scan: _panel_trend_analysis(scan, request.args.get("trend_granularity", "day")),
+    "dow_sales": _panel_dow_sales,
+    "category_rank": _panel_category_rank,
+    "category_rank_by_large": _panel_category_rank_by_large,
+    "profit_summary": _panel_profit_summary,
+}
+
+
+@app.route("/api/dashboard_bundle")
+@cached_api(STORE_ID)
+def api_dashboard_bundle():
+    """
+    首页看板批量接口：panels=kpi,sales_trend,...（缺省为全部）+ 与单个面板接口相同的筛选参数，
+    销售扫描与毛利扫描各读一次，各面板在其上派生，返回 {"panels": {名称: 与单个接口相同的 JSON}, "errors": {名称: 错误}}。
+    sales_trend 的粒度取 granularity，trend_analysis 的粒度取 trend_granularity（缺省 day）。
+    有面板出错时返回 500（其余面板照常返回，不进缓存）。
+    """
+    names = list(dict.fromkeys(p.strip() for p in request.args.get("panels", "").split(",") if p.strip())) or list(DASHBOARD_PANELS)
+    unknown = [n for n in names if n not in DASHBOARD_PANELS]
+    if unknown:
+        return jsonify({"error": f"未知面板: {', '.join(unknown)}", "available": list(DASHBOARD_PANELS)}), 400
+    conn = get_conn()
+    try:
+        scan = _DashboardScan(conn, by_category="category_pie" in names)
+        panels, errors = {}, {}
+        for name in names:
+            try:
+                panels[name] = DASHBOARD_PANELS[name](scan)
+            except Exception as e:
+                errors[name] = str(e)
+        return jsonify({"panels": panels, "errors": errors}), (500 if errors else 200)
     finally:
         conn.close()
 
@@ -9588,7 +9635,14 @@ def api_structured_report():
     }
     conn = get_conn()
     try:
-        insight_data = _get_consumer_insight_data(param_override=param_override)
+        # 消费洞察、智能建议与市场拓展报告的查询互不依赖，合并为一个计划并发执行
+        plan = QueryPlan(conn)
+        plan.call("insight_data", _get_consumer_insight_data, param_override, use_conn=False)
+        declare_insight_queries(plan, STORE_ID, ns="insights.")
+        if include_market:
+            declare_marketing_queries(plan, STORE_ID, days=30, ns="market.", optional=True)
+        res = plan.run()
+        insight_data = res["insight_data"]
         drill_context = None
         if category or brand or product_name:
             drill_context = {
@@ -9599,11 +9653,11 @@ def api_structured_report():
                 "drill_styles": insight_data.get("drill_styles"),
                 "drill_sku_rank": insight_data.get("drill_sku_rank"),
             }
-        insights = build_insights(conn, STORE_ID, drill_context=drill_context)
+        insights = compose_insights(res, STORE_ID, drill_context=drill_context, ns="insights.")
         market_report_text = None
         if include_market:
             try:
-                market_lines = build_marketing_report(conn, STORE_ID, days=30, mode="market_expansion")
+                market_lines = compose_marketing_report(res, days=30, mode="market_expansion", ns="market.")
                 market_report_text = "\n".join(market_lines) if isinstance(market_lines, list) else str(market_lines)
             except Exception:
                 market_report_text = ""
@@ -9653,6 +9707,8 @@ def api_repair_recalc_unit_price():
                 GROUP BY data_date, category, store_id
             """)
             conn.commit()
+        refresh_sale_rollup(conn, STORE_ID)
+        bump_data_version(conn, STORE_ID)
         conn.close()
         return jsonify({"success": True, "message": "已按单价×数量重算销售额与成本"})
     except Exception as e:
@@ -9683,6 +9739,8 @@ def api_repair_swap_amount_cost():
                 GROUP BY data_date, category, store_id
             """)
             conn.commit()
+        refresh_sale_rollup(conn, STORE_ID)
+        bump_data_version(conn, STORE_ID)
         conn.close()
         return jsonify({"success": True, "message": "已对调金额与成本并重算毛利表"})
     except Exception as e:
@@ -10073,11 +10131,13 @@ def api_price_compare():
         if request.method == "GET":
             days = int(request.args.get("days", 30))
             fetch_limit = request.args.get("fetch_limit", type=int)
+            max_age = request.args.get("max_age", type=int)
             sku_codes = None
         else:
             data = (request.get_json(silent=True) or {}) if request.is_json else {}
             days = int(data.get("days", 30))
             fetch_limit = data.get("fetch_limit")
+            max_age = int(data["max_age"]) if data.get("max_age") is not None else None
             sku_codes = data.get("sku_codes")  # 前端勾选的货号，仅对选中项比价
         if fetch_limit is None:
             try:
@@ -10088,7 +10148,8 @@ def api_price_compare():
         use_mock = request.method == "GET"  # POST 时用真实 API
         conn = get_conn()
         try:
-            result = run_full_pipeline(conn, store_id=STORE_ID, days=days, use_mock_fetcher=use_mock, fetch_limit=fetch_limit, sku_codes=sku_codes)
+            # max_age：竞品价缓存可接受的最长秒数，看板临时比价可配合 fetch_limit=0 只读缓存
+            result = run_full_pipeline(conn, store_id=STORE_ID, days=days, use_mock_fetcher=use_mock, fetch_limit=fetch_limit, sku_codes=sku_codes, max_age=max_age)
             report = format_report(result)
             items = result.get("items", [])
             # 构建表格数据，确保 items 字段始终存在（即使为空数组）
@@ -10141,7 +10202,7 @@ def api_price_compare():
 def api_price_compare_daily():
     """
     每日自动比价：按当日（或昨日）销售 TOP 商品比价，可选推送飞书。
-    供用户主动触发或 OpenClaw/cron 调用。body: limit, fetch_limit, send_feishu, feishu_at_user_id
+    供用户主动触发或 OpenClaw/cron 调用。body: limit, fetch_limit, max_age, send_feishu, feishu_at_user_id
     """
     if request.method == "OPTIONS":
         return "", 204
@@ -10153,6 +10214,7 @@ def api_price_compare_daily():
         fetch_limit = data.get("fetch_limit")
         if fetch_limit is not None:
             fetch_limit = int(fetch_limit)
+        max_age = int(data["max_age"]) if data.get("max_age") is not None else None
         send_feishu_flag = data.get("send_feishu", False)
         at_user_id = data.get("feishu_at_user_id") or os.environ.get("FEISHU_AT_USER_ID", "ou_8db735f2")
         at_user_name = data.get("feishu_at_user_name") or os.environ.get("FEISHU_AT_USER_NAME", "余为军")
@@ -10160,7 +10222,7 @@ def api_price_compare_daily():
         try:
             result = run_daily_top_compare(
                 conn, store_id=STORE_ID, data_date=None, limit=limit,
-                use_mock_fetcher=False, save_to_db=True, fetch_limit=fetch_limit or limit,
+                use_mock_fetcher=False, save_to_db=True, fetch_limit=limit if fetch_limit is None else fetch_limit, max_age=max_age,
             )
             report = format_report(result)
             items = result.get("items", [])
@@ -10282,15 +10344,17 @@ def api_price_compare_results():
 
 @app.route("/api/health")
 def api_health():
-    """健康检查"""
+    """健康检查（含数据库连接池状态）"""
     try:
         conn = get_conn()
         conn.close()
-        return jsonify({"status": "ok", "db": "connected"})
+        return jsonify({"status": "ok", "db": "connected", "pool": pool_stats(), "cache": cache_stats()})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return jsonify({"status": "error", "message": str(e), "pool": pool_stats(), "cache": cache_stats()}), 500
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "5002"))
+    # 预热数据库连接池，首批请求免去 TCP+认证握手；数据库未就绪时不影响启动
+    warm_pool()
     app.run(host="0.0.0.0", port=port, debug=False)
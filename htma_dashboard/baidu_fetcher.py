@@ -14,12 +14,22 @@ try:
     load_dotenv(os.path.join(_root, ".env"))
 except ImportError:
     pass
+import threading
 import time
 import urllib.request
 import urllib.parse
 import json
 from typing import Optional, Callable, Any
 
+try:
+    from mcp_session import McpSseSession
+    from price_cache import note_fetch_error
+    from rate_limit import urlopen as _limited_urlopen
+except ImportError:
+    from htma_dashboard.mcp_session import McpSseSession
+    from htma_dashboard.price_cache import note_fetch_error
+    from htma_dashboard.rate_limit import urlopen as _limited_urlopen
+
 # ========== 配置（环境变量） ==========
 # 百度 API 商城 apikey：https://apis.baidu.com/ 购买商品条码/商品搜索类 API 后获取
 BAIDU_APISTORE_KEY = os.environ.get("BAIDU_APISTORE_KEY", "")
@@ -49,91 +59,64 @@ BAIDU_YOUXUAN_TOKEN = os.environ.get("BAIDU_YOUXUAN_TOKEN", "")
 BAIDU_YOUXUAN_SSE_BASE = "https://mcp-youxuan.baidu.com"
 
 
-def _http_get(url: str, headers: Optional[dict] = None, timeout: int = 10) -> Optional[dict]:
-    """发起 GET 请求，返回 JSON"""
+def _urlopen(req, timeout: int, provider: Optional[str] = None):
+    """provider 为数据源名时按 rate_limit 中该数据源的 QPS/并发限流。"""
+    if provider:
+        return _limited_urlopen(provider, req, timeout)
+    return urllib.request.urlopen(req, timeout=timeout)
+
+
+def _http_get(url: str, headers: Optional[dict] = None, timeout: int = 10, provider: Optional[str] = None) -> Optional[dict]:
+    """发起 GET 请求，返回 JSON；请求失败返回 None 并标记本次检索出错（价格缓存不做负缓存）"""
     try:
         req = urllib.request.Request(url, headers=headers or {})
-        with urllib.request.urlopen(req, timeout=timeout) as r:
+        with _urlopen(req, timeout, provider) as r:
             return json.loads(r.read().decode())
     except Exception:
+        note_fetch_error()
         return None
 
 
-def _http_post(url: str, data: Optional[bytes] = None, headers: Optional[dict] = None, timeout: int = 10) -> Optional[dict]:
-    """发起 POST 请求，返回 JSON"""
+def _http_post(url: str, data: Optional[bytes] = None, headers: Optional[dict] = None, timeout: int = 10, provider: Optional[str] = None) -> Optional[dict]:
+    """发起 POST 请求，返回 JSON；请求失败同 _http_get"""
     try:
         h = dict(headers or {})
         if data and "Content-Type" not in h:
             h["Content-Type"] = "application/x-www-form-urlencoded"
         req = urllib.request.Request(url, data=data or None, headers=h, method="POST")
-        with urllib.request.urlopen(req, timeout=timeout) as r:
+        with _urlopen(req, timeout, provider) as r:
             return json.loads(r.read().decode())
     except Exception:
+        note_fetch_error()
         return None
 
 
-def _mcp_youxuan_sse_endpoint(token: str, timeout: int = 10) -> Optional[str]:
-    """
-    连接百度优选 MCP SSE，解析 endpoint 事件得到 POST 地址。
-    返回可用于 tools/call 的完整 URL，失败返回 None。
-    """
-    if not token or not token.strip():
-        return None
-    base = BAIDU_YOUXUAN_SSE_BASE
-    sse_url = f"{base}/mcp/sse?key={urllib.parse.quote(token.strip())}"
-    try:
-        req = urllib.request.Request(sse_url, headers={"Accept": "text/event-stream"})
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            endpoint_data = None
-            event_type = None
-            for line in r:
-                line = line.decode("utf-8", errors="replace").strip()
-                if line.startswith("event:"):
-                    event_type = line[6:].strip()
-                elif line.startswith("data:") and event_type == "endpoint":
-                    endpoint_data = line[5:].strip()
-                    break
-            if not endpoint_data:
-                return None
-            if endpoint_data.startswith("http://") or endpoint_data.startswith("https://"):
-                return endpoint_data
-            base_url = base.rstrip("/")
-            if endpoint_data.startswith("/"):
-                return base_url + endpoint_data
-            return base_url + "/" + endpoint_data
-    except Exception:
-        return None
+_youxuan_sessions = {}
+_youxuan_sessions_lock = threading.Lock()
+
+
+def _mcp_youxuan_session(token: str) -> McpSseSession:
+    """百度优选 MCP 的共享会话（按 Token 各一个），查价与商品列表共用，SSE 连接与 endpoint 跨请求复用。"""
+    key = (BAIDU_YOUXUAN_SSE_BASE, token.strip())
+    with _youxuan_sessions_lock:
+        session = _youxuan_sessions.get(key)
+        if session is None:
+            sse_url = f"{BAIDU_YOUXUAN_SSE_BASE}/mcp/sse?key={urllib.parse.quote(token.strip())}"
+            session = _youxuan_sessions[key] = McpSseSession(sse_url, base_url=BAIDU_YOUXUAN_SSE_BASE, provider="baidu_youxuan")
+    return session
 
 
 def _mcp_youxuan_call_tool(token: str, tool_name: str, arguments: dict, timeout: int = 12) -> Optional[dict]:
     """
-    百度优选 MCP：先取 endpoint，再 POST JSON-RPC tools/call。
-    返回 JSON-RPC result 或 None。
+    百度优选 MCP：经共享会话 POST JSON-RPC tools/call（SSE 连接与 endpoint 复用，断开自动重连）。
+    返回 JSON-RPC result 或 None（调用失败，同时标记本次检索出错）。
     """
-    endpoint = _mcp_youxuan_sse_endpoint(token, timeout=timeout)
-    if not endpoint:
-        return None
-    payload = {
-        "jsonrpc": "2.0",
-        "id": "1",
-        "method": "tools/call",
-        "params": {"name": tool_name, "arguments": arguments},
-    }
-    body = json.dumps(payload).encode("utf-8")
-    try:
-        req = urllib.request.Request(
-            endpoint,
-            data=body,
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            out = json.loads(r.read().decode())
-    except Exception:
+    if not token or not token.strip():
         return None
-    if "result" in out:
-        return out["result"]
-    return None
+    result = _mcp_youxuan_session(token).call_tool(tool_name, arguments, timeout=timeout)
+    if result is None:
+        note_fetch_error()
+    return result
 
 
 def baidu_youxuan_price_fetcher(std_name: str) -> Optional[dict]:
@@ -273,7 +256,7 @@ def juhe_price_fetcher(std_name: str) -> Optional[dict]:
         return None
     url = JUHE_PRICE_URL
     params = urllib.parse.urlencode({"key": JUHE_PRICE_KEY, "q": keyword})
-    data = _http_get(f"{url}?{params}", timeout=8)
+    data = _http_get(f"{url}?{params}", timeout=8, provider="juhe")
     if not data or data.get("error_code") != 0:
         return None
     result = data.get("result", {})
@@ -349,7 +332,7 @@ def _onebound_search(platform: str, keyword: str) -> Optional[dict]:
         "page": "1",
         "page_size": "10",
     })
-    data = _http_get(f"{url}?{params}", timeout=12)
+    data = _http_get(f"{url}?{params}", timeout=12, provider="onebound")
     if not data or str(data.get("error_code", "")) != "0000":
         return None
     items_obj = data.get("items") or {}
@@ -424,7 +407,7 @@ def baidu_apistore_barcode_fetcher(std_name: str, barcode: Optional[str] = None)
         # 部分百度 API 商城商品搜索接口（以实际文档为准）
         url = "https://api.jisuapi.com/shopping/search"
         params = urllib.parse.urlencode({"appkey": BAIDU_APISTORE_KEY, "keyword": (std_name or "")[:20]})
-    data = _http_get(f"{url}?{params}", timeout=8)
+    data = _http_get(f"{url}?{params}", timeout=8, provider="apistore")
     if not data or data.get("status") != "0":
         return None
     result = data.get("result") or data.get("data") or {}
@@ -462,7 +445,7 @@ def jd_haojingke_fetcher(std_name: str) -> Optional[dict]:
         "sort": "1",  # 1=券后价升序
         "sortby": "asc",
     })
-    data = _http_get(f"{url}?{params}", timeout=12)
+    data = _http_get(f"{url}?{params}", timeout=12, provider="haojingke")
     if not data or data.get("status_code") != 200:
         return None
     items = data.get("data") or []
@@ -511,7 +494,7 @@ def haojingke_unified_fetcher(std_name: str, source_type: int = 0) -> Optional[d
     if source_type > 0:
         params["source_type"] = str(source_type)
     qs = urllib.parse.urlencode(params)
-    data = _http_get(f"{url}?{qs}", timeout=12)
+    data = _http_get(f"{url}?{qs}", timeout=12, provider="haojingke")
     if not data or data.get("status_code") != 200:
         return None
     items = data.get("data") or []
@@ -560,7 +543,7 @@ def pdd_haojingke_fetcher(std_name: str) -> Optional[dict]:
         "page_size": "10",
         "sort_type": "3",  # 按价格升序
     })
-    data = _http_get(f"{url}?{params}", timeout=10)
+    data = _http_get(f"{url}?{params}", timeout=10, provider="haojingke")
     if not data or data.get("status_code") != 200:
         return None
     goods = (data.get("data") or {}).get("goods_list") or []
@@ -682,9 +665,8 @@ def item_fetcher_jd_taobao(item: dict) -> Optional[dict]:
             if r:
                 jd_r = r
 
-    # 3) 淘宝：OneBound Taobao（蚂蚁星球无淘宝，仅 OneBound 支持）
+    # 3) 淘宝：OneBound Taobao（蚂蚁星球无淘宝，仅 OneBound 支持）；限流由 rate_limit 按数据源控制
     if keyword:
-        time.sleep(0.15)  # 限流
         tb_r = onebound_taobao_price_fetcher(keyword)
 
     jd_min = float(jd_r["min_price"]) if jd_r and jd_r.get("min_price") else None
@@ -709,6 +691,26 @@ def item_fetcher_jd_taobao(item: dict) -> Optional[dict]:
     }
 
 
+def configured_price_sources() -> list:
+    """当前已配置 Key/Token 的数据源名（item_fetcher 等的 price_sources），价格缓存按此区分不同配置下的检索结果。"""
+    sources = []
+    if BAIDU_APISTORE_KEY:
+        sources.append("baidu_apistore")
+    if BAIDU_YOUXUAN_TOKEN:
+        sources.append("baidu_youxuan")
+    if ONEBOUND_KEY and ONEBOUND_SECRET:
+        sources.append(f"onebound_{ONEBOUND_PLATFORM}")
+    if PDD_HOJINGKE_APIKEY:
+        sources.append("haojingke")
+    if JUHE_PRICE_KEY:
+        sources.append("juhe")
+    return sources
+
+
+item_fetcher.price_sources = configured_price_sources
+item_fetcher_jd_taobao.price_sources = configured_price_sources
+
+
 def get_configured_fetcher(dual_platform: bool = True) -> Optional[Callable[[dict], Optional[dict]]]:
     """
     返回已配置的 fetcher。dual_platform=True 时优先返回京东+淘宝双平台 fetcher。
@@ -737,7 +739,7 @@ def onebound_test_ok() -> tuple[bool, str]:
         "page": "1",
         "page_size": "5",
     })
-    data = _http_get(f"{url}?{params}", timeout=10)
+    data = _http_get(f"{url}?{params}", timeout=10, provider="onebound")
     if not data:
         return False, "OneBound 请求失败"
     ec = str(data.get("error_code", ""))
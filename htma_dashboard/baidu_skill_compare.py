@@ -12,6 +12,13 @@ import urllib.request
 import urllib.error
 from typing import Optional, Dict, Any, List, Tuple
 
+try:
+    from price_cache import note_fetch_error
+    from rate_limit import provider_limit, urlopen as _limited_urlopen
+except ImportError:
+    from htma_dashboard.price_cache import note_fetch_error
+    from htma_dashboard.rate_limit import provider_limit, urlopen as _limited_urlopen
+
 # OpenClaw 仪表盘安装的 Skill 为 baidu-preferred（clawhub 上已无该 skill，见 docs/百度Skill优先-无clawhub方案.md）
 BAIDU_SKILL_SLUG = os.environ.get("BAIDU_SKILL_SLUG", "baidu-preferred")
 GATEWAY_URL = os.environ.get("OPENCLAW_GATEWAY_URL", "http://127.0.0.1:18789").rstrip("/")
@@ -62,7 +69,7 @@ def _call_baidu_skill_via_baidu_gateway(query: str, timeout: int) -> Dict[str, A
                     method="POST",
                     headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 )
-                with urllib.request.urlopen(req, timeout=timeout) as r:
+                with _limited_urlopen("baidu_skill", req, timeout) as r:
                     out = json.loads(r.read().decode())
                 if not out.get("ok"):
                     err = out.get("error", {})
@@ -77,10 +84,13 @@ def _call_baidu_skill_via_baidu_gateway(query: str, timeout: int) -> Dict[str, A
             except urllib.error.HTTPError as e:
                 if e.code == 404:
                     break
+                note_fetch_error()
                 return {"status": "error", "message": f"HTTP {e.code}: {e.reason}"[:500]}
             except urllib.error.URLError as e:
+                note_fetch_error()
                 return {"status": "error", "message": f"百度 Skill 网关不可达: {e.reason}"[:500]}
             except (json.JSONDecodeError, Exception) as e:
+                note_fetch_error()
                 continue
     return {"status": "error", "message": "百度 Skill 网关未返回可解析比价"}
 
@@ -103,7 +113,7 @@ def _call_baidu_skill_via_gateway(query: str, timeout: int) -> Dict[str, Any]:
                         "Content-Type": "application/json",
                     },
                 )
-                with urllib.request.urlopen(req, timeout=timeout) as r:
+                with _limited_urlopen("baidu_skill", req, timeout) as r:
                     out = json.loads(r.read().decode())
                 if not out.get("ok"):
                     err = out.get("error", {})
@@ -120,10 +130,13 @@ def _call_baidu_skill_via_gateway(query: str, timeout: int) -> Dict[str, Any]:
             except urllib.error.HTTPError as e:
                 if e.code == 404:
                     break
+                note_fetch_error()
                 return {"status": "error", "message": f"HTTP {e.code}: {e.reason}"[:500]}
             except urllib.error.URLError as e:
+                note_fetch_error()
                 return {"status": "error", "message": f"网关不可达: {e.reason}"[:500]}
             except (json.JSONDecodeError, Exception) as e:
+                note_fetch_error()
                 if tool_name == "search_products" and payload.get("params"):
                     return {"status": "error", "message": str(e)[:500]}
                 continue
@@ -149,14 +162,15 @@ def _call_runner_subprocess(query: str, timeout: int = 30) -> Dict[str, Any]:
         return {"status": "error", "message": f"未找到 runner 脚本: {runner}"}
     try:
         import sys as _sys
-        result = subprocess.run(
-            [_sys.executable or "python3", runner, "get_price_comparison", query],
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-            cwd=root,
-            env=dict(os.environ),
-        )
+        with provider_limit("baidu_skill"):
+            result = subprocess.run(
+                [_sys.executable or "python3", runner, "get_price_comparison", query],
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+                cwd=root,
+                env=dict(os.environ),
+            )
         out = (result.stdout or "").strip()
         for line in reversed(out.split("\n")):
             line = line.strip()
@@ -178,10 +192,13 @@ def _call_runner_subprocess(query: str, timeout: int = 30) -> Dict[str, Any]:
                     return {"status": "error", "message": (data.get("error") or "runner 无价格数据")[:500]}
             except json.JSONDecodeError:
                 continue
+        note_fetch_error()
         return {"status": "error", "message": (result.stderr or out or "runner 无有效输出")[:500]}
     except subprocess.TimeoutExpired:
+        note_fetch_error()
         return {"status": "error", "message": "百度 Skill runner 调用超时"}
     except Exception as e:
+        note_fetch_error()
         return {"status": "error", "message": str(e)[:500]}
 
 
@@ -257,7 +274,7 @@ def _call_search_products_raw(keyword: str, timeout: int = 15) -> Tuple[Optional
                 "Content-Type": "application/json",
             },
         )
-        with urllib.request.urlopen(req, timeout=timeout) as r:
+        with _limited_urlopen("baidu_skill", req, timeout) as r:
             out = json.loads(r.read().decode())
         if not out.get("ok"):
             err = out.get("error", {})
@@ -271,10 +288,13 @@ def _call_search_products_raw(keyword: str, timeout: int = 15) -> Tuple[Optional
                 return products, None
         return None, "搜索返回无列表"
     except urllib.error.HTTPError as e:
+        note_fetch_error()
         return None, f"HTTP {e.code}: {e.reason}"
     except urllib.error.URLError as e:
+        note_fetch_error()
         return None, f"网关不可达: {e.reason}"
     except (json.JSONDecodeError, Exception) as e:
+        note_fetch_error()
         return None, str(e)[:300]
 
 
@@ -437,11 +457,11 @@ def call_baidu_skill(
     except FileNotFoundError:
         pass  # 继续尝试本地多数据源
     except subprocess.TimeoutExpired:
-        pass
+        note_fetch_error()
     except json.JSONDecodeError:
         pass
     except Exception:
-        pass
+        note_fetch_error()
 
     # 仅用百度 Skill，不再回退到其它数据源
     return {"status": "error", "message": err_msg or "百度 Skill（网关/runner）未返回价格，请确认网关已加载 baidu-price-tools 且 projectRoot 已配置，或本机可执行 clawhub run（见 docs/百度Skill比价环境说明.md）"}
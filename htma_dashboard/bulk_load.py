@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+导入批量装载快速路径（可选，HTMA_IMPORT_BULK_LOAD=1）：替代按 2500 行拼接的多行 INSERT … ON DUPLICATE KEY UPDATE。
+
+1. 解析好的行写入临时 TSV（MySQL LOAD DATA 默认转义：\\t 分隔、\\n 换行、反斜杠转义、NULL 写 \\N）；
+2. LOAD DATA LOCAL INFILE 装入本次导入的临时暂存表（CREATE TEMPORARY TABLE … AS SELECT 目标列，列类型与目标表一致，无唯一键）；
+3. 一条 INSERT … SELECT … ON DUPLICATE KEY UPDATE 合并进目标表。
+LOAD 产生告警（超长、类型不符、NOT NULL 列为空等）的行按告警中的行号在暂存表标记为坏行，不参与合并，
+连同原因返回给调用方写入诊断，不再逐行重试。
+需要客户端（db_config 在开启本模式时设置 local_infile）与服务端（local_infile=ON）都允许 LOCAL INFILE；
+不可用时抛 BulkLoadUnavailable，调用方退回原来的批量 INSERT。
+"""
+import math
+import os
+import re
+import tempfile
+from datetime import date, datetime
+
+BULK_LOAD_ENABLED = os.environ.get("HTMA_IMPORT_BULK_LOAD", "0").strip().lower() in ("1", "true", "yes", "on")
+# 行数少于该值时批量 INSERT 已足够快，不走 LOAD DATA
+BULK_LOAD_MIN_ROWS = int(os.environ.get("HTMA_IMPORT_BULK_LOAD_MIN_ROWS", "5000"))
+
+_TSV_ESCAPE = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+_WARNING_ROW = re.compile(r"at row (\d+)")
+_MARK_CHUNK = 1000
+
+
+class BulkLoadUnavailable(Exception):
+    """LOAD DATA LOCAL INFILE 未开启或暂存表无法创建，调用方应退回普通批量写入。"""
+
+
+def use_bulk_load(n_rows):
+    return BULK_LOAD_ENABLED and n_rows >= BULK_LOAD_MIN_ROWS
+
+
+def tsv_field(v):
+    """单个值转为 LOAD DATA 默认格式的字段文本。"""
+    if v is None:
+        return "\\N"
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, float):
+        if not math.isfinite(v):
+            return "\\N"
+        s = repr(v)
+        return f"{v:.10f}".rstrip("0").rstrip(".") if "e" in s else s
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.isoformat()
+    return str(v).translate(_TSV_ESCAPE)
+
+
+def write_tsv(fp, rows):
+    for row in rows:
+        fp.write("\t".join(tsv_field(v) for v in row))
+        fp.write("\n")
+
+
+def _warning_message(w):
+    return w.get("Message", "") if isinstance(w, dict) else (w[2] if len(w) > 2 else str(w))
+
+
+def bulk_upsert(conn, table, all_cols, vals_list, update_str, max_report=20):
+    """
+    vals_list（与 all_cols 对齐）经 TSV + 暂存表一次合并进 table，update_str 为 ON DUPLICATE KEY UPDATE 子句
+    （目标列需以 "table." 限定，避免与暂存表同名列歧义）。
+    返回 (合并行数, 坏行数, [(vals_list 下标, 原因), …] 最多 max_report 条)。不调用 commit，由调用方提交。
+    """
+    stg = f"_stg_{table}"
+    col_str = ", ".join(all_cols)
+    cur = conn.cursor()
+    fd, path = tempfile.mkstemp(prefix="htma_bulk_", suffix=".tsv")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as fp:
+            write_tsv(fp, vals_list)
+        try:
+            cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {stg}")
+            cur.execute(f"CREATE TEMPORARY TABLE {stg} AS SELECT {col_str} FROM {table} WHERE 1 = 0")
+            cur.execute(f"ALTER TABLE {stg} ADD COLUMN _line INT NOT NULL AUTO_INCREMENT PRIMARY KEY, ADD COLUMN _bad TINYINT NOT NULL DEFAULT 0")
+            cur.execute("SET SESSION max_error_count = 65535")
+            cur.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {stg} CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({col_str})",
+                (path,),
+            )
+        except Exception as e:
+            raise BulkLoadUnavailable(str(e)) from e
+        cur.execute("SHOW WARNINGS")
+        bad = {}
+        for w in cur.fetchall() or []:
+            msg = _warning_message(w)
+            m = _WARNING_ROW.search(msg)
+            if m:
+                bad.setdefault(int(m.group(1)), msg)
+        lines = sorted(bad)
+        for i in range(0, len(lines), _MARK_CHUNK):
+            chunk = lines[i:i + _MARK_CHUNK]
+            cur.execute(f"UPDATE {stg} SET _bad = 1 WHERE _line IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+        cur.execute(f"""
+            INSERT INTO {table} ({col_str})
+            SELECT {col_str} FROM {stg} WHERE _bad = 0 ORDER BY _line
+            ON DUPLICATE KEY UPDATE {update_str}
+        """)
+        report = [(line - 1, bad[line]) for line in lines[:max_report]]
+        return len(vals_list) - len(lines), len(lines), report
+    finally:
+        try:
+            cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {stg}")
+        except Exception:
+            pass
+        try:
+            os.remove(path)
+        except OSError:
+            pass
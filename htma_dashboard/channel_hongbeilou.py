@@ -3,6 +3,11 @@
 from datetime import date, datetime
 from decimal import Decimal
 
+try:
+    from stock_latest import LATEST_TABLE, stock_source
+except ImportError:
+    from htma_dashboard.stock_latest import LATEST_TABLE, stock_source
+
 
 def _d(v, default=None):
     if v is None:
@@ -145,8 +150,9 @@ def enrich_catalog_row(row, share_ratio=0.3):
     return row
 
 
-def build_catalog_sql(store_id, category_large_code, category_mid_code, category_small_code, min_stock, exclude_expired, has_price_compare, has_batch_table):
-    """Returns (sql, params_list). 无比价表/批次表时用 CAST NULL，避免无效 JOIN。"""
+def build_catalog_sql(store_id, category_large_code, category_mid_code, category_small_code, min_stock, exclude_expired, has_price_compare, has_batch_table, stock_table="t_htma_stock"):
+    """Returns (sql, params_list). 无比价表/批次表时用 CAST NULL，避免无效 JOIN。
+    stock_table 为最新库存表时直接读（每货号一行），否则在库存历史表上按货号取 data_date 最大的一行。"""
     conds = ["ls.stock_qty > %s"]
     params = [min_stock]
 
@@ -162,6 +168,21 @@ def build_catalog_sql(store_id, category_large_code, category_mid_code, category
     _add_cat("category_mid_code", "category_mid", category_mid_code)
     _add_cat("category_small_code", "category_small", category_small_code)
 
+    if stock_table == LATEST_TABLE:
+        stock_from = "FROM " + LATEST_TABLE + " ls"
+        conds.insert(0, "ls.store_id = %s")
+        params.insert(0, store_id)
+        stock_params = []
+    else:
+        stock_from = """FROM t_htma_stock ls
+    INNER JOIN (
+      SELECT sku_code, MAX(data_date) AS md
+      FROM t_htma_stock
+      WHERE store_id = %s
+      GROUP BY sku_code
+    ) z ON z.sku_code = ls.sku_code AND z.md = ls.data_date AND ls.store_id = %s"""
+        stock_params = [store_id, store_id]
+
     if has_batch_table and exclude_expired:
         conds.append("(eb.earliest_expiry IS NULL OR eb.earliest_expiry >= CURDATE())")
 
@@ -218,13 +239,7 @@ def build_catalog_sql(store_id, category_large_code, category_mid_code, category
       pm.delivery_price AS master_delivery_price,
       """ + batch_cols + """
       """ + rival_col + """
-    FROM t_htma_stock ls
-    INNER JOIN (
-      SELECT sku_code, MAX(data_date) AS md
-      FROM t_htma_stock
-      WHERE store_id = %s
-      GROUP BY sku_code
-    ) z ON z.sku_code = ls.sku_code AND z.md = ls.data_date AND ls.store_id = %s
+    """ + stock_from + """
     LEFT JOIN t_htma_products p ON p.store_id = ls.store_id AND p.sku_code = ls.sku_code
     LEFT JOIN t_htma_product_master pm ON pm.sku_code = ls.sku_code AND pm.store_id = %s
     """ + join_batch + join_price + """
@@ -232,7 +247,7 @@ def build_catalog_sql(store_id, category_large_code, category_mid_code, category
     ORDER BY ls.category_large_code, ls.category_mid_code, ls.category_small_code, ls.sku_code
     """
 
-    full_params = [store_id, store_id, store_id]
+    full_params = stock_params + [store_id]
     if has_batch_table:
         full_params.append(store_id)
     full_params.extend(params)
@@ -261,6 +276,7 @@ def query_catalog_rows(conn, store_id, category_large_code="", category_mid_code
             exclude_expired,
             has_pc,
             has_batch,
+            stock_table=stock_source(conn, store_id),
         )
         cur.execute(sql, params)
         rows = cur.fetchall()
@@ -289,7 +305,7 @@ def build_selection_logic_meta(
     with conn.cursor() as cur:
         has_pc = table_exists(cur, "t_price_compare")
         has_batch = table_exists(cur, "t_htma_sku_batch")
-        cur.execute("SELECT MAX(data_date) AS md FROM t_htma_stock WHERE store_id = %s", (store_id,))
+        cur.execute("SELECT MAX(data_date) AS md FROM " + stock_source(conn, store_id) + " WHERE store_id = %s", (store_id,))
         rmd = cur.fetchone() or {}
         md = rmd.get("md")
         latest = md.isoformat() if md and hasattr(md, "isoformat") else (str(md) if md else None)
@@ -300,7 +316,7 @@ def build_selection_logic_meta(
         {
             "id": "stock_snapshot",
             "title": "库存快照",
-            "detail": "每个 SKU 取「本门店」在库存表 t_htma_stock 中 **data_date 最大** 的一行作为当前库存；门店 ID 与看板一致。",
+            "detail": "每个 SKU 取「本门店」在库存表 t_htma_stock 中 **data_date 最大** 的一行作为当前库存（已构建最新库存表 t_htma_stock_latest 时直接读该表）；门店 ID 与看板一致。",
         },
         {
             "id": "stock_floor",
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+在 Python 侧复现 MySQL 的分组/比较口径：消费洞察单次扫描（consumer_insight）与看板共享扫描（dashboard_panels）
+在内存中按维度分组时用这里的键，结果与 SQL 版 GROUP BY / TRIM 一致。
+"""
+from functools import lru_cache
+
+
+@lru_cache(maxsize=65536)
+def fold(s):
+    """分组键比较：近似 MySQL 默认排序规则（不区分大小写、忽略尾部空格）；tuple 逐项折叠。"""
+    if isinstance(s, tuple):
+        return tuple(fold(x) for x in s)
+    return s.rstrip(" ").casefold() if isinstance(s, str) else s
+
+
+def trim(s):
+    """MySQL TRIM：只去首尾空格。"""
+    return s.strip(" ") if isinstance(s, str) else s
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Excel 列映射档案：ERP 导出只有少数几种版式，按表头指纹记住检测好的列映射，同版式的后续文件不再跑关键字启发式。
+
+- 指纹 = 类型（sale_daily / sale_summary / stock / profit / labor）+ 列数 + 规范化后的表头行（去空白、去「求和项:」、
+  合并单元格向前填充后的文字），同一版式的文件指纹相同；
+- 检测出的映射在解析出有效数据后自动记为 learned 档案；之后同指纹文件直接使用；
+- 启发式选错列（如销售金额/参考金额对调）时可手动固定（pinned）档案：接口 POST /api/column_profiles，
+  或直接编辑档案文件；pinned 档案不会被自动学习覆盖，取代过去上传时临时设置 HTMA_SWAP_AMOUNT_COST 的做法。
+档案存 JSON 文件（HTMA_COLUMN_PROFILES_PATH，默认 data/column_profiles.json，运行时生成、不入库），按修改时间缓存在进程内，
+进程池子进程与多 worker 共用：改写时持文件锁（旁边的 .lock 文件，flock）重新读盘再原子替换，并发学习不丢更新。
+HTMA_COLUMN_PROFILES=0 关闭（每次都检测）。读写失败按未命中处理。
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内锁
+    fcntl = None
+
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PROFILES_PATH = os.environ.get("HTMA_COLUMN_PROFILES_PATH", "").strip() or os.path.join(_PROJECT_ROOT, "data", "column_profiles.json")
+PROFILES_ENABLED = os.environ.get("HTMA_COLUMN_PROFILES", "1").strip().lower() not in ("0", "false", "no", "off")
+
+PROFILE_KINDS = ("sale_daily", "sale_summary", "stock", "profit", "labor")
+
+_lock = threading.Lock()
+_cache = {"mtime": None, "profiles": {}}
+
+
+def _reset_after_fork():
+    """进程池 fork 出的子进程可能继承一把被其他线程持有的 _lock，换新锁（进程间互斥靠文件锁）。"""
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def normalize_header(cells):
+    """表头单元格规范化：去空白与「求和项:」前缀，去掉行尾空单元格。"""
+    out = []
+    for v in cells:
+        s = "" if v is None else re.sub(r"\s+", "", str(v))
+        if s.lower() == "nan":
+            s = ""
+        if s.startswith("求和项:"):
+            s = s[4:]
+        out.append(s)
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+def header_fingerprint(kind, cells, ncol):
+    """类型 + 列数 + 规范化表头的指纹（16 位十六进制）；表头为空返回 None。"""
+    norm = normalize_header(cells)
+    if not any(norm):
+        return None
+    raw = "\x1f".join([kind, str(ncol)] + norm)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _read():
+    with open(PROFILES_PATH, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+    return data.get("profiles") or {} if isinstance(data, dict) else {}
+
+
+def _load():
+    try:
+        mtime = os.path.getmtime(PROFILES_PATH)
+    except OSError:
+        return {}
+    if _cache["mtime"] != mtime:
+        try:
+            profiles = _read()
+        except (OSError, ValueError):
+            return {}
+        _cache["profiles"], _cache["mtime"] = profiles, mtime
+    return _cache["profiles"]
+
+
+@contextmanager
+def _locked():
+    """改写档案的互斥：线程间用 _lock，进程间（进程池子进程、多 worker）对 PROFILES_PATH.lock 加 flock。
+    持锁后直接读盘（不用按修改时间的缓存，同一时间粒度内的两次写入 mtime 可能相同），返回当前档案。"""
+    with _lock:
+        os.makedirs(os.path.dirname(PROFILES_PATH), exist_ok=True)
+        with open(PROFILES_PATH + ".lock", "a") as lock_fp:
+            if fcntl is not None:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+            try:
+                try:
+                    profiles = _read()
+                except (OSError, ValueError):
+                    profiles = {}
+                yield dict(profiles)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_fp.fileno(), fcntl.LOCK_UN)
+
+
+def _save(profiles):
+    d = os.path.dirname(PROFILES_PATH)
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".column_profiles.", dir=d)
+    with os.fdopen(fd, "w", encoding="utf-8") as fp:
+        json.dump({"profiles": profiles}, fp, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, PROFILES_PATH)
+    _cache["mtime"], _cache["profiles"] = os.path.getmtime(PROFILES_PATH), profiles
+
+
+def list_profiles(kind=None):
+    """全部档案（按类型过滤），[{fingerprint, name, kind, pinned, header, cols, ...}]。"""
+    return [dict(p, fingerprint=fp) for fp, p in sorted(_load().items()) if kind is None or p.get("kind") == kind]
+
+
+def match_profile(kind, fingerprint):
+    """同类型同指纹的档案（dict，cols 的键值同检测结果），未命中返回 None。"""
+    if not PROFILES_ENABLED or not fingerprint:
+        return None
+    p = _load().get(fingerprint)
+    if not p or p.get("kind") != kind or not isinstance(p.get("cols"), dict):
+        return None
+    return dict(p, fingerprint=fingerprint)
+
+
+def _update(fingerprint, fn):
+    with _locked() as profiles:
+        rec = fn(profiles.get(fingerprint))
+        if rec is None:
+            return None
+        profiles[fingerprint] = rec
+        _save(profiles)
+        return dict(rec, fingerprint=fingerprint)
+
+
+def learn_profile(kind, fingerprint, cells, cols):
+    """记住一次检测并验证有效（解析出数据）的列映射；已有档案（含 pinned）不覆盖。失败静默。"""
+    if not PROFILES_ENABLED or not fingerprint or match_profile(kind, fingerprint):
+        return None
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _new(old):
+        if old is not None:
+            return None
+        return {
+            "name": f"{kind}-{fingerprint[:6]}", "kind": kind, "pinned": False, "header": normalize_header(cells),
+            "cols": dict(cols), "created_at": now, "updated_at": now,
+        }
+
+    try:
+        return _update(fingerprint, _new)
+    except Exception:
+        return None
+
+
+def pin_profile(kind, fingerprint, cols=None, name=None, header=None, swap_amount_cost=False):
+    """
+    手动固定档案：cols 覆盖已有映射中的对应列（{"amount": 29, "cost": 38}），swap_amount_cost 对调 amount/cost
+    （毛利表为 total_sale/cost）。指纹尚无档案时 cols 即完整映射。返回固定后的档案；kind 与已有档案不符时抛 ValueError。
+    """
+    if kind not in PROFILE_KINDS:
+        raise ValueError(f"未知类型: {kind}")
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _pin(old):
+        if old is not None and old.get("kind") != kind:
+            raise ValueError(f"指纹 {fingerprint} 属于 {old.get('kind')}，不是 {kind}")
+        rec = dict(old or {"kind": kind, "header": normalize_header(header or []), "cols": {}, "created_at": now})
+        merged = dict(rec.get("cols") or {})
+        for k, v in (cols or {}).items():
+            merged[k] = int(v) if isinstance(v, str) and v.strip().isdigit() else v
+        if swap_amount_cost:
+            a, c = ("total_sale", "cost") if kind == "profit" else ("amount", "cost")
+            if a in merged and c in merged:
+                merged[a], merged[c] = merged[c], merged[a]
+        if not merged:
+            raise ValueError("没有可固定的列映射")
+        rec.update(cols=merged, pinned=True, updated_at=now, name=name or rec.get("name") or f"{kind}-{fingerprint[:6]}")
+        return rec
+
+    return _update(fingerprint, _pin)
+
+
+def delete_profile(fingerprint):
+    """删除档案（下次同版式文件重新检测）；存在返回 True。"""
+    with _locked() as profiles:
+        if profiles.pop(fingerprint, None) is None:
+            return False
+        _save(profiles)
+        return True
@@ -0,0 +1,611 @@
+# -*- coding: utf-8 -*-
+"""
+消费洞察单次扫描：/api/consumer_insight 原先对 t_htma_sale 逐面板发约 30 条 SQL（概览、品类矩阵、品牌、价格带、供应商、
+经销方式、新品、退货、折扣区间、下钻……），同一日期范围被反复过滤、分组。这里改为：
+
+1. 一次扫描：按所选日期范围读 t_htma_sale，LEFT JOIN 商品主数据，按「SKU × 各面板用到的维度（品类、品牌、供应商、品名、
+   色系、风格、售价）」分组求和，得到 SKU 级聚合（通常比日明细少一个数量级），品类/品牌筛选结果作为 in_filter 列
+   （只带日期条件的面板——经销方式、新品、折扣类——照旧不受品类筛选影响）；
+2. 各面板由这份聚合派生：build_frame 转成 pandas 列式表（金额按分、售价按万分之一元存整数，求和精确），
+   按折叠后的维度键 groupby；折扣类分子需要高精度，单独一次遍历用 Decimal 累加。比率按 MySQL DECIMAL 除法规则
+   （被除数小数位 + 4 位，四舍五入）计算，结果与逐条 SQL 一致；
+3. 主数据计数、库存、环比上期、零销售 SKU 与四级下钻折扣仍各一条小查询（范围或表不同）。
+
+不依赖 Flask：build_consumer_insight(cur, ...) 返回面板字典，由 app 补上 bi_insight 与 date_range。
+HTMA_INSIGHT_SINGLE_SCAN=0 时 app 退回逐条 SQL 的实现；扫描失败（如缺 color_system/style 列）也自动退回。
+"""
+import os
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+
+import pandas as pd
+
+try:
+    from collation import fold, trim
+except ImportError:
+    from htma_dashboard.collation import fold, trim
+
+INSIGHT_SINGLE_SCAN = os.environ.get("HTMA_INSIGHT_SINGLE_SCAN", "1").strip().lower() not in ("0", "false", "no", "off")
+
+_ZERO = Decimal(0)
+_HUNDRED = Decimal(100)
+
+PRICE_BANDS = ("0", "1-49", "50-99", "100-199", "200-499", "500-999", "1000+")
+DISCOUNT_BANDS = ("0-10%", "10-20%", "20-30%", "30%+")
+
+# 分组键：sale 侧在派生表内计算（品类筛选条件引用的是 t_htma_sale 的无前缀列名，放在外层会与主数据列歧义）
+_SCAN_SQL = """
+    SELECT s.sku_code, s.cat, s.brand, s.supplier, s.product_name, s.color_system, s.style, s.sale_price, s.in_filter,
+           m.list_price,
+           NULLIF(TRIM(m.distribution_mode), '') AS distribution_mode,
+           TRIM(COALESCE(m.product_status, '')) = '新品' AS is_new,
+           SUM(s.sale_amount) AS sale_amount,
+           SUM(s.gross_profit) AS profit,
+           SUM(s.sale_qty) AS qty,
+           SUM(s.return_amount) AS return_amount,
+           COUNT(*) AS n
+    FROM (
+        SELECT sku_code, sale_amount, gross_profit, sale_qty, return_amount, sale_price, product_name,
+               COALESCE(NULLIF(TRIM(category_large), ''), NULLIF(TRIM(category_mid), ''), NULLIF(TRIM(category), ''), '未分类') AS cat,
+               NULLIF(TRIM(brand_name), '') AS brand,
+               NULLIF(TRIM(supplier_name), '') AS supplier,
+               NULLIF(TRIM(color_system), '') AS color_system,
+               NULLIF(TRIM(style), '') AS style,
+               (1 = 1{category_cond}) AS in_filter
+        FROM t_htma_sale
+        WHERE store_id = %s AND {date_cond}
+    ) s
+    LEFT JOIN t_htma_product_master m ON m.sku_code = s.sku_code AND m.store_id = %s
+    GROUP BY s.sku_code, s.cat, s.brand, s.supplier, s.product_name, s.color_system, s.style, s.sale_price, s.in_filter,
+             m.list_price, distribution_mode, is_new
+"""
+
+
+def _dec(v):
+    if v is None:
+        return _ZERO
+    return v if isinstance(v, Decimal) else Decimal(str(v))
+
+
+def _div(a, b, scale):
+    """MySQL DECIMAL 除法：保留 scale 位小数并四舍五入；除数为 0 返回 None（NULLIF）。"""
+    if not b:
+        return None
+    with localcontext() as ctx:
+        ctx.prec = 60
+        return (_dec(a) / _dec(b)).quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP)
+
+
+def _margin(profit, amount):
+    """CASE WHEN SUM(sale_amount) > 0 THEN SUM(gross_profit)/SUM(sale_amount)*100 ELSE 0 END（金额 2 位小数 → 商 6 位）。"""
+    return _div(profit, amount, 6) * _HUNDRED if amount > 0 else _ZERO
+
+
+def _discount_ratio(price, list_price):
+    """1 - sale_price / list_price（均为 4 位小数 → 商 8 位）；无售价返回 None。"""
+    if price is None:
+        return None
+    return 1 - _div(price, list_price, 8)
+
+
+def _r2(v):
+    return round(float(v or 0), 2)
+
+
+def price_band(price):
+    p = _dec(price)
+    if p <= 0:
+        return "0"
+    for upper, band in ((50, "1-49"), (100, "50-99"), (200, "100-199"), (500, "200-499"), (1000, "500-999")):
+        if p < upper:
+            return band
+    return "1000+"
+
+
+def discount_band(price, list_price):
+    ratio = _discount_ratio(price, list_price)
+    if ratio is None:
+        return "30%+"  # 售价为空时 CASE 各分支均不成立，落入 ELSE
+    pct = ratio * _HUNDRED
+    if pct < 10:
+        return "0-10%"
+    if pct < 20:
+        return "10-20%"
+    if pct < 30:
+        return "20-30%"
+    return "30%+"
+
+
+def _has_list_price(g):
+    return g["list_price"] is not None and g["list_price"] > 0
+
+
+def _scaled(v, scale=2):
+    """DECIMAL → 放大 10^scale 的整数（金额为分、售价为万分之一元），整数求和不丢精度。"""
+    return int((_dec(v) * 10 ** scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _unscaled(v, scale=2):
+    return Decimal(int(v)).scaleb(-scale)
+
+
+def fetch_insight_groups(cur, store_id, date_cond, date_params, category_cond="", filter_params=()):
+    """执行单次扫描，返回 SKU 级分组行（金额为 Decimal，空值按 0）。"""
+    cur.execute(
+        _SCAN_SQL.format(category_cond=category_cond, date_cond=date_cond),
+        tuple(filter_params) + (store_id,) + tuple(date_params) + (store_id,),
+    )
+    groups = []
+    for r in cur.fetchall():
+        groups.append({
+            "sku_code": r.get("sku_code"),
+            "cat": r.get("cat") or "未分类",
+            "brand": r.get("brand"),
+            "supplier": r.get("supplier"),
+            "product_name": r.get("product_name"),
+            "color_system": r.get("color_system"),
+            "style": r.get("style"),
+            "sale_price": None if r.get("sale_price") is None else _dec(r.get("sale_price")),
+            "list_price": None if r.get("list_price") is None else _dec(r.get("list_price")),
+            "distribution_mode": r.get("distribution_mode"),
+            "is_new": bool(r.get("is_new")),
+            "in_filter": bool(r.get("in_filter")),
+            "sale_amount": _dec(r.get("sale_amount")),
+            "profit": _dec(r.get("profit")),
+            "qty": _dec(r.get("qty")),
+            "return_amount": _dec(r.get("return_amount")),
+            "n": int(r.get("n") or 0),
+        })
+    return groups
+
+
+_FRAME_KEYS = (
+    "sku_code", "sku", "cat", "cat_f", "brand", "brand_f", "brand_drill", "brand_drill_f", "supplier", "supplier_f",
+    "product_name", "pname_f", "style_name", "style_name_f", "color_system", "color_system_f", "style", "style_f",
+    "mode", "mode_f", "price_band", "discount_band", "in_filter", "listed", "is_new",
+    "sa", "gp", "qty", "ret", "price_sum", "price_n",
+)
+
+
+def build_frame(groups):
+    """
+    扫描分组 → 列式 DataFrame：金额、数量按分存 int64，售价合计按万分之一元存 int64；
+    各维度的显示值与折叠后的分组键（近似 MySQL 排序规则）各存一列，空值已按面板口径替换为「未分类」「未填」。
+    """
+    rows = []
+    for g in groups:
+        price = g["sale_price"]
+        listed = _has_list_price(g)
+        brand, pname = g["brand"], g["product_name"]
+        style_name = trim(pname) or "未填"
+        rows.append((
+            g["sku_code"], fold(g["sku_code"]), g["cat"], fold(g["cat"]), brand or "未分类", fold(brand or "未分类"),
+            brand or "未填", fold(brand or "未填"), g["supplier"] or "未填", fold(g["supplier"] or "未填"),
+            pname, fold(pname), style_name, fold(style_name),
+            g["color_system"] or "未填", fold(g["color_system"] or "未填"), g["style"] or "未填", fold(g["style"] or "未填"),
+            g["distribution_mode"] or "未分类", fold(g["distribution_mode"] or "未分类"),
+            price_band(price), discount_band(price, g["list_price"]) if listed else None, g["in_filter"], listed, g["is_new"],
+            _scaled(g["sale_amount"]), _scaled(g["profit"]), _scaled(g["qty"]), _scaled(g["return_amount"]),
+            _scaled(price, 4) * g["n"] if price is not None else 0, g["n"] if price is not None else 0,
+        ))
+    df = pd.DataFrame.from_records(rows, columns=_FRAME_KEYS)
+    for col in ("sa", "gp", "qty", "ret", "price_sum", "price_n"):
+        df[col] = df[col].astype("int64")
+    for col in ("in_filter", "listed", "is_new"):
+        df[col] = df[col].astype(bool)
+    return df
+
+
+def _grouped(df, by, label):
+    """按折叠键 by（列名或列名列表）分组求和；key 取组内首个显示值（label 为列表时为元组）。保持首次出现顺序。"""
+    if df.empty:
+        return []
+    labels = label if isinstance(label, (list, tuple)) else [label]
+    spec = {f"k{i}": (c, "first") for i, c in enumerate(labels)}
+    spec.update(sa=("sa", "sum"), gp=("gp", "sum"), qty=("qty", "sum"), ret=("ret", "sum"), skus=("sku", "nunique"),
+                price_sum=("price_sum", "sum"), price_n=("price_n", "sum"))
+    agg = df.groupby(by, sort=False, dropna=False).agg(**spec)
+    out = []
+    for r in agg.itertuples(index=False):
+        keys = [v if isinstance(v, str) else None for v in r[:len(labels)]]
+        out.append({
+            "key": tuple(keys) if isinstance(label, (list, tuple)) else keys[0],
+            "sale_amount": _unscaled(r.sa), "profit": _unscaled(r.gp), "qty": _unscaled(r.qty), "return_amount": _unscaled(r.ret),
+            "skus": int(r.skus), "price_sum": _unscaled(r.price_sum, 4), "price_n": int(r.price_n),
+        })
+    return out
+
+
+def _top(accs, limit=None, key="sale_amount"):
+    """HAVING SUM(sale_amount) > 0 ORDER BY key DESC LIMIT limit"""
+    rows = sorted((a for a in accs if a["sale_amount"] > 0), key=lambda a: a[key], reverse=True)
+    return rows[:limit] if limit else rows
+
+
+def _metrics(acc):
+    return {
+        "sale_amount": _r2(acc["sale_amount"]),
+        "profit": _r2(acc["profit"]),
+        "qty": _r2(acc["qty"]),
+        "margin_pct": _r2(_margin(acc["profit"], acc["sale_amount"])),
+    }
+
+
+def _discount_stats(groups):
+    """
+    只带日期条件、关联划线价（list_price > 0）的折扣类汇总，一次遍历：品类/价格带/整体的加权折扣分子分母、
+    SKU 级平均折扣与毛利（高折扣低毛利）。价格带与整体只计售价不高于划线价的行。
+    """
+    cat, band, sku = {}, {}, {}
+    total = [_ZERO, _ZERO]
+    for g in groups:
+        if not _has_list_price(g):
+            continue
+        sa, price = g["sale_amount"], g["sale_price"]
+        ratio = _discount_ratio(price, g["list_price"])
+        weighted = sa * ratio if ratio is not None else None
+        c = cat.setdefault(fold(g["cat"]), [_ZERO, _ZERO])
+        c[1] += sa
+        if weighted is not None:
+            c[0] += weighted
+        if price is not None and price <= g["list_price"]:
+            for acc in (band.setdefault(price_band(price), [_ZERO, _ZERO]), total):
+                acc[0] += weighted
+                acc[1] += sa
+        s = sku.setdefault(fold(g["sku_code"]), {"sku_code": g["sku_code"], "sale_amount": _ZERO, "profit": _ZERO, "disc_sum": _ZERO, "disc_n": 0, "names": []})
+        s["sale_amount"] += sa
+        s["profit"] += g["profit"]
+        if ratio is not None:
+            s["disc_sum"] += ratio * _HUNDRED * g["n"]
+            s["disc_n"] += g["n"]
+        if g["product_name"] is not None:
+            s["names"].append(g["product_name"])
+    return cat, band, total, sku
+
+
+def _weighted_pct(acc):
+    """SUM(sale_amount * (1 - sale_price/list_price)) / NULLIF(SUM(sale_amount), 0) * 100（分子 10 位小数 → 商 14 位）。"""
+    q = _div(acc[0], acc[1], 14)
+    return None if q is None else q * _HUNDRED
+
+
+def derive_panels(groups, drill=None):
+    """
+    由扫描分组派生只依赖销售扫描的面板（不含主数据计数、库存、环比、零销售等需另查的部分）。
+    drill: {"category": ..., "brand": ..., "product_name": ...}，与逐条 SQL 版的下钻条件一致。
+    """
+    drill = drill or {}
+    df = build_frame(groups)
+    filtered = df[df["in_filter"]]
+
+    # 1. 概览
+    total_sale_d, total_profit_d, total_qty_d = (_unscaled(filtered[c].sum()) for c in ("sa", "gp", "qty"))
+    total_sale, total_profit, total_qty = float(total_sale_d), float(total_profit_d), float(total_qty_d)
+    sku_sold = int(filtered["sku"].nunique())
+    total_sale_for_contrib = total_sale or 1
+    disc_cat, disc_band, disc_total, disc_sku = _discount_stats(groups)
+
+    # 2. 品类贡献矩阵 + 品类平均折扣率
+    cat_all = _grouped(filtered, "cat_f", "cat")
+    cats = _top(cat_all, 20)
+    total_profit_for_contrib = max(1, sum(float(a["profit"]) for a in cats))
+    category_matrix = []
+    for a in cats:
+        sale_amt, profit_amt = float(a["sale_amount"]), float(a["profit"])
+        avg_price = _div(a["price_sum"], a["price_n"], 8) if a["price_n"] else None
+        disc = disc_cat.get(fold(a["key"]))
+        category_matrix.append({
+            "category": a["key"],
+            "sku_sold": a["skus"],
+            "qty": round(float(a["qty"]), 2),
+            "sale_amount": round(sale_amt, 2),
+            "sale_contrib_pct": round(sale_amt / total_sale_for_contrib * 100, 2),
+            "profit": round(profit_amt, 2),
+            "profit_contrib_pct": round(profit_amt / total_profit_for_contrib * 100, 2),
+            "margin_pct": _r2(_margin(a["profit"], a["sale_amount"])),
+            "avg_sale_price": _r2(avg_price),
+            "avg_discount_pct": _r2(_weighted_pct(disc)) if disc is not None else None,
+        })
+
+    # 3. 品牌、4b. 供应商、4c. 单品 Top20
+    brand = [
+        {"brand": a["key"], "sku_sold": a["skus"], **_metrics(a), "contrib_pct": round(float(a["sale_amount"]) / total_sale_for_contrib * 100, 2)}
+        for a in _top(_grouped(filtered, "brand_f", "brand"), 30)
+    ]
+    supplier = [
+        {"supplier": a["key"], **_metrics(a), "contrib_pct": round(float(a["sale_amount"]) / total_sale_for_contrib * 100, 2)}
+        for a in _top(_grouped(filtered, "supplier_f", "supplier"), 20)
+    ]
+    top_sku = [
+        {"sku_code": a["key"][0] or "", "product_name": ((trim(a["key"][1]) or a["key"][0]) or "")[:40], **_metrics(a)}
+        for a in _top(_grouped(filtered, ["sku", "pname_f"], ["sku_code", "product_name"]), 20)
+    ]
+
+    # 4. 价格带（按实际售价分段）+ 价格带平均折扣率
+    bands = {a["key"]: a for a in _grouped(filtered, "price_band", "price_band")}
+    band_accs = [bands[b] for b in PRICE_BANDS if b in bands]
+    total_qty_for_band = total_qty or 1
+    total_sku_bands = sum(a["skus"] for a in band_accs) or 1
+    price_band_rows = []
+    for a in band_accs:
+        pb = {
+            "band": a["key"], "sku_count": a["skus"], "sale_amount": _r2(a["sale_amount"]), "qty": _r2(a["qty"]),
+            "margin_pct": _r2(_margin(a["profit"], a["sale_amount"])),
+            "avg_discount_pct": _r2(_weighted_pct(disc_band[a["key"]])) if a["key"] in disc_band else None,
+        }
+        pb["sale_contrib_pct"] = round(pb["sale_amount"] / total_sale_for_contrib * 100, 2) if total_sale > 0 else 0
+        pb["qty_contrib_pct"] = round(pb["qty"] / total_qty_for_band * 100, 2) if total_qty > 0 else 0
+        pb["sku_contrib_pct"] = round(pb["sku_count"] / total_sku_bands * 100, 2)
+        price_band_rows.append(pb)
+
+    # 4d. 整体平均折扣率
+    avg_discount_pct = _r2(_weighted_pct(disc_total)) if disc_total[1] > 0 else None
+
+    # 5. 经销方式（只带日期条件，LEFT JOIN 主数据）
+    distribution = []
+    for a in _top(_grouped(df, "mode_f", "mode")):
+        amt, qty = float(a["sale_amount"]), float(a["qty"])
+        distribution.append({
+            "mode": a["key"],
+            "sale_amount": round(amt, 2),
+            "profit": _r2(a["profit"]),
+            "margin_pct": _r2(_margin(a["profit"], a["sale_amount"])),
+            "contrib_pct": round(amt / total_sale_for_contrib * 100, 2),
+            "avg_sale_price": round(amt / qty, 2) if qty > 0 else None,
+        })
+
+    # 6. 新品表现（销售侧；主数据新品总数由调用方补）
+    new_rows = df[df["is_new"]]
+    new_sale, new_profit = float(_unscaled(new_rows["sa"].sum())), float(_unscaled(new_rows["gp"].sum()))
+    new_sku_sold = int(new_rows["sku"].nunique())
+
+    # 7. 退货率
+    total_return = float(_unscaled(filtered["ret"].sum()))
+    return_rate_pct = round(total_return / total_sale_for_contrib * 100, 2) if total_sale > 0 else 0
+    return_by_cat = [
+        {"category": a["key"], "sale_amount": _r2(a["sale_amount"]), "return_amount": _r2(a["return_amount"]),
+         "return_rate_pct": _r2(_margin(a["return_amount"], a["sale_amount"]))}
+        for a in _top([a for a in cat_all if a["return_amount"] > 0], 10, key="return_amount")
+    ]
+
+    # 8. 色系 / 风格
+    color_style = {
+        field: [{"name": a["key"], "sale_amount": _r2(a["sale_amount"]), "margin_pct": _r2(_margin(a["profit"], a["sale_amount"]))}
+                for a in _top(_grouped(filtered, field + "_f", field), 10)]
+        for field in ("color_system", "style")
+    }
+
+    # 8b. 折扣区间（只带日期条件、关联划线价）
+    dbands = {a["key"]: a for a in _grouped(df[df["listed"]], "discount_band", "discount_band")}
+    discount_band_rows = [
+        {"band": b, "sku_cnt": dbands[b]["skus"], "sale_amount": _r2(dbands[b]["sale_amount"]), "profit": _r2(dbands[b]["profit"]),
+         "qty": _r2(dbands[b]["qty"]), "margin_pct": _r2(_margin(dbands[b]["profit"], dbands[b]["sale_amount"]))}
+        for b in DISCOUNT_BANDS if b in dbands
+    ]
+
+    # 8d. 高折扣低毛利（SKU 平均折扣 > 30% 且毛利率 < 10%）
+    candidates = []
+    for s in disc_sku.values():
+        avg_disc = _div(s["disc_sum"], s["disc_n"], 12) if s["disc_n"] else None
+        margin = _margin(s["profit"], s["sale_amount"])
+        if margin < 10 and avg_disc is not None and avg_disc > 30:
+            candidates.append((s, margin, avg_disc))
+    candidates.sort(key=lambda t: t[0]["sale_amount"], reverse=True)
+    high_discount_low_margin = [{
+        "sku_code": s["sku_code"] or "",
+        "product_name": (max(s["names"]) if s["names"] else "")[:40],
+        "sale_amount": _r2(s["sale_amount"]),
+        "profit": _r2(s["profit"]),
+        "margin_pct": _r2(margin),
+        "avg_discount_pct": _r2(avg_disc),
+    } for s, margin, avg_disc in candidates[:50]]
+
+    # 下钻：品类 → 品牌 → 款式(品名) → 货号
+    drill_brands, drill_styles, drill_sku_rank = [], [], []
+    category_name, brand_name, product_name = drill.get("category"), drill.get("brand"), drill.get("product_name")
+    if category_name:
+        drill_brands = [
+            {"brand": a["key"], **_metrics(a), "sku_sold": a["skus"]}
+            for a in _top(_grouped(filtered, "brand_drill_f", "brand_drill"), 50)
+        ]
+    if category_name and brand_name and not product_name:
+        drill_styles = [
+            {"product_name": a["key"], **_metrics(a), "sku_sold": a["skus"]}
+            for a in _top(_grouped(filtered, "style_name_f", "style_name"), 100)
+        ]
+    if category_name and brand_name and product_name:
+        target = fold(product_name)
+        matched = filtered[filtered["product_name"].map(lambda v: fold(trim(v or ""))) == target]
+        names = matched.groupby("sku", sort=False)["product_name"].agg(lambda v: max((x for x in v if isinstance(x, str)), default=""))
+        brands = matched.groupby("sku", sort=False)["brand"].agg(lambda v: max((x for x in v if x != "未分类"), default=""))
+        for a in _top(_grouped(matched, "sku", "sku_code"), 100):
+            fk = fold(a["key"])
+            drill_sku_rank.append({
+                "sku_code": a["key"] or "",
+                "product_name": names.get(fk, "").strip() or "-",
+                "brand_name": brands.get(fk, "").strip() or "-",
+                **_metrics(a),
+                "avg_discount_pct": None,
+            })
+
+    return {
+        "totals": {"total_sale": total_sale, "total_profit": total_profit, "total_qty": total_qty, "sku_sold": sku_sold,
+                   "total_return": total_return, "avg_discount_pct": avg_discount_pct,
+                   "new_sale": new_sale, "new_profit": new_profit, "new_sku_sold": new_sku_sold},
+        "category_matrix": category_matrix,
+        "brand": brand,
+        "price_band": price_band_rows,
+        "supplier": supplier,
+        "top_sku": top_sku,
+        "distribution": distribution,
+        "return_rate_pct": return_rate_pct,
+        "return_by_cat": return_by_cat,
+        "color_style": color_style,
+        "discount_band": discount_band_rows,
+        "high_discount_low_margin": high_discount_low_margin,
+        "drill_brands": drill_brands,
+        "drill_styles": drill_styles,
+        "drill_sku_rank": drill_sku_rank,
+    }
+
+
+def _interval_days(date_params):
+    return int(date_params[0]) if date_params and isinstance(date_params[0], (int, float)) else 30
+
+
+def _zero_sale_skus(cur, store_id, date_params):
+    """主数据中有、本周期内无销售的 SKU（限 100 条），口径同逐条 SQL 版。"""
+    use_date_range = len(date_params) == 2 and all(isinstance(x, str) and "-" in str(x) for x in date_params)
+    if use_date_range:
+        cur.execute("""
+            SELECT pm.sku_code, pm.product_name, pm.category_name, pm.brand_name, pm.retail_price
+            FROM t_htma_product_master pm
+            LEFT JOIN (SELECT DISTINCT sku_code FROM t_htma_sale WHERE store_id = %s AND data_date BETWEEN %s AND %s) s ON pm.sku_code = s.sku_code
+            WHERE pm.store_id = %s AND s.sku_code IS NULL
+            LIMIT 100
+        """, (store_id, date_params[0], date_params[1], store_id))
+    else:
+        cur.execute("""
+            SELECT pm.sku_code, pm.product_name, pm.category_name, pm.brand_name, pm.retail_price
+            FROM t_htma_product_master pm
+            LEFT JOIN (SELECT DISTINCT sku_code FROM t_htma_sale WHERE store_id = %s AND data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)) s ON pm.sku_code = s.sku_code
+            WHERE pm.store_id = %s AND s.sku_code IS NULL
+            LIMIT 100
+        """, (store_id, _interval_days(date_params), store_id))
+    return [{
+        "sku_code": r.get("sku_code") or "",
+        "product_name": (r.get("product_name") or "")[:50],
+        "category_name": (r.get("category_name") or "")[:32],
+        "brand_name": (r.get("brand_name") or "")[:32],
+        "retail_price": round(float(r.get("retail_price") or 0), 2),
+    } for r in cur.fetchall()]
+
+
+def build_consumer_insight(cur, store_id, date_cond, date_params, params, category_cond="", drill=None, stock="t_htma_stock"):
+    """
+    单次扫描版消费洞察：params 为 (store_id,) + date_params + 品类/品牌筛选参数（同 _query_filters）。
+    stock 为读当前库存的表（stock_latest.stock_source 的结果）。
+    返回与逐条 SQL 版相同结构的字典，bi_insight、date_range 留空由调用方填写。扫描失败时抛出异常。
+    """
+    date_params = tuple(date_params)
+    groups = fetch_insight_groups(cur, store_id, date_cond, date_params, category_cond, tuple(params)[1 + len(date_params):])
+    panels = derive_panels(groups, drill)
+    t = panels.pop("totals")
+    total_sale, total_profit, total_qty = t["total_sale"], t["total_profit"], t["total_qty"]
+    total_sale_for_contrib = total_sale or 1
+
+    # 主数据：SKU 总数（动销率分母）、平均零售价、新品总数
+    cur.execute("""
+        SELECT COUNT(*) AS c,
+               AVG(CASE WHEN COALESCE(retail_price, 0) > 0 THEN retail_price END) AS avg_retail,
+               SUM(TRIM(COALESCE(product_status, '')) = '新品') AS new_total
+        FROM t_htma_product_master WHERE store_id = %s
+    """, (store_id,))
+    pm = cur.fetchone() or {}
+    sku_total = int(pm.get("c") or 0)
+    new_sku_total = int(pm.get("new_total") or 0)
+    avg_retail_price = round(float(pm.get("avg_retail")), 2) if pm.get("avg_retail") else None
+    sell_through_pct = (t["sku_sold"] / sku_total * 100) if sku_total > 0 else None
+
+    # 库存周转天数（最近一天库存 / 日均销量）
+    try:
+        cur.execute(f"SELECT COALESCE(SUM(stock_qty), 0) AS total_stock FROM {stock} WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM {stock} WHERE store_id = %s)", (store_id, store_id))
+        total_stock = float(cur.fetchone().get("total_stock") or 0)
+        interval_days = max(1, _interval_days(date_params))
+        daily_sale_qty = total_qty / interval_days if interval_days else 0
+        inventory_turnover_days = round(total_stock / daily_sale_qty, 1) if daily_sale_qty > 0 and total_stock >= 0 else None
+    except Exception:
+        inventory_turnover_days = None
+
+    margin_pct = (total_profit / total_sale * 100) if total_sale > 0 else 0
+    overview = {
+        "total_sale": round(total_sale, 2),
+        "total_qty": round(total_qty, 2),
+        "total_profit": round(total_profit, 2),
+        "margin_pct": round(margin_pct, 2),
+        "sku_sold": t["sku_sold"],
+        "sku_total": sku_total,
+        "sell_through_pct": round(sell_through_pct, 2) if sell_through_pct is not None else None,
+        "unit_price": round((total_sale / total_qty) if total_qty > 0 else 0, 2),
+        "avg_retail_price": avg_retail_price,
+        "inventory_turnover_days": inventory_turnover_days,
+        "avg_discount_pct": t["avg_discount_pct"],
+    }
+
+    category_matrix = panels["category_matrix"]
+    new_sale, new_profit, new_sku_sold = t["new_sale"], t["new_profit"], t["new_sku_sold"]
+    new_product = {
+        "new_sale": round(new_sale, 2),
+        "new_profit": round(new_profit, 2),
+        "new_sale_contrib_pct": round(new_sale / total_sale_for_contrib * 100, 2) if total_sale > 0 else 0,
+        "new_margin_pct": round(new_profit / new_sale * 100, 2) if new_sale > 0 else 0,
+        "new_sku_sold": new_sku_sold,
+        "new_sku_total": new_sku_total,
+        "new_sell_through_pct": round(new_sku_sold / new_sku_total * 100, 2) if new_sku_total > 0 else None,
+        "old_sale_contrib_pct": round((total_sale - new_sale) / total_sale_for_contrib * 100, 2) if total_sale > 0 else 0,
+    }
+
+    try:
+        zero_sale_skus = _zero_sale_skus(cur, store_id, date_params)
+    except Exception:
+        zero_sale_skus = []
+
+    # 环比：上一段同长度区间
+    period_over_period = {}
+    try:
+        interval_days = _interval_days(date_params)
+        if interval_days >= 1:
+            cur.execute("""
+                SELECT COALESCE(SUM(sale_amount), 0) AS prev_sale
+                FROM t_htma_sale
+                WHERE store_id = %s AND data_date BETWEEN DATE_SUB(CURDATE(), INTERVAL %s DAY) AND DATE_SUB(CURDATE(), INTERVAL %s DAY)
+            """, (store_id, interval_days * 2, interval_days + 1))
+            prev_sale = float(cur.fetchone().get("prev_sale") or 0)
+            pct_change = round((total_sale - prev_sale) / prev_sale * 100, 2) if prev_sale > 0 else None
+            period_over_period = {"prev_sale": round(prev_sale, 2), "pct_change": pct_change}
+    except Exception:
+        period_over_period = {}
+
+    # 四级下钻的货号折扣不限日期，按货号单查
+    drill_sku_rank = panels["drill_sku_rank"]
+    if drill_sku_rank:
+        try:
+            sku_list = [row["sku_code"] for row in drill_sku_rank]
+            cur.execute("""
+                SELECT s.sku_code, AVG(1 - s.sale_price / NULLIF(p.list_price, 0)) * 100 AS avg_discount_pct
+                FROM t_htma_sale s
+                INNER JOIN t_htma_product_master p ON p.sku_code = s.sku_code AND p.store_id = s.store_id AND COALESCE(p.list_price, 0) > 0
+                WHERE s.store_id = %s AND s.sku_code IN (""" + ",".join(["%s"] * len(sku_list)) + """)
+                GROUP BY s.sku_code
+            """, (store_id,) + tuple(sku_list))
+            discount_map = {r.get("sku_code"): round(float(r.get("avg_discount_pct") or 0), 2) for r in cur.fetchall()}
+            for row in drill_sku_rank:
+                row["avg_discount_pct"] = discount_map.get(row["sku_code"])
+        except Exception:
+            pass
+
+    return {
+        "overview": overview,
+        "bi_insight": None,
+        "category_matrix": category_matrix,
+        "category_top_sale": [{"category": c["category"], "sale_amount": c["sale_amount"], "profit": c["profit"], "margin_pct": c["margin_pct"], "sale_contrib_pct": c.get("sale_contrib_pct"), "profit_contrib_pct": c.get("profit_contrib_pct")} for c in category_matrix[:10]],
+        "category_top_profit": sorted([{"category": c["category"], "sale_amount": c["sale_amount"], "profit": c["profit"], "margin_pct": c["margin_pct"]} for c in category_matrix], key=lambda x: x["profit"], reverse=True)[:10],
+        "category_top_margin": sorted([{"category": c["category"], "sale_amount": c["sale_amount"], "profit": c["profit"], "margin_pct": c["margin_pct"]} for c in category_matrix if c["margin_pct"] > 0], key=lambda x: x["margin_pct"], reverse=True)[:5],
+        "brand": panels["brand"],
+        "price_band": panels["price_band"],
+        "supplier": panels["supplier"],
+        "top_sku": panels["top_sku"],
+        "distribution": panels["distribution"],
+        "new_product": new_product,
+        "return_rate_pct": panels["return_rate_pct"],
+        "return_by_cat": panels["return_by_cat"],
+        "color_style": panels["color_style"],
+        "period_over_period": period_over_period,
+        "date_range": None,
+        "discount_band": panels["discount_band"],
+        "zero_sale_skus": zero_sale_skus,
+        "high_discount_low_margin": panels["high_discount_low_margin"],
+        "drill_brands": panels["drill_brands"],
+        "drill_styles": panels["drill_styles"],
+        "drill_subcategory": [],
+        "drill_sku_rank": drill_sku_rank,
+    }
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+首页看板面板的共享扫描：KPI、品类占比、销售趋势、走势分析、周几对比原先各自按同一组筛选条件扫一遍销售表，
+品类排行、按大类排行、品类汇总各自扫一遍 t_htma_profit。这里改为每组筛选条件各读一次：
+
+- 销售扫描：按 日期（需要品类占比时加 category）分组求和销售额与毛利，读 sale_source 选出的表（汇总表或明细）；
+- 毛利扫描：t_htma_profit 按 category 与大/中/小类列分组求和；
+- 各面板由扫描结果在内存中派生：金额按原类型累加（DECIMAL 列为 Decimal，求和精确），分组键用 collation.fold 近似 MySQL 默认排序规则，
+  排序、Top N 与 SQL 版一致，周按 YEAR + ISO 周（WEEK(d, 3)）、月按 YEAR + MONTH 分组。
+
+不依赖 Flask：app 的单个面板接口与 /api/dashboard_bundle 都经由这里派生，返回 SQL 行同形的 dict 列表，
+JSON 格式化留在 app。
+"""
+try:
+    from collation import fold, trim
+except ImportError:
+    from htma_dashboard.collation import fold, trim
+
+_ZERO = 0
+
+_SALE_SCAN_SQL = """
+    SELECT data_date{dims},
+           COALESCE(SUM(sale_amount), 0) AS sale_amount,
+           COALESCE(SUM(COALESCE(gross_profit, 0)), 0) AS profit_amount
+    FROM {src}
+    WHERE store_id = %s AND {date_cond}{category_cond}
+    GROUP BY data_date{dims}
+"""
+
+_PROFIT_SCAN_SQL = """
+    SELECT category, category_large, category_large_code, category_mid, category_small,
+           COALESCE(SUM(total_sale), 0) AS total_sale, COALESCE(SUM(total_profit), 0) AS total_profit
+    FROM t_htma_profit
+    WHERE store_id = %s AND {date_cond}{category_cond}
+    GROUP BY category, category_large, category_large_code, category_mid, category_small
+"""
+
+
+def fetch_sale_scan(cur, src, date_cond, category_cond, params, by_category=False):
+    """销售扫描：返回 [{data_date, (category,) sale_amount, profit_amount}]；params 与 WHERE 占位符顺序一致。"""
+    dims = ", category" if by_category else ""
+    cur.execute(_SALE_SCAN_SQL.format(dims=dims, src=src, date_cond=date_cond, category_cond=category_cond), params)
+    return cur.fetchall()
+
+
+def fetch_profit_scan(cur, date_cond, category_cond, params):
+    """毛利扫描：返回 [{category, category_large, category_large_code, category_mid, category_small, total_sale, total_profit}]。"""
+    cur.execute(_PROFIT_SCAN_SQL.format(date_cond=date_cond, category_cond=category_cond), params)
+    return cur.fetchall()
+
+
+def _amount(v):
+    return _ZERO if v is None else v
+
+
+def _grouped(rows, key, label, fields):
+    """按 key(row) 分组累加 fields；label(row) 取组内第一行（与 MySQL 非聚合列取值一致）。返回按首次出现排序的列表。"""
+    groups = {}
+    for r in rows:
+        k = key(r)
+        g = groups.get(k)
+        if g is None:
+            g = groups[k] = dict(label(r), **{f: _ZERO for f in fields})
+        for f in fields:
+            g[f] += _amount(r[f])
+    return list(groups.values())
+
+
+# ---------- 销售扫描派生 ----------
+
+def sale_totals(rows):
+    """(销售额, 毛利) 合计。"""
+    sale, profit = _ZERO, _ZERO
+    for r in rows:
+        sale += _amount(r["sale_amount"])
+        profit += _amount(r["profit_amount"])
+    return sale, profit
+
+
+def category_pie(rows, top=10):
+    """品类占比：按 category 汇总后前 top 名保留，其余并为「其他」，按销售额降序。rows 需含 category。"""
+    cs = _grouped(
+        rows, lambda r: fold(r["category"]),
+        lambda r: {"category": "未分类" if r["category"] is None else r["category"]}, ("sale_amount",),
+    )
+    cs.sort(key=lambda g: g["sale_amount"], reverse=True)
+    labelled = [{"category": g["category"] if i < top else "其他", "sale_amount": g["sale_amount"]} for i, g in enumerate(cs)]
+    out = _grouped(labelled, lambda r: fold(r["category"]), lambda r: {"category": r["category"]}, ("sale_amount",))
+    out.sort(key=lambda g: g["sale_amount"], reverse=True)
+    return out
+
+
+def trend_points(rows, granularity):
+    """按日/周/月汇总，按时间升序。日：x_date 为 date；周：x_date 为「YYYY-Wnn」并带 week_start；月：x_date 为「YYYY-MM」。"""
+    if granularity == "day":
+        key = lambda r: r["data_date"]
+    elif granularity == "week":
+        key = lambda r: (r["data_date"].year, r["data_date"].isocalendar()[1])
+    else:
+        key = lambda r: (r["data_date"].year, r["data_date"].month)
+    groups = {}
+    for r in rows:
+        k = key(r)
+        g = groups.get(k)
+        if g is None:
+            g = groups[k] = {"start": r["data_date"], "sale_amount": _ZERO, "profit_amount": _ZERO}
+        elif r["data_date"] < g["start"]:
+            g["start"] = r["data_date"]
+        g["sale_amount"] += _amount(r["sale_amount"])
+        g["profit_amount"] += _amount(r["profit_amount"])
+    out = []
+    for k, g in sorted(groups.items(), key=lambda kv: kv[1]["start"]):
+        point = {"sale_amount": g["sale_amount"], "profit_amount": g["profit_amount"]}
+        if granularity == "day":
+            point["x_date"] = g["start"]
+        elif granularity == "week":
+            point["x_date"] = f"{k[0]}-W{k[1]:02d}"
+            point["week_start"] = g["start"]
+        else:
+            point["x_date"] = g["start"].strftime("%Y-%m")
+        out.append(point)
+    return out
+
+
+def dow_sales(rows):
+    """按星期几汇总（1=周日 … 7=周六，同 DAYOFWEEK），返回 {dow: {sale_amount, profit_amount, day_count}}，无销售的星期不出现。"""
+    out, days = {}, {}
+    for r in rows:
+        d = r["data_date"]
+        dow = d.isoweekday() % 7 + 1
+        g = out.setdefault(dow, {"sale_amount": _ZERO, "profit_amount": _ZERO})
+        g["sale_amount"] += _amount(r["sale_amount"])
+        g["profit_amount"] += _amount(r["profit_amount"])
+        days.setdefault(dow, set()).add(d)
+    for dow, g in out.items():
+        g["day_count"] = len(days[dow])
+    return out
+
+
+# ---------- 毛利扫描派生 ----------
+
+def profit_totals(rows):
+    """(销售额, 毛利) 合计。"""
+    sale, profit = _ZERO, _ZERO
+    for r in rows:
+        sale += _amount(r["total_sale"])
+        profit += _amount(r["total_profit"])
+    return sale, profit
+
+
+def category_rank_rows(rows, limit=50):
+    """按 category 汇总，销售额降序取前 limit 名。"""
+    out = _grouped(
+        rows, lambda r: fold(r["category"]),
+        lambda r: {"category": "未分类" if r["category"] is None else r["category"]}, ("total_sale", "total_profit"),
+    )
+    out.sort(key=lambda g: g["total_sale"], reverse=True)
+    return out[:limit]
+
+
+def category_large_rank_rows(rows, limit=50):
+    """按大类（名称 + 编码）汇总，名称与编码均为空的行不计；显示名缺省依次取编码、「未分类」。"""
+    def label(r):
+        name, code = trim(r["category_large"]) or None, trim(r["category_large_code"]) or None
+        return {"category_large": name or code or "未分类", "category_large_code": code or name or ""}
+
+    kept = [r for r in rows if trim(r["category_large"] or "") or trim(r["category_large_code"] or "")]
+    out = _grouped(kept, lambda r: (fold(r["category_large"]), fold(r["category_large_code"])), label, ("total_sale", "total_profit"))
+    out.sort(key=lambda g: g["total_sale"], reverse=True)
+    return out[:limit]
+
+
+def profit_summary_rows(rows):
+    """按 category 汇总，附组内大/中/小类（MAX(COALESCE(x, ''))），销售额降序。"""
+    levels = {}
+    for r in rows:
+        lv = levels.setdefault(fold(r["category"]), {"category_large": "", "category_mid": "", "category_small": ""})
+        for col in lv:
+            v = r[col] or ""
+            if fold(v) > fold(lv[col]):
+                lv[col] = v
+    out = _grouped(
+        rows, lambda r: fold(r["category"]),
+        lambda r: dict(levels[fold(r["category"])], category="未分类" if r["category"] is None else r["category"]),
+        ("total_sale", "total_profit"),
+    )
+    out.sort(key=lambda g: g["total_sale"], reverse=True)
+    return out
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+门店数据版本号 t_htma_data_version：每次导入/修复提交后 +1，接口缓存的 key 带上版本号，
+导入完成后旧缓存自然失效（脚本进程导入也能让看板进程感知）。
+
+- bump_data_version(conn, store_id)：导入成功提交后调用，失败不影响导入；conn 为 None 时自取连接（导入异常时用，不碰导入连接上未提交的事务）；
+- 表由 scripts/29_create_data_version.sql 创建；未执行脚本时每进程首次 bump 建表一次，之后不再发 DDL；
+- get_data_version(store_id)：读版本号，进程内缓存 HTMA_CACHE_VERSION_TTL 秒（默认 5），数据库不可用时返回上次值；
+- 本进程内 bump 立即生效：写库成功即刷新本地版本号；写库失败时记一次本地未同步计数叠加在库内版本号上。
+"""
+import os
+import threading
+import time
+
+DATA_VERSION_TABLE = "t_htma_data_version"
+VERSION_TTL = float(os.environ.get("HTMA_CACHE_VERSION_TTL", "5"))  # 秒
+
+_lock = threading.Lock()
+_db_versions = {}  # store_id -> (version, expire_at)
+_local_bumps = {}  # store_id -> 本进程未能写库的 bump 次数
+_table_ready = False
+
+
+def _get_conn():
+    try:
+        from db_config import get_conn
+    except ImportError:
+        from htma_dashboard.db_config import get_conn
+    return get_conn()
+
+
+def ensure_data_version_table(conn):
+    """建版本号表（已存在则跳过，每进程只执行一次）。DDL 会隐式提交。"""
+    global _table_ready
+    if _table_ready:
+        return
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} (
+          store_id   VARCHAR(32)     NOT NULL PRIMARY KEY,
+          version    BIGINT UNSIGNED NOT NULL DEFAULT 0,
+          updated_at DATETIME        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='门店数据版本号(接口缓存失效)'
+    """)
+    conn.commit()
+    cur.close()
+    _table_ready = True
+
+
+def _read_version(cur, store_id):
+    cur.execute(f"SELECT version FROM {DATA_VERSION_TABLE} WHERE store_id = %s", (store_id,))
+    row = cur.fetchone()
+    if not row:
+        return 0
+    return int((row.get("version") if isinstance(row, dict) else row[0]) or 0)
+
+
+def bump_data_version(conn, store_id):
+    """门店数据版本号 +1 并提交；返回新版本号字符串。conn 为 None 时自取连接。数据库写失败时仅本进程生效。"""
+    own = conn is None
+    try:
+        conn = conn or _get_conn()
+        try:
+            ensure_data_version_table(conn)
+            cur = conn.cursor()
+            try:
+                cur.execute(f"""
+                    INSERT INTO {DATA_VERSION_TABLE} (store_id, version) VALUES (%s, 1)
+                    ON DUPLICATE KEY UPDATE version = version + 1
+                """, (store_id,))
+                conn.commit()
+                v = _read_version(cur, store_id)
+            finally:
+                cur.close()
+        finally:
+            if own:
+                conn.close()
+        with _lock:
+            _db_versions[store_id] = (v, time.time() + VERSION_TTL)
+    except Exception:
+        with _lock:
+            _local_bumps[store_id] = _local_bumps.get(store_id, 0) + 1
+    return get_data_version(store_id)
+
+
+def get_data_version(store_id, conn=None):
+    """当前数据版本号（"库内版本.本进程未同步 bump 次数"），用于拼缓存 key；".0" 结尾时各进程含义一致。"""
+    now = time.time()
+    with _lock:
+        hit = _db_versions.get(store_id)
+    if hit is None or hit[1] <= now:
+        v = hit[0] if hit else 0
+        try:
+            own = conn is None
+            c = conn or _get_conn()
+            try:
+                with c.cursor() as cur:
+                    v = _read_version(cur, store_id)
+            finally:
+                if own:
+                    c.close()
+        except Exception:
+            pass  # 表不存在或库不可用：沿用上次值
+        with _lock:
+            _db_versions[store_id] = (v, now + VERSION_TTL)
+        hit = (v, 0)
+    with _lock:
+        local = _local_bumps.get(store_id, 0)
+    return f"{hit[0]}.{local}"
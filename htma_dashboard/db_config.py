@@ -2,8 +2,16 @@
 """
 数据库配置：统一从项目根目录 .env 读取 MYSQL_*，供 app 与所有脚本共用。
 使用前确保已安装 python-dotenv；脚本单独运行时本模块会先加载 .env。
+
+get_conn() 默认从进程内有界连接池取连接（HTMA_DB_POOL=0 可关闭，退回每次新建连接）：
+- 启动时可调用 warm_pool() 预建 HTMA_DB_POOL_MIN 个连接；
+- 取出时 ping 检活，超过 HTMA_DB_POOL_MAX_LIFETIME 秒的连接回收重建；
+- 连接数达到 HTMA_DB_POOL_SIZE 时最多等待 HTMA_DB_POOL_TIMEOUT 秒，超时抛 PoolTimeout；
+- 调用方原有的 conn.close() 不变，实际是归还连接池（归还前 rollback 未提交事务）。
 """
 import os
+import threading
+import time
 
 # 项目根目录（htma_dashboard 的上一级）
 _ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -28,8 +36,251 @@ DB_CONFIG = {
     "charset": "utf8mb4",
     "cursorclass": pymysql.cursors.DictCursor,
 }
+# 导入批量装载模式（bulk_load.py）需要客户端允许 LOAD DATA LOCAL INFILE
+if os.environ.get("HTMA_IMPORT_BULK_LOAD", "0").strip().lower() in ("1", "true", "yes", "on"):
+    DB_CONFIG["local_infile"] = True
+
+# 连接池参数（.env 可覆盖）
+POOL_ENABLED = os.environ.get("HTMA_DB_POOL", "1").strip().lower() not in ("0", "false", "no", "off")
+POOL_SIZE = int(os.environ.get("HTMA_DB_POOL_SIZE", "10"))
+POOL_MIN = int(os.environ.get("HTMA_DB_POOL_MIN", "2"))
+POOL_MAX_LIFETIME = int(os.environ.get("HTMA_DB_POOL_MAX_LIFETIME", "3600"))  # 秒
+POOL_TIMEOUT = float(os.environ.get("HTMA_DB_POOL_TIMEOUT", "10"))  # 秒
+
+
+class PoolTimeout(Exception):
+    """连接池已满且在等待时间内无连接归还。"""
+
+
+class PooledConnection:
+    """池化连接代理：属性/方法透传给 pymysql 连接，close() 改为归还连接池，重复 close 无副作用。"""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._closed = False
+
+    def __getattr__(self, name):
+        if name in ("_pool", "_raw", "_created_at", "_closed"):
+            raise AttributeError(name)
+        if self._raw is None:
+            raise pymysql.err.InterfaceError(0, "连接已归还连接池")
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        raw, self._raw = self._raw, None
+        self._pool._release(raw, self._created_at)
+
+    def discard(self):
+        """断开底层连接且不放回池中（会话状态不可信时用，如 RELEASE_LOCK 失败仍持有命名锁）。"""
+        if self._closed:
+            return
+        ConnectionPool._discard(self._raw)
+        self.close()
+
+    @property
+    def open(self):
+        return self._raw is not None and self._raw.open
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # 调用方忘记 close 时仍归还，避免池内连接泄漏
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """线程安全的有界 MySQL 连接池。"""
+
+    def __init__(self, config=None, max_size=POOL_SIZE, min_size=POOL_MIN, max_lifetime=POOL_MAX_LIFETIME, timeout=POOL_TIMEOUT, connect=None):
+        self._config = dict(config or DB_CONFIG)
+        self.max_size = max(1, int(max_size))
+        self.min_size = max(0, min(int(min_size), self.max_size))
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self._connect = connect or pymysql.connect
+        # RLock：PooledConnection.__del__ 可能在持锁期间被 GC 触发并回调 _release
+        self._cond = threading.Condition(threading.RLock())
+        self._idle = []  # [(raw, created_at)]，后进先出，最近用过的连接最热
+        self._size = 0  # 已创建且未销毁的连接数（空闲 + 借出）
+        self._stats = {"created": 0, "recycled": 0, "ping_failed": 0, "checkouts": 0, "waits": 0, "timeouts": 0}
+
+    def _new_raw(self):
+        raw = self._connect(**self._config)
+        with self._cond:
+            self._stats["created"] += 1
+        return raw, time.time()
+
+    def _expired(self, created_at):
+        return bool(self.max_lifetime) and time.time() - created_at > self.max_lifetime
+
+    @staticmethod
+    def _discard(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def warm(self, n=None):
+        """预建连接至 n（默认 min_size）个空闲连接，返回实际新建数。"""
+        target = self.min_size if n is None else min(int(n), self.max_size)
+        made = 0
+        while True:
+            with self._cond:
+                if len(self._idle) >= target or self._size >= self.max_size:
+                    return made
+                self._size += 1
+            try:
+                raw, created_at = self._new_raw()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((raw, created_at))
+                self._cond.notify()
+            made += 1
+
+    def get(self, timeout=None):
+        """借出连接：优先取空闲连接（ping 检活、超龄回收），否则在上限内新建，满则等待。"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            item = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"数据库连接池已满（{self.max_size}），等待 {timeout}s 超时")
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    item = self._idle.pop()
+                else:
+                    self._size += 1
+            if item is None:
+                try:
+                    raw, created_at = self._new_raw()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                raw, created_at = item
+                if self._expired(created_at) or not self._ping(raw):
+                    self._discard(raw)
+                    with self._cond:
+                        self._size -= 1
+                        self._stats["recycled"] += 1
+                        self._cond.notify()
+                    continue
+            with self._cond:
+                self._stats["checkouts"] += 1
+            return PooledConnection(self, raw, created_at)
+
+    def _ping(self, raw):
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._cond:
+                self._stats["ping_failed"] += 1
+            return False
+
+    def _release(self, raw, created_at):
+        """归还连接：结束未提交事务，避免下个借用者读到旧快照；异常或超龄则销毁。"""
+        keep = raw is not None and getattr(raw, "open", True) and not self._expired(created_at)
+        if keep:
+            try:
+                raw.rollback()
+                if raw.get_autocommit() != bool(self._config.get("autocommit", False)):
+                    raw.autocommit(bool(self._config.get("autocommit", False)))
+            except Exception:
+                keep = False
+        with self._cond:
+            if keep:
+                self._idle.append((raw, created_at))
+            else:
+                self._size -= 1
+                self._stats["recycled"] += 1
+            self._cond.notify()
+        if not keep and raw is not None:
+            self._discard(raw)
+
+    def close_all(self):
+        """关闭全部空闲连接（借出中的连接归还时仍会正常回池）。"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for raw, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._stats)
+            out.update({
+                "max_size": self.max_size,
+                "min_size": self.min_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_lifetime": self.max_lifetime,
+                "timeout": self.timeout,
+            })
+        return out
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """进程级单例连接池（首次调用时创建，fork 出的子进程应各自新建）。"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
+
+def warm_pool(n=None):
+    """启动时预热连接池；数据库不可用时返回 0 而不抛异常，不影响服务启动。"""
+    if not POOL_ENABLED:
+        return 0
+    try:
+        return get_pool().warm(n)
+    except Exception:
+        return 0
+
+
+def pool_stats():
+    """连接池状态（供 /api/health 展示）；未启用连接池时返回 {"enabled": False}。"""
+    if not POOL_ENABLED:
+        return {"enabled": False}
+    out = get_pool().stats()
+    out["enabled"] = True
+    return out
 
 
 def get_conn():
-    """返回 pymysql 连接（与 app 及所有脚本共用同一配置）。"""
-    return pymysql.connect(**DB_CONFIG)
+    """返回 pymysql 连接（与 app 及所有脚本共用同一配置）。启用连接池时 close() 即归还连接池。"""
+    if not POOL_ENABLED:
+        return pymysql.connect(**DB_CONFIG)
+    return get_pool().get()
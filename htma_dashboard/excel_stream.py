@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+流式读取 Excel（导入用）：逐行生成，不把整本工作簿读成 DataFrame，峰值内存与文件大小无关。
+
+- .xlsx：openpyxl read_only + values_only 逐行迭代；
+- .xls：xlrd on_demand 只加载首个工作表，逐行取值（日期单元格转 datetime，整数值转 int，与 pandas 读取结果一致；
+  .xls 格式本身最多 65536 行，内存有上限）；
+- 扩展名与实际格式不符时依次尝试另一种引擎，最后退回 pd.read_excel。
+read_excel_stream 返回前 HTMA_EXCEL_HEAD_ROWS 行（默认 200）组成的 DataFrame 供表头检测，其余行以生成器给出。
+"""
+import os
+from itertools import islice
+
+import pandas as pd
+
+HEAD_ROWS = int(os.environ.get("HTMA_EXCEL_HEAD_ROWS", "200"))
+
+
+def _norm(v):
+    """与 pandas 读取一致：整数值的浮点转 int，空串视为空。"""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str) and v == "":
+        return None
+    return v
+
+
+def _strip_trailing_empty(row):
+    n = len(row)
+    while n and row[n - 1] is None:
+        n -= 1
+    return row[:n]
+
+
+def _iter_xlsx(path):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # 部分导出工具写错 dimension，按实际单元格读取
+        for row in ws.iter_rows(values_only=True):
+            yield _strip_trailing_empty(tuple(_norm(v) for v in row))
+    finally:
+        wb.close()
+
+
+def _iter_xls(path):
+    import xlrd
+
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for r in range(sheet.nrows):
+            out = []
+            for cell in sheet.row(r):
+                if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                    out.append(None)
+                elif cell.ctype == xlrd.XL_CELL_DATE:
+                    try:
+                        out.append(xlrd.xldate_as_datetime(cell.value, book.datemode))
+                    except Exception:
+                        out.append(cell.value)
+                elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                    out.append(bool(cell.value))
+                else:
+                    out.append(_norm(cell.value))
+            yield _strip_trailing_empty(tuple(out))
+    finally:
+        book.release_resources()
+
+
+def _iter_pandas(path):
+    df = pd.read_excel(path, header=None)
+    for row in df.itertuples(index=False, name=None):
+        yield _strip_trailing_empty(tuple(None if (isinstance(v, float) and pd.isna(v)) else _norm(v) for v in row))
+
+
+def iter_excel_rows(path):
+    """逐行生成首个工作表的单元格值（tuple，行尾空单元格已去掉）。"""
+    ext = os.path.splitext(path)[1].lower()
+    readers = [_iter_xlsx, _iter_xls] if ext in (".xlsx", ".xlsm") else [_iter_xls, _iter_xlsx]
+    last_err = None
+    for reader in readers:
+        it = reader(path)
+        try:
+            first = next(it)
+        except StopIteration:
+            return
+        except Exception as e:  # 格式不符或引擎未安装，换下一个
+            last_err = e
+            continue
+        yield first
+        yield from it
+        return
+    try:
+        yield from _iter_pandas(path)
+    except Exception as e:
+        raise last_err or e
+
+
+def read_excel_stream(path, head_rows=None):
+    """
+    返回 (head_df, rest)：head_df 为前 head_rows 行（按最宽行补齐列数，与 pd.read_excel(header=None) 的前若干行一致），
+    rest 为其后各行的生成器（跳过全空行，短行补 None 到 head_df 列数）。
+    """
+    rows = iter_excel_rows(path)
+    head = list(islice(rows, head_rows or HEAD_ROWS))
+    ncol = max((len(r) for r in head), default=0)
+    head_df = pd.DataFrame([r + (None,) * (ncol - len(r)) for r in head], columns=range(ncol))
+
+    def rest():
+        for r in rows:
+            if not r:
+                continue
+            yield r + (None,) * (ncol - len(r)) if len(r) < ncol else r
+
+    return head_df, rest()
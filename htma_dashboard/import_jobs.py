@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+后台导入任务：上传文件先落盘，入队到本进程的线程池后立即返回 job_id，前端轮询 /api/import_jobs/<id> 查看进度与结果。
+
+- 同一门店同一时间只跑一个导入任务：本进程内按门店排队（先到先跑），跨 worker 进程再由 store_import_lock
+  （MySQL GET_LOCK）互斥，后到的任务等待前一个完成；
+- 任务状态（queued / running / done / failed）、分阶段计时与结果写入 SQLite（HTMA_IMPORT_JOBS_PATH，WAL），
+  多 worker 部署时任一进程都能查询，超过 HTMA_IMPORT_JOB_KEEP_HOURS 的记录自动清理；本进程内存只保留最近
+  HTMA_IMPORT_JOB_MEMORY_KEEP 个已结束任务（同样不超过保留小时数），更早的从 SQLite 查询；
+- 阶段由导入代码调用 stage(name) 标记：read（读表头）、detect（表头/列检测）、parse（逐行解析聚合，含流式读取其余行）、
+  insert（写库）、backfill（维度回填与汇总表）、refresh（导入后刷新毛利/品类/商品表）。
+  新阶段开始即结束上一阶段；不在后台任务线程中调用时为空操作，同步导入与脚本不受影响。
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+IMPORT_JOB_WORKERS = max(1, int(os.environ.get("HTMA_IMPORT_JOB_WORKERS", "2")))
+IMPORT_JOBS_PATH = os.environ.get("HTMA_IMPORT_JOBS_PATH", "").strip() or os.path.join(tempfile.gettempdir(), "htma_import_jobs.sqlite3")
+IMPORT_JOB_KEEP_HOURS = float(os.environ.get("HTMA_IMPORT_JOB_KEEP_HOURS", "72"))
+IMPORT_JOB_MEMORY_KEEP = max(0, int(os.environ.get("HTMA_IMPORT_JOB_MEMORY_KEEP", "50")))
+# 跨进程门店锁最长等待秒数（前一个导入仍未结束则本任务失败）
+IMPORT_LOCK_TIMEOUT = int(os.environ.get("HTMA_IMPORT_LOCK_TIMEOUT", "1800"))
+
+STAGES = ("read", "detect", "parse", "insert", "backfill", "refresh")
+
+_local = threading.local()
+
+
+class JobStore:
+    """任务记录的 SQLite 存储；每线程一个连接。"""
+
+    def __init__(self, path=IMPORT_JOBS_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS import_jobs (
+              id       TEXT PRIMARY KEY,
+              store_id TEXT NOT NULL,
+              status   TEXT NOT NULL,
+              created  REAL NOT NULL,
+              updated  REAL NOT NULL,
+              doc      TEXT NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_created ON import_jobs (created)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, doc):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO import_jobs (id, store_id, status, created, updated, doc) VALUES (?, ?, ?, ?, ?, ?)",
+            (doc["id"], doc["store_id"], doc["status"], doc["created_at"], time.time(), json.dumps(doc, ensure_ascii=False, default=str)),
+        )
+
+    def load(self, job_id):
+        row = self._conn().execute("SELECT doc FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune(self, keep_hours=IMPORT_JOB_KEEP_HOURS):
+        self._conn().execute(
+            "DELETE FROM import_jobs WHERE created < ? AND status IN ('done', 'failed')",
+            (time.time() - keep_hours * 3600,),
+        )
+
+
+class ImportJob:
+    """一次导入任务：阶段列表按 (文件, 阶段) 记录开始时间与耗时（毫秒）。"""
+
+    def __init__(self, store_id, kind, files=(), store=None):
+        self.id = uuid.uuid4().hex
+        self.store_id = store_id
+        self.kind = kind
+        self.files = list(files)
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = []
+        self.result = None
+        self.error = None
+        self._file = None
+        self._t0 = None
+        self._store = store
+
+    def to_dict(self):
+        totals = {}
+        for s in self.stages:
+            if s["elapsed_ms"] is not None:
+                totals[s["stage"]] = totals.get(s["stage"], 0) + s["elapsed_ms"]
+        current = self.stages[-1] if self.stages and self.stages[-1]["status"] == "running" else None
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "store_id": self.store_id,
+            "kind": self.kind,
+            "files": self.files,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_ms": round((end - self.started_at) * 1000) if self.started_at else None,
+            "current": {"file": current["file"], "stage": current["stage"]} if current else None,
+            "stages": self.stages,
+            "stage_totals_ms": totals,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def _save(self):
+        if self._store is not None:
+            try:
+                self._store.save(self.to_dict())
+            except Exception:
+                pass  # 状态记录失败不影响导入本身
+
+    def _close_stage(self, status="done"):
+        if self.stages and self.stages[-1]["status"] == "running":
+            self.stages[-1]["status"] = status
+            self.stages[-1]["elapsed_ms"] = round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def begin_file(self, label):
+        self._close_stage()
+        self._file = label
+        self._save()
+
+    def mark(self, name):
+        self._close_stage()
+        self._t0 = time.perf_counter()
+        self.stages.append({"file": self._file, "stage": name, "status": "running", "started_at": time.time(), "elapsed_ms": None})
+        self._save()
+
+    def start(self):
+        self.status = "running"
+        self.started_at = time.time()
+        self._save()
+
+    def finish(self, result):
+        self._close_stage()
+        self.result = result
+        self.status = "failed" if isinstance(result, dict) and result.get("success") is False else "done"
+        self.finished_at = time.time()
+        self._save()
+
+    def fail(self, exc):
+        self._close_stage("failed")
+        tb = traceback.format_exc()
+        self.error = str(exc)
+        self.result = {"success": False, "message": str(exc), "traceback": tb[-2000:]}
+        self.status = "failed"
+        self.finished_at = time.time()
+        self._save()
+
+
+def stage(name):
+    """标记当前导入任务进入 name 阶段（见 STAGES）；不在后台任务中时为空操作。"""
+    job = getattr(_local, "job", None)
+    if job is not None:
+        job.mark(name)
+
+
+def begin_file(label):
+    """后续阶段归属到文件 label（如 sale_daily）；不在后台任务中时为空操作。"""
+    job = getattr(_local, "job", None)
+    if job is not None:
+        job.begin_file(label)
+
+
+class ImportJobRunner:
+    """线程池 + 按门店排队：同一门店的任务串行执行，不同门店可并行（最多 workers 个）。"""
+
+    def __init__(self, workers=IMPORT_JOB_WORKERS, store=None, memory_keep=IMPORT_JOB_MEMORY_KEEP):
+        self.store = store
+        self.memory_keep = memory_keep
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="htma-import")
+        self._queues = {}  # store_id -> deque[(job, fn, cleanup)]，队首为正在执行的任务
+        self._lock = threading.Lock()
+        self._jobs = {}  # 本进程未结束及最近结束的任务（见 _evict），SQLite 不可用时供查询
+
+    def submit(self, store_id, kind, fn, files=(), cleanup=None):
+        """fn() 返回结果 dict（与同步接口的响应体相同）；cleanup() 在任务结束后调用（删除临时文件等）。"""
+        job = ImportJob(store_id, kind, files, store=self.store)
+        job._save()
+        with self._lock:
+            self._jobs[job.id] = job
+            q = self._queues.setdefault(store_id, deque())
+            q.append((job, fn, cleanup))
+            idle = len(q) == 1
+        if idle:
+            self._executor.submit(self._drain, store_id)
+        return job
+
+    def get(self, job_id):
+        """任务状态 dict；本进程内存没有（已淘汰或其他 worker 的任务）时读 SQLite 记录，都没有返回 None。"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is not None:
+            try:
+                return self.store.load(job_id)
+            except Exception:
+                return None
+        return None
+
+    def _evict(self):
+        """已结束任务只在内存保留最近 memory_keep 个且不超过 IMPORT_JOB_KEEP_HOURS，结果已写入 SQLite。"""
+        cutoff = time.time() - IMPORT_JOB_KEEP_HOURS * 3600
+        with self._lock:
+            finished = sorted((j for j in self._jobs.values() if j.finished_at is not None), key=lambda j: j.finished_at)
+            stale = finished[:max(0, len(finished) - self.memory_keep)]
+            stale += [j for j in finished[len(stale):] if j.finished_at < cutoff]
+            for j in stale:
+                self._jobs.pop(j.id, None)
+
+    def _drain(self, store_id):
+        while True:
+            with self._lock:
+                job, fn, cleanup = self._queues[store_id][0]
+            self._run(job, fn, cleanup)
+            with self._lock:
+                q = self._queues[store_id]
+                q.popleft()
+                if not q:
+                    del self._queues[store_id]
+                    return
+
+    def _run(self, job, fn, cleanup):
+        _local.job = job
+        job.start()
+        try:
+            job.finish(fn())
+        except Exception as e:
+            job.fail(e)
+        finally:
+            _local.job = None
+            if cleanup is not None:
+                try:
+                    cleanup()
+                except Exception:
+                    pass
+            self._evict()
+            if self.store is not None:
+                try:
+                    self.store.prune()
+                except Exception:
+                    pass
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                try:
+                    store = JobStore()
+                except Exception:
+                    store = None  # 任务记录只留在本进程内存
+                _runner = ImportJobRunner(store=store)
+    return _runner
+
+
+def submit_import_job(store_id, kind, fn, files=(), cleanup=None):
+    return get_runner().submit(store_id, kind, fn, files=files, cleanup=cleanup)
+
+
+def get_import_job(job_id):
+    """任务状态 dict（见 ImportJob.to_dict）；不存在返回 None。优先本进程内存，其次共享的 SQLite 记录。"""
+    return get_runner().get(job_id)
+
+
+@contextmanager
+def store_import_lock(conn, store_id, timeout=None):
+    """跨进程门店导入锁（MySQL GET_LOCK，连接级）：持有期间其他 worker 的同门店导入等待；超时抛 RuntimeError。"""
+    name = f"htma_import:{store_id}"[:64]
+    cur = conn.cursor()
+    cur.execute("SELECT GET_LOCK(%s, %s) AS got", (name, IMPORT_LOCK_TIMEOUT if timeout is None else timeout))
+    row = cur.fetchone()
+    got = row.get("got") if isinstance(row, dict) else (row[0] if row else None)
+    if got != 1:
+        raise RuntimeError(f"门店 {store_id} 已有导入任务在进行，请稍后重试")
+    try:
+        yield
+    finally:
+        try:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+        except Exception:
+            # 释放失败时锁仍挂在该会话上：断开连接由 MySQL 随会话释放，不能带着锁回到连接池
+            try:
+                if hasattr(conn, "discard"):
+                    conn.discard()
+                else:
+                    conn.close()
+            except Exception:
+                pass
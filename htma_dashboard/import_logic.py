@@ -1,15 +1,64 @@
 # -*- coding: utf-8 -*-
 """Excel 导入逻辑：完整导入所有合规数据到 MySQL"""
+import functools
+import inspect
 import os
 import re
 from datetime import datetime
+from itertools import chain, islice
 
+import numpy as np
 import pandas as pd
 import pymysql
 
+try:
+    from bulk_load import BulkLoadUnavailable, bulk_upsert, use_bulk_load
+    from column_profiles import header_fingerprint, learn_profile, match_profile
+    from data_version import bump_data_version
+    from excel_stream import read_excel_stream
+    from import_jobs import stage as job_stage
+    from import_manifest import forget_days
+    from sale_rollup import refresh_sale_rollup
+    from sku_dim import fill_sku_dim, refresh_sku_dim
+    from stock_latest import ensure_stock_latest_table, invalidate_stock_latest, refresh_stock_latest, stock_source
+except ImportError:  # 脚本以 htma_dashboard.import_logic 形式导入
+    from htma_dashboard.bulk_load import BulkLoadUnavailable, bulk_upsert, use_bulk_load
+    from htma_dashboard.column_profiles import header_fingerprint, learn_profile, match_profile
+    from htma_dashboard.data_version import bump_data_version
+    from htma_dashboard.excel_stream import read_excel_stream
+    from htma_dashboard.import_jobs import stage as job_stage
+    from htma_dashboard.import_manifest import forget_days
+    from htma_dashboard.sale_rollup import refresh_sale_rollup
+    from htma_dashboard.sku_dim import fill_sku_dim, refresh_sku_dim
+    from htma_dashboard.stock_latest import ensure_stock_latest_table, invalidate_stock_latest, refresh_stock_latest, stock_source
+
 STORE_ID = "沈阳超级仓"
 
 
+def _bumps_data_version(fn):
+    """
+    导入/刷新函数成功返回后门店数据版本号 +1，看板接口缓存随之失效。
+    抛异常时（可能已分批提交了一部分）改用单独连接 bump：导入连接上未提交的行须留给调用方回滚，不能被顺带提交。
+    """
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = sig.bind_partial(*args, **kwargs).arguments
+        conn = bound.get("conn")
+        store_id = bound.get("store_id") or STORE_ID
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            if conn is not None:
+                bump_data_version(None, store_id)
+            raise
+        if conn is not None:
+            bump_data_version(conn, store_id)
+        return result
+    return wrapper
+
+
 def _safe_decimal(v, default=0):
     """数值解析，支持千分位逗号（如 18,000.00）。"""
     if v is None or (isinstance(v, float) and pd.isna(v)):
@@ -17,9 +66,10 @@ def _safe_decimal(v, default=0):
     try:
         if isinstance(v, str):
             v = v.replace(",", "").strip()
-        return float(v)
+        f = float(v)
     except (TypeError, ValueError):
         return default
+    return default if pd.isna(f) else f  # 文本 "nan" 等不写入 NaN
 
 
 def _safe_str(v, max_len=128):
@@ -201,6 +251,26 @@ def _detect_header_row(df, keywords=("货号", "商品", "编码", "品号", "
     return 1
 
 
+def _profiled_cols(kind, df, start_row, detect, swap_amount_cost=False):
+    """
+    列映射先按表头指纹查档案（column_profiles），命中则不再检测；未命中执行 detect()。
+    返回 (cols, 档案或 None, 指纹, 表头单元格)；解析出数据后由调用方 learn_profile 记住检测结果。
+    swap_amount_cost（上传时勾选「金额/进价列对调」）只对本次导入对调金额/成本列，返回临时档案，不学习为档案；
+    需长期生效时用 column_profiles.pin_profile 固定。
+    """
+    h = start_row - 1
+    cells = _header_row_forward_fill(df.iloc[h]) if 0 <= h < df.shape[0] else []
+    fp = header_fingerprint(kind, cells, df.shape[1])
+    profile = match_profile(kind, fp)
+    cols = dict(profile["cols"]) if profile else detect()
+    if swap_amount_cost:
+        a, c = ("total_sale", "cost") if kind == "profit" else ("amount", "cost")
+        if cols.get(a) is not None and cols.get(c) is not None:
+            cols[a], cols[c] = cols[c], cols[a]
+        profile = {"name": "swap_amount_cost", "cols": cols, "pinned": False}
+    return cols, profile, fp, cells
+
+
 def _find_col_by_header(df, header_row_idx, keywords):
     """在 header 行中查找包含任一 keyword 的列索引，返回第一个匹配的列"""
     if header_row_idx >= df.shape[0]:
@@ -408,16 +478,40 @@ def _read_excel_safe(path):
     raise last_err or RuntimeError("无法读取 Excel（.xls 需安装 xlrd: pip install xlrd>=2.0.1）")
 
 
-def preview_sale_excel(excel_path, is_summary=False):
-    """预览销售 Excel 结构，用于调试。返回检测到的列、首行数据、可能的问题"""
+def _read_excel_rows(excel_path, keywords):
+    """
+    流式读取大表（销售日报/汇总、库存）：返回 (df, rest)。df 为去掉前导无用行后的前若干行，供表头/列检测；
+    rest 为其余行的生成器，数据行用 chain(df.iloc[start_row:].itertuples(...), rest) 逐行处理，不整本读入内存。
+    """
+    job_stage("read")
+    head, rest = read_excel_stream(excel_path)
+    return _trim_leading_junk_rows(head, keywords), rest
+
+
+def preview_sale_excel(excel_path, is_summary=False, parse=False):
+    """预览销售 Excel 结构，用于调试。返回检测到的列、首行数据、可能的问题。
+    parse=True 时读取其余行的同时完成整表解析，结果放在返回值 parsed 中（同 parse_sale_file，供 parsed_cache 缓存后直接导入）。"""
     try:
-        df = _read_excel_safe(excel_path)
-        raw_rows, raw_cols = df.shape[0], df.shape[1]
-        df_trimmed = _trim_leading_junk_rows(df, ("货号", "销售金额", "商品编码", "销售日期", "销售数量", "品号", "商品号", "商品名称", "订单日期", "销售汇总"))
+        head, rest_rows = read_excel_stream(excel_path)
+        # 只取前若干行做检测；剩余行仅计数，不驻留内存
+        df_trimmed = _trim_leading_junk_rows(head, _SALE_HEADER_KEYWORDS)
+        counter = [0]
+
+        def _counted(rows):
+            for row in rows:
+                counter[0] += 1
+                yield row
+
+        parsed = _parse_sale_frame(df_trimmed, _counted(rest_rows), is_summary) if parse else None
+        rest_count = counter[0] if parse else sum(1 for _ in rest_rows)
+        raw_rows, raw_cols = head.shape[0] + rest_count, head.shape[1]
         if df_trimmed.shape[0] == 0:
             return {"ok": False, "error": "trim后无数据", "raw_rows": raw_rows, "raw_cols": raw_cols}
         start_row = _detect_header_row(df_trimmed)
-        cols = _detect_sale_cols(df_trimmed, start_row, df_trimmed.shape[1], is_summary=is_summary)
+        cols, profile, fp, _ = _profiled_cols(
+            "sale_summary" if is_summary else "sale_daily", df_trimmed, start_row,
+            lambda: _detect_sale_cols(df_trimmed, start_row, df_trimmed.shape[1], is_summary=is_summary),
+        )
         data_rows = df_trimmed.iloc[start_row:]
         sample = []
         for i, (_, row) in enumerate(data_rows.head(3).iterrows()):
@@ -438,11 +532,14 @@ def preview_sale_excel(excel_path, is_summary=False):
         return {
             "ok": True,
             "raw_rows": raw_rows, "raw_cols": raw_cols,
-            "trimmed_rows": len(df_trimmed), "header_row": start_row - 1, "data_rows": len(data_rows),
+            "trimmed_rows": len(df_trimmed) + rest_count, "header_row": start_row - 1, "data_rows": len(data_rows) + rest_count,
             "cols": cols,
+            "fingerprint": fp,
+            "profile": {"name": profile["name"], "pinned": bool(profile.get("pinned"))} if profile else None,
             "sample": sample,
             "issues": issues,
             "return_gift_cols_detected": return_cols_ok,
+            **({"parsed": parsed} if parse else {}),
         }
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -475,129 +572,121 @@ STOCK_NEW_COLS = {
 }
 
 
-def import_sale_daily(excel_path, conn, overwrite_on_duplicate=True):
-    """销售日报表：支持表头检测。仅写入 t_htma_sale（增量/覆盖），不触碰库存/人力/品类/商品档案。默认同(日期,货号)覆盖不累加，避免重复导入同一日报导致翻倍。"""
-    ensure_sale_table_columns(conn)
-    df = _read_excel_safe(excel_path)
-    df = _trim_leading_junk_rows(df, ("货号", "销售金额", "商品编码", "销售日期", "销售数量", "品号", "商品号", "商品名称", "订单日期", "销售汇总"))
+@_bumps_data_version
+def import_sale_daily(excel_path, conn, overwrite_on_duplicate=True, resolve_dims=None, swap_amount_cost=False):
+    """销售日报表：支持表头检测。仅写入 t_htma_sale（增量/覆盖），不触碰库存/人力/品类/商品档案。默认同(日期,货号)覆盖不累加，避免重复导入同一日报导致翻倍。
+    返回 (导入条数, 诊断, {(store_id, data_date)})，第三项传给 refresh_profit 做增量重算。
+    resolve_dims 缺省取 HTMA_SALE_RESOLVE_DIMS：写入前按商品档案补齐维度，回填只规范化本次写入的行。
+    swap_amount_cost：本次导入对调销售金额/成本列（见 _profiled_cols）。"""
+    parsed = parse_sale_file(excel_path, is_summary=False, swap_amount_cost=swap_amount_cost)
+    return write_parsed_sale(conn, parsed, overwrite_on_duplicate, resolve_dims)[:3]
+
+
+_SALE_HEADER_KEYWORDS = ("货号", "销售金额", "商品编码", "销售日期", "销售数量", "品号", "商品号", "商品名称", "订单日期", "销售汇总")
+
+
+def parse_sale_file(excel_path, is_summary=False, swap_amount_cost=False):
+    """
+    读取并解析销售日报/汇总（不访问数据库，可在子进程中执行，见 parallel_import）。
+    返回 dict：is_summary、diag（无法解析的原因，此时无数据）或 all_cols / vals_list / keys / stats（同 _parse_sale_rows）。
+    """
+    df, rest_rows = _read_excel_rows(excel_path, _SALE_HEADER_KEYWORDS)
+    return _parse_sale_frame(df, rest_rows, is_summary, swap_amount_cost)
+
+
+def _parse_sale_frame(df, rest_rows, is_summary, swap_amount_cost=False):
+    """parse_sale_file 的解析部分：df 为去掉前导无用行的前若干行，rest_rows 为其余行的迭代器（预览时与 parse_sale_file 共用）。"""
     if df.shape[0] <= 1:
-        return 0, "行数不足"
+        return {"is_summary": is_summary, "diag": "行数不足"}
+    job_stage("detect")
     ncol = df.shape[1]
     start_row = _detect_header_row(df)
-    cols = _detect_sale_cols(df, start_row, ncol, is_summary=False)
-    # 销售日报至少需要: 货号, 日期, 销售金额, 参考金额
+    kind = "sale_summary" if is_summary else "sale_daily"
+    cols, profile, fp, cells = _profiled_cols(
+        kind, df, start_row, lambda: _detect_sale_cols(df, start_row, ncol, is_summary=is_summary), swap_amount_cost,
+    )
+    # 至少需要: 货号, 日期, 销售金额, 参考金额
     if cols.get("amount") is not None and ncol <= cols["amount"]:
-        return 0, f"列数不足(需>={cols['amount']+1}, 实际{ncol})"
+        return {"is_summary": is_summary, "diag": f"列数不足(需>={cols['amount']+1}, 实际{ncol})"}
     if cols.get("cost") is not None and ncol <= cols["cost"]:
-        return 0, f"列数不足(需>={cols['cost']+1}, 实际{ncol})"
+        return {"is_summary": is_summary, "diag": f"列数不足(需>={cols['cost']+1}, 实际{ncol})"}
+    job_stage("parse")
     data_rows = df.iloc[start_row:]
-    cur = conn.cursor()
-    inserted = 0
-    skipped_no_sku = 0
-    skipped_no_date = 0
-    skipped_summary = 0
-    skipped_err = 0
-    first_err = None
-    col_list = None
-    buf = []
-    qty_idx = cols.get("qty", 28)
+    # 按 (日期, 货号) 去重合并后再写入，避免重复数据上传（默认列式解析，见 _parse_sale_rows）
+    rows = chain(data_rows.itertuples(index=False, name=None), rest_rows)
+    if is_summary:
+        all_cols, vals_list, keys, stats = _parse_sale_rows(rows, cols, SALE_SUMMARY_FULL, "sale_summary", is_summary=True)
+    else:
+        all_cols, vals_list, keys, stats = _parse_sale_rows(rows, cols, SALE_DAILY_FULL, "sale_daily", is_summary=False)
+    if profile is None and keys:
+        learn_profile(kind, fp, cells, cols)
+    return {
+        "is_summary": is_summary, "all_cols": all_cols, "vals_list": vals_list, "keys": keys, "stats": stats,
+        "profile": profile["name"] if profile else None,
+    }
 
-    def flush_sale_batch():
-        nonlocal inserted, skipped_err, first_err, col_list
-        if not buf:
-            return
-        try:
-            _batch_insert_sale(cur, col_list, buf, overwrite_on_duplicate)
-            inserted += len(buf)
-        except Exception as e:
-            col_str = ", ".join(col_list)
-            one_ph = ", ".join(["%s"] * len(col_list))
-            if overwrite_on_duplicate:
-                update_parts = ["sale_qty=VALUES(sale_qty)", "sale_amount=VALUES(sale_amount)", "sale_cost=VALUES(sale_cost)", "gross_profit=VALUES(gross_profit)"]
-            else:
-                update_parts = ["sale_qty=sale_qty+VALUES(sale_qty)", "sale_amount=sale_amount+VALUES(sale_amount)", "sale_cost=sale_cost+VALUES(sale_cost)", "gross_profit=gross_profit+VALUES(gross_profit)"]
-            for c in col_list:
-                if c not in ("data_date", "sku_code", "store_id", "sale_qty", "sale_amount", "sale_cost", "gross_profit", "source_sheet"):
-                    update_parts.append(f"{c}=VALUES({c})")
-            update_parts.append("source_sheet=VALUES(source_sheet)")
-            update_str = ", ".join(update_parts)
-            sql_one = f"INSERT INTO t_htma_sale ({col_str}) VALUES ({one_ph}) ON DUPLICATE KEY UPDATE {update_str}"
-            for v in buf:
-                try:
-                    cur.execute(sql_one, tuple(v))
-                    inserted += 1
-                except Exception as e2:
-                    skipped_err += 1
-                    if first_err is None:
-                        first_err = str(e2)
-        buf.clear()
 
-    # 按 (日期, 货号) 去重合并后再写入，避免重复数据上传（用 itertuples 替代 iterrows 提升遍历效率）
-    agg_sale = {}  # (dt, sku) -> (qty_sum, amount_sum, cost_sum, gross_sum, row)
-    for row in data_rows.itertuples(index=False, name=None):
-        row = tuple(row)
-        if _is_sale_summary_row(row, cols):
-            skipped_summary += 1
-            continue
-        dt = _parse_date(_row_val(row, cols["date"]))
-        sku_raw = _row_val(row, cols["sku"])
-        sku = (str(sku_raw or "").strip())[:64]
-        # 无货号或货号为表头/合计等：一律视为「无商品、仅合计」行，不导入，避免重复计算
-        if not sku or sku in SALE_SUMMARY_ROW_KEYWORDS or _is_summary_like(sku):
-            skipped_no_sku += 1
-            continue
-        if not dt:
-            skipped_no_date += 1
-            continue
-        sale_amount = _row_val(row, cols["amount"], as_decimal=True)
-        cost = _row_val(row, cols["cost"], as_decimal=True)
-        gross = sale_amount - cost
-        if sale_amount == 0 and cost > 0:
-            gross = 0
-        qty = _row_val(row, qty_idx, as_decimal=True) or 0
-        key = (dt, sku)
-        if key not in agg_sale:
-            agg_sale[key] = [0, 0, 0, 0, row]
-        agg_sale[key][0] += qty
-        agg_sale[key][1] += sale_amount
-        agg_sale[key][2] += cost
-        agg_sale[key][3] += gross
+@_bumps_data_version
+def import_parsed_sale(parsed, conn, overwrite_on_duplicate=True, resolve_dims=None):
+    """写入已解析的销售日报/汇总（如 parsed_cache 中预览时缓存的结果），返回值同 import_sale_daily。"""
+    return write_parsed_sale(conn, parsed, overwrite_on_duplicate, resolve_dims)[:3]
 
-    for (dt, sku), (qty_sum, amount_sum, cost_sum, gross_sum, row) in agg_sale.items():
-        try:
-            all_cols, all_vals = _build_sale_row_vals(row, dt, sku, amount_sum, cost_sum, gross_sum, cols, SALE_DAILY_FULL, source_sheet="sale_daily", qty_override=qty_sum)
-            if col_list is None:
-                col_list = all_cols
-            buf.append(all_vals)
-            if len(buf) >= _IMPORT_BATCH_SIZE:
-                flush_sale_batch()
-        except Exception as e:
-            skipped_err += 1
-            if first_err is None:
-                first_err = str(e)
-    flush_sale_batch()
+
+def write_parsed_sale(conn, parsed, overwrite_on_duplicate=True, resolve_dims=None, refresh_rollup=True):
+    """
+    写入 parse_sale_file 的结果：按商品档案补齐维度 → 批量写入 → 按写入键回填 →（refresh_rollup 时）刷新销售日汇总与 SKU 维表。
+    返回 (导入条数, 诊断, partitions, 写库失败行数)，前三项同 import_sale_daily；写库失败的行重新导入可能成功，
+    调用方据此决定是否记为已导入（parallel_import）。refresh_rollup=False 时由调用方按 partitions 统一刷新日汇总与 SKU 维表。
+    """
+    if "diag" in parsed:
+        return 0, parsed["diag"], set(), 0
+    ensure_sale_table_columns(conn)
+    if resolve_dims is None:
+        resolve_dims = SALE_RESOLVE_DIMS_IN_PYTHON
+    all_cols, vals_list, keys, stats = parsed["all_cols"], parsed["vals_list"], parsed["keys"], parsed["stats"]
+    if resolve_dims:
+        master_dims = load_product_master_dims(conn, STORE_ID, {sku for _, sku in keys})
+        for (_, sku), all_vals in zip(keys, vals_list):
+            resolve_sale_dims(all_cols, all_vals, master_dims.get(sku))
+    forget_days(conn, "t_htma_sale", {dt for dt, _ in keys}, STORE_ID)  # 这些日期将被重写，导入清单的日校验和作废
+    job_stage("insert")
+    inserted, write_failed, first_err = _write_sale_rows(conn, all_cols, vals_list, overwrite_on_duplicate)
+    skipped_err = write_failed + stats["err"]
+    first_err = stats["first_err"] or first_err
     conn.commit()
-    backfill_sale_category_and_supplier(conn, STORE_ID)
+    job_stage("backfill")
+    touched = backfill_sale_category_and_supplier(conn, STORE_ID, keys=set(keys), resolved=resolve_dims)
+    written_dates = {dt for dt, _ in keys} | touched
+    rollup_err = _refresh_sale_rollup_safe(conn, written_dates) if refresh_rollup else None
+    dim_err = _refresh_sku_dim_safe(conn, written_dates) if refresh_rollup else None
     diag = None
-    if inserted == 0 or skipped_summary > 0:
-        parts = [f"总行{len(data_rows)}", f"去重后{len(agg_sale)}条", f"导入{inserted}条"]
-        if skipped_summary:
-            parts.append(f"跳过汇总行{skipped_summary}条")
-        if skipped_no_sku:
-            parts.append(f"无货号{skipped_no_sku}")
-        if skipped_no_date:
-            parts.append(f"无日期{skipped_no_date}")
+    # 日报仅在异常时给出诊断；汇总始终给出
+    if parsed["is_summary"] or inserted == 0 or stats["summary"] > 0 or skipped_err or rollup_err or dim_err:
+        parts = [f"总行{stats['total']}", f"去重后{len(keys)}条", f"导入{inserted}条"]
+        if stats["summary"]:
+            parts.append(f"跳过汇总行{stats['summary']}条")
+        if stats["no_sku"]:
+            parts.append(f"无货号{stats['no_sku']}")
+        if stats["no_date"]:
+            parts.append(f"无日期{stats['no_date']}")
         if skipped_err:
             parts.append(f"导入失败{skipped_err}行")
         if first_err:
             parts.append(f"异常:{first_err[:100]}")
-        diag = "销售日报: " + ", ".join(parts)
-    return inserted, diag
+        if rollup_err:
+            parts.append(rollup_err)
+        if dim_err:
+            parts.append(dim_err)
+        diag = ", ".join(parts) if parsed["is_summary"] else "销售日报: " + ", ".join(parts)
+    return inserted, diag, sale_partitions(STORE_ID, written_dates), write_failed
 
 
 # 批量写入每批行数，减少数据库往返，避免长时间导入超时（如 Cloudflare 524）；适当增大可提升导入速度
 _IMPORT_BATCH_SIZE = 2500
 
+# 导入时在内存中按商品档案补齐品牌/供应商与大中小类（resolve_sale_dims），写入后无需整店 UPDATE 回填；0 关闭则写入后按写入键回填
+SALE_RESOLVE_DIMS_IN_PYTHON = os.environ.get("HTMA_SALE_RESOLVE_DIMS", "1").strip().lower() not in ("0", "false", "no", "off")
+
 
 def _build_sale_row_vals(row, dt, sku, sale_amount, cost, gross, cols, full_map, source_sheet="sale_daily", qty_override=None):
     """构建单行销售数据 (all_cols, all_vals)。所有 full_map 列均参与写入，缺列或空值用 0/NULL 保证数据完整。"""
@@ -620,6 +709,285 @@ def _build_sale_row_vals(row, dt, sku, sale_amount, cost, gross, cols, full_map,
     return all_cols, all_vals
 
 
+# 销售导入解析/去重走列式路径（按块向量化转换与过滤、groupby 去重、按列数组生成参数）；0 关闭则整体逐行处理
+SALE_IMPORT_VECTORIZED = os.environ.get("HTMA_SALE_VECTORIZED", "1").strip().lower() not in ("0", "false", "no", "off")
+# 列式路径每块行数：块内向量化，块间只合并去重后的结果，内存随块大小而非文件大小增长
+_SALE_PARSE_CHUNK_ROWS = 50000
+_SALE_MEASURES = ["_qty", "_amount", "_cost", "_gross"]
+_SUMMARY_RE = re.compile("|".join(re.escape(k) for k in SUMMARY_SUBSTRINGS))
+
+
+def _sale_row_measures(row, cols, qty_idx, is_summary):
+    """单行 (数量, 销售额, 成本, 毛利)：汇总表有进销差价列时以其为毛利并反推成本；销售额为 0 而成本为正时毛利记 0。"""
+    sale_amount = _row_val(row, cols["amount"], as_decimal=True)
+    cost = _row_val(row, cols["cost"], as_decimal=True)
+    if is_summary and cols.get("margin") is not None:
+        gross = _row_val(row, cols["margin"], as_decimal=True)
+        cost = sale_amount - gross if sale_amount and gross is not None else cost
+    else:
+        gross = sale_amount - cost
+    if sale_amount == 0 and cost > 0:
+        gross = 0
+    qty = _row_val(row, qty_idx, as_decimal=True) or 0
+    return qty, sale_amount, cost, gross
+
+
+def _aggregate_sale_rows(rows, cols, is_summary, stats):
+    """逐行过滤汇总/无货号/无日期行，按 (日期, 货号) 合并：{(dt, sku): [qty, amount, cost, gross, 首行]}。"""
+    qty_idx = cols.get("qty", 30 if is_summary else 28)
+    agg_sale = {}
+    for row in rows:
+        stats["total"] += 1
+        row = tuple(row)
+        if _is_sale_summary_row(row, cols):
+            stats["summary"] += 1
+            continue
+        dt = _parse_date(_row_val(row, cols["date"]))
+        sku_raw = _row_val(row, cols["sku"])
+        sku = (str(sku_raw or "").strip())[:64]
+        # 无货号或货号为表头/合计等：一律视为「无商品、仅合计」行，不导入，避免重复计算
+        if not sku or sku in SALE_SUMMARY_ROW_KEYWORDS or _is_summary_like(sku):
+            stats["no_sku"] += 1
+            continue
+        if not dt:
+            stats["no_date"] += 1
+            continue
+        qty, sale_amount, cost, gross = _sale_row_measures(row, cols, qty_idx, is_summary)
+        key = (dt, sku)
+        if key not in agg_sale:
+            agg_sale[key] = [0, 0, 0, 0, row]
+        agg_sale[key][0] += qty
+        agg_sale[key][1] += sale_amount
+        agg_sale[key][2] += cost
+        agg_sale[key][3] += gross
+    return agg_sale
+
+
+def _text_codes(s, max_len=128):
+    """
+    整列版 _row_val（文本口径），按唯一值转换：返回 (codes, conv)，conv[codes] 即整列结果（空值 codes=-1 落在末位 None）。
+    字符串去空白/截断、整数转字符串均向量化，其余类型（浮点、日期等）逐个走 _row_val。
+    """
+    codes, uniques = pd.factorize(s.to_numpy(dtype=object))
+    conv = np.empty(len(uniques) + 1, dtype=object)
+    kind = pd.api.types.infer_dtype(uniques, skipna=False)
+    if kind == "string":
+        is_str, is_int = np.ones(len(uniques), dtype=bool), np.zeros(len(uniques), dtype=bool)
+    elif kind == "integer":
+        is_str, is_int = np.zeros(len(uniques), dtype=bool), np.ones(len(uniques), dtype=bool)
+    else:
+        types = [type(u) for u in uniques]
+        is_str = np.fromiter((t is str for t in types), dtype=bool, count=len(types))
+        is_int = np.fromiter((t is int for t in types), dtype=bool, count=len(types))
+    if is_str.any():
+        stripped = (u.strip() for u in uniques[is_str])
+        conv[:-1][is_str] = [t[:max_len] if t and t.lower() != "nan" else None for t in stripped]
+    rest = np.flatnonzero(~is_str)
+    if is_int.any():
+        idx = np.flatnonzero(is_int)
+        try:
+            ints = uniques[idx].astype(np.int64)
+            exact = np.abs(ints) < 2 ** 53  # 与 _row_val 的 str(int(float(v))) 一致的范围
+            conv[idx[exact]] = ints[exact].astype(str).astype(object)
+            rest = np.setdiff1d(rest, idx[exact])
+        except OverflowError:
+            pass
+    for i in rest:
+        conv[i] = _row_val((uniques[i],), 0)
+    return codes, conv
+
+
+def _col_text(s, max_len=128):
+    codes, conv = _text_codes(s, max_len)
+    return conv[codes]
+
+
+def _col_num(s):
+    """整列版 _safe_decimal（缺省 0）：数字、数字串与千分位串向量化转换，仍失败的值逐个回退。"""
+    num = pd.to_numeric(s, errors="coerce").astype(float)
+    retry = num.isna() & s.notna()
+    if retry.any():
+        raw = s[retry]
+        fixed = pd.to_numeric(raw.astype(str).str.replace(",", "", regex=False).str.strip(), errors="coerce").astype(float)
+        bad = fixed.isna()
+        if bad.any():
+            fixed[bad] = [_safe_decimal(v, 0) for v in raw[bad]]
+        num[retry] = fixed
+    return num.fillna(0.0)
+
+
+def _col_parse_date(s):
+    """整列版 _parse_date(_row_val(v))：日期列取值很少，按唯一值解析后回填。"""
+    codes, uniques = pd.factorize(s.to_numpy(dtype=object))
+    conv = np.empty(len(uniques) + 1, dtype=object)
+    for i, u in enumerate(uniques):
+        conv[i] = _parse_date(_row_val((u,), 0))
+    return conv[codes]
+
+
+def _dedup_sale_frame(frame):
+    """按 (_dt, _sku) 合并：度量列按出现顺序累加（与逐行累加同序），其余列保留首次出现的行，顺序同首次出现。"""
+    dt_codes, _ = pd.factorize(frame["_dt"])
+    sku_codes, skus = pd.factorize(frame["_sku"])
+    codes, _ = pd.factorize(dt_codes.astype(np.int64) * len(skus) + sku_codes)
+    _, first_idx = np.unique(codes, return_index=True)
+    first = frame.iloc[first_idx].reset_index(drop=True)
+    for m in _SALE_MEASURES:
+        first[m] = np.bincount(codes, weights=frame[m].to_numpy(dtype=float), minlength=len(first_idx))
+    return first
+
+
+def _sale_chunk_frame(chunk, cols, is_summary, stats):
+    """列式处理一块行：向量化转换、汇总行/无货号/无日期过滤与块内去重，返回 原始列 + _dt/_sku/度量列 的 DataFrame。"""
+    df = pd.DataFrame(chunk, dtype=object)
+    n = len(df)
+    empty = pd.Series([None] * n, dtype=object)
+
+    def col(idx):
+        return df[idx] if idx is not None and 0 <= idx < df.shape[1] else empty
+
+    def text(idx, max_len):
+        """(逐行截断文本, 逐行是否含汇总关键词/等于汇总关键字)；字符串运算只在唯一值上做。"""
+        codes, conv = _text_codes(col(idx))
+        u = np.array([(t or "")[:max_len] for t in conv], dtype=object)
+        flag = np.fromiter((t in SALE_SUMMARY_ROW_KEYWORDS or _SUMMARY_RE.search(t) is not None for t in u), dtype=bool, count=len(u))
+        return u[codes], flag[codes]
+
+    sku, sku_flag = text(cols["sku"], 64)
+    _, cat_flag = text(cols.get("category", 9), 64)
+    _, pn_flag = text(cols.get("product_name", 3), 128)
+    # 同 _is_sale_summary_row：货号/品类等于汇总关键字，或货号/品类/品名包含汇总词（品名的「等于」必然也「包含」）
+    summary = sku_flag | cat_flag | pn_flag
+    no_sku = ~summary & (sku == "")
+    dt = _col_parse_date(col(cols["date"]))
+    no_date = ~summary & ~no_sku & pd.isna(dt)
+    keep = ~summary & ~no_sku & ~no_date
+
+    out = df[keep].reset_index(drop=True)
+    amount = _col_num(col(cols["amount"])[keep]).to_numpy()
+    cost = _col_num(col(cols["cost"])[keep]).to_numpy()
+    if is_summary and cols.get("margin") is not None:
+        gross = _col_num(col(cols["margin"])[keep]).to_numpy()
+        cost = np.where(amount != 0, amount - gross, cost)
+    else:
+        gross = amount - cost
+    gross = np.where((amount == 0) & (cost > 0), 0.0, gross)
+    out["_dt"] = dt[keep]
+    out["_sku"] = sku[keep]
+    out["_qty"] = _col_num(col(cols.get("qty", 30 if is_summary else 28))[keep]).to_numpy()
+    out["_amount"] = amount
+    out["_cost"] = cost
+    out["_gross"] = gross
+    out = _dedup_sale_frame(out)
+    stats["total"] += n
+    stats["summary"] += int(summary.sum())
+    stats["no_sku"] += int(no_sku.sum())
+    stats["no_date"] += int(no_date.sum())
+    return out
+
+
+def _agg_to_frame(agg_sale):
+    """逐行合并结果转为与 _sale_chunk_frame 相同结构的 DataFrame（列式路径某块出错时回退用）。"""
+    keys = list(agg_sale)
+    out = pd.DataFrame([agg_sale[k][4] for k in keys], dtype=object)
+    out["_dt"] = [k[0] for k in keys]
+    out["_sku"] = [k[1] for k in keys]
+    for i, m in enumerate(_SALE_MEASURES):
+        out[m] = [float(agg_sale[k][i]) for k in keys]
+    return out
+
+
+def _sale_vals_from_frame(frame, cols, full_map, source_sheet):
+    """按列数组生成写入参数，结果与逐行 _build_sale_row_vals 一致：返回 (all_cols, vals_list)。"""
+    n = len(frame)
+    extra_cols, arrays = [], []
+    for excel_col, db_col, as_dec in full_map:
+        if db_col in ("data_date", "sku_code", "sale_amount", "sale_qty"):
+            continue
+        idx = cols.get(db_col, excel_col if isinstance(excel_col, int) and excel_col >= 0 else -1)
+        if idx is None or idx < 0 or idx not in frame.columns:
+            arr = 0 if as_dec else None
+        elif as_dec:
+            arr = _col_num(frame[idx]).to_numpy()
+        else:
+            arr = _col_text(frame[idx])
+        extra_cols.append(db_col)
+        arrays.append(arr)
+    all_cols = ["data_date", "sku_code", "store_id"] + extra_cols + ["sale_qty", "sale_amount", "sale_cost", "gross_profit", "source_sheet"]
+    columns = [frame["_dt"].to_numpy(), frame["_sku"].to_numpy(), STORE_ID] + arrays
+    columns += [frame[m].to_numpy() for m in _SALE_MEASURES] + [source_sheet]
+    out = np.empty((n, len(columns)), dtype=object)
+    for j, arr in enumerate(columns):
+        out[:, j] = arr
+    return all_cols, out.tolist()
+
+
+def _parse_sale_rows(rows, cols, full_map, source_sheet, is_summary=False):
+    """
+    解析销售明细行：过滤汇总/无货号/无日期行，按 (日期, 货号) 合并（度量求和，其余列取首行）。
+    返回 (all_cols, vals_list, keys, stats)，vals_list 与 keys 一一对应、按首次出现顺序；
+    stats 含 total/summary/no_sku/no_date/err/first_err。
+    SALE_IMPORT_VECTORIZED 时按 _SALE_PARSE_CHUNK_ROWS 分块列式处理，某块出错则该块回退逐行；关闭时整体逐行（原路径）。
+    """
+    stats = {"total": 0, "summary": 0, "no_sku": 0, "no_date": 0, "err": 0, "first_err": None}
+    if SALE_IMPORT_VECTORIZED:
+        parts = []
+        it = iter(rows)
+        while True:
+            chunk = list(islice(it, _SALE_PARSE_CHUNK_ROWS))
+            if not chunk:
+                break
+            try:
+                part = _sale_chunk_frame(chunk, cols, is_summary, stats)
+            except Exception:
+                part = _agg_to_frame(_aggregate_sale_rows(chunk, cols, is_summary, stats))
+            if len(part):
+                parts.append(part)
+        if not parts:
+            return None, [], [], stats
+        frame = _dedup_sale_frame(pd.concat(parts, ignore_index=True)) if len(parts) > 1 else parts[0]
+        keys = list(zip(frame["_dt"].tolist(), frame["_sku"].tolist()))
+        try:
+            all_cols, vals_list = _sale_vals_from_frame(frame, cols, full_map, source_sheet)
+            return all_cols, vals_list, keys, stats
+        except Exception:
+            raw_cols = [c for c in frame.columns if isinstance(c, int)]
+            agg_sale = {
+                key: [q, a, c, g, r]
+                for key, q, a, c, g, r in zip(keys, *(frame[m].tolist() for m in _SALE_MEASURES), frame[raw_cols].itertuples(index=False, name=None))
+            }
+    else:
+        agg_sale = _aggregate_sale_rows(rows, cols, is_summary, stats)
+    all_cols, vals_list, keys = None, [], []
+    for (dt, sku), (qty_sum, amount_sum, cost_sum, gross_sum, row) in agg_sale.items():
+        try:
+            all_cols, all_vals = _build_sale_row_vals(row, dt, sku, amount_sum, cost_sum, gross_sum, cols, full_map, source_sheet=source_sheet, qty_override=qty_sum)
+        except Exception as e:
+            stats["err"] += 1
+            if stats["first_err"] is None:
+                stats["first_err"] = str(e)
+            continue
+        vals_list.append(all_vals)
+        keys.append((dt, sku))
+    return all_cols, vals_list, keys, stats
+
+
+_SALE_UPSERT_FIXED_COLS = ("data_date", "sku_code", "store_id", "sale_qty", "sale_amount", "sale_cost", "gross_profit", "source_sheet")
+
+
+def _sale_upsert_clause(all_cols, overwrite_on_duplicate=False, target=""):
+    """t_htma_sale 的 ON DUPLICATE KEY UPDATE 子句；target（如 "t_htma_sale."）用于 INSERT … SELECT 时限定目标列。"""
+    t = target
+    measures = ("sale_qty", "sale_amount", "sale_cost", "gross_profit")
+    if overwrite_on_duplicate:
+        update_parts = [f"{t}{m}=VALUES({m})" for m in measures]
+    else:
+        update_parts = [f"{t}{m}={t}{m}+VALUES({m})" for m in measures]
+    update_parts += [f"{t}{c}=VALUES({c})" for c in all_cols if c not in _SALE_UPSERT_FIXED_COLS]
+    update_parts.append(f"{t}source_sheet=VALUES(source_sheet)")
+    return ", ".join(update_parts)
+
+
 def _batch_insert_sale(cur, all_cols, vals_list, overwrite_on_duplicate=False):
     """批量 INSERT 销售表。overwrite_on_duplicate=True 时同键覆盖不累加，避免日报+汇总同传时销售额翻倍。"""
     if not vals_list:
@@ -627,21 +995,7 @@ def _batch_insert_sale(cur, all_cols, vals_list, overwrite_on_duplicate=False):
     n = len(vals_list)
     placeholders = ", ".join(["(" + ", ".join(["%s"] * len(all_cols)) + ")" for _ in range(n)])
     col_str = ", ".join(all_cols)
-    if overwrite_on_duplicate:
-        update_parts = [
-            "sale_qty=VALUES(sale_qty)", "sale_amount=VALUES(sale_amount)",
-            "sale_cost=VALUES(sale_cost)", "gross_profit=VALUES(gross_profit)",
-        ]
-    else:
-        update_parts = [
-            "sale_qty=sale_qty+VALUES(sale_qty)", "sale_amount=sale_amount+VALUES(sale_amount)",
-            "sale_cost=sale_cost+VALUES(sale_cost)", "gross_profit=gross_profit+VALUES(gross_profit)",
-        ]
-    extra_cols = [c for c in all_cols if c not in ("data_date", "sku_code", "store_id", "sale_qty", "sale_amount", "sale_cost", "gross_profit", "source_sheet")]
-    for c in extra_cols:
-        update_parts.append(f"{c}=VALUES({c})")
-    update_parts.append("source_sheet=VALUES(source_sheet)")
-    update_str = ", ".join(update_parts)
+    update_str = _sale_upsert_clause(all_cols, overwrite_on_duplicate)
     flat = []
     for v in vals_list:
         flat.extend(v)
@@ -652,6 +1006,46 @@ def _batch_insert_sale(cur, all_cols, vals_list, overwrite_on_duplicate=False):
     """, flat)
 
 
+def _write_sale_rows(conn, all_cols, vals_list, overwrite_on_duplicate=True):
+    """
+    写入 t_htma_sale，返回 (写入条数, 失败行数, 首个错误)。不提交，由调用方 commit。
+    开启 HTMA_IMPORT_BULK_LOAD 且行数达到阈值时走 LOAD DATA 暂存表一次合并，坏行由暂存表告警报告；
+    否则（或批量装载不可用，见 BulkLoadUnavailable）按 _IMPORT_BATCH_SIZE 多行 INSERT，某批失败则该批逐行写入。
+    """
+    if not vals_list:
+        return 0, 0, None
+    if use_bulk_load(len(vals_list)):
+        try:
+            n, n_bad, report = bulk_upsert(conn, "t_htma_sale", all_cols, vals_list, _sale_upsert_clause(all_cols, overwrite_on_duplicate, "t_htma_sale."))
+            sku_pos = all_cols.index("sku_code")
+            first_err = f"货号{vals_list[report[0][0]][sku_pos]}: {report[0][1]}" if report else None
+            return n, n_bad, first_err
+        except BulkLoadUnavailable:
+            pass  # 服务端未开 local_infile 等：退回多行 INSERT；合并阶段的 SQL 错误照常抛出
+    cur = conn.cursor()
+    inserted = skipped_err = 0
+    first_err = None
+    sql_one = (
+        f"INSERT INTO t_htma_sale ({', '.join(all_cols)}) VALUES ({', '.join(['%s'] * len(all_cols))}) "
+        f"ON DUPLICATE KEY UPDATE {_sale_upsert_clause(all_cols, overwrite_on_duplicate)}"
+    )
+    for i in range(0, len(vals_list), _IMPORT_BATCH_SIZE):
+        batch = vals_list[i:i + _IMPORT_BATCH_SIZE]
+        try:
+            _batch_insert_sale(cur, all_cols, batch, overwrite_on_duplicate)
+            inserted += len(batch)
+        except Exception:
+            for v in batch:
+                try:
+                    cur.execute(sql_one, tuple(v))
+                    inserted += 1
+                except Exception as e:
+                    skipped_err += 1
+                    if first_err is None:
+                        first_err = str(e)
+    return inserted, skipped_err, first_err
+
+
 def _import_sale_full(row, dt, sku, sale_amount, cost, gross, cur, cols, full_map, source_sheet="sale_daily"):
     """完整导入：将 Excel 行按 full_map 映射写入 t_htma_sale 所有字段（单行，供 fallback 或小数据量使用）。"""
     all_cols, all_vals = _build_sale_row_vals(row, dt, sku, sale_amount, cost, gross, cols, full_map, source_sheet)
@@ -686,125 +1080,12 @@ def _import_sale_full(row, dt, sku, sale_amount, cost, gross, cur, cols, full_ma
             raise
 
 
-def import_sale_summary(excel_path, conn, overwrite_on_duplicate=True):
-    """销售汇总表：支持表头检测。仅写入 t_htma_sale。默认 overwrite_on_duplicate=True：同(日期,货号)覆盖不累加，避免与日报重复导入或单独导入时在已有数据上累加导致翻倍（如 3 月 7 日重复）。"""
-    ensure_sale_table_columns(conn)
-    df = _read_excel_safe(excel_path)
-    df = _trim_leading_junk_rows(df, ("货号", "销售金额", "商品编码", "销售日期", "销售数量", "品号", "商品号", "商品名称", "订单日期", "销售汇总"))
-    if df.shape[0] <= 1:
-        return 0, "行数不足"
-    ncol = df.shape[1]
-    start_row = _detect_header_row(df)
-    cols = _detect_sale_cols(df, start_row, ncol, is_summary=True)
-    if cols.get("amount") is not None and ncol <= cols["amount"]:
-        return 0, f"列数不足(需>={cols['amount']+1}, 实际{ncol})"
-    if cols.get("cost") is not None and ncol <= cols["cost"]:
-        return 0, f"列数不足(需>={cols['cost']+1}, 实际{ncol})"
-    data_rows = df.iloc[start_row:]
-    cur = conn.cursor()
-    inserted = 0
-    skipped_no_sku = 0
-    skipped_no_date = 0
-    skipped_summary = 0
-    skipped_err = 0
-    first_err = None
-    col_list = None
-    buf = []
-    qty_idx = cols.get("qty", 30)
-
-    def flush_sale_batch():
-        nonlocal inserted, skipped_err, first_err, col_list
-        if not buf:
-            return
-        try:
-            _batch_insert_sale(cur, col_list, buf, overwrite_on_duplicate)
-            inserted += len(buf)
-        except Exception as e:
-            col_str = ", ".join(col_list)
-            one_ph = ", ".join(["%s"] * len(col_list))
-            if overwrite_on_duplicate:
-                update_parts = ["sale_qty=VALUES(sale_qty)", "sale_amount=VALUES(sale_amount)", "sale_cost=VALUES(sale_cost)", "gross_profit=VALUES(gross_profit)"]
-            else:
-                update_parts = ["sale_qty=sale_qty+VALUES(sale_qty)", "sale_amount=sale_amount+VALUES(sale_amount)", "sale_cost=sale_cost+VALUES(sale_cost)", "gross_profit=gross_profit+VALUES(gross_profit)"]
-            for c in col_list:
-                if c not in ("data_date", "sku_code", "store_id", "sale_qty", "sale_amount", "sale_cost", "gross_profit", "source_sheet"):
-                    update_parts.append(f"{c}=VALUES({c})")
-            update_parts.append("source_sheet=VALUES(source_sheet)")
-            update_str = ", ".join(update_parts)
-            sql_one = f"INSERT INTO t_htma_sale ({col_str}) VALUES ({one_ph}) ON DUPLICATE KEY UPDATE {update_str}"
-            for v in buf:
-                try:
-                    cur.execute(sql_one, tuple(v))
-                    inserted += 1
-                except Exception as e2:
-                    skipped_err += 1
-                    if first_err is None:
-                        first_err = str(e2)
-        buf.clear()
-
-    # 按 (日期, 货号) 去重合并后再写入，避免重复数据上传（用 itertuples 替代 iterrows 提升遍历效率）
-    agg_sale = {}  # (dt, sku) -> (qty_sum, amount_sum, cost_sum, gross_sum, row)
-    for row in data_rows.itertuples(index=False, name=None):
-        row = tuple(row)
-        if _is_sale_summary_row(row, cols):
-            skipped_summary += 1
-            continue
-        dt = _parse_date(_row_val(row, cols["date"]))
-        sku_raw = _row_val(row, cols["sku"])
-        sku = (str(sku_raw or "").strip())[:64]
-        # 无货号或货号为表头/合计等：一律视为「无商品、仅合计」行，不导入，避免重复计算
-        if not sku or sku in SALE_SUMMARY_ROW_KEYWORDS or _is_summary_like(sku):
-            skipped_no_sku += 1
-            continue
-        if not dt:
-            skipped_no_date += 1
-            continue
-        sale_amount = _row_val(row, cols["amount"], as_decimal=True)
-        cost = _row_val(row, cols["cost"], as_decimal=True)
-        if cols.get("margin") is not None:
-            gross = _row_val(row, cols["margin"], as_decimal=True)
-            cost = sale_amount - gross if sale_amount and gross is not None else cost
-        else:
-            gross = sale_amount - cost
-        if sale_amount == 0 and cost > 0:
-            gross = 0
-        qty = _row_val(row, qty_idx, as_decimal=True) or 0
-        key = (dt, sku)
-        if key not in agg_sale:
-            agg_sale[key] = [0, 0, 0, 0, row]
-        agg_sale[key][0] += qty
-        agg_sale[key][1] += sale_amount
-        agg_sale[key][2] += cost
-        agg_sale[key][3] += gross
-
-    for (dt, sku), (qty_sum, amount_sum, cost_sum, gross_sum, row) in agg_sale.items():
-        try:
-            all_cols, all_vals = _build_sale_row_vals(row, dt, sku, amount_sum, cost_sum, gross_sum, cols, SALE_SUMMARY_FULL, source_sheet="sale_summary", qty_override=qty_sum)
-            if col_list is None:
-                col_list = all_cols
-            buf.append(all_vals)
-            if len(buf) >= _IMPORT_BATCH_SIZE:
-                flush_sale_batch()
-        except Exception as e:
-            skipped_err += 1
-            if first_err is None:
-                first_err = str(e)
-    flush_sale_batch()
-    conn.commit()
-    backfill_sale_category_and_supplier(conn, STORE_ID)
-    parts = [f"总行{len(data_rows)}", f"去重后{len(agg_sale)}条", f"导入{inserted}条"]
-    if skipped_summary:
-        parts.append(f"跳过汇总行{skipped_summary}条")
-    if skipped_no_sku:
-        parts.append(f"无货号{skipped_no_sku}")
-    if skipped_no_date:
-        parts.append(f"无日期{skipped_no_date}")
-    if skipped_err:
-        parts.append(f"导入失败{skipped_err}行")
-    if first_err:
-        parts.append(f"异常:{first_err[:100]}")
-    diag = ", ".join(parts)
-    return inserted, diag
+@_bumps_data_version
+def import_sale_summary(excel_path, conn, overwrite_on_duplicate=True, resolve_dims=None, swap_amount_cost=False):
+    """销售汇总表：支持表头检测。仅写入 t_htma_sale。默认 overwrite_on_duplicate=True：同(日期,货号)覆盖不累加，避免与日报重复导入或单独导入时在已有数据上累加导致翻倍（如 3 月 7 日重复）。
+    返回值、resolve_dims、swap_amount_cost 同 import_sale_daily。"""
+    parsed = parse_sale_file(excel_path, is_summary=True, swap_amount_cost=swap_amount_cost)
+    return write_parsed_sale(conn, parsed, overwrite_on_duplicate, resolve_dims)[:3]
 
 
 def _detect_stock_cols(df, start_row, ncol):
@@ -974,6 +1255,14 @@ def _build_stock_row_vals(row, data_date, qty, amount, cols, full_map):
     return all_cols, all_vals
 
 
+def _stock_upsert_clause(all_cols, target=""):
+    """t_htma_stock 的 ON DUPLICATE KEY UPDATE 子句（同 _sale_upsert_clause，target 用于 INSERT … SELECT）。"""
+    t = target
+    update_parts = [f"{t}stock_qty=VALUES(stock_qty)", f"{t}stock_amount=VALUES(stock_amount)"]
+    update_parts += [f"{t}{c}=VALUES({c})" for c in all_cols if c not in ("data_date", "sku_code", "store_id", "stock_qty", "stock_amount")]
+    return ", ".join(update_parts)
+
+
 def _batch_insert_stock(cur, all_cols, vals_list):
     """批量 INSERT 库存表。vals_list 每项为一行 all_vals。"""
     if not vals_list:
@@ -981,11 +1270,7 @@ def _batch_insert_stock(cur, all_cols, vals_list):
     n = len(vals_list)
     placeholders = ", ".join(["(" + ", ".join(["%s"] * len(all_cols)) + ")" for _ in range(n)])
     col_str = ", ".join(all_cols)
-    update_parts = ["stock_qty=VALUES(stock_qty)", "stock_amount=VALUES(stock_amount)"]
-    extra_cols = [c for c in all_cols if c not in ("data_date", "sku_code", "store_id", "stock_qty", "stock_amount")]
-    for c in extra_cols:
-        update_parts.append(f"{c}=VALUES({c})")
-    update_str = ", ".join(update_parts)
+    update_str = _stock_upsert_clause(all_cols)
     flat = []
     for v in vals_list:
         flat.extend(v)
@@ -996,6 +1281,35 @@ def _batch_insert_stock(cur, all_cols, vals_list):
     """, flat)
 
 
+def _write_stock_rows(conn, all_cols, vals_list, src_rows, data_date, cols, full_map):
+    """
+    写入 t_htma_stock，返回 (写入条数, 失败行数, 首个错误)。批量装载同 _write_sale_rows；
+    普通路径某批失败则该批按 src_rows（与 vals_list 一一对应的首行）逐行 _import_stock_full。
+    """
+    if not vals_list:
+        return 0, 0, None
+    if use_bulk_load(len(vals_list)):
+        try:
+            n, n_bad, report = bulk_upsert(conn, "t_htma_stock", all_cols, vals_list, _stock_upsert_clause(all_cols, "t_htma_stock."))
+            sku_pos = all_cols.index("sku_code")
+            first_err = f"货号{vals_list[report[0][0]][sku_pos]}: {report[0][1]}" if report else None
+            return n, n_bad, first_err
+        except BulkLoadUnavailable:
+            pass  # 服务端未开 local_infile 等：退回多行 INSERT；合并阶段的 SQL 错误照常抛出
+    cur = conn.cursor()
+    inserted = 0
+    for i in range(0, len(vals_list), _IMPORT_BATCH_SIZE):
+        batch = vals_list[i:i + _IMPORT_BATCH_SIZE]
+        try:
+            _batch_insert_stock(cur, all_cols, batch)
+            inserted += len(batch)
+        except Exception:
+            for first_row in src_rows[i:i + _IMPORT_BATCH_SIZE]:
+                if _import_stock_full(first_row, data_date, cur, cols, full_map):
+                    inserted += 1
+    return inserted, 0, None
+
+
 def _import_stock_full(row, data_date, cur, cols, full_map):
     """完整导入：将 Excel 行按 full_map 映射写入 t_htma_stock 所有字段。同一 (date, sku) 应由调用方先聚合。"""
     qty = _row_val(row, cols.get("stock_qty", 15), as_decimal=True)
@@ -1033,16 +1347,22 @@ def _import_stock_full(row, data_date, cur, cols, full_map):
         raise
 
 
+@_bumps_data_version
 def import_stock(excel_path, conn):
     """实时库存表：支持表头检测，完整导入。仅写入 t_htma_stock（按日期+货号覆盖），不触碰销售/人力/品类/商品档案。同一货号多行（多仓库/库位）会按货号汇总数量与金额后再写入，避免统计偏小。"""
+    return write_parsed_stock(conn, parse_stock_file(excel_path))[:2]
+
+
+def parse_stock_file(excel_path):
+    """读取并按货号聚合库存表（不访问数据库，可在子进程中执行）。返回 dict：diag（无法解析的原因）或写入所需的行与合计。"""
     m = re.search(r"(\d{4})-(\d{2})-(\d{2})", os.path.basename(excel_path))
     data_date = m.group(0) if m else datetime.now().strftime("%Y-%m-%d")
-    df = _read_excel_safe(excel_path)
-    df = _trim_leading_junk_rows(df, ("货号", "实时库存", "库存", "商品名称", "库存金额", "库存数量", "库存总金额", "库存售价金额"))
+    df, rest_rows = _read_excel_rows(excel_path, ("货号", "实时库存", "库存", "商品名称", "库存金额", "库存数量", "库存总金额", "库存售价金额"))
     if df.shape[0] <= 1 or df.shape[1] < 5:
-        return 0, "行数或列数不足"
+        return {"diag": "行数或列数不足"}
+    job_stage("detect")
     start_row = _detect_header_row(df)
-    cols = _detect_stock_cols(df, start_row, df.shape[1])
+    cols, profile, fp, cells = _profiled_cols("stock", df, start_row, lambda: _detect_stock_cols(df, start_row, df.shape[1]))
     data_rows = df.iloc[start_row:]
     ncol = df.shape[1]
     sku_idx = cols.get("sku_code", cols.get("sku", 2))
@@ -1050,9 +1370,10 @@ def import_stock(excel_path, conn):
     fallback_amt = 26 if ncol >= 26 else 17
     qty_idx = cols.get("stock_qty", fallback_qty)
     amt_idx = cols.get("stock_amount", fallback_amt)
-    # 按货号聚合：同一货号多行（多仓库/库位）数量、金额相加，避免唯一键 (data_date, sku_code) 只保留最后一行导致统计偏小（用 itertuples 替代 iterrows，按 sku 只保留首行索引，写库时再取行，减少拷贝与遍历）
-    agg = {}  # sku -> (qty_sum, amount_sum, first_row_index)
-    for i, row in enumerate(data_rows.itertuples(index=False, name=None)):
+    # 按货号聚合：同一货号多行（多仓库/库位）数量、金额相加，避免唯一键 (data_date, sku_code) 只保留最后一行导致统计偏小（逐行流式读取，按 sku 只保留首行）
+    job_stage("parse")
+    agg = {}  # sku -> (qty_sum, amount_sum, first_row)
+    for row in chain(data_rows.itertuples(index=False, name=None), rest_rows):
         row = tuple(row)
         sku = _row_val(row, sku_idx)
         if not sku:
@@ -1070,55 +1391,88 @@ def import_stock(excel_path, conn):
             if ap:
                 amount = ap * qty
         if sku not in agg:
-            agg[sku] = [0, 0, i]
+            agg[sku] = [0, 0, row]
         agg[sku][0] += qty
         agg[sku][1] += amount
-    cur = conn.cursor()
-    inserted = 0
     col_list = None
-    buf = []
+    stock_vals, stock_rows = [], []  # stock_rows 与 stock_vals 一一对应，批量失败逐行回退时用首行重建
     # STOCK_V2_EXTRA 仅适用于「库存查询」类宽表（≥26 列含大类/中类/小类）；24 列「实时库存」与 STOCK_FULL 列位一致，若误合并会把第 6 列商品名称写入 category_mid_code 导致超长报错
     full_map = STOCK_FULL + (STOCK_V2_EXTRA if ncol >= 26 else [])
-
-    def flush_stock_batch():
-        nonlocal inserted, col_list
-        if not buf:
-            return
-        try:
-            _batch_insert_stock(cur, col_list, buf)
-            inserted += len(buf)
-        except Exception:
-            for (first_row, qty_sum, amt_sum) in buf_rows:
-                if _import_stock_full(first_row, data_date, cur, cols, full_map):
-                    inserted += 1
-        buf.clear()
-        buf_rows.clear()
-
-    buf_rows = []  # 与 buf 一一对应，用于 fallback 时调用 _import_stock_full(first_row,...)
-
-    for sku, (qty_sum, amt_sum, first_i) in agg.items():
+    for sku, (qty_sum, amt_sum, first_row) in agg.items():
         if _is_summary_like(sku):
             continue
-        first_row = data_rows.iloc[first_i].copy()
+        first_row = list(first_row)
         if qty_idx < len(first_row):
-            first_row.iloc[qty_idx] = qty_sum
+            first_row[qty_idx] = qty_sum
         if amt_idx < len(first_row):
-            first_row.iloc[amt_idx] = amt_sum
+            first_row[amt_idx] = amt_sum
         all_cols, all_vals = _build_stock_row_vals(first_row, data_date, qty_sum, amt_sum, cols, full_map)
         if all_cols is None:
             continue
         if col_list is None:
             col_list = all_cols
-        buf.append(all_vals)
-        buf_rows.append((first_row, qty_sum, amt_sum))
-        if len(buf) >= _IMPORT_BATCH_SIZE:
-            flush_stock_batch()
-    flush_stock_batch()
+        stock_vals.append(all_vals)
+        stock_rows.append(first_row)
+    if profile is None and stock_vals:
+        learn_profile("stock", fp, cells, cols)
+    return {
+        "data_date": data_date, "cols": cols, "full_map": full_map, "col_list": col_list, "vals_list": stock_vals, "src_rows": stock_rows,
+        "total_qty": sum(a[0] for a in agg.values()), "total_amt": sum(a[1] for a in agg.values()),
+    }
+
+
+def write_parsed_stock(conn, parsed):
+    """写入 parse_stock_file 的结果，返回 (导入条数, 诊断, 写库失败行数)，前两项同 import_stock。"""
+    if "diag" in parsed:
+        return 0, parsed["diag"], 0
+    latest_err = _ensure_stock_latest_safe(conn)  # 建表为 DDL，须在写入前执行，避免隐式提交拆开导入事务
+    forget_days(conn, "t_htma_stock", [parsed["data_date"]], STORE_ID)
+    job_stage("insert")
+    inserted, failed, first_err = _write_stock_rows(
+        conn, parsed["col_list"], parsed["vals_list"], parsed["src_rows"], parsed["data_date"], parsed["cols"], parsed["full_map"]
+    )
+    if inserted:
+        if latest_err is None:
+            latest_err = _merge_stock_latest_safe(conn, [parsed["data_date"]])
+        else:
+            _invalidate_stock_latest_safe(conn)
     conn.commit()
-    total_qty = sum(a[0] for a in agg.values())
-    total_amt = sum(a[1] for a in agg.values())
-    diag = f"库存: 导入{inserted}条, 合计数量{total_qty:,.0f}件, 合计金额{total_amt:,.2f}元"
-    return inserted, diag
+    dim_err = _fill_sku_dim_safe(conn, "stock", parsed["data_date"]) if inserted else None
+    diag = f"库存: 导入{inserted}条, 合计数量{parsed['total_qty']:,.0f}件, 合计金额{parsed['total_amt']:,.2f}元"
+    if failed:
+        diag += f", 导入失败{failed}行" + (f"(异常:{first_err[:100]})" if first_err else "")
+    if latest_err:
+        diag += f", {latest_err}"
+    if dim_err:
+        diag += f", {dim_err}"
+    return inserted, diag, failed
+
+
+def _ensure_stock_latest_safe(conn):
+    """确保最新库存表存在；失败返回诊断文本（读取方会退回库存表），成功返回 None。"""
+    try:
+        ensure_stock_latest_table(conn)
+        return None
+    except Exception as e:
+        return f"最新库存表不可用:{str(e)[:80]}"
+
+
+def _merge_stock_latest_safe(conn, dates):
+    """在导入事务内把本次日期的库存行合并进最新库存表；失败时标记需重建（读取退回库存表），不影响已写入的库存。"""
+    try:
+        refresh_stock_latest(conn, STORE_ID, dates, commit=False)
+        return None
+    except Exception as e:
+        _invalidate_stock_latest_safe(conn)
+        return f"最新库存表更新失败(已改读库存表):{str(e)[:80]}"
+
+
+def _invalidate_stock_latest_safe(conn):
+    """本次库存未能合并进最新库存表时标记需重建，避免读到过期快照；表不存在等错误忽略。"""
+    try:
+        invalidate_stock_latest(conn, STORE_ID)
+    except Exception:
+        pass
 
 
 def _detect_category_cols(df):
@@ -1155,6 +1509,7 @@ def _detect_category_cols(df):
     return default, 1
 
 
+@_bumps_data_version
 def import_category(excel_path, conn):
     """导入品类主数据表（附表结构：大类编、大类名称、中类编、中类名称、小类编、小类名称）。
     支持合并单元格：空单元格沿用上一行同列值。"""
@@ -1235,6 +1590,7 @@ def _detect_tax_burden_cols(df):
     return default, 1
 
 
+@_bumps_data_version
 def import_tax_burden(excel_path, conn):
     """导入税率负担表 Excel 到 t_htma_tax_burden。按编码：已存在则覆盖，不存在则新增。"""
     df = _read_excel_safe(excel_path)
@@ -1311,10 +1667,11 @@ def _detect_profit_cols(df, start_row, ncol):
     return default
 
 
-def import_profit(excel_path, conn):
+@_bumps_data_version
+def import_profit(excel_path, conn, swap_amount_cost=False):
     """导入毛利汇总 Excel 到 t_htma_profit。
     格式：大类名称、类别名称、求和项:销售金额、求和项:参考进价金额。
-    毛利=销售金额-参考进价金额。过滤前4行，日期从文件名或表头提取。"""
+    毛利=销售金额-参考进价金额。过滤前4行，日期从文件名或表头提取。swap_amount_cost 对调销售金额/进价金额列。"""
     df = _read_excel_safe(excel_path)
     df = _trim_leading_junk_rows(df, ("大类名称", "类别名称", "销售金额", "参考进价", "求和项"))
     if df.shape[0] <= 1:
@@ -1322,7 +1679,7 @@ def import_profit(excel_path, conn):
     ncol = df.shape[1]
     start_row = _detect_header_row(df)
     start_row = max(start_row, 4)
-    cols = _detect_profit_cols(df, start_row, ncol)
+    cols, profile, fp, cells = _profiled_cols("profit", df, start_row, lambda: _detect_profit_cols(df, start_row, ncol), swap_amount_cost)
     data_date = _extract_report_date(excel_path) or _extract_report_date(df) or datetime.now().strftime("%Y-%m-%d")
     data_rows = df.iloc[start_row:]
     cur = conn.cursor()
@@ -1376,21 +1733,20 @@ def import_profit(excel_path, conn):
             else:
                 skipped += 1
     conn.commit()
+    if profile is None and inserted:
+        learn_profile("profit", fp, cells, cols)
     diag = None
     if inserted == 0 and skipped > 0:
         diag = f"毛利表: 总行{len(data_rows)}, 跳过{skipped}行"
     return inserted, diag
 
 
-def refresh_category_from_sale(conn):
-    """从销售表透视大类/中类/小类，写入品类主数据表 t_htma_category。仅操作 t_htma_category，不触碰销售/库存/人力/商品档案表。"""
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT category_large_code, category_large, category_mid_code, category_mid, category_small_code, category_small, category FROM t_htma_sale LIMIT 1")
-    except Exception:
-        return 0
-    cur.execute("TRUNCATE TABLE t_htma_category")
-    cur.execute("""
+_CATEGORY_DATES_PER_STATEMENT = 62
+
+
+def _category_upsert_sql(where=""):
+    # 名称为空/占位时不覆盖已有名称，避免某天的残缺行把主数据名称冲掉
+    return f"""
         INSERT INTO t_htma_category (category_large_code, category_large, category_mid_code, category_mid, category_small_code, category_small)
         SELECT
             COALESCE(NULLIF(TRIM(lc), ''), '0'),
@@ -1408,16 +1764,79 @@ def refresh_category_from_sale(conn):
                 COALESCE(category_small_code, '') AS sc,
                 MAX(COALESCE(NULLIF(TRIM(category_small), ''), NULLIF(TRIM(category), ''), '')) AS sn
             FROM t_htma_sale
-            WHERE (COALESCE(TRIM(category_large_code), '') != '' OR COALESCE(TRIM(category_large), '') != '')
+            WHERE ((COALESCE(TRIM(category_large_code), '') != '' OR COALESCE(TRIM(category_large), '') != '')
                OR (COALESCE(TRIM(category_mid_code), '') != '' OR COALESCE(TRIM(category_mid), '') != '')
-               OR (COALESCE(TRIM(category_small_code), '') != '' OR COALESCE(TRIM(category_small), '') != '' OR COALESCE(TRIM(category), '') != '')
+               OR (COALESCE(TRIM(category_small_code), '') != '' OR COALESCE(TRIM(category_small), '') != '' OR COALESCE(TRIM(category), '') != '')){where}
             GROUP BY COALESCE(category_large_code, ''), COALESCE(category_mid_code, ''), COALESCE(category_small_code, '')
         ) t
         WHERE (TRIM(lc) != '' OR TRIM(ln) != '') OR (TRIM(mc) != '' OR TRIM(mn) != '') OR (TRIM(sc) != '' OR TRIM(sn) != '')
-        ON DUPLICATE KEY UPDATE category_large=VALUES(category_large), category_mid=VALUES(category_mid), category_small=VALUES(category_small)
-    """)
-    conn.commit()
-    return cur.rowcount
+        ON DUPLICATE KEY UPDATE
+            category_large=IF(VALUES(category_large) = '未分类', category_large, VALUES(category_large)),
+            category_mid=IF(VALUES(category_mid) = '', category_mid, VALUES(category_mid)),
+            category_small=IF(VALUES(category_small) = '', category_small, VALUES(category_small))
+    """
+
+
+def refresh_category_from_sale(conn, partitions=None):
+    """
+    从销售表透视大类/中类/小类，增量 upsert 到品类主数据表 t_htma_category（不清空表，读者始终看到完整数据）。
+    partitions 为销售导入返回的 {(store_id, data_date)}：只扫描这些日期的销售行；未传时扫描整张销售表。
+    销售中已不存在的品类由 prune_unused_categories 定期清理。仅操作 t_htma_category。
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT category_large_code, category_large, category_mid_code, category_mid, category_small_code, category_small, category FROM t_htma_sale LIMIT 1")
+    except Exception:
+        return 0
+    total = 0
+    try:
+        if partitions is None:
+            cur.execute(_category_upsert_sql())
+            total = cur.rowcount
+        else:
+            by_store = {}
+            for store_id, d in partitions:
+                if store_id and d:
+                    by_store.setdefault(store_id, set()).add(d)
+            for store_id, dates in by_store.items():
+                ds = sorted(dates)
+                for i in range(0, len(ds), _CATEGORY_DATES_PER_STATEMENT):
+                    chunk = ds[i:i + _CATEGORY_DATES_PER_STATEMENT]
+                    ph = ", ".join(["%s"] * len(chunk))
+                    cur.execute(_category_upsert_sql(f" AND store_id = %s AND data_date IN ({ph})"), (store_id, *chunk))
+                    total += cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return total
+
+
+def prune_unused_categories(conn):
+    """删除销售表中已不再出现的品类编码组合（定期执行，如全量导入后或 scripts/prune_unused_categories.py）；返回删除条数。"""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE c FROM t_htma_category c
+            LEFT JOIN (
+                SELECT DISTINCT
+                    COALESCE(NULLIF(TRIM(category_large_code), ''), '0') AS lc,
+                    COALESCE(TRIM(category_mid_code), '') AS mc,
+                    COALESCE(TRIM(category_small_code), '') AS sc
+                FROM t_htma_sale
+            ) u ON u.lc = c.category_large_code AND u.mc = c.category_mid_code AND u.sc = c.category_small_code
+            WHERE u.lc IS NULL
+        """)
+        deleted = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return deleted
 
 
 # t_htma_sale 表需有的大类/中类/小类/供应商/品牌等列（与 run_add_columns 一致，用于导入前确保列存在）
@@ -1437,6 +1856,40 @@ SALE_TABLE_EXTRA_COLUMNS = [
 ]
 
 
+# 筛选用的品类/品牌列：导入与回填后统一 TRIM、空串置 NULL，query_layer 才能用等值/IN 谓词走索引
+SALE_CANONICAL_DIM_COLUMNS = (
+    "category_large_code", "category_large", "category_mid_code", "category_mid",
+    "category_small_code", "category_small", "category", "brand_name",
+)
+
+
+def normalize_sale_dimensions(conn, store_id: str = None, keys=None):
+    """
+    规范化 t_htma_sale 品类编码/名称与品牌列：去首尾空白、空串置 NULL。
+    导入已按此写入，这里兜底其它写入路径（回填、旧数据、脚本）。keys 为 {(data_date, sku_code)} 时只检查这些行。
+    返回被修改行涉及的日期集合。
+    """
+    store_id = store_id or STORE_ID
+    dirty = " OR ".join(f"({c} = '' OR CHAR_LENGTH({c}) <> CHAR_LENGTH(TRIM({c})))" for c in SALE_CANONICAL_DIM_COLUMNS)
+    sets = ", ".join(f"{c} = NULLIF(TRIM({c}), '')" for c in SALE_CANONICAL_DIM_COLUMNS)
+    cur = conn.cursor()
+    touched = set()
+    try:
+        for scope, scope_params in _sale_key_scopes(keys):
+            params = (store_id, *scope_params)
+            cur.execute(f"SELECT DISTINCT data_date FROM t_htma_sale WHERE store_id = %s{scope} AND ({dirty})", params)
+            dates = {_row_first(r) for r in cur.fetchall()}
+            if dates:
+                cur.execute(f"UPDATE t_htma_sale SET {sets} WHERE store_id = %s{scope} AND ({dirty})", params)
+                touched |= dates
+        if touched:
+            conn.commit()
+    finally:
+        cur.close()
+    touched.discard(None)
+    return touched
+
+
 def ensure_sale_table_columns(conn):
     """确保 t_htma_sale 存在大类/中类/小类/供应商/品牌等列；缺则 ADD COLUMN，已存在则跳过（便于未跑过 run_add_columns 的环境）。"""
     cur = conn.cursor()
@@ -1452,50 +1905,191 @@ def ensure_sale_table_columns(conn):
     cur.close()
 
 
-def backfill_sale_category_and_supplier(conn, store_id: str = None):
+# 导入后按写入键回填时，每条语句覆盖的货号数（(data_date, sku_code) 唯一键范围扫描）
+_BACKFILL_SKUS_PER_STATEMENT = 1000
+
+
+def _sale_key_scopes(keys, alias=""):
+    """
+    把 {(data_date, sku_code)} 按日期分组、货号分块，生成 (" AND data_date = %s AND sku_code IN (...)", params)，
+    可走 uk_date_sku 唯一键；keys 为 None 时只生成一个不限范围的空条件（整店）。
+    """
+    if keys is None:
+        yield "", ()
+        return
+    by_date = {}
+    for d, sku in keys:
+        if d and sku:
+            by_date.setdefault(d, set()).add(sku)
+    for d in sorted(by_date):
+        skus = sorted(by_date[d])
+        for i in range(0, len(skus), _BACKFILL_SKUS_PER_STATEMENT):
+            chunk = skus[i:i + _BACKFILL_SKUS_PER_STATEMENT]
+            ph = ", ".join(["%s"] * len(chunk))
+            yield f" AND {alias}data_date = %s AND {alias}sku_code IN ({ph})", (d, *chunk)
+
+
+def backfill_sale_category_and_supplier(conn, store_id: str = None, keys=None, resolved=False):
     """
     透视回填：对 t_htma_sale 中大类/中类/小类/供应商/品牌为空的记录，
     1) 从 t_htma_product_master 按 sku_code+store_id 回填 brand_name、supplier_name；
     2) 若有 category（类别名称）但无大类/中类/小类，则用 category 回填 category_small/category_mid/category_large；
-    3) 再调用 refresh_category_from_sale 更新 t_htma_category。
+    3) 规范化品类/品牌列（normalize_sale_dimensions）。
+    keys 为导入写入的 {(data_date, sku_code)} 时只处理这些行，不扫描整店历史；
+    resolved=True 表示写入前已用 resolve_sale_dims 在内存中补齐，跳过 1、2 两步。
+    返回被回填行涉及的销售日期集合（供销售日汇总表、毛利表、品类表按日期重算）；
+    品类表由调用方导入结束后以 refresh_category_from_sale(conn, partitions) 增量刷新一次。
     """
     store_id = store_id or STORE_ID
     cur = conn.cursor()
+    touched_dates = set()
     try:
-        # 1) 从商品档案回填品牌、供应商（仅当 sale 中为空时）
-        cur.execute("""
-            UPDATE t_htma_sale s
-            INNER JOIN t_htma_product_master p ON p.sku_code = s.sku_code AND p.store_id = s.store_id
-            SET
-                s.brand_name = COALESCE(NULLIF(TRIM(s.brand_name), ''), p.brand_name),
-                s.supplier_name = COALESCE(NULLIF(TRIM(s.supplier_name), ''), p.supplier_name)
-            WHERE s.store_id = %s
-              AND (COALESCE(TRIM(s.brand_name), '') = '' OR COALESCE(TRIM(s.supplier_name), '') = '')
-        """, (store_id,))
-        conn.commit()
-        # 2) 用 category 回填大类/中类/小类（仅当三者均为空且 category 有值时）
-        cur.execute("""
-            UPDATE t_htma_sale
-            SET
-                category_large = COALESCE(NULLIF(TRIM(category_large), ''), category),
-                category_mid = COALESCE(NULLIF(TRIM(category_mid), ''), category),
-                category_small = COALESCE(NULLIF(TRIM(category_small), ''), category)
-            WHERE store_id = %s
-              AND COALESCE(TRIM(category_large), '') = ''
-              AND COALESCE(TRIM(category_mid), '') = ''
-              AND COALESCE(TRIM(category_small), '') = ''
-              AND COALESCE(TRIM(category), '') != ''
-        """, (store_id,))
+        for scope, scope_params in ([] if resolved else _sale_key_scopes(keys, "s.")):
+            params = (store_id, *scope_params)
+            # 1) 从商品档案回填品牌、供应商（仅当 sale 中为空时）
+            cur.execute(f"""
+                SELECT DISTINCT s.data_date
+                FROM t_htma_sale s
+                INNER JOIN t_htma_product_master p ON p.sku_code = s.sku_code AND p.store_id = s.store_id
+                WHERE s.store_id = %s{scope}
+                  AND (COALESCE(TRIM(s.brand_name), '') = '' OR COALESCE(TRIM(s.supplier_name), '') = '')
+                  AND (COALESCE(TRIM(p.brand_name), '') != '' OR COALESCE(TRIM(p.supplier_name), '') != '')
+            """, params)
+            dates = {_row_first(r) for r in cur.fetchall()}
+            if dates:
+                cur.execute(f"""
+                    UPDATE t_htma_sale s
+                    INNER JOIN t_htma_product_master p ON p.sku_code = s.sku_code AND p.store_id = s.store_id
+                    SET
+                        s.brand_name = COALESCE(NULLIF(TRIM(s.brand_name), ''), p.brand_name),
+                        s.supplier_name = COALESCE(NULLIF(TRIM(s.supplier_name), ''), p.supplier_name)
+                    WHERE s.store_id = %s{scope}
+                      AND (COALESCE(TRIM(s.brand_name), '') = '' OR COALESCE(TRIM(s.supplier_name), '') = '')
+                """, params)
+                touched_dates |= dates
+            # 2) 用 category 回填大类/中类/小类（仅当三者均为空且 category 有值时）
+            missing = """
+                  AND COALESCE(TRIM(s.category_large), '') = ''
+                  AND COALESCE(TRIM(s.category_mid), '') = ''
+                  AND COALESCE(TRIM(s.category_small), '') = ''
+                  AND COALESCE(TRIM(s.category), '') != ''
+            """
+            cur.execute(f"SELECT DISTINCT s.data_date FROM t_htma_sale s WHERE s.store_id = %s{scope}{missing}", params)
+            dates = {_row_first(r) for r in cur.fetchall()}
+            if dates:
+                cur.execute(f"""
+                    UPDATE t_htma_sale s
+                    SET
+                        s.category_large = COALESCE(NULLIF(TRIM(s.category_large), ''), s.category),
+                        s.category_mid = COALESCE(NULLIF(TRIM(s.category_mid), ''), s.category),
+                        s.category_small = COALESCE(NULLIF(TRIM(s.category_small), ''), s.category)
+                    WHERE s.store_id = %s{scope}{missing}
+                """, params)
+                touched_dates |= dates
         conn.commit()
-        # 3) 刷新品类主数据表
-        refresh_category_from_sale(conn)
+        # 3) 规范化品类/品牌列（TRIM、空串置 NULL），供筛选走索引
+        touched_dates |= normalize_sale_dimensions(conn, store_id, keys)
     except Exception:
         conn.rollback()
         raise
     finally:
         cur.close()
+    touched_dates.discard(None)
+    return touched_dates
 
 
+def load_product_master_dims(conn, store_id, skus):
+    """按货号批量读取商品档案的品牌/供应商：{sku_code: (brand_name, supplier_name)}；商品档案表不存在时返回 {}。"""
+    out = {}
+    skus = sorted({s for s in skus if s})
+    cur = conn.cursor()
+    try:
+        for i in range(0, len(skus), _BACKFILL_SKUS_PER_STATEMENT):
+            chunk = skus[i:i + _BACKFILL_SKUS_PER_STATEMENT]
+            ph = ", ".join(["%s"] * len(chunk))
+            cur.execute(f"""
+                SELECT sku_code, brand_name, supplier_name FROM t_htma_product_master
+                WHERE store_id = %s AND sku_code IN ({ph})
+            """, (store_id, *chunk))
+            for r in cur.fetchall():
+                if isinstance(r, dict):
+                    out[r["sku_code"]] = (r.get("brand_name"), r.get("supplier_name"))
+                else:
+                    out[r[0]] = (r[1], r[2])
+    except pymysql.err.ProgrammingError:
+        return {}
+    finally:
+        cur.close()
+    return out
+
+
+def resolve_sale_dims(all_cols, all_vals, master_dims=None):
+    """
+    写入前在内存中补齐一行销售数据的维度（与 backfill 步骤 1、2 口径一致）：
+    品牌/供应商为空时取商品档案值；大类/中类/小类均为空而类别名称有值时三者都填类别名称。就地修改 all_vals。
+    """
+    idx = {c: i for i, c in enumerate(all_cols)}
+
+    def get(col):
+        return all_vals[idx[col]] if col in idx else None
+
+    def put(col, v):
+        if col in idx:
+            all_vals[idx[col]] = v
+
+    if master_dims:
+        brand, supplier = master_dims
+        brand = (str(brand or "").strip())[:64] or None
+        supplier = (str(supplier or "").strip())[:128] or None
+        if (not get("brand_name") or not get("supplier_name")) and (brand or supplier):
+            put("brand_name", get("brand_name") or brand)
+            put("supplier_name", get("supplier_name") or supplier)
+    category = get("category")
+    if category and not (get("category_large") or get("category_mid") or get("category_small")):
+        for col in ("category_large", "category_mid", "category_small"):
+            put(col, category[:64])
+    return all_vals
+
+
+def _row_first(row):
+    """取单列查询结果的值，兼容 DictCursor 与普通游标。"""
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0] if row else None
+
+
+def _refresh_sale_rollup_safe(conn, dates):
+    """导入后按日期增量重算销售日汇总表；失败不影响已写入的明细，返回诊断文本（成功返回 None）。无日期时不刷新。"""
+    if not dates:
+        return None
+    try:
+        refresh_sale_rollup(conn, STORE_ID, dates)
+        return None
+    except Exception as e:
+        return f"销售日汇总刷新失败:{str(e)[:80]}"
+
+
+def _refresh_sku_dim_safe(conn, dates):
+    """导入后按日期把销售合并进 SKU 维表；失败不影响已写入的明细，返回诊断文本（成功返回 None）。无日期时不刷新。"""
+    if not dates:
+        return None
+    try:
+        refresh_sku_dim(conn, STORE_ID, dates)
+        return None
+    except Exception as e:
+        return f"SKU维表刷新失败:{str(e)[:80]}"
+
+
+def _fill_sku_dim_safe(conn, source, data_date=None, store_id=None):
+    """库存/商品档案导入后补齐 SKU 维表中为空的属性；失败返回诊断文本（成功返回 None）。"""
+    try:
+        fill_sku_dim(conn, store_id or STORE_ID, source, data_date)
+        return None
+    except Exception as e:
+        return f"SKU维表补齐失败:{str(e)[:80]}"
+
+
+@_bumps_data_version
 def sync_products_table(conn, store_id: str = "沈阳超级仓", days: int = 90) -> int:
     """
     从 t_htma_sale + t_htma_stock 同步商品主表 t_htma_products。
@@ -1534,7 +2128,8 @@ def sync_products_table(conn, store_id: str = "沈阳超级仓", days: int = 90)
     """
     cur.execute(create_sql)
     conn.commit()
-    insert_sql = """
+    stock = stock_source(conn, store_id)  # 最新库存表就绪时免去对库存历史的 MAX(data_date) 子查询
+    insert_sql = f"""
         INSERT INTO t_htma_products
         (store_id, sku_code, product_name, raw_name, spec, barcode, brand_name,
          category, category_large, category_mid, category_small,
@@ -1552,8 +2147,8 @@ def sync_products_table(conn, store_id: str = "沈阳超级仓", days: int = 90)
                COALESCE(SUM(s.sale_qty),0), COALESCE(SUM(s.sale_amount),0), COALESCE(SUM(s.gross_profit),0),
                NOW()
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND s.data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
         GROUP BY s.sku_code, st.product_name, s.product_name, s.category, s.category_large, s.category_mid, s.category_small
         ON DUPLICATE KEY UPDATE
@@ -1584,6 +2179,7 @@ def sync_products_table(conn, store_id: str = "沈阳超级仓", days: int = 90)
     return cnt
 
 
+@_bumps_data_version
 def sync_category_table(conn, store_id: str = "沈阳超级仓", days: int = 30) -> int:
     """
     从 t_htma_profit 汇总同步品类毛利表 t_htma_category_profit。
@@ -1648,10 +2244,11 @@ def sync_category_table(conn, store_id: str = "沈阳超级仓", days: int = 30)
     return cnt
 
 
-def refresh_profit(conn):
-    """按日期+品类汇总销售表，写入毛利表（含分类层级字段）"""
-    cur = conn.cursor()
-    cur.execute("""
+_PROFIT_DATES_PER_STATEMENT = 62
+
+
+def _profit_insert_select_sql(where=""):
+    return f"""
         INSERT INTO t_htma_profit (data_date, category, total_sale, total_profit, profit_rate, store_id,
             category_code, category_large_code, category_large, category_mid_code, category_mid, category_small_code, category_small)
         SELECT data_date, COALESCE(category, '未分类'),
@@ -1660,15 +2257,62 @@ def refresh_profit(conn):
                store_id,
                MAX(category_code), MAX(category_large_code), MAX(category_large),
                MAX(category_mid_code), MAX(category_mid), MAX(category_small_code), MAX(category_small)
-        FROM t_htma_sale
+        FROM t_htma_sale{where}
         GROUP BY data_date, category, store_id
         ON DUPLICATE KEY UPDATE total_sale=VALUES(total_sale), total_profit=VALUES(total_profit), profit_rate=VALUES(profit_rate),
             category_code=VALUES(category_code), category_large_code=VALUES(category_large_code), category_large=VALUES(category_large),
             category_mid_code=VALUES(category_mid_code), category_mid=VALUES(category_mid),
             category_small_code=VALUES(category_small_code), category_small=VALUES(category_small)
-    """)
-    conn.commit()
-    return cur.rowcount
+    """
+
+
+def sale_partitions(store_id, dates):
+    """把日期集合转为 {(store_id, data_date)}，供 refresh_profit 增量重算。"""
+    return {(store_id, d) for d in (dates or ()) if d}
+
+
+@_bumps_data_version
+def refresh_profit(conn, partitions=None, full=False):
+    """
+    按日期+品类汇总销售表，写入毛利表（含分类层级字段）。
+    partitions 为导入返回的 {(store_id, data_date)}：只重算这些日期，并删除当日销售中已不存在的品类行；
+    full=True（或未传 partitions）时全量重算整张销售表，供 run_full_import 等脚本使用。
+    """
+    cur = conn.cursor()
+    if full or partitions is None:
+        cur.execute(_profit_insert_select_sql())
+        conn.commit()
+        return cur.rowcount
+    by_store = {}
+    for store_id, d in partitions:
+        if store_id and d:
+            by_store.setdefault(store_id, set()).add(d)
+    total = 0
+    try:
+        for store_id, dates in by_store.items():
+            ds = sorted(dates)
+            for i in range(0, len(ds), _PROFIT_DATES_PER_STATEMENT):
+                chunk = ds[i:i + _PROFIT_DATES_PER_STATEMENT]
+                ph = ", ".join(["%s"] * len(chunk))
+                cur.execute(f"""
+                    DELETE p FROM t_htma_profit p
+                    WHERE p.store_id = %s AND p.data_date IN ({ph})
+                      AND NOT EXISTS (
+                        SELECT 1 FROM t_htma_sale s
+                        WHERE s.store_id = p.store_id AND s.data_date = p.data_date
+                          AND COALESCE(s.category, '未分类') = p.category
+                      )
+                """, (store_id, *chunk))
+                total += cur.rowcount
+                cur.execute(_profit_insert_select_sql(f" WHERE store_id = %s AND data_date IN ({ph})"), (store_id, *chunk))
+                total += cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return total
 
 
 # ---------- 人力成本导入（组长表 + 全职表，附图格式）----------
@@ -1729,6 +2373,7 @@ def _supplier_from_sheet(sheet_name, max_len=64):
     return "斗米"[:max_len]
 
 
+@_bumps_data_version
 def import_labor_cost(excel_path, report_month, conn, store_id=None):
     """
     导入人力成本 Excel：支持单 sheet 或多 sheet，自动识别类型并归类。
@@ -1849,7 +2494,15 @@ def import_labor_cost(excel_path, report_month, conn, store_id=None):
         diagnostics.append(str(e))
         return counts, diagnostics, []
 
+    labor_learn = None  # (本 sheet 导入前的条数, 指纹, 表头, 映射)：该 sheet 导入出数据后记住岗位列
+
+    def _learn_labor_pos_col():
+        if labor_learn and sum(counts.values()) > labor_learn[0]:
+            learn_profile("labor", *labor_learn[1:])
+
     for sheet_name in sheets:
+        _learn_labor_pos_col()
+        labor_learn = None
         # 跳过汇总表 sheet（合计/跟发票或发薪对应）：仅人数与总成本，无到人明细，避免重复计入
         _sn = (sheet_name or "").strip()
         if "合计" in _sn and ("发票" in _sn or "发薪" in _sn or "对应" in _sn):
@@ -1884,13 +2537,22 @@ def import_labor_cost(excel_path, report_month, conn, store_id=None):
             if n:
                 col_map[col] = n
 
-        # 岗位列：组长表可能用「职务」，组员表用「岗位」；先确定 pos_col 再对合并单元格做向前填充
+        # 岗位列：组长表可能用「职务」，组员表用「岗位」；先确定 pos_col 再对合并单元格做向前填充。
+        # 同版式（sheet 类型 + 表头）命中列映射档案时直接取档案中的岗位列
+        sheet_kind = "leader" if preferred_leader else "fulltime" if preferred_fulltime else (
+            "parttime" if "兼职" in sheet_name_lower else "hourly" if "小时工" in sheet_name_lower else "other")
+        labor_cells = ["[%s]" % sheet_kind] + [col_map.get(c, "") for c in df_header.columns]
+        labor_fp = header_fingerprint("labor", labor_cells, len(df_header.columns))
+        labor_profile = match_profile("labor", labor_fp)
         pos_col = None
-        for c in df_header.columns:
-            nm = col_map.get(c) or _normalize_header(str(c))
-            if "岗位" in nm:
-                pos_col = c
-                break
+        if labor_profile:
+            pos_col = next((c for c in df_header.columns if col_map.get(c) == labor_profile["cols"].get("pos_col")), None)
+        if not pos_col:
+            for c in df_header.columns:
+                nm = col_map.get(c) or _normalize_header(str(c))
+                if "岗位" in nm:
+                    pos_col = c
+                    break
         if not pos_col and (preferred_leader or not preferred_fulltime):
             for c in df_header.columns:
                 nm = col_map.get(c) or _normalize_header(str(c))
@@ -1919,6 +2581,8 @@ def import_labor_cost(excel_path, report_month, conn, store_id=None):
                 pos_col = first_col
         if not pos_col:
             continue
+        if not labor_profile and col_map.get(pos_col):
+            labor_learn = (sum(counts.values()), labor_fp, labor_cells, {"pos_col": col_map[pos_col]})
 
         # 岗位/职务列合并单元格：向前填充，避免同一岗位多行只显示首行、其余为 NaN
         if pos_col in df_header.columns:
@@ -2260,6 +2924,7 @@ def import_labor_cost(excel_path, report_month, conn, store_id=None):
                     """, (report_month, ptype, pos_name, "", total_cost, total_cost, default_supplier, store_id))
                     counts[ptype] += 1
             conn.commit()
+    _learn_labor_pos_col()
 
     if n_to_person_total[0] > 0 and n_to_person_with_real_name[0] / n_to_person_total[0] < 0.5:
         diagnostics.append("建议：多数明细姓名为空或行号，请在 Excel 中增加「姓名」列（或「人员」「员工姓名」）后重新导入，以便到人明细准确。")
@@ -2332,6 +2997,7 @@ def _ocr_image_to_table(image_path):
         return None, None
 
 
+@_bumps_data_version
 def import_labor_cost_from_image(image_path, report_month, conn, store_id=None, position_type=None):
     """从附图 OCR 识别表格并导入人力成本。position_type='leader'|'fulltime' 必填，与组长表/组员表一一对应。返回 (leader_count, fulltime_count, diagnostics)。"""
     store_id = store_id or STORE_ID
@@ -2502,6 +3168,7 @@ def import_labor_cost_from_image(image_path, report_month, conn, store_id=None,
     return 0, 0, diagnostics
 
 
+@_bumps_data_version
 def refresh_labor_cost_analysis(conn):
     """从 t_htma_labor_cost 汇总写入 t_htma_labor_cost_analysis，用于月度比对分析。返回刷新的月份数。"""
     cur = conn.cursor(pymysql.cursors.DictCursor)
@@ -2712,6 +3379,7 @@ def _ensure_product_master_distribution_mode(conn):
         pass
 
 
+@_bumps_data_version
 def import_product_master(excel_path, conn, store_id=None, archive_date=None):
     """分店商品档案 Excel 导入 t_htma_product_master。仅操作 t_htma_product_master（按门店+货号覆盖），不触碰销售/库存/人力/品类表。按文件名解析 archive_date（分店商品档案_20260306-_101750.xlsx）。返回 (inserted_count, message)。"""
     _ensure_product_master_distribution_mode(conn)
@@ -2806,6 +3474,18 @@ def import_product_master(excel_path, conn, store_id=None, archive_date=None):
     msg = f"去重后导入 {inserted} 条（同门店+货号已覆盖）"
     if skip_no_sku:
         msg += f"，跳过无货号 {skip_no_sku} 行"
+    if inserted:
+        # 销售导入只回填本次写入的行：商品档案更新后在此补一次历史销售中仍为空的品牌/供应商
+        try:
+            touched = backfill_sale_category_and_supplier(conn, store_id)
+            rollup_err = _refresh_sale_rollup_safe(conn, touched)
+            if rollup_err:
+                msg += f"，{rollup_err}"
+        except Exception as e:
+            msg += f"，销售维度回填失败:{str(e)[:80]}"
+        dim_err = _fill_sku_dim_safe(conn, "product_master", store_id=store_id)
+        if dim_err:
+            msg += f"，{dim_err}"
     return inserted, msg
 
 
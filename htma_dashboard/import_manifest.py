@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+导入清单：按文件内容哈希记录每次导入，重复放入下载目录的同一 Excel 不再重新解析、写库和刷新。
+
+- t_htma_import_manifest：门店 + 文件类型 + 内容哈希（SHA-256）唯一，记录文件名、大小、识别到的日期范围、
+  总行数/写入行数、结果（ok / failed）、诊断，以及导入完成时该日期范围内各日校验和的指纹（day_sums）；
+  find_import 只认 ok 的记录，且要求该范围内的日校验和与指纹仍一致、目标表行数不少于当时写入行数，
+  否则（失败、日期被其他文件或其他导入路径重写过、被清空过）视为未导入，交给逐日校验和决定写哪些日期；
+- t_htma_import_day_checksum：按目标表 + 日期记录最近一次写入该日数据的行校验和（与列顺序、行顺序无关），
+  部分重叠的文件（如 1～15 日与 10～20 日）只写入校验和有变化的日期；按目标表而不是文件类型记录。
+  import_logic 每次写销售/库存表（含 /api/import 等不记清单的路径）都先 forget_days 删掉所写日期的校验和，
+  日报写过的日期又被汇总或接口上传覆盖后，再导日报会因校验和不同（或已删除）而重新写入；
+- force=True（接口 force=1、脚本 --force）跳过上述判断；HTMA_IMPORT_MANIFEST=0 整体关闭。
+清单读写失败（无建表权限等）一律按「未导入过」处理，不影响导入本身。
+"""
+import hashlib
+import os
+from datetime import date, datetime
+
+MANIFEST_TABLE = "t_htma_import_manifest"
+DAY_CHECKSUM_TABLE = "t_htma_import_day_checksum"
+MANIFEST_ENABLED = os.environ.get("HTMA_IMPORT_MANIFEST", "1").strip().lower() not in ("0", "false", "no", "off")
+
+_HASH_CHUNK = 1024 * 1024
+_tables_ready = False  # 本进程已建表，避免每个文件都执行 DDL
+
+
+def file_digest(path):
+    """文件内容 SHA-256（十六进制）。"""
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(_HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def ensure_manifest_tables(conn):
+    """建清单表与日校验和表（已存在则跳过）。"""
+    global _tables_ready
+    if _tables_ready:
+        return
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+          id           BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+          store_id     VARCHAR(32)     NOT NULL,
+          file_kind    VARCHAR(32)     NOT NULL,
+          file_hash    CHAR(64)        NOT NULL,
+          file_name    VARCHAR(255)    DEFAULT NULL,
+          file_size    BIGINT          DEFAULT NULL,
+          date_min     DATE            DEFAULT NULL,
+          date_max     DATE            DEFAULT NULL,
+          rows_total   INT             DEFAULT NULL,
+          rows_written INT             DEFAULT NULL,
+          day_sums     CHAR(64)        DEFAULT NULL,
+          status       VARCHAR(16)     NOT NULL,
+          message      VARCHAR(500)    DEFAULT NULL,
+          created_at   DATETIME        DEFAULT CURRENT_TIMESTAMP,
+          updated_at   DATETIME        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          UNIQUE KEY uk_manifest (store_id, file_kind, file_hash)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='导入清单(按文件内容哈希去重)'
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DAY_CHECKSUM_TABLE} (
+          store_id     VARCHAR(32) NOT NULL,
+          target_table VARCHAR(64) NOT NULL,
+          data_date    DATE        NOT NULL,
+          checksum     CHAR(64)    NOT NULL,
+          row_count    INT         NOT NULL,
+          updated_at   DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          PRIMARY KEY (store_id, target_table, data_date)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='导入按日行校验和(跳过未变化日期)'
+    """)
+    conn.commit()
+    cur.close()
+    _tables_ready = True
+
+
+def _row_get(row, key, idx):
+    return row.get(key) if isinstance(row, dict) else row[idx]
+
+
+def _table_count(cur, table, store_id, date_min, date_max):
+    cur.execute(f"SELECT COUNT(*) AS n FROM {table} WHERE store_id = %s AND data_date BETWEEN %s AND %s", (store_id, date_min, date_max))
+    row = cur.fetchone()
+    return int(_row_get(row, "n", 0) or 0) if row else 0
+
+
+def _range_fingerprint(cur, table, store_id, date_min, date_max):
+    """table 在 [date_min, date_max] 内各日校验和的指纹；一天都没有时返回 None。"""
+    cur.execute(f"""
+        SELECT data_date, checksum FROM {DAY_CHECKSUM_TABLE}
+        WHERE store_id = %s AND target_table = %s AND data_date BETWEEN %s AND %s ORDER BY data_date
+    """, (store_id, table, date_min, date_max))
+    rows = cur.fetchall() or []
+    if not rows:
+        return None
+    h = hashlib.sha256()
+    for r in rows:
+        h.update(f"{_row_get(r, 'data_date', 0)}:{_row_get(r, 'checksum', 1)};".encode("utf-8"))
+    return h.hexdigest()
+
+
+def find_import(conn, digest, kind, store_id, table=None):
+    """
+    同门店、同类型、同内容且成功的导入记录（dict：file_name、rows_written、created_at 等），没有返回 None。
+    给出 table 时再核对：记录的日期范围内各日校验和与导入时的指纹一致（这些日期没被其他文件或导入路径重写过），
+    且该表在范围内仍有不少于 rows_written 行（没被清空或删除过），否则视为未导入。
+    """
+    if not MANIFEST_ENABLED or not digest:
+        return None
+    keys = ("file_name", "rows_total", "rows_written", "date_min", "date_max", "created_at", "day_sums")
+    try:
+        ensure_manifest_tables(conn)
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {", ".join(keys)} FROM {MANIFEST_TABLE}
+            WHERE store_id = %s AND file_kind = %s AND file_hash = %s AND status = 'ok'
+        """, (store_id, kind, digest))
+        row = cur.fetchone()
+        if not row:
+            cur.close()
+            return None
+        rec = {k: _row_get(row, k, i) for i, k in enumerate(keys)}
+        if table and rec["date_min"]:
+            if rec["day_sums"] is None or _range_fingerprint(cur, table, store_id, rec["date_min"], rec["date_max"]) != rec["day_sums"]:
+                rec = None
+            elif rec["rows_written"] and _table_count(cur, table, store_id, rec["date_min"], rec["date_max"]) < rec["rows_written"]:
+                rec = None
+        cur.close()
+    except Exception:
+        return None
+    return rec
+
+
+def record_import(conn, digest, kind, path, store_id, rows_written=0, rows_total=None, dates=(), status="ok", message=None, table=None):
+    """写入/更新一条清单记录并提交；给出 table 时记下该表在日期范围内的日校验和指纹（须在 save_day_checksums 之后调用）。失败静默。"""
+    if not MANIFEST_ENABLED or not digest:
+        return
+    dates = [d for d in dates if d]
+    try:
+        ensure_manifest_tables(conn)
+        cur = conn.cursor()
+        day_sums = _range_fingerprint(cur, table, store_id, min(dates), max(dates)) if table and dates and status == "ok" else None
+        cur.execute(f"""
+            INSERT INTO {MANIFEST_TABLE}
+              (store_id, file_kind, file_hash, file_name, file_size, date_min, date_max, rows_total, rows_written, day_sums, status, message)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE file_name = VALUES(file_name), date_min = VALUES(date_min), date_max = VALUES(date_max),
+              rows_total = VALUES(rows_total), rows_written = VALUES(rows_written), day_sums = VALUES(day_sums),
+              status = VALUES(status), message = VALUES(message)
+        """, (
+            store_id, kind, digest, os.path.basename(path)[:255], os.path.getsize(path) if os.path.exists(path) else None,
+            min(dates) if dates else None, max(dates) if dates else None, rows_total, rows_written, day_sums, status,
+            (message or "")[:500] or None,
+        ))
+        conn.commit()
+        cur.close()
+    except Exception:
+        pass
+
+
+def _canon(v):
+    if isinstance(v, float):
+        return repr(round(v, 6))
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    if isinstance(v, date):
+        return v.isoformat()
+    return repr(v)
+
+
+def day_checksums(all_cols, vals_list):
+    """按 data_date 列分组计算行校验和：{日期: (sha256 十六进制, 行数)}。列按名称排序、行按内容排序后再哈希。"""
+    if not all_cols or "data_date" not in all_cols:
+        return {}
+    di = all_cols.index("data_date")
+    order = sorted(range(len(all_cols)), key=lambda i: all_cols[i])
+    header = "\x1f".join(all_cols[i] for i in order)
+    by_day = {}
+    for vals in vals_list:
+        by_day.setdefault(vals[di], []).append("\x1f".join(_canon(vals[i]) for i in order))
+    out = {}
+    for d, lines in by_day.items():
+        h = hashlib.sha256(header.encode("utf-8"))
+        for line in sorted(lines):
+            h.update(b"\x1e")
+            h.update(line.encode("utf-8"))
+        out[d] = (h.hexdigest(), len(lines))
+    return out
+
+
+def unchanged_days(conn, table, checksums, store_id):
+    """checksums 中与上次写入 table 时校验和相同、且 table 中该日行数不少于当时写入行数的日期集合。"""
+    if not MANIFEST_ENABLED or not checksums:
+        return set()
+    try:
+        ensure_manifest_tables(conn)
+        days = sorted(checksums, key=str)
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT data_date, checksum FROM {DAY_CHECKSUM_TABLE}
+            WHERE store_id = %s AND target_table = %s AND data_date IN ({", ".join(["%s"] * len(days))})
+        """, (store_id, table, *days))
+        stored = {str(_row_get(r, "data_date", 0)): _row_get(r, "checksum", 1) for r in cur.fetchall() or []}
+        same = [d for d, (cs, _) in checksums.items() if stored.get(str(d)) == cs]
+        if same:
+            cur.execute(
+                f"SELECT data_date, COUNT(*) AS n FROM {table} WHERE store_id = %s AND data_date IN ({', '.join(['%s'] * len(same))}) GROUP BY data_date",
+                (store_id, *same),
+            )
+            counts = {str(_row_get(r, "data_date", 0)): int(_row_get(r, "n", 1) or 0) for r in cur.fetchall() or []}
+            same = [d for d in same if counts.get(str(d), 0) >= checksums[d][1]]
+        cur.close()
+    except Exception:
+        return set()
+    return set(same)
+
+
+def save_day_checksums(conn, table, checksums, store_id):
+    """记录本次写入 table 的各日期校验和并提交；失败静默。"""
+    if not MANIFEST_ENABLED or not checksums:
+        return
+    try:
+        ensure_manifest_tables(conn)
+        cur = conn.cursor()
+        cur.executemany(f"""
+            INSERT INTO {DAY_CHECKSUM_TABLE} (store_id, target_table, data_date, checksum, row_count) VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE checksum = VALUES(checksum), row_count = VALUES(row_count)
+        """, [(store_id, table, d, cs, n) for d, (cs, n) in checksums.items()])
+        conn.commit()
+        cur.close()
+    except Exception:
+        pass
+
+
+def forget_days(conn, table, dates, store_id):
+    """
+    table 的这些日期即将被重写：删掉其日校验和（不提交，随调用方的写入事务提交）。
+    此后覆盖过这些日期的清单记录指纹不再一致、逐日比较也不再跳过；失败静默。
+    """
+    dates = sorted({d for d in dates if d}, key=str)
+    if not MANIFEST_ENABLED or not dates:
+        return
+    try:
+        ensure_manifest_tables(conn)
+        cur = conn.cursor()
+        cur.execute(
+            f"DELETE FROM {DAY_CHECKSUM_TABLE} WHERE store_id = %s AND target_table = %s AND data_date IN ({', '.join(['%s'] * len(dates))})",
+            (store_id, table, *dates),
+        )
+        cur.close()
+    except Exception:
+        pass
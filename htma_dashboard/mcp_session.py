@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+MCP（SSE 传输）客户端会话：连接一次 SSE、缓存 endpoint，之后的 tools/call 复用同一通道。
+原先每次查价都先开 SSE 流等 endpoint 事件、丢弃连接再 POST，每个商品多付一次往返与 SSE 建连。
+
+- 连接：GET sse_url 读到 `event: endpoint` 即得 POST 地址，SSE 流由后台线程继续读取（空闲超过 HTMA_MCP_SSE_IDLE_TIMEOUT 秒视为断开）；
+- 复用：JSON-RPC id 递增，多个线程可同时 call_tool；响应在 POST 响应体里（百度优选的做法）直接取，
+  否则等 SSE 流上 id 相同的 `message` 事件；
+- 重连：SSE 断开、POST 失败或 endpoint 失效（400/404/410）时丢弃连接，重新连接后重试一次；
+- 失败一律返回 None，与原 _mcp_youxuan_call_tool 一致。
+"""
+import itertools
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+try:
+    from rate_limit import urlopen as _limited_urlopen
+except ImportError:
+    from htma_dashboard.rate_limit import urlopen as _limited_urlopen
+
+MCP_SSE_IDLE_TIMEOUT = float(os.environ.get("HTMA_MCP_SSE_IDLE_TIMEOUT", "300"))  # 秒
+
+_STALE_ENDPOINT_CODES = (400, 404, 410)
+
+
+def _iter_events(resp):
+    """按 SSE 规则逐个产出 (event, data)：空行分隔事件，多行 data 以换行拼接，event 缺省为 message。"""
+    event, data = None, []
+    for raw in resp:
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event or "message", "\n".join(data)
+            event, data = None, []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+    if data:
+        yield event or "message", "\n".join(data)
+
+
+def _set_read_timeout(resp, timeout):
+    """建连用短超时，拿到 endpoint 后把 SSE 流的读超时放宽为空闲超时（取不到底层 socket 时保持原超时）。"""
+    try:
+        resp.fp.raw._sock.settimeout(timeout)
+    except Exception:
+        pass
+
+
+def _shutdown(resp):
+    """先 shutdown 底层 socket 让后台读线程的 readline 返回，再 close（否则 close 会等读线程持有的缓冲区锁）。"""
+    try:
+        resp.fp.raw._sock.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+    try:
+        resp.close()
+    except Exception:
+        pass
+
+
+class _Waiter:
+    def __init__(self, generation):
+        self.generation = generation
+        self.message = None
+        self.dropped = False
+        self._event = threading.Event()
+
+    def set(self, message, dropped=False):
+        self.message = message
+        self.dropped = dropped
+        self._event.set()
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+        return self.message
+
+
+class McpSseSession:
+    """
+    单个 MCP SSE 服务的长连接会话（线程安全）。base_url 用于拼接相对 endpoint（缺省取 sse_url 的协议+主机）；
+    provider 为 rate_limit 数据源名时，tools/call 的 POST 按该数据源限流。
+    """
+
+    def __init__(self, sse_url, base_url=None, provider=None, idle_timeout=None):
+        self.sse_url = sse_url
+        if base_url is None:
+            scheme, rest = sse_url.split("://", 1)
+            base_url = f"{scheme}://{rest.split('/', 1)[0]}"
+        self.base_url = base_url.rstrip("/")
+        self.provider = provider
+        self.idle_timeout = MCP_SSE_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.connects = 0  # 建立 SSE 连接的次数
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = {}  # str(id) -> _Waiter
+        self._endpoint = None
+        self._resp = None
+        self._generation = 0
+
+    def _resolve(self, endpoint):
+        if endpoint.startswith("http://") or endpoint.startswith("https://"):
+            return endpoint
+        if endpoint.startswith("/"):
+            return self.base_url + endpoint
+        return self.base_url + "/" + endpoint
+
+    def _ensure_connected(self, timeout):
+        """返回 (endpoint, generation)，未连接时建立 SSE 连接。"""
+        with self._lock:
+            if self._endpoint:
+                return self._endpoint, self._generation
+            req = urllib.request.Request(self.sse_url, headers={"Accept": "text/event-stream"})
+            resp = urllib.request.urlopen(req, timeout=timeout)
+            events = _iter_events(resp)
+            try:
+                endpoint = next((data for event, data in events if event == "endpoint"), None)
+            except Exception:
+                resp.close()
+                raise
+            if not endpoint:
+                resp.close()
+                raise ConnectionError("MCP SSE 未返回 endpoint 事件")
+            _set_read_timeout(resp, self.idle_timeout)
+            self._generation += 1
+            self._endpoint, self._resp = self._resolve(endpoint), resp
+            self.connects += 1
+            threading.Thread(
+                target=self._read_loop, args=(resp, events, self._generation), name="mcp-sse-reader", daemon=True,
+            ).start()
+            return self._endpoint, self._generation
+
+    def _read_loop(self, resp, events, generation):
+        try:
+            for event, data in events:
+                if event != "message":
+                    continue
+                try:
+                    msg = json.loads(data)
+                except ValueError:
+                    continue
+                for m in msg if isinstance(msg, list) else [msg]:
+                    if isinstance(m, dict) and m.get("id") is not None:
+                        with self._lock:
+                            waiter = self._pending.pop(str(m["id"]), None)
+                        if waiter:
+                            waiter.set(m)
+        except Exception:
+            pass
+        finally:
+            self._drop(generation)
+
+    def _drop(self, generation):
+        """丢弃指定代的连接：关闭 SSE 流，该连接上仍在等待的请求以 dropped 结束。"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            resp, self._endpoint, self._resp = self._resp, None, None
+            dropped = [k for k, w in self._pending.items() if w.generation == generation]
+            waiters = [self._pending.pop(k) for k in dropped]
+        for w in waiters:
+            w.set(None, dropped=True)
+        if resp is not None:
+            _shutdown(resp)
+
+    def _post(self, endpoint, payload, timeout):
+        req = urllib.request.Request(
+            endpoint, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}, method="POST",
+        )
+        opener = _limited_urlopen(self.provider, req, timeout) if self.provider else urllib.request.urlopen(req, timeout=timeout)
+        with opener as r:
+            return r.read()
+
+    def call_tool(self, name, arguments, timeout=12):
+        """JSON-RPC tools/call，返回 result；失败（含重连重试后仍失败、超时）返回 None。"""
+        for attempt in range(2):
+            try:
+                endpoint, generation = self._ensure_connected(timeout)
+            except Exception:
+                return None
+            rid = next(self._ids)
+            waiter = _Waiter(generation)
+            with self._lock:
+                self._pending[str(rid)] = waiter
+            payload = {"jsonrpc": "2.0", "id": rid, "method": "tools/call", "params": {"name": name, "arguments": arguments}}
+            try:
+                body = self._post(endpoint, payload, timeout)
+            except Exception as e:
+                with self._lock:
+                    self._pending.pop(str(rid), None)
+                if isinstance(e, urllib.error.HTTPError) and e.code not in _STALE_ENDPOINT_CODES:
+                    return None
+                self._drop(generation)
+                continue
+            msg = None
+            try:
+                out = json.loads(body.decode("utf-8")) if body and body.strip() else None
+                if isinstance(out, dict) and ("result" in out or "error" in out):
+                    msg = out
+            except ValueError:
+                pass
+            if msg is None:
+                msg = waiter.wait(timeout)
+            with self._lock:
+                self._pending.pop(str(rid), None)
+            if msg is None:
+                if waiter.dropped:
+                    continue
+                return None
+            return msg.get("result") if "result" in msg else None
+        return None
+
+    def close(self):
+        self._drop(self._generation)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+多文件并行导入（下载目录批量导入 / 月底补导多份销售日报）。
+
+- 解析阶段（读 Excel + 表头检测 + 逐行解析聚合，CPU 密集且各文件独立）放进进程池并行，子进程只返回解析好的行批次，不连数据库；
+- 写库阶段在调用方连接上按文件原顺序逐个进行：同一张表不会并发写入（无锁竞争），同 (日期, 货号) 仍以后写入的文件为准，
+  与逐个导入结果一致；前面的文件写库时后面的文件已在子进程中解析；
+- 派生表只在全部文件写完后刷新一次：销售日汇总按合并后的日期刷新，数据版本号只递增一次；
+  毛利/品类/商品表由调用方按返回的 partitions 刷新一次；
+- 导入清单（import_manifest）：内容与已成功导入的文件相同则不解析直接跳过（记入 skipped），
+  与已写入数据按日校验和相同的日期不再写库，force=True 时照常全部导入。
+进程数 HTMA_IMPORT_PARSE_WORKERS（默认 CPU 核数），1 或只有一个文件时在当前进程内顺序解析；进程池不可用时自动退回顺序解析。
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+
+try:
+    from import_jobs import begin_file, stage as job_stage
+    from import_manifest import day_checksums, file_digest, find_import, record_import, save_day_checksums, unchanged_days
+    from import_logic import (
+        STORE_ID,
+        _bumps_data_version,
+        _refresh_sale_rollup_safe,
+        _refresh_sku_dim_safe,
+        parse_sale_file,
+        parse_stock_file,
+        write_parsed_sale,
+        write_parsed_stock,
+    )
+except ImportError:  # 脚本以 htma_dashboard.parallel_import 形式导入
+    from htma_dashboard.import_jobs import begin_file, stage as job_stage
+    from htma_dashboard.import_manifest import day_checksums, file_digest, find_import, record_import, save_day_checksums, unchanged_days
+    from htma_dashboard.import_logic import (
+        STORE_ID,
+        _bumps_data_version,
+        _refresh_sale_rollup_safe,
+        _refresh_sku_dim_safe,
+        parse_sale_file,
+        parse_stock_file,
+        write_parsed_sale,
+        write_parsed_stock,
+    )
+
+PARSE_WORKERS = int(os.environ.get("HTMA_IMPORT_PARSE_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+
+PARALLEL_KINDS = ("sale_daily", "sale_summary", "stock")
+
+TARGET_TABLES = {"sale_daily": "t_htma_sale", "sale_summary": "t_htma_sale", "stock": "t_htma_stock"}
+
+
+def parse_file(kind, path):
+    """在子进程中执行：按类型解析单个文件，返回 parse_sale_file / parse_stock_file 的结果。"""
+    if kind == "stock":
+        return parse_stock_file(path)
+    return parse_sale_file(path, is_summary=(kind == "sale_summary"))
+
+
+def _parse_safe(kind, path):
+    try:
+        return parse_file(kind, path)
+    except Exception as e:
+        return e
+
+
+def _iter_parsed(files, workers):
+    """按 files 顺序逐个给出 (kind, path, 解析结果或异常)；进程池最多提前解析 2×workers 个文件，控制内存。"""
+    pool = None
+    if workers > 1 and len(files) > 1:
+        try:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(files)))
+        except Exception:
+            pool = None
+    if pool is None:
+        for kind, path in files:
+            yield kind, path, _parse_safe(kind, path)
+        return
+    try:
+        todo = iter(files)
+        window = deque((kind, path, pool.submit(parse_file, kind, path)) for kind, path in islice(todo, 2 * workers))
+        while window:
+            kind, path, fut = window.popleft()
+            try:
+                parsed = fut.result()
+            except BrokenProcessPool:
+                # 子进程异常退出：本文件及剩余文件改在当前进程顺序解析
+                for k, p in chain([(kind, path)], ((k, p) for k, p, _ in window), todo):
+                    yield k, p, _parse_safe(k, p)
+                return
+            except Exception as e:
+                parsed = e
+            nxt = next(todo, None)
+            if nxt is not None:
+                window.append((nxt[0], nxt[1], pool.submit(parse_file, *nxt)))
+            yield kind, path, parsed
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _drop_unchanged_days(conn, kind, parsed, force=False):
+    """
+    按日校验和去掉与上次写入相同的日期（原地修改 parsed，行与 keys / src_rows 保持对应；force 时不去掉）。
+    返回 (本次写入日期的校验和, 跳过的日期)。
+    """
+    if "diag" in parsed:
+        return {}, set()
+    cols = parsed["col_list"] if kind == "stock" else parsed["all_cols"]
+    sums = day_checksums(cols, parsed["vals_list"])
+    same = set() if force else unchanged_days(conn, TARGET_TABLES[kind], sums, STORE_ID)
+    if not same:
+        return sums, set()
+    di = cols.index("data_date")
+    keep = [i for i, vals in enumerate(parsed["vals_list"]) if vals[di] not in same]
+    parsed["vals_list"] = [parsed["vals_list"][i] for i in keep]
+    if kind == "stock":
+        parsed["src_rows"] = [parsed["src_rows"][i] for i in keep]
+    else:
+        parsed["keys"] = [k for k in parsed["keys"] if k[0] not in same]
+    return {d: v for d, v in sums.items() if d not in same}, same
+
+
+def _parsed_dates(kind, parsed):
+    if "diag" in parsed:
+        return []
+    if kind == "stock":
+        return [parsed["data_date"]]
+    return sorted({dt for dt, _ in parsed["keys"]})
+
+
+@_bumps_data_version
+def import_excel_files(conn, files, workers=None, overwrite_on_duplicate=True, force=False):
+    """
+    files: [(kind, path)]，kind 为 sale_daily / sale_summary / stock，按写入顺序排列（同键后者覆盖前者）。
+    返回 dict：counts {kind: 导入条数}、diagnostics、errors、partitions（传给 refresh_profit / refresh_category_from_sale）、
+    files [(kind, path, 条数, 诊断)]、rollup_err（日汇总刷新失败原因，同时计入 diagnostics）、
+    skipped [(kind, path)]（内容与已导入文件相同而跳过，force=True 时为空）。单个文件失败记入 errors，不影响其他文件。
+    """
+    out = {
+        "counts": {k: 0 for k in PARALLEL_KINDS}, "diagnostics": [], "errors": [], "partitions": set(), "files": [],
+        "rollup_err": None, "skipped": [],
+    }
+    digests, todo = {}, []
+    for kind, path in files:
+        try:
+            digests[path] = file_digest(path)
+        except OSError:
+            digests[path] = None  # 读不到的文件交给解析阶段报错
+        seen = None if force else find_import(conn, digests[path], kind, STORE_ID, TARGET_TABLES.get(kind))
+        if seen:
+            out["skipped"].append((kind, path))
+            out["diagnostics"].append(f"{kind} {os.path.basename(path)}: 内容与 {seen['file_name']}（{seen['created_at']}）相同，已跳过")
+        else:
+            todo.append((kind, path))
+    parsed_files = _iter_parsed(todo, workers or PARSE_WORKERS)
+    while True:
+        begin_file(None)
+        job_stage("parse")  # 等待子进程解析下一个文件
+        item = next(parsed_files, None)
+        if item is None:
+            break
+        kind, path, parsed = item
+        name = os.path.basename(path)
+        begin_file(kind)
+        if isinstance(parsed, Exception):
+            out["errors"].append(f"{kind} {name}: {parsed}")
+            record_import(conn, digests[path], kind, path, STORE_ID, status="failed", message=str(parsed))
+            continue
+        dates = _parsed_dates(kind, parsed)
+        rows_total = len(parsed.get("vals_list") or ())
+        sums, same = _drop_unchanged_days(conn, kind, parsed, force)
+        if same and not parsed["vals_list"]:
+            diag = f"{kind} {name}: {len(same)} 天数据与已导入的相同，已跳过"
+            out["files"].append((kind, path, 0, diag))
+            out["diagnostics"].append(diag)
+            record_import(conn, digests[path], kind, path, STORE_ID, 0, rows_total, dates, message=diag, table=TARGET_TABLES[kind])
+            continue
+        try:
+            if kind == "stock":
+                cnt, diag, failed = write_parsed_stock(conn, parsed)
+            else:
+                cnt, diag, parts, failed = write_parsed_sale(conn, parsed, overwrite_on_duplicate, refresh_rollup=False)
+                out["partitions"] |= parts
+        except Exception as e:
+            out["errors"].append(f"{kind} {name}: {e}")
+            record_import(conn, digests[path], kind, path, STORE_ID, status="failed", message=str(e))
+            continue
+        if same:
+            diag = (diag + "; " if diag else "") + f"{len(same)} 天数据未变化已跳过"
+        out["counts"][kind] += cnt
+        out["files"].append((kind, path, cnt, diag))
+        if diag:
+            out["diagnostics"].append(diag)
+        # 有写库失败的行时不记为已导入、不保存逐日校验和，下次导入同一文件会重试这些日期
+        ok = "diag" not in parsed and failed == 0 and (cnt > 0 or not parsed["vals_list"])
+        if ok:
+            save_day_checksums(conn, TARGET_TABLES[kind], sums, STORE_ID)
+        record_import(conn, digests[path], kind, path, STORE_ID, cnt, rows_total, dates, "ok" if ok else "failed", diag, TARGET_TABLES[kind])
+    if out["partitions"]:
+        begin_file(None)
+        job_stage("backfill")
+        sale_dates = {d for s, d in out["partitions"] if s == STORE_ID}
+        out["rollup_err"] = _refresh_sale_rollup_safe(conn, sale_dates)
+        if out["rollup_err"]:
+            out["diagnostics"].append(out["rollup_err"])
+        dim_err = _refresh_sku_dim_safe(conn, sale_dates)
+        if dim_err:
+            out["diagnostics"].append(dim_err)
+    return out
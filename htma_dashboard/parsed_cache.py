@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+预览与导入共用的销售表解析结果缓存：预览（/api/import preview_only=1、/api/import_preview）时顺带完成整表解析，
+按列存成压缩 npz，返回 preview_token；确认导入时传 preview_token 即可直接从解析好的列写库，不再重新上传和解析。
+
+- token = 类型 + 文件内容 SHA-256 前 32 位，同一文件重复预览得到同一 token；
+- 每列按类型存为 int64 / float64 数组，字符串列存 UTF-8 字节缓冲 + 偏移量 + 空值掩码（同 Arrow 的字符串布局），
+  类型混杂的列存 JSON 文本，不依赖 pickle；元数据（列名、统计、文件名）存 JSON；
+- 目录 HTMA_PARSED_CACHE_DIR（默认系统临时目录/htma_parsed_cache），HTMA_PARSED_CACHE_TTL 秒（默认 7200）后过期，
+  写入新条目时顺带清理过期文件。
+"""
+import json
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+PARSED_CACHE_DIR = os.environ.get("HTMA_PARSED_CACHE_DIR", "").strip() or os.path.join(tempfile.gettempdir(), "htma_parsed_cache")
+PARSED_CACHE_TTL = int(os.environ.get("HTMA_PARSED_CACHE_TTL", "7200"))
+
+CACHE_KINDS = ("sale_daily", "sale_summary")
+
+_TOKEN_RE = re.compile(r"^(sale_daily|sale_summary)-[0-9a-f]{32}$")
+
+
+def make_token(kind, digest):
+    return f"{kind}-{digest[:32]}"
+
+
+def _path(token):
+    return os.path.join(PARSED_CACHE_DIR, token + ".npz")
+
+
+def _column_type(values):
+    kinds = {type(v) for v in values if v is not None}
+    if not kinds:
+        return "n"
+    if kinds == {int}:
+        return "i" if None not in values else "o"
+    if kinds <= {int, float}:
+        return "f" if None not in values else "o"
+    if kinds == {str}:
+        return "s"
+    return "o"
+
+
+def _pack_str(arrays, name, values):
+    enc = [("" if v is None else v).encode("utf-8") for v in values]
+    arrays[name] = np.frombuffer(b"".join(enc), dtype=np.uint8)
+    arrays[name + "_off"] = np.cumsum([0] + [len(b) for b in enc], dtype=np.int64)
+
+
+def _unpack_str(z, name):
+    buf, offs = z[name].tobytes(), z[name + "_off"].tolist()
+    return [buf[offs[i]:offs[i + 1]].decode("utf-8") for i in range(len(offs) - 1)]
+
+
+def _encode(parsed):
+    cols, rows = parsed["all_cols"], parsed["vals_list"]
+    arrays, types = {}, []
+    for j in range(len(cols)):
+        values = [r[j] for r in rows]
+        t = _column_type(values)
+        types.append(t)
+        if t == "i":
+            arrays[f"c{j}"] = np.array(values, dtype=np.int64)
+        elif t == "f":
+            arrays[f"c{j}"] = np.array(values, dtype=np.float64)
+        elif t == "s":
+            _pack_str(arrays, f"c{j}", values)
+            arrays[f"m{j}"] = np.array([v is None for v in values], dtype=bool)
+        elif t == "o":
+            arrays[f"c{j}"] = np.array(json.dumps(values, ensure_ascii=False, default=str))
+    _pack_str(arrays, "k_date", [str(d) for d, _ in parsed["keys"]])
+    _pack_str(arrays, "k_sku", [str(s) for _, s in parsed["keys"]])
+    return arrays, types
+
+
+def _decode(z, meta):
+    n = meta["rows"]
+    columns = []
+    for j, t in enumerate(meta["types"]):
+        if t == "n":
+            columns.append([None] * n)
+        elif t in ("i", "f"):
+            columns.append(z[f"c{j}"].tolist())
+        elif t == "s":
+            vals, mask = _unpack_str(z, f"c{j}"), z[f"m{j}"].tolist()
+            columns.append([None if m else v for v, m in zip(vals, mask)])
+        else:
+            columns.append(json.loads(z[f"c{j}"].item()))
+    return {
+        "is_summary": meta["is_summary"], "all_cols": meta["all_cols"], "vals_list": [list(r) for r in zip(*columns)] if columns else [],
+        "keys": list(zip(_unpack_str(z, "k_date"), _unpack_str(z, "k_sku"))), "stats": meta["stats"], "profile": meta.get("profile"),
+    }
+
+
+def store_parsed(kind, digest, parsed, file_name=None):
+    """缓存 parse_sale_file 的结果，返回 preview_token；无数据（diag）或写入失败返回 None。"""
+    if kind not in CACHE_KINDS or not digest or "diag" in parsed:
+        return None
+    token = make_token(kind, digest)
+    try:
+        os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+        prune()
+        arrays, types = _encode(parsed)
+        meta = {
+            "kind": kind, "is_summary": parsed["is_summary"], "all_cols": parsed["all_cols"], "types": types,
+            "rows": len(parsed["vals_list"]), "stats": parsed["stats"], "profile": parsed.get("profile"),
+            "file_name": file_name, "created": time.time(),
+        }
+        fd, tmp = tempfile.mkstemp(prefix=".parsed.", suffix=".npz", dir=PARSED_CACHE_DIR)
+        with os.fdopen(fd, "wb") as fp:
+            np.savez_compressed(fp, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+        os.replace(tmp, _path(token))
+    except Exception:
+        return None
+    return token
+
+
+def parsed_token_kind(token):
+    """token 有效且未过期时返回其类型（sale_daily / sale_summary），否则 None；不读取内容。"""
+    if not token or not _TOKEN_RE.match(token):
+        return None
+    try:
+        if time.time() - os.path.getmtime(_path(token)) > PARSED_CACHE_TTL:
+            return None
+    except OSError:
+        return None
+    return token.split("-", 1)[0]
+
+
+def load_parsed(token):
+    """按 preview_token 取回 (kind, parsed, file_name)；token 无效、过期或文件损坏返回 None。"""
+    if not token or not _TOKEN_RE.match(token):
+        return None
+    path = _path(token)
+    try:
+        if time.time() - os.path.getmtime(path) > PARSED_CACHE_TTL:
+            os.unlink(path)
+            return None
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(z["meta"].item())
+            return meta["kind"], _decode(z, meta), meta.get("file_name")
+    except Exception:
+        return None
+
+
+def prune():
+    """删除过期的缓存文件。"""
+    now = time.time()
+    try:
+        names = os.listdir(PARSED_CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(PARSED_CACHE_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > PARSED_CACHE_TTL:
+                os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+竞品价格缓存：货盘比价、每日 TOP 比价、/api/price_compare 与批量比价脚本对几分钟/几小时前刚查过的商品不再重复调用付费接口。
+
+- 两级：进程内 LRU（HTMA_PRICE_CACHE_LRU_ENTRIES 条）-> MySQL 表 t_htma_price_cache（scripts/33_create_price_cache.sql，open_price_cache 时自动建表）；
+- key：条码规范化后为 `bc:<条码>`，无条码时为 `kw:<build_search_keyword 结果，小写、合并空白>`；另按数据源区分：
+  fetcher 名，fetcher 带 price_sources()（返回当前已配置的数据源名）时再加上配置集合的摘要，
+  不同 fetcher 或同一 fetcher 换了数据源配置后互不复用；
+- 存：最低价、平台、match_type、完整结果（JSON）与检索时间；接口明确无结果也记一条（负缓存，min_price 为 NULL）。
+  检索过程中有数据源请求失败（网络、超时、HTTP 错误，由 fetcher 调 note_fetch_error 标记）时空结果不做负缓存，下次重查；
+- 有效期：有价条目 HTMA_PRICE_CACHE_TTL 秒，负缓存 HTMA_PRICE_CACHE_NEGATIVE_TTL 秒；调用方传 max_age 时两者都改用 max_age
+  （看板临时比价传较大的 max_age 并配合 fetch_limit=0，可完全由缓存出结果）；
+- 表不可用等异常一律按未命中处理，不影响比价。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+PRICE_CACHE_ENABLED = os.environ.get("HTMA_PRICE_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+PRICE_CACHE_TTL = int(os.environ.get("HTMA_PRICE_CACHE_TTL", "86400"))  # 秒
+PRICE_CACHE_NEGATIVE_TTL = int(os.environ.get("HTMA_PRICE_CACHE_NEGATIVE_TTL", "21600"))  # 秒
+PRICE_CACHE_LRU_ENTRIES = int(os.environ.get("HTMA_PRICE_CACHE_LRU_ENTRIES", "5000"))
+CACHE_TABLE = "t_htma_price_cache"
+
+_KEYS_PER_STATEMENT = 500
+
+
+def normalize_barcode(barcode):
+    """条码只留数字，12/13/14 位有效（与 baidu_fetcher 的条码优先检索一致），否则返回 None。"""
+    if not barcode:
+        return None
+    s = "".join(c for c in str(barcode).strip() if c.isdigit())
+    return s if len(s) in (12, 13, 14) else None
+
+
+def normalize_keyword(keyword):
+    return re.sub(r"\s+", " ", str(keyword or "")).strip().lower()
+
+
+def cache_key(barcode=None, keyword=None):
+    """条码优先，其次关键词；都没有时返回 None（不缓存）。"""
+    bc = normalize_barcode(barcode)
+    if bc:
+        return f"bc:{bc}"
+    kw = normalize_keyword(keyword)
+    return f"kw:{kw[:180]}" if kw else None
+
+
+class _LRU:
+    """进程内 LRU：value 为 (结果 dict 或 None, 检索时刻 epoch 秒)。"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None:
+                self._data.move_to_end(key)
+            return hit
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_lru = _LRU(PRICE_CACHE_LRU_ENTRIES)
+_table_ready = False
+_fetch_state = threading.local()
+
+
+def note_fetch_error():
+    """数据源请求失败（网络、超时、HTTP 错误）时由 fetcher 调用：当前线程本次检索的空结果不做负缓存。"""
+    _fetch_state.errored = True
+
+
+def fetch_with_status(fetch, *args):
+    """调用 fetch(*args)，返回 (结果, 本次检索中是否有数据源请求失败)；按线程统计，可在检索线程池中使用。"""
+    _fetch_state.errored = False
+    try:
+        return fetch(*args), _fetch_state.errored
+    finally:
+        _fetch_state.errored = False
+
+
+def ensure_price_cache_table(conn):
+    """建缓存表（已存在则跳过，每进程只执行一次）。DDL 会隐式提交，须在写业务数据之前调用。"""
+    global _table_ready
+    if _table_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+              cache_key   VARCHAR(191)  NOT NULL COMMENT 'bc:条码 或 kw:规范化关键词',
+              provider    VARCHAR(64)   NOT NULL COMMENT '数据源（fetcher 名）',
+              min_price   DECIMAL(12, 2) DEFAULT NULL COMMENT '竞品最低价，NULL 为无结果（负缓存）',
+              platform    VARCHAR(255)  DEFAULT NULL,
+              match_type  VARCHAR(32)   DEFAULT NULL,
+              payload     TEXT          DEFAULT NULL COMMENT '完整检索结果 JSON',
+              fetched_at  DATETIME      NOT NULL COMMENT '检索时间',
+              PRIMARY KEY (cache_key, provider),
+              KEY idx_fetched (fetched_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='竞品价格缓存'
+        """)
+    _table_ready = True
+
+
+class PriceCache:
+    """
+    单个数据源的价格缓存。get_many 返回 {key: 结果 dict 或 None(负缓存)}，未命中/已过期的 key 不出现；
+    put_many 写入两级（结果为 None 即负缓存）。conn 为调用方连接，不建表、不提交，由调用方决定提交时机。
+    """
+
+    def __init__(self, conn, provider, ttl=None, negative_ttl=None, max_age=None):
+        self.conn = conn
+        self.provider = provider
+        self.ttl = PRICE_CACHE_TTL if ttl is None else ttl
+        self.negative_ttl = PRICE_CACHE_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        self.max_age = max_age
+
+    def _fresh(self, result, age):
+        limit = self.max_age if self.max_age is not None else (self.ttl if result is not None else self.negative_ttl)
+        return age <= limit
+
+    def get_many(self, keys):
+        now = time.time()
+        out, missing = {}, []
+        for k in dict.fromkeys(k for k in keys if k):
+            hit = _lru.get((self.provider, k))
+            if hit is not None and self._fresh(hit[0], now - hit[1]):
+                out[k] = hit[0]
+            else:
+                missing.append(k)
+        if missing and self.conn is not None:
+            try:
+                with self.conn.cursor() as cur:
+                    for i in range(0, len(missing), _KEYS_PER_STATEMENT):
+                        chunk = missing[i:i + _KEYS_PER_STATEMENT]
+                        ph = ", ".join(["%s"] * len(chunk))
+                        cur.execute(
+                            f"SELECT cache_key, payload, TIMESTAMPDIFF(SECOND, fetched_at, NOW()) AS age FROM {CACHE_TABLE} "
+                            f"WHERE provider = %s AND cache_key IN ({ph})",
+                            (self.provider, *chunk),
+                        )
+                        for r in cur.fetchall():
+                            result = json.loads(r["payload"]) if r.get("payload") else None
+                            age = max(0, int(r.get("age") or 0))
+                            _lru.set((self.provider, r["cache_key"]), (result, now - age))
+                            if self._fresh(result, age):
+                                out[r["cache_key"]] = result
+            except Exception:
+                pass
+        return out
+
+    def put_many(self, entries):
+        """entries: [(key, 结果 dict 或 None)]；key 为空的跳过。"""
+        now = time.time()
+        rows = []
+        for k, result in entries:
+            if not k:
+                continue
+            _lru.set((self.provider, k), (result, now))
+            price = result.get("min_price") if result else None
+            rows.append((
+                k, self.provider, price,
+                (result.get("platform") or "")[:255] if result else None,
+                (result.get("match_type") or None) if result else None,
+                json.dumps(result, ensure_ascii=False, default=str) if result else None,
+            ))
+        if not rows or self.conn is None:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.executemany(f"""
+                    INSERT INTO {CACHE_TABLE} (cache_key, provider, min_price, platform, match_type, payload, fetched_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                    ON DUPLICATE KEY UPDATE min_price = VALUES(min_price), platform = VALUES(platform),
+                        match_type = VALUES(match_type), payload = VALUES(payload), fetched_at = VALUES(fetched_at)
+                """, rows)
+        except Exception:
+            pass  # 单条语句失败只回滚该语句，不影响调用方事务
+
+
+def provider_name(fetcher):
+    """缓存的数据源名：fetcher 名；fetcher 带 price_sources() 时加上已配置数据源集合的摘要（同一 fetcher 换配置不复用旧结果）。"""
+    name = getattr(fetcher, "__name__", None) or type(fetcher).__name__
+    sources = getattr(fetcher, "price_sources", None)
+    if callable(sources):
+        digest = hashlib.sha1(",".join(sorted(sources())).encode("utf-8")).hexdigest()[:12]
+        return f"{name[:51]}:{digest}"
+    return name[:64]
+
+
+def open_price_cache(conn, fetcher, max_age=None):
+    """
+    按 fetcher 取缓存；HTMA_PRICE_CACHE=0 或没有真实 fetcher 时返回 None。
+    建表 DDL 会隐式提交，在此执行：调用方须在写业务数据之前打开缓存。
+    """
+    if not PRICE_CACHE_ENABLED or fetcher is None:
+        return None
+    try:
+        ensure_price_cache_table(conn)
+    except Exception:
+        pass  # 建表失败按未命中处理
+    return PriceCache(conn, provider_name(fetcher), max_age=max_age)
+
+
+def clear_memory_cache():
+    """清空进程内 LRU（测试用）。"""
+    _lru.clear()
@@ -9,10 +9,17 @@
 """
 import os
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
 from typing import Optional, Callable
 
+try:
+    from price_cache import cache_key as price_cache_key, fetch_with_status, open_price_cache
+    from stock_latest import stock_source
+except ImportError:
+    from htma_dashboard.price_cache import cache_key as price_cache_key, fetch_with_status, open_price_cache
+    from htma_dashboard.stock_latest import stock_source
+
 # 单位标准化映射
 _UNIT_MAP = {
     "克": "g", "千克": "kg", "公斤": "kg", "毫升": "ml", "升": "L",
@@ -25,6 +32,9 @@ _FILTER_WORDS = ("特价", "促销", "包邮", "限时", "秒杀", "清仓", "
 _TIER_HIGH = 20      # ≥20% 高优势
 _TIER_MID = 5        # 5%~20% 中等
 _TIER_LOW = 0        # 0~5% 无优势
+
+# 阶段3 真实 fetcher 并发检索的线程数（各数据源的 QPS/并发另由 rate_limit 控制）；<=1 为逐个检索
+PRICE_FETCH_WORKERS = int(os.environ.get("HTMA_PRICE_FETCH_WORKERS", "8"))
 # <0% 价格劣势
 
 
@@ -33,8 +43,9 @@ def stage1_standardize(conn, store_id: str = "沈阳超级仓", days: int = 30,
     阶段1：自有数据标准化
     从 t_htma_sale + t_htma_stock 导出并清洗，形成可检索的商品数据集。
     """
+    stock = stock_source(conn, store_id)
     cur = conn.cursor()
-    cur.execute("""
+    cur.execute(f"""
         SELECT s.sku_code,
                COALESCE(st.product_name, s.product_name, s.sku_code) AS raw_name,
                MAX(COALESCE(st.spec, s.spec)) AS spec,
@@ -46,8 +57,8 @@ def stage1_standardize(conn, store_id: str = "沈阳超级仓", days: int = 30,
                SUM(s.gross_profit) AS gross_profit,
                SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) AS unit_price
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s
           AND s.data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
           AND COALESCE(s.category_small,'') NOT LIKE %s
@@ -105,8 +116,9 @@ def stage1_standardize_for_skus(
     if not sku_list:
         return []
     placeholders = ",".join(["%s"] * len(sku_list))
+    stock = stock_source(conn, store_id)
     cur = conn.cursor()
-    cur.execute("""
+    cur.execute(f"""
         SELECT s.sku_code,
                COALESCE(st.product_name, s.product_name, s.sku_code) AS raw_name,
                MAX(COALESCE(st.spec, s.spec)) AS spec,
@@ -118,8 +130,8 @@ def stage1_standardize_for_skus(
                SUM(s.gross_profit) AS gross_profit,
                SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) AS unit_price
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s
           AND s.data_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
           AND s.sku_code IN (""" + placeholders + """)
@@ -171,6 +183,7 @@ def stage1_standardize_single_day(
     用于每日自动比价：只对当天（或昨日）销售占比高、销售额大的商品比价。
     data_date 为 None 时自动选择：优先今日，无数据则昨日。
     """
+    stock = stock_source(conn, store_id)
     cur = conn.cursor()
     if data_date is None:
         cur.execute(
@@ -185,7 +198,7 @@ def stage1_standardize_single_day(
         data_date = rows[0]["data_date"]
         if isinstance(data_date, datetime):
             data_date = data_date.date()
-    cur.execute("""
+    cur.execute(f"""
         SELECT s.sku_code,
                COALESCE(st.product_name, s.product_name, s.sku_code) AS raw_name,
                MAX(COALESCE(st.spec, s.spec)) AS spec,
@@ -197,8 +210,8 @@ def stage1_standardize_single_day(
                SUM(s.gross_profit) AS gross_profit,
                SUM(s.sale_amount)/NULLIF(SUM(s.sale_qty),0) AS unit_price
         FROM t_htma_sale s
-        LEFT JOIN t_htma_stock st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
-            AND st.data_date = (SELECT MAX(t.data_date) FROM t_htma_stock t WHERE t.store_id = %s)
+        LEFT JOIN {stock} st ON st.sku_code = s.sku_code AND st.store_id = s.store_id
+            AND st.data_date = (SELECT MAX(t.data_date) FROM {stock} t WHERE t.store_id = %s)
         WHERE s.store_id = %s AND s.data_date = %s
           AND COALESCE(s.category_small,'') NOT LIKE %s
           AND COALESCE(s.category_small,'') NOT LIKE %s
@@ -395,28 +408,65 @@ def stage2_mock_fetcher(std_name: str) -> Optional[dict]:
     return {"min_price": round(base * 1.15, 2), "platform": "模拟", "is_same_spec": True}
 
 
+def _fetch_competitor_prices(items: list[dict], get_price, concurrent: bool):
+    """
+    按 items 顺序逐个产出 (竞品价, 检索中是否有数据源请求失败)，竞品价为 stage2_fetch_competitor_price 的结果。
+    concurrent 时在线程池中并发检索，产出顺序仍与 items 一致；某个商品检索抛异常时在产出到该商品时抛出（与逐个检索时一致）。
+    """
+    workers = min(PRICE_FETCH_WORKERS, len(items))
+    if not concurrent or workers <= 1:
+        for it in items:
+            yield fetch_with_status(stage2_fetch_competitor_price, it, get_price)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="htma-price-fetch") as pool:
+        futures = [pool.submit(fetch_with_status, stage2_fetch_competitor_price, it, get_price) for it in items]
+        try:
+            for f in futures:
+                yield f.result()
+        finally:
+            for f in futures:
+                f.cancel()
+
+
 def stage3_calc_advantage(
     items: list[dict],
     fetcher: Optional[Callable[[str], Optional[dict]]] = None,
     use_mock: bool = True,
     fetch_limit: Optional[int] = None,
+    cache=None,
 ) -> list[dict]:
     """
     阶段3：价格对比与指标量化
     价格优势率 = (竞品最低价 - 好特卖售价) / 竞品最低价 * 100%
     fetch_limit: 使用真实 fetcher 时，仅对前 N 个商品调用 API，其余标为独家款，用于控制成本
+    真实 fetcher 在 HTMA_PRICE_FETCH_WORKERS 个线程中并发检索，各数据源按 rate_limit 限流；结果顺序与输入一致。
+    cache: price_cache.PriceCache，命中的商品直接用缓存结果（不计入 fetch_limit、不调用 API），检索结果写回缓存；
+    检索中有数据源请求失败且没拿到价格的商品不写回（不把故障当成「无结果」负缓存）。
     """
     get_price = fetcher or (stage2_mock_fetcher if use_mock else None)
-    out = []
+    cache = cache if fetcher else None
+    priced = []  # [(item, 是否检索, 缓存 key)]，保持输入顺序
     for idx, it in enumerate(items):
-        ht_price = float(it.get("unit_price") or 0)
-        if ht_price <= 0:
+        if float(it.get("unit_price") or 0) <= 0:
             continue
-        # 真实 API 时，可限制调用次数以控制成本；模拟模式不限制
-        do_fetch = get_price and (not fetcher or fetch_limit is None or idx < fetch_limit)
-        if fetcher and do_fetch:
-            time.sleep(0.12)  # 限流，避免第三方 API 超频
-        comp = stage2_fetch_competitor_price(it, get_price if do_fetch else None) if get_price else None
+        # 真实 API 时，可限制调用次数以控制成本（按输入序号计，含被跳过的商品）；模拟模式不限制
+        do_fetch = bool(get_price) and (not fetcher or fetch_limit is None or idx < fetch_limit)
+        key = price_cache_key(it.get("barcode"), build_search_keyword(it)) if cache else None
+        priced.append((it, do_fetch, key))
+    cached = cache.get_many([key for _, _, key in priced]) if cache else {}
+    to_fetch = [(it, key) for it, do_fetch, key in priced if do_fetch and key not in cached]
+    comps = _fetch_competitor_prices([it for it, _ in to_fetch], get_price, concurrent=bool(fetcher))
+    fetched = {}  # id(item) -> (检索结果, 是否有数据源请求失败)
+    out = []
+    for it, do_fetch, key in priced:
+        ht_price = float(it.get("unit_price") or 0)
+        if key in cached:
+            comp = cached[key]
+        elif do_fetch:
+            fetched[id(it)] = next(comps)
+            comp = fetched[id(it)][0]
+        else:
+            comp = None
         if not comp or comp.get("min_price") is None or float(comp.get("min_price") or 0) <= 0:
             it["advantage_pct"] = None
             it["competitor_min"] = None
@@ -450,6 +500,14 @@ def stage3_calc_advantage(
             else:
                 it["tier"] = "价格劣势款"
         out.append(it)
+    if cache and to_fetch:
+        entries = []
+        for it, key in to_fetch:
+            comp, errored = fetched[id(it)]
+            has_price = bool(comp) and comp.get("min_price") is not None
+            if key and (has_price or not errored):
+                entries.append((key, comp))
+        cache.put_many(entries)
     return out
 
 
@@ -498,6 +556,16 @@ def stage4_portfolio_analysis(items: list[dict]) -> dict:
     }
 
 
+def _commit_price_cache(conn, cache):
+    """提交 stage3 写入的竞品价缓存（PriceCache.put_many 不提交）；失败不影响比价结果。"""
+    if cache is None:
+        return
+    try:
+        conn.commit()
+    except Exception:
+        pass
+
+
 def run_full_pipeline(
     conn,
     store_id: str = "沈阳超级仓",
@@ -507,10 +575,12 @@ def run_full_pipeline(
     save_to_db: bool = True,
     fetch_limit: Optional[int] = None,
     sku_codes: Optional[list] = None,
+    max_age: Optional[int] = None,
 ) -> dict:
     """执行完整 4 阶段闭环，返回货盘分析结果。fetcher 优先使用传入的，否则尝试 baidu_fetcher 已配置的。
     fetch_limit: 真实 API 时仅对前 N 个商品比价，其余标为独家款，用于控制成本（如 50）
-    sku_codes: 若传入非空列表，仅对这些 sku_code 的商品执行比价（前端勾选）。"""
+    sku_codes: 若传入非空列表，仅对这些 sku_code 的商品执行比价（前端勾选）。
+    max_age: 竞品价缓存可接受的最长秒数（缺省按 HTMA_PRICE_CACHE_TTL）；配合 fetch_limit=0 时完全由缓存出结果。"""
     fetcher_error = None
     fetcher_platform = "jd"  # 用于报告提示
     if fetcher is None:
@@ -559,11 +629,14 @@ def run_full_pipeline(
                 fetcher = None
                 fetcher_platform = "未配置"
     use_mock = use_mock_fetcher and fetcher is None
+    # 缓存表 DDL 隐式提交，须在流水线写库之前执行
+    cache = open_price_cache(conn, fetcher, max_age=max_age)
     if sku_codes and isinstance(sku_codes, (list, tuple)) and len([s for s in sku_codes if s]) > 0:
         items = stage1_standardize_for_skus(conn, store_id, sku_codes, days=days)
     else:
         items = stage1_standardize(conn, store_id, days)
-    items = stage3_calc_advantage(items, fetcher=fetcher, use_mock=use_mock, fetch_limit=fetch_limit)
+    items = stage3_calc_advantage(items, fetcher=fetcher, use_mock=use_mock, fetch_limit=fetch_limit, cache=cache)
+    _commit_price_cache(conn, cache)
     portfolio = stage4_portfolio_analysis(items)
     run_at = datetime.now()
 
@@ -626,10 +699,12 @@ def run_daily_top_compare(
     fetcher: Optional[Callable] = None,
     save_to_db: bool = True,
     fetch_limit: Optional[int] = None,
+    max_age: Optional[int] = None,
 ) -> dict:
     """
     按单日销售筛选后的比价流水线：用于每日自动比价。
     筛选当日（或最近有数据的日期）销售额最高的 limit 个商品，执行比价并返回结果。
+    max_age: 竞品价缓存可接受的最长秒数，同 run_full_pipeline。
     """
     items = stage1_standardize_single_day(conn, store_id=store_id, data_date=data_date, limit=limit)
     if not items:
@@ -695,7 +770,9 @@ def run_daily_top_compare(
             except ImportError:
                 fetcher = None
     use_mock = use_mock_fetcher and fetcher is None
-    items = stage3_calc_advantage(items, fetcher=fetcher, use_mock=use_mock, fetch_limit=fetch_limit or limit)
+    cache = open_price_cache(conn, fetcher, max_age=max_age)
+    items = stage3_calc_advantage(items, fetcher=fetcher, use_mock=use_mock, fetch_limit=limit if fetch_limit is None else fetch_limit, cache=cache)
+    _commit_price_cache(conn, cache)
     portfolio = stage4_portfolio_analysis(items)
     run_at = datetime.now()
     if save_to_db:
@@ -3,13 +3,35 @@
 通用数据查询层（重构用）。
 统一日期/品类/品牌筛选解析，以及趋势类查询的 profit -> sale 降级逻辑。
 使用方式：在 app.py 中 from query_layer import date_condition, query_filters_from_request 后逐步替换 _date_condition / _query_filters。
+
+品类/品牌筛选：先按销售数据中的品类编码/名称组合把「编码或名称」解析为编码集合，生成 col IN (...) 形式的谓词，
+可走 (store_id, category_*_code, data_date) 复合索引；查找表不可用或 HTMA_CATEGORY_LOOKUP=0 时退回 COALESCE(TRIM(...)) 写法。
 """
 import os
 from datetime import date, datetime, timedelta
-from typing import Tuple, Optional
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    from data_version import get_data_version
+    from sale_rollup import sale_source
+except ImportError:
+    from htma_dashboard.data_version import get_data_version
+    from htma_dashboard.sale_rollup import sale_source
 
 DEFAULT_DAYS = 30
 
+CATEGORY_LOOKUP_ENABLED = os.environ.get("HTMA_CATEGORY_LOOKUP", "1").strip().lower() not in ("0", "false", "no", "off")
+DEFAULT_STORE_ID = "沈阳超级仓"
+
+# 层级 -> (编码列, 名称列)；小类名称兼容 category（类别名称）
+CATEGORY_LEVEL_COLUMNS = {
+    "large": ("category_large_code", ("category_large",)),
+    "mid": ("category_mid_code", ("category_mid",)),
+    "small": ("category_small_code", ("category_small", "category")),
+}
+
+_category_lookup_cache = {}  # store_id -> (数据版本, 查找表)
+
 
 def date_condition(
     period: str,
@@ -70,9 +92,9 @@ def parse_period_from_request():
     return period, start_date, end_date
 
 
-def query_filters_from_request(include_sku: bool = False):
+def query_filters_from_request(include_sku: bool = False, lookup=None, conn=None):
     """
-    从 Flask request.args 解析筛选条件。
+    从 Flask request.args 解析筛选条件。lookup 为 build_category_lookup 结果，缺省时按需加载（调用方已持有连接时传 conn）。
     返回 (date_cond, date_params, params, sale_category_cond, sku_cond)。
     params 中 store_id 占位为 None，调用方需填入 STORE_ID 后使用。
     与 app.py _query_filters 返回格式兼容。
@@ -88,32 +110,9 @@ def query_filters_from_request(include_sku: bool = False):
     sku_code = (request.args.get("sku_code") or "").strip() if include_sku else ""
 
     date_cond, date_params = date_condition(period, start_date, end_date)
-    sale_conds = []
-    sale_params = []
-    if category_name:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_large), '') = %s OR COALESCE(TRIM(category_mid), '') = %s OR COALESCE(TRIM(category), '') = %s)"
-        )
-        sale_params.extend([category_name, category_name, category_name])
-    if brand_name:
-        sale_conds.append(" AND COALESCE(TRIM(brand_name), '') = %s")
-        sale_params.append(brand_name)
-    if category_large_code:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)"
-        )
-        sale_params.extend([category_large_code, category_large_code])
-    if category_mid_code:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)"
-        )
-        sale_params.extend([category_mid_code, category_mid_code])
-    if category_small_code:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_small_code), '') = %s OR COALESCE(TRIM(category_small), '') = %s OR COALESCE(TRIM(category), '') = %s)"
-        )
-        sale_params.extend([category_small_code, category_small_code, category_small_code])
-    sale_category_cond = "".join(sale_conds)
+    sale_category_cond, sale_params = sale_filter_conds(
+        category_name, brand_name, category_large_code, category_mid_code, category_small_code, lookup=lookup, conn=conn
+    )
     sku_cond = ""
     if sku_code:
         sku_cond = " AND sku_code = %s"
@@ -131,6 +130,8 @@ def query_filters_from_params(
     category_large_code: Optional[str] = None,
     category_mid_code: Optional[str] = None,
     category_small_code: Optional[str] = None,
+    lookup=None,
+    conn=None,
 ) -> Tuple[str, tuple, tuple, str, str]:
     """
     从显式参数解析筛选条件（不依赖 request）。
@@ -148,31 +149,148 @@ def query_filters_from_params(
     csc = (category_small_code or "").strip() or None
 
     date_cond, date_params = date_condition(period, start_date, end_date)
-    sale_conds = []
-    sale_params = []
-    if category_name:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_large), '') = %s OR COALESCE(TRIM(category_mid), '') = %s OR COALESCE(TRIM(category), '') = %s)"
-        )
-        sale_params.extend([category_name, category_name, category_name])
-    if brand_name:
-        sale_conds.append(" AND COALESCE(TRIM(brand_name), '') = %s")
-        sale_params.append(brand_name)
-    if clc:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_large_code), '') = %s OR COALESCE(TRIM(category_large), '') = %s)"
-        )
-        sale_params.extend([clc, clc])
-    if cmc:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_mid_code), '') = %s OR COALESCE(TRIM(category_mid), '') = %s)"
-        )
-        sale_params.extend([cmc, cmc])
-    if csc:
-        sale_conds.append(
-            " AND (COALESCE(TRIM(category_small_code), '') = %s OR COALESCE(TRIM(category_small), '') = %s OR COALESCE(TRIM(category), '') = %s)"
-        )
-        sale_params.extend([csc, csc, csc])
-    sale_category_cond = "".join(sale_conds)
+    sale_category_cond, sale_params = sale_filter_conds(category_name, brand_name, clc, cmc, csc, lookup=lookup, conn=conn)
     params = (None,) + tuple(date_params) + tuple(sale_params)
     return date_cond, tuple(date_params), params, sale_category_cond, ""
+
+
+def build_category_lookup(rows) -> Dict[str, Dict[str, Set[str]]]:
+    """
+    由销售数据中的 (level, code, name) 去重组合构建 {层级: {名称: {编码}}}，编码与名称均已 TRIM，空编码不记入。
+    同一编码下的多个名称（含小类的 category）各自记入；无编码的行不靠此表匹配，筛选谓词始终带 code IS NULL AND name 分支。
+    """
+    lookup = {level: {} for level in CATEGORY_LEVEL_COLUMNS}
+    for r in rows or ():
+        level = r.get("level")
+        code = str(r.get("code") or "").strip()
+        name = str(r.get("name") or "").strip()
+        if level in lookup and name and code:
+            lookup[level].setdefault(name, set()).add(code)
+    return lookup
+
+
+def _get_conn():
+    try:
+        from db_config import get_conn
+    except ImportError:
+        from htma_dashboard.db_config import get_conn
+    return get_conn()
+
+
+def _category_pairs_sql(table):
+    """各层级 (编码, 名称) 去重组合；小类名称兼容 category 列。"""
+    parts = []
+    for level, (code_col, name_cols) in CATEGORY_LEVEL_COLUMNS.items():
+        for name_col in name_cols:
+            parts.append(
+                f"SELECT '{level}' AS level, {code_col} AS code, {name_col} AS name FROM {table} "
+                f"WHERE store_id = %s AND {code_col} IS NOT NULL AND {name_col} IS NOT NULL "
+                f"GROUP BY {code_col}, {name_col}"
+            )
+    return " UNION ALL ".join(parts), len(parts)
+
+
+def load_category_lookup(conn=None, store_id=DEFAULT_STORE_ID):
+    """
+    读取销售数据（汇总表就绪时读 t_htma_sale_daily_agg）中的品类编码/名称组合，构建名称->编码查找表。
+    优先用调用方的连接；按数据版本缓存，导入写入 bump 版本后下次筛选自动重建。失败或关闭时返回 None。
+    """
+    if not CATEGORY_LOOKUP_ENABLED:
+        return None
+    version = get_data_version(store_id, conn)
+    hit = _category_lookup_cache.get(store_id)
+    if hit and hit[0] == version:
+        return hit[1]
+    data = None
+    try:
+        own = conn is None
+        c = conn or _get_conn()
+        try:
+            sql, n = _category_pairs_sql(sale_source(c, store_id))
+            with c.cursor() as cur:
+                cur.execute(sql, (store_id,) * n)
+                data = build_category_lookup(cur.fetchall())
+        finally:
+            if own:
+                c.close()
+    except Exception:
+        data = None
+    _category_lookup_cache[store_id] = (version, data)
+    return data
+
+
+def _in_cond(col, values):
+    return f"{col} IN ({', '.join(['%s'] * len(values))})", list(values)
+
+
+def category_level_cond(level: str, value: str, lookup=None) -> Tuple[str, list]:
+    """
+    单层级「编码或名称」筛选，返回 (" AND ...", params)。
+    有查找表时：编码集合 = {value} ∪ 名称为 value 的编码，生成 code IN (...)，
+    并始终追加 (code IS NULL AND name = value) 分支匹配无编码的行（仍是同一索引上的范围扫描）。
+    lookup 为 None 时生成原有 COALESCE(TRIM(...)) 谓词。
+    """
+    code_col, name_cols = CATEGORY_LEVEL_COLUMNS[level]
+    if lookup is None:
+        parts = [f"COALESCE(TRIM({c}), '') = %s" for c in (code_col,) + name_cols]
+        return " AND (" + " OR ".join(parts) + ")", [value] * len(parts)
+    matched = lookup.get(level, {}).get(value, set())
+    codes = [value] + sorted(c for c in matched if c != value)
+    cond, params = _in_cond(code_col, codes)
+    names = " OR ".join(f"{c} = %s" for c in name_cols)
+    params.extend([value] * len(name_cols))
+    return f" AND ({cond} OR ({code_col} IS NULL AND ({names})))", params
+
+
+def category_name_cond(value: str, lookup=None) -> Tuple[str, list]:
+    """类别名称筛选（匹配大类名/中类名/category），有查找表时大类、中类名称转为编码 IN 谓词。"""
+    if lookup is None:
+        return (
+            " AND (COALESCE(TRIM(category_large), '') = %s OR COALESCE(TRIM(category_mid), '') = %s OR COALESCE(TRIM(category), '') = %s)",
+            [value, value, value],
+        )
+    parts, params = [], []
+    for level in ("large", "mid"):
+        code_col, name_cols = CATEGORY_LEVEL_COLUMNS[level]
+        matched = lookup.get(level, {}).get(value, set())
+        if matched:
+            cond, p = _in_cond(code_col, sorted(matched))
+            parts.append(cond)
+            params.extend(p)
+        parts.append(f"({code_col} IS NULL AND {name_cols[0]} = %s)")
+        params.append(value)
+    parts.append("category = %s")
+    params.append(value)
+    return " AND (" + " OR ".join(parts) + ")", params
+
+
+def sale_filter_conds(
+    category_name: Optional[str] = None,
+    brand_name: Optional[str] = None,
+    category_large_code: Optional[str] = None,
+    category_mid_code: Optional[str] = None,
+    category_small_code: Optional[str] = None,
+    lookup=None,
+    conn=None,
+) -> Tuple[str, list]:
+    """
+    组装 t_htma_sale（及销售日汇总表）的品类/品牌筛选，返回 (sale_category_cond, params)。
+    lookup 缺省时按需加载查找表（有 conn 则复用调用方连接）；加载失败则整体退回 COALESCE(TRIM(...)) 写法。
+    """
+    if lookup is None and (category_name or brand_name or category_large_code or category_mid_code or category_small_code):
+        lookup = load_category_lookup(conn)
+    conds, params = [], []
+    if category_name:
+        c, p = category_name_cond(category_name, lookup)
+        conds.append(c)
+        params.extend(p)
+    if brand_name:
+        # 品牌名导入/回填时已 TRIM，可直接等值匹配走 (store_id, brand_name, data_date) 索引
+        conds.append(" AND COALESCE(TRIM(brand_name), '') = %s" if lookup is None else " AND brand_name = %s")
+        params.append(brand_name)
+    for level, value in (("large", category_large_code), ("mid", category_mid_code), ("small", category_small_code)):
+        if value:
+            c, p = category_level_cond(level, value, lookup)
+            conds.append(c)
+            params.extend(p)
+    return "".join(conds), params
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+组合报告的子查询计划：结构化报告、增强分析卡片、营销报告、智能建议原先在同一游标上逐条执行十几条互不依赖的 SELECT，
+总耗时是各条之和。QueryPlan 先声明这些查询（query）或需要连接的函数（call），run() 时并发执行后按名称返回结果：
+
+- 并发：每个任务从连接池（db_config.get_conn）借一个连接，执行完即归还；单个计划最多 HTMA_QUERY_PLAN_CONCURRENCY 个任务同时执行，
+  整个计划最长等待 HTMA_QUERY_PLAN_TIMEOUT 秒，超时抛 QueryPlanTimeout（仍在执行的查询结束后连接照常归还）；
+- 串行：HTMA_QUERY_PLAN_CONCURRENCY<=1 时按声明顺序在调用方连接上逐条执行，与原实现一致；
+- 退回：借不到连接（连接池满、建连失败）的任务在并发阶段结束后改在调用方连接上串行补跑；
+  自行取连接的任务（use_conn=False）在工作线程内遇到连接池等待超时（PoolTimeout）同样改为串行补跑；
+- 异常：声明了 fallback 的任务出错时取 fallback，否则按声明顺序抛出第一个异常（与串行执行时一致）；
+- 嵌套：在计划的工作线程内再建计划（如任务函数内部也用了 QueryPlan）时串行执行，单个请求的并发不超过上限。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+QUERY_PLAN_CONCURRENCY = int(os.environ.get("HTMA_QUERY_PLAN_CONCURRENCY", "4"))
+QUERY_PLAN_TIMEOUT = float(os.environ.get("HTMA_QUERY_PLAN_TIMEOUT", "60"))  # 秒
+
+_RAISE = object()
+_local = threading.local()
+
+
+class QueryPlanTimeout(Exception):
+    """计划内任务未在 HTMA_QUERY_PLAN_TIMEOUT 秒内全部完成。"""
+
+
+class _ConnectFailed(Exception):
+    """工作线程借连接失败（内部使用，触发在调用方连接上补跑）。"""
+
+
+def _default_connect():
+    try:
+        from db_config import get_conn
+    except ImportError:
+        from htma_dashboard.db_config import get_conn
+    return get_conn()
+
+
+def _pool_timeout():
+    try:
+        from db_config import PoolTimeout
+    except ImportError:
+        from htma_dashboard.db_config import PoolTimeout
+    return PoolTimeout
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class QueryPlan:
+    """一组互不依赖的查询/函数；conn 为调用方连接（串行与补跑时使用，不会被关闭）。"""
+
+    def __init__(self, conn, concurrency=None, timeout=None, connect=None):
+        self.conn = conn
+        self.concurrency = QUERY_PLAN_CONCURRENCY if concurrency is None else int(concurrency)
+        self.timeout = QUERY_PLAN_TIMEOUT if timeout is None else timeout
+        self._connect = connect or _default_connect
+        self._tasks = []  # [(name, fn(conn), fallback, needs_conn)]
+
+    def query(self, name, sql, params=(), one=False, fallback=_RAISE):
+        """声明一条 SELECT；结果为 fetchall() 列表，one=True 时为 fetchone()。"""
+        def run(conn):
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.fetchone() if one else cur.fetchall()
+            finally:
+                cur.close()
+        return self._add(name, run, fallback)
+
+    def call(self, name, fn, *args, use_conn=True, fallback=_RAISE):
+        """声明一个函数任务：use_conn=True 时调用 fn(conn, *args)，否则 fn(*args)（函数自行取连接）。"""
+        if use_conn:
+            return self._add(name, lambda conn: fn(conn, *args), fallback)
+        return self._add(name, lambda conn: fn(*args), fallback, needs_conn=False)
+
+    def _add(self, name, fn, fallback, needs_conn=True):
+        if any(t[0] == name for t in self._tasks):
+            raise ValueError(f"重复的任务名: {name}")
+        self._tasks.append((name, fn, fallback, needs_conn))
+        return self
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def run(self):
+        """执行全部任务，返回 {name: 结果}。"""
+        if self.concurrency <= 1 or len(self._tasks) <= 1 or getattr(_local, "in_worker", False):
+            return self._run_serial(self._tasks, {})
+        return self._run_concurrent()
+
+    def _run_serial(self, tasks, out):
+        for name, fn, fallback, _ in tasks:
+            try:
+                out[name] = fn(self.conn)
+            except Exception:
+                if fallback is _RAISE:
+                    raise
+                out[name] = fallback
+        return out
+
+    def _worker(self, fn, needs_conn):
+        _local.in_worker = True
+        try:
+            if not needs_conn:
+                try:
+                    return fn(None)
+                except _pool_timeout() as e:
+                    raise _ConnectFailed(e)
+            try:
+                conn = self._connect()
+            except Exception as e:
+                raise _ConnectFailed(e)
+            try:
+                return fn(conn)
+            finally:
+                _close(conn)
+        finally:
+            _local.in_worker = False
+
+    def _run_concurrent(self):
+        pool = ThreadPoolExecutor(max_workers=min(self.concurrency, len(self._tasks)), thread_name_prefix="htma-query-plan")
+        try:
+            futures = [pool.submit(self._worker, fn, needs_conn) for _, fn, _, needs_conn in self._tasks]
+            done, pending = wait(futures, timeout=self.timeout)
+            if pending:
+                names = [t[0] for t, f in zip(self._tasks, futures) if f in pending]
+                raise QueryPlanTimeout(f"子查询 {self.timeout}s 内未完成: {', '.join(names)}")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        out, retry = {}, []
+        for task, future in zip(self._tasks, futures):
+            name, _, fallback, _ = task
+            err = future.exception()
+            if err is None:
+                out[name] = future.result()
+            elif isinstance(err, _ConnectFailed):
+                retry.append(task)
+            elif fallback is not _RAISE:
+                out[name] = fallback
+            else:
+                raise err
+        self._run_serial(retry, out)
+        return {t[0]: out[t[0]] for t in self._tasks}
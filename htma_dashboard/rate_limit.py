@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+竞品比价第三方接口的按数据源限流：每个数据源一个令牌桶（QPS）加一个并发上限，进程内共享。
+货盘比价阶段3并发检索后，原先「每个商品之间 sleep」的节流改由这里按数据源控制：
+
+- 数据源：onebound（万邦）、haojingke（蚂蚁星球）、baidu_youxuan（百度优选 MCP）、juhe（聚合数据）、
+  apistore（百度 API 商城/极速数据）、baidu_skill（OpenClaw 百度 Skill 网关与 runner）；
+- 配置：HTMA_PRICE_QPS_<数据源>、HTMA_PRICE_CONCURRENCY_<数据源>（数据源名大写），缺省见 PROVIDER_DEFAULTS；
+  QPS<=0 不限速，并发<=0 不限并发；
+- 用法：`with provider_limit("onebound"): ...` 包住一次 HTTP 请求；urlopen(provider, req, timeout) 为带限流的 urlopen。
+"""
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+# 数据源 -> (QPS, 并发)
+PROVIDER_DEFAULTS = {
+    "onebound": (5.0, 4),
+    "haojingke": (5.0, 4),
+    "baidu_youxuan": (5.0, 4),
+    "juhe": (5.0, 2),
+    "apistore": (5.0, 2),
+    "baidu_skill": (2.0, 2),
+}
+_FALLBACK = (5.0, 2)
+
+
+class TokenBucket:
+    """令牌桶：每秒补 rate 个令牌，最多攒 capacity 个（缺省 max(1, rate)）；acquire 阻塞到取得一个令牌。"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class ProviderLimiter:
+    """单个数据源的限流器：先占并发名额再取令牌，退出时归还名额。可重复用作 with 上下文。"""
+
+    def __init__(self, name, qps, concurrency, clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.qps = float(qps)
+        self.concurrency = int(concurrency)
+        self._bucket = TokenBucket(self.qps, clock=clock, sleep=sleep)
+        self._slots = threading.BoundedSemaphore(self.concurrency) if self.concurrency > 0 else None
+
+    def __enter__(self):
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            self._bucket.acquire()
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if self._slots is not None:
+            self._slots.release()
+        return False
+
+
+def _env_number(key, default, cast):
+    raw = (os.environ.get(key) or "").strip()
+    if not raw:
+        return default
+    try:
+        return cast(raw)
+    except ValueError:
+        return default
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def provider_limit(provider):
+    """取数据源的共享限流器（首次使用时按环境变量创建）。"""
+    lim = _limiters.get(provider)
+    if lim is not None:
+        return lim
+    with _limiters_lock:
+        lim = _limiters.get(provider)
+        if lim is None:
+            qps, conc = PROVIDER_DEFAULTS.get(provider, _FALLBACK)
+            key = provider.upper()
+            qps = _env_number(f"HTMA_PRICE_QPS_{key}", qps, float)
+            conc = _env_number(f"HTMA_PRICE_CONCURRENCY_{key}", conc, int)
+            lim = _limiters[provider] = ProviderLimiter(provider, qps, conc)
+    return lim
+
+
+def reset_limiters():
+    """丢弃已创建的限流器（测试或修改环境变量后重新读取配置）。"""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+@contextmanager
+def urlopen(provider, req, timeout):
+    """按数据源限流的 urllib.request.urlopen：读取响应期间占用并发名额。"""
+    with provider_limit(provider):
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            yield r
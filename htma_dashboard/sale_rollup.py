@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+销售日汇总（rollup）表 t_htma_sale_daily_agg：按 门店+日期+大/中/小类+品牌+供应商 预聚合 t_htma_sale，
+供 KPI、趋势、品类占比、品牌/供应商贡献等汇总接口读取，避免每次请求重扫明细。
+
+- 维度列保留销售表原值（不 TRIM、不补空），因此接口原有的 COALESCE(TRIM(...)) 筛选与 GROUP BY 在汇总表上结果一致；
+- 度量列与销售表同名（sale_amount / gross_profit / sale_qty / sale_cost / 退货 / 赠送），SQL 只需替换表名；
+- gross_profit 存 SUM(COALESCE(gross_profit, 0))；gross_profit_filled 存 SUM(COALESCE(gross_profit, sale_amount - sale_cost, 0))；
+- 导入只按涉及日期 DELETE + INSERT ... SELECT 重算；从未全量构建过的门店首次刷新时自动全量构建。
+"""
+import os
+import time
+
+ROLLUP_TABLE = "t_htma_sale_daily_agg"
+ROLLUP_META_TABLE = "t_htma_sale_daily_agg_meta"
+SALE_TABLE = "t_htma_sale"
+
+# HTMA_SALE_ROLLUP=0 时汇总接口一律读明细表（便于排查口径问题）
+ROLLUP_ENABLED = os.environ.get("HTMA_SALE_ROLLUP", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# 维度列（GROUP BY 键）与度量列 (汇总列, 明细表达式)
+ROLLUP_DIM_COLUMNS = (
+    "category_large_code", "category_large", "category_mid_code", "category_mid",
+    "category_small_code", "category_small", "category", "category_code",
+    "brand_name", "supplier_name",
+)
+ROLLUP_MEASURES = (
+    ("sale_amount", "SUM(COALESCE(sale_amount, 0))"),
+    ("gross_profit", "SUM(COALESCE(gross_profit, 0))"),
+    ("gross_profit_filled", "SUM(COALESCE(gross_profit, sale_amount - sale_cost, 0))"),
+    ("sale_qty", "SUM(COALESCE(sale_qty, 0))"),
+    ("sale_cost", "SUM(COALESCE(sale_cost, 0))"),
+    ("return_qty", "SUM(COALESCE(return_qty, 0))"),
+    ("return_amount", "SUM(COALESCE(return_amount, 0))"),
+    ("gift_qty", "SUM(COALESCE(gift_qty, 0))"),
+    ("gift_amount", "SUM(COALESCE(gift_amount, 0))"),
+    ("row_count", "COUNT(*)"),
+)
+
+_DATES_PER_STATEMENT = 62
+_READY_TTL = 30  # 秒，就绪状态进程内缓存
+_ready_cache = {}  # store_id -> (ready, expire_at)
+
+
+def ensure_sale_rollup_table(conn):
+    """建汇总表与状态表（已存在则跳过）。"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+          id                  BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+          store_id            VARCHAR(32)     DEFAULT NULL COMMENT '门店ID',
+          data_date           DATE            NOT NULL COMMENT '销售日期',
+          category_large_code VARCHAR(32)     DEFAULT NULL,
+          category_large      VARCHAR(64)     DEFAULT NULL,
+          category_mid_code   VARCHAR(32)     DEFAULT NULL,
+          category_mid        VARCHAR(64)     DEFAULT NULL,
+          category_small_code VARCHAR(32)     DEFAULT NULL,
+          category_small      VARCHAR(64)     DEFAULT NULL,
+          category            VARCHAR(64)     DEFAULT NULL,
+          category_code       VARCHAR(32)     DEFAULT NULL,
+          brand_name          VARCHAR(64)     DEFAULT NULL,
+          supplier_name       VARCHAR(128)    DEFAULT NULL,
+          sale_amount         DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          gross_profit        DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          gross_profit_filled DECIMAL(16, 2)  NOT NULL DEFAULT 0 COMMENT '毛利为空时按销售额-成本补齐',
+          sale_qty            DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          sale_cost           DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          return_qty          DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          return_amount       DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          gift_qty            DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          gift_amount         DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+          row_count           INT             NOT NULL DEFAULT 0 COMMENT '明细行数',
+          KEY idx_store_date (store_id, data_date),
+          KEY idx_store_large_date (store_id, category_large_code, data_date),
+          KEY idx_store_brand (store_id, brand_name),
+          KEY idx_store_supplier (store_id, supplier_name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='销售日汇总(门店/日期/品类/品牌/供应商)'
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_META_TABLE} (
+          store_id      VARCHAR(32) NOT NULL PRIMARY KEY,
+          full_built_at DATETIME    DEFAULT NULL COMMENT '最近一次全量构建时间',
+          updated_at    DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='销售日汇总构建状态'
+    """)
+    conn.commit()
+    cur.close()
+
+
+def _insert_select_sql(date_filter):
+    dims = ", ".join(ROLLUP_DIM_COLUMNS)
+    measure_cols = ", ".join(c for c, _ in ROLLUP_MEASURES)
+    measure_exprs = ", ".join(e for _, e in ROLLUP_MEASURES)
+    return f"""
+        INSERT INTO {ROLLUP_TABLE} (store_id, data_date, {dims}, {measure_cols})
+        SELECT store_id, data_date, {dims}, {measure_exprs}
+        FROM {SALE_TABLE}
+        WHERE store_id = %s{date_filter}
+        GROUP BY store_id, data_date, {dims}
+    """
+
+
+def _is_full_built(cur, store_id):
+    cur.execute(f"SELECT full_built_at FROM {ROLLUP_META_TABLE} WHERE store_id = %s", (store_id,))
+    row = cur.fetchone()
+    if not row:
+        return False
+    v = row.get("full_built_at") if isinstance(row, dict) else row[0]
+    return v is not None
+
+
+def refresh_sale_rollup(conn, store_id, dates=None):
+    """
+    重算汇总表。dates 为空时全量重建该门店；否则仅重算给定日期（DELETE + INSERT ... SELECT，同一事务内完成）。
+    门店从未全量构建过时，即使给了 dates 也做一次全量构建。返回写入的汇总行数。
+    """
+    ensure_sale_rollup_table(conn)
+    cur = conn.cursor()
+    try:
+        full = not dates or not _is_full_built(cur, store_id)
+        written = 0
+        if full:
+            cur.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE store_id = %s", (store_id,))
+            cur.execute(_insert_select_sql(""), (store_id,))
+            written = cur.rowcount
+            cur.execute(f"""
+                INSERT INTO {ROLLUP_META_TABLE} (store_id, full_built_at) VALUES (%s, NOW())
+                ON DUPLICATE KEY UPDATE full_built_at = VALUES(full_built_at)
+            """, (store_id,))
+        else:
+            ds = sorted({str(d)[:10] for d in dates if d})
+            for i in range(0, len(ds), _DATES_PER_STATEMENT):
+                chunk = ds[i:i + _DATES_PER_STATEMENT]
+                ph = ", ".join(["%s"] * len(chunk))
+                cur.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE store_id = %s AND data_date IN ({ph})", (store_id, *chunk))
+                cur.execute(_insert_select_sql(f" AND data_date IN ({ph})"), (store_id, *chunk))
+                written += cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    _ready_cache.pop(store_id, None)
+    return written
+
+
+def rollup_ready(conn, store_id):
+    """汇总表是否可用于该门店（已全量构建过）。结果缓存 _READY_TTL 秒；表不存在视为不可用。"""
+    if not ROLLUP_ENABLED:
+        return False
+    hit = _ready_cache.get(store_id)
+    now = time.time()
+    if hit and hit[1] > now:
+        return hit[0]
+    ready = False
+    try:
+        with conn.cursor() as cur:
+            ready = _is_full_built(cur, store_id)
+    except Exception:
+        ready = False
+    _ready_cache[store_id] = (ready, now + _READY_TTL)
+    return ready
+
+
+def sale_source(conn, store_id, sku_cond=""):
+    """
+    汇总类查询应读的表名：汇总表就绪且无 SKU 级筛选时返回 ROLLUP_TABLE，否则返回明细表 t_htma_sale。
+    汇总表不含 sku_code，带 sku_cond 的查询必须走明细。
+    """
+    if sku_cond and sku_cond.strip():
+        return SALE_TABLE
+    return ROLLUP_TABLE if rollup_ready(conn, store_id) else SALE_TABLE
+
+
+def profit_filled_expr(table):
+    """「毛利为空按销售额-成本补齐」口径在明细表/汇总表上的 SUM 参数表达式。"""
+    if table == ROLLUP_TABLE:
+        return "gross_profit_filled"
+    return "COALESCE(gross_profit, sale_amount - sale_cost, 0)"
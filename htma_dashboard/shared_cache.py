@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程共享的接口结果缓存（二级缓存）：多 worker 部署时，同机各进程复用彼此算好的响应。
+
+- 默认后端 SQLite（HTMA_SHARED_CACHE=sqlite，文件 HTMA_SHARED_CACHE_PATH，WAL 模式，按字节上限淘汰最早写入的条目）；
+- 可选 Redis 协议后端（HTMA_SHARED_CACHE=redis，HTMA_SHARED_CACHE_URL=redis://host:port/db），
+  内置最小 RESP 客户端，不依赖 redis 包，Redis 或兼容的本地替身均可；每个 key 都带过期时间
+  （不超过 HTMA_SHARED_CACHE_MAX_TTL 秒），导入后旧版本号的 key 会自行过期，不会无限堆积；
+- HTMA_SHARED_CACHE=off 关闭，只用进程内 LRU。
+值由 api_cache 编码为 状态码+mimetype+zlib 压缩正文；key 已含门店数据版本号，导入后旧条目不再命中。
+后端异常一律按未命中处理，不影响接口。
+"""
+import os
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+
+SHARED_CACHE_BACKEND = os.environ.get("HTMA_SHARED_CACHE", "sqlite").strip().lower()
+SHARED_CACHE_PATH = os.environ.get("HTMA_SHARED_CACHE_PATH", "").strip() or os.path.join(tempfile.gettempdir(), "htma_api_cache.sqlite3")
+SHARED_CACHE_URL = os.environ.get("HTMA_SHARED_CACHE_URL", "redis://127.0.0.1:6379/0").strip()
+SHARED_CACHE_MAX_BYTES = int(float(os.environ.get("HTMA_SHARED_CACHE_MAX_MB", "256")) * 1024 * 1024)
+SHARED_CACHE_MAX_TTL = float(os.environ.get("HTMA_SHARED_CACHE_MAX_TTL", "86400"))  # 秒，redis 后端单条上限
+
+_HEADER = struct.Struct("!HB")  # 状态码, mimetype 长度
+
+
+def encode_entry(body, status, mimetype):
+    """(正文, 状态码, mimetype) -> 紧凑字节：2 字节状态码 + 1 字节 mimetype 长度 + mimetype + zlib(正文)。"""
+    mt = (mimetype or "").encode("ascii")[:255]
+    return _HEADER.pack(status, len(mt)) + mt + zlib.compress(body, 6)
+
+
+def decode_entry(blob):
+    status, n = _HEADER.unpack_from(blob, 0)
+    off = _HEADER.size
+    mimetype = blob[off:off + n].decode("ascii")
+    return zlib.decompress(blob[off + n:]), status, mimetype
+
+
+class SQLiteBackend:
+    """同机多进程共享的 SQLite 缓存文件；每线程一个连接。"""
+
+    name = "sqlite"
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS api_cache (
+              k         TEXT PRIMARY KEY,
+              v         BLOB NOT NULL,
+              size      INTEGER NOT NULL,
+              expire_at REAL,
+              created   REAL NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_api_cache_created ON api_cache (created)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT v, expire_at FROM api_cache WHERE k = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self._conn().execute("DELETE FROM api_cache WHERE k = ?", (key,))
+            return None
+        return bytes(row[0])
+
+    def set(self, key, blob, ttl=None):
+        now = time.time()
+        expire = None if ttl is None else now + ttl
+        self._conn().execute(
+            "INSERT OR REPLACE INTO api_cache (k, v, size, expire_at, created) VALUES (?, ?, ?, ?, ?)",
+            (key, sqlite3.Binary(blob), len(blob), expire, now),
+        )
+        self._writes += 1
+        if self._writes % 50 == 0:
+            self.prune()
+
+    def prune(self):
+        """删除过期条目；总大小超过上限时按写入时间从旧到新删除。"""
+        conn = self._conn()
+        conn.execute("DELETE FROM api_cache WHERE expire_at IS NOT NULL AND expire_at < ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM api_cache").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes * 0.8
+            rows = conn.execute("SELECT k, size FROM api_cache ORDER BY created").fetchall()
+            drop = []
+            for k, size in rows:
+                if excess <= 0:
+                    break
+                drop.append((k,))
+                excess -= size
+            conn.executemany("DELETE FROM api_cache WHERE k = ?", drop)
+
+    def clear(self):
+        self._conn().execute("DELETE FROM api_cache")
+
+
+class RedisBackend:
+    """最小 RESP2 客户端：GET / SET PX / 按前缀清空；每线程一个连接，断线自动重连一次。"""
+
+    name = "redis"
+
+    def __init__(self, url=SHARED_CACHE_URL, prefix="htma:api:", timeout=1.0, max_ttl=SHARED_CACHE_MAX_TTL):
+        u = urllib.parse.urlparse(url)
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 6379
+        self.db = int((u.path or "/0").strip("/") or 0)
+        self.password = urllib.parse.unquote(u.password) if u.password else None
+        self.prefix = prefix
+        self.timeout = timeout
+        self.max_ttl = max_ttl
+        self._local = threading.local()
+
+    def _sock(self):
+        s = getattr(self._local, "sock", None)
+        if s is None:
+            s = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._local.sock = s
+            self._local.buf = b""
+            if self.password:
+                self._call_raw(s, "AUTH", self.password)
+            if self.db:
+                self._call_raw(s, "SELECT", str(self.db))
+        return s
+
+    def _drop(self):
+        s = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if s is not None:
+            try:
+                s.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _pack(*args):
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    def _readline(self, s):
+        while b"\r\n" not in self._local.buf:
+            chunk = s.recv(65536)
+            if not chunk:
+                raise ConnectionError("redis 连接已关闭")
+            self._local.buf += chunk
+        line, self._local.buf = self._local.buf.split(b"\r\n", 1)
+        return line
+
+    def _readexact(self, s, n):
+        while len(self._local.buf) < n + 2:
+            chunk = s.recv(65536)
+            if not chunk:
+                raise ConnectionError("redis 连接已关闭")
+            self._local.buf += chunk
+        data, self._local.buf = self._local.buf[:n], self._local.buf[n + 2:]
+        return data
+
+    def _reply(self, s):
+        line = self._readline(s)
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RuntimeError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            return None if n < 0 else self._readexact(s, n)
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._reply(s) for _ in range(n)]
+        raise RuntimeError("无法解析的 redis 响应")
+
+    def _call_raw(self, s, *args):
+        s.sendall(self._pack(*args))
+        return self._reply(s)
+
+    def _call(self, *args):
+        for attempt in (0, 1):
+            try:
+                return self._call_raw(self._sock(), *args)
+            except (OSError, ConnectionError):
+                self._drop()
+                if attempt:
+                    raise
+
+    def get(self, key):
+        return self._call("GET", self.prefix + key)
+
+    def set(self, key, blob, ttl=None):
+        """ttl 为 None（不过期的闭区间查询）时也按 max_ttl 过期：redis 没有按大小淘汰，旧版本号的 key 只能靠过期清理。"""
+        ttl = self.max_ttl if ttl is None else min(ttl, self.max_ttl)
+        self._call("SET", self.prefix + key, blob, "PX", str(max(1, int(ttl * 1000))))
+
+    def clear(self):
+        cursor = b"0"
+        while True:
+            cursor, keys = self._call("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", "500")
+            if keys:
+                self._call("DEL", *keys)
+            if cursor in (b"0", 0):
+                break
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_shared_backend():
+    """按 HTMA_SHARED_CACHE 创建进程级后端单例；关闭或初始化失败返回 None。"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                try:
+                    if SHARED_CACHE_BACKEND == "redis":
+                        _backend = RedisBackend()
+                    elif SHARED_CACHE_BACKEND == "sqlite":
+                        _backend = SQLiteBackend()
+                    else:
+                        _backend = False
+                except Exception:
+                    _backend = False
+    return _backend or None
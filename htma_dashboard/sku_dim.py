@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+SKU 属性维表 t_htma_sku_dim：每个 门店+货号 一行，存品名、条码、规格、品牌、供应商与大/中/小类编码和名称，
+替代接口里 `SELECT sku_code, MAX(category_large_code), ... FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code`
+这类每次请求都扫一遍销售历史的属性推导。
+
+- 销售为准：全量构建按货号取销售表各列 MAX（与原内联推导一致）；导入销售后按涉及日期合并，日期不早于已有 sale_date 时非空值覆盖；
+- 库存、商品档案只补空：销售里没有的货号或为空的列，用库存最新快照、商品档案（category_name 记为 category）补齐；
+- 维度值 TRIM 后存储、空串存 NULL（与销售表筛选列口径一致），三级品类编码各有 (store_id, 编码) 索引，可直接套 query_layer 的品类筛选；
+- 从未全量构建过的门店，首次任一刷新都做全量构建；未构建或 HTMA_SKU_DIM=0 时 sku_dim_subquery 退回销售表内联推导。
+"""
+import os
+import time
+
+try:
+    from stock_latest import stock_source
+except ImportError:
+    from htma_dashboard.stock_latest import stock_source
+
+SKU_DIM_TABLE = "t_htma_sku_dim"
+SKU_DIM_META_TABLE = "t_htma_sku_dim_meta"
+SALE_TABLE = "t_htma_sale"
+
+SKU_DIM_ENABLED = os.environ.get("HTMA_SKU_DIM", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# (列名, 定义)
+SKU_DIM_COLUMNS = (
+    ("product_name", "VARCHAR(128) DEFAULT NULL"),
+    ("barcode", "VARCHAR(64) DEFAULT NULL"),
+    ("spec", "VARCHAR(64) DEFAULT NULL"),
+    ("brand_name", "VARCHAR(64) DEFAULT NULL"),
+    ("supplier_name", "VARCHAR(128) DEFAULT NULL"),
+    ("category", "VARCHAR(64) DEFAULT NULL"),
+    ("category_large_code", "VARCHAR(32) DEFAULT NULL"),
+    ("category_large", "VARCHAR(64) DEFAULT NULL"),
+    ("category_mid_code", "VARCHAR(32) DEFAULT NULL"),
+    ("category_mid", "VARCHAR(64) DEFAULT NULL"),
+    ("category_small_code", "VARCHAR(32) DEFAULT NULL"),
+    ("category_small", "VARCHAR(64) DEFAULT NULL"),
+)
+_COLS = tuple(name for name, _ in SKU_DIM_COLUMNS)
+
+# 品类联表常用列（库存预警、KPI 库存按品类筛选等）
+SKU_CATEGORY_COLUMNS = (
+    "category_large_code", "category_large", "category_mid_code", "category_mid",
+    "category_small_code", "category_small", "category",
+)
+
+# 补空来源：维表列 -> 来源表列（缺省同名）
+_FILL_SOURCE_COLUMNS = {
+    "stock": {},
+    "product_master": {"category": "category_name"},
+}
+
+_DATES_PER_STATEMENT = 62
+_READY_TTL = 30  # 秒，就绪状态进程内缓存
+_ready_cache = {}  # store_id -> (ready, expire_at)
+
+
+def ensure_sku_dim_table(conn):
+    """建维表与状态表（已存在则跳过）。DDL 会隐式提交，须在导入事务之外调用。"""
+    cols = ",\n".join(f"          {name:<20} {ddl}" for name, ddl in SKU_DIM_COLUMNS)
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SKU_DIM_TABLE} (
+          store_id             VARCHAR(32) NOT NULL COMMENT '门店ID',
+          sku_code             VARCHAR(64) NOT NULL COMMENT '货号',
+{cols},
+          sale_date            DATE        DEFAULT NULL COMMENT '属性取自的最近销售日期（库存/档案补齐的为 NULL）',
+          updated_at           DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          PRIMARY KEY (store_id, sku_code),
+          KEY idx_store_large (store_id, category_large_code),
+          KEY idx_store_mid (store_id, category_mid_code),
+          KEY idx_store_small (store_id, category_small_code),
+          KEY idx_store_brand (store_id, brand_name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='SKU属性维表(品名/条码/规格/品牌/供应商/品类)'
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SKU_DIM_META_TABLE} (
+          store_id      VARCHAR(32) NOT NULL PRIMARY KEY,
+          full_built_at DATETIME    DEFAULT NULL COMMENT '最近一次全量构建时间',
+          updated_at    DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='SKU属性维表构建状态'
+    """)
+    cur.close()
+
+
+def _row_first(row):
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0] if row else None
+
+
+def _present_columns(cur, table):
+    cur.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,),
+    )
+    return {str(_row_first(r)).lower() for r in cur.fetchall()}
+
+
+def _is_full_built(cur, store_id):
+    cur.execute(f"SELECT full_built_at FROM {SKU_DIM_META_TABLE} WHERE store_id = %s", (store_id,))
+    return _row_first(cur.fetchone()) is not None
+
+
+def _clean(expr):
+    return f"NULLIF(TRIM({expr}), '')"
+
+
+def _sale_sql(cols, date_filter, merge):
+    """从销售表按货号取各列 MAX；merge=True 时按 sale_date 新旧合并（sale_date 最后赋值，前面各列比较的是旧日期）。"""
+    col_str = ", ".join(cols)
+    exprs = ", ".join(f"MAX({_clean(c)})" for c in cols)
+    sql = f"""
+        INSERT INTO {SKU_DIM_TABLE} (store_id, sku_code, {col_str}, sale_date)
+        SELECT %s, sku_code, {exprs}, MAX(data_date)
+        FROM {SALE_TABLE}
+        WHERE store_id = %s{date_filter}
+        GROUP BY sku_code
+    """
+    if merge:
+        newer = f"VALUES(sale_date) >= COALESCE({SKU_DIM_TABLE}.sale_date, VALUES(sale_date))"
+        updates = ", ".join(f"{c} = IF({newer}, COALESCE(VALUES({c}), {SKU_DIM_TABLE}.{c}), {SKU_DIM_TABLE}.{c})" for c in cols)
+        sql += f"""
+        ON DUPLICATE KEY UPDATE {updates},
+            sale_date = GREATEST(COALESCE({SKU_DIM_TABLE}.sale_date, VALUES(sale_date)), VALUES(sale_date))
+    """
+    return sql
+
+
+def _fill_sql(cur, conn, store_id, source, data_date=None):
+    """库存/商品档案补空：返回 (sql, params)；来源表没有任何可用列时返回 (None, None)。"""
+    mapping = _FILL_SOURCE_COLUMNS[source]
+    if source == "stock":
+        table = stock_source(conn, store_id)
+        if data_date:
+            where, params = "store_id = %s AND data_date = %s", [store_id, str(data_date)[:10]]
+        else:
+            where = f"store_id = %s AND data_date = (SELECT MAX(data_date) FROM {table} WHERE store_id = %s)"
+            params = [store_id, store_id]
+    else:
+        table, where, params = "t_htma_product_master", "store_id = %s", [store_id]
+    present = _present_columns(cur, table)
+    cols = [c for c in _COLS if mapping.get(c, c) in present]
+    if not cols:
+        return None, None
+    col_str = ", ".join(cols)
+    exprs = ", ".join(_clean(mapping.get(c, c)) for c in cols)
+    updates = ", ".join(f"{c} = COALESCE({SKU_DIM_TABLE}.{c}, VALUES({c}))" for c in cols)
+    return f"""
+        INSERT INTO {SKU_DIM_TABLE} (store_id, sku_code, {col_str})
+        SELECT store_id, sku_code, {exprs}
+        FROM {table}
+        WHERE {where}
+        ON DUPLICATE KEY UPDATE {updates}
+    """, params
+
+
+def _sale_columns(cur):
+    present = _present_columns(cur, SALE_TABLE)
+    return [c for c in _COLS if c in present]
+
+
+def _full_build(cur, conn, store_id):
+    cur.execute(f"DELETE FROM {SKU_DIM_TABLE} WHERE store_id = %s", (store_id,))
+    cur.execute(_sale_sql(_sale_columns(cur), "", merge=False), (store_id, store_id))
+    written = cur.rowcount
+    for source in ("stock", "product_master"):
+        sql, params = _fill_sql(cur, conn, store_id, source)
+        if sql:
+            cur.execute(sql, params)
+    cur.execute(f"""
+        INSERT INTO {SKU_DIM_META_TABLE} (store_id, full_built_at) VALUES (%s, NOW())
+        ON DUPLICATE KEY UPDATE full_built_at = VALUES(full_built_at)
+    """, (store_id,))
+    return written
+
+
+def refresh_sku_dim(conn, store_id, dates=None):
+    """
+    按销售表更新维表。dates 为空时全量重建该门店；否则把这些日期的销售按货号合并进来（日期较新者非空值覆盖）。
+    门店从未全量构建过时，即使给了 dates 也做一次全量构建。返回写入/合并的行数（MySQL 对覆盖行计 2）。
+    """
+    ensure_sku_dim_table(conn)
+    cur = conn.cursor()
+    try:
+        if not dates or not _is_full_built(cur, store_id):
+            written = _full_build(cur, conn, store_id)
+        else:
+            cols = _sale_columns(cur)
+            ds = sorted({str(d)[:10] for d in dates if d})
+            written = 0
+            for i in range(0, len(ds), _DATES_PER_STATEMENT):
+                chunk = ds[i:i + _DATES_PER_STATEMENT]
+                ph = ", ".join(["%s"] * len(chunk))
+                cur.execute(_sale_sql(cols, f" AND data_date IN ({ph})", merge=True), (store_id, store_id, *chunk))
+                written += cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    _ready_cache.pop(store_id, None)
+    return written
+
+
+def fill_sku_dim(conn, store_id, source, data_date=None):
+    """
+    用库存（source="stock"，data_date 为导入日期，缺省取最新快照）或商品档案（source="product_master"）补齐维表中为空的列，
+    并补入销售里没有的货号。门店未全量构建过时改做全量构建。返回写入的行数。
+    """
+    ensure_sku_dim_table(conn)
+    cur = conn.cursor()
+    try:
+        if not _is_full_built(cur, store_id):
+            written = _full_build(cur, conn, store_id)
+        else:
+            sql, params = _fill_sql(cur, conn, store_id, source, data_date)
+            written = 0
+            if sql:
+                cur.execute(sql, params)
+                written = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    _ready_cache.pop(store_id, None)
+    return written
+
+
+def sku_dim_ready(conn, store_id):
+    """维表是否可用于该门店（已全量构建过）。结果缓存 _READY_TTL 秒；表不存在视为不可用。"""
+    if not SKU_DIM_ENABLED:
+        return False
+    hit = _ready_cache.get(store_id)
+    now = time.time()
+    if hit and hit[1] > now:
+        return hit[0]
+    ready = False
+    try:
+        with conn.cursor() as cur:
+            ready = _is_full_built(cur, store_id)
+    except Exception:
+        ready = False
+    _ready_cache[store_id] = (ready, now + _READY_TTL)
+    return ready
+
+
+def sku_dim_subquery(conn, store_id, columns, where=""):
+    """
+    「每货号一行属性」派生表 SQL：SELECT sku_code, <columns> ...，首个占位符为 store_id，其后为 where 的占位符。
+    维表就绪时直接读维表（where 作用于货号的属性）；否则退回销售表按货号 MAX 推导（where 作用于销售行）。
+    columns 可含 store_id；where 形如 " AND ..."，只引用维表列（与销售表同名）。
+    """
+    if sku_dim_ready(conn, store_id):
+        cols = "".join(f", {c}" for c in columns)
+        return f"SELECT sku_code{cols} FROM {SKU_DIM_TABLE} WHERE store_id = %s{where}"
+    cols = "".join(f", MAX({c}) AS {c}" for c in columns)
+    return f"SELECT sku_code{cols} FROM {SALE_TABLE} WHERE store_id = %s{where} GROUP BY sku_code"
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+最新库存表 t_htma_stock_latest：每个 门店+货号 一行，存该货号在 t_htma_stock 中 data_date 最大的那一行，
+供「当前库存」类查询读取，避免每次对不断增长的库存历史做 MAX(data_date) 子查询或按货号分组取最新行。
+
+- 主键 (store_id, sku_code)，另有 (store_id, data_date) 索引：原先 `data_date = (SELECT MAX(data_date) FROM t_htma_stock ...)`
+  的查询只需把两处表名换成本表，结果不变（最新快照日期的货号，其最新行正是该日快照行），MAX 走索引；
+  按货号取最新行（如鸿蓓楼选品目录）直接读本表；
+- 列与 t_htma_stock 同名（不含 id/时间戳），刷新时只复制库存表实际存在的列；
+- 导入库存（write_parsed_stock）在同一事务内按导入日期合并：日期不早于已有行的才覆盖；从未全量构建过的门店首次导入时全量构建；
+- 建表是 DDL（会隐式提交），须在写入库存之前调用 ensure_stock_latest_table。
+"""
+import os
+import time
+
+LATEST_TABLE = "t_htma_stock_latest"
+LATEST_META_TABLE = "t_htma_stock_latest_meta"
+STOCK_TABLE = "t_htma_stock"
+
+# HTMA_STOCK_LATEST=0 时一律读库存历史表（便于排查口径问题）
+STOCK_LATEST_ENABLED = os.environ.get("HTMA_STOCK_LATEST", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# (列名, 定义)：与库存导入写入的列一致（STOCK_FULL + STOCK_V2_EXTRA）
+LATEST_COLUMNS = (
+    ("warehouse_code", "VARCHAR(32) DEFAULT NULL"),
+    ("warehouse_name", "VARCHAR(128) DEFAULT NULL"),
+    ("category", "VARCHAR(64) DEFAULT NULL"),
+    ("category_name", "VARCHAR(64) DEFAULT NULL"),
+    ("category_large_code", "VARCHAR(32) DEFAULT NULL"),
+    ("category_large", "VARCHAR(64) DEFAULT NULL"),
+    ("category_mid_code", "VARCHAR(32) DEFAULT NULL"),
+    ("category_mid", "VARCHAR(64) DEFAULT NULL"),
+    ("category_small_code", "VARCHAR(32) DEFAULT NULL"),
+    ("category_small", "VARCHAR(64) DEFAULT NULL"),
+    ("product_name", "VARCHAR(128) DEFAULT NULL"),
+    ("short_name", "VARCHAR(64) DEFAULT NULL"),
+    ("product_code", "VARCHAR(64) DEFAULT NULL"),
+    ("barcode", "VARCHAR(64) DEFAULT NULL"),
+    ("spec", "VARCHAR(64) DEFAULT NULL"),
+    ("unit", "VARCHAR(16) DEFAULT NULL"),
+    ("brand_code", "VARCHAR(32) DEFAULT NULL"),
+    ("brand_name", "VARCHAR(64) DEFAULT NULL"),
+    ("supplier_code", "VARCHAR(64) DEFAULT NULL"),
+    ("supplier_name", "VARCHAR(128) DEFAULT NULL"),
+    ("contact", "VARCHAR(64) DEFAULT NULL"),
+    ("biz_mode", "VARCHAR(32) DEFAULT NULL"),
+    ("branch_manage", "VARCHAR(32) DEFAULT NULL"),
+    ("location_code", "VARCHAR(32) DEFAULT NULL"),
+    ("location_name", "VARCHAR(64) DEFAULT NULL"),
+    ("product_status", "VARCHAR(32) DEFAULT NULL"),
+    ("stock_qty", "DECIMAL(12, 2) NOT NULL DEFAULT 0"),
+    ("stock_boxes", "DECIMAL(12, 2) DEFAULT NULL"),
+    ("stock_amount", "DECIMAL(14, 2) DEFAULT 0"),
+    ("stock_amount_retail", "DECIMAL(14, 2) DEFAULT NULL"),
+    ("avg_price", "DECIMAL(14, 4) DEFAULT NULL"),
+    ("avg_inbound_price", "DECIMAL(14, 4) DEFAULT NULL"),
+    ("sale_price", "DECIMAL(14, 4) DEFAULT NULL"),
+    ("aging", "DECIMAL(10, 4) DEFAULT NULL"),
+    ("last_change_date", "DATETIME DEFAULT NULL"),
+)
+
+_READY_TTL = 30  # 秒，就绪状态进程内缓存
+_ready_cache = {}  # store_id -> (ready, expire_at)
+
+
+def ensure_stock_latest_table(conn):
+    """建最新库存表与状态表（已存在则跳过）。DDL 会隐式提交，须在导入写入之前调用。"""
+    cols = ",\n".join(f"          {name:<20} {ddl}" for name, ddl in LATEST_COLUMNS)
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LATEST_TABLE} (
+          store_id             VARCHAR(32) NOT NULL COMMENT '门店ID',
+          sku_code             VARCHAR(64) NOT NULL COMMENT '货号',
+          data_date            DATE        NOT NULL COMMENT '该货号最新库存日期',
+{cols},
+          PRIMARY KEY (store_id, sku_code),
+          KEY idx_store_date (store_id, data_date)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='最新库存(每门店每货号取库存表最新一行)'
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LATEST_META_TABLE} (
+          store_id      VARCHAR(32) NOT NULL PRIMARY KEY,
+          full_built_at DATETIME    DEFAULT NULL COMMENT '最近一次全量构建时间',
+          updated_at    DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='最新库存构建状态'
+    """)
+    cur.close()
+
+
+def _row_first(row):
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0] if row else None
+
+
+def _stock_columns(cur):
+    """库存表实际存在的可复制列（部署较早的库可能缺部分扩展列）。"""
+    cur.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (STOCK_TABLE,),
+    )
+    present = {str(_row_first(r)).lower() for r in cur.fetchall()}
+    return [name for name, _ in LATEST_COLUMNS if name in present]
+
+
+def _is_full_built(cur, store_id):
+    cur.execute(f"SELECT full_built_at FROM {LATEST_META_TABLE} WHERE store_id = %s", (store_id,))
+    return _row_first(cur.fetchone()) is not None
+
+
+def _full_sql(cols):
+    col_str = ", ".join(cols)
+    src_cols = ", ".join(f"st.{c}" for c in cols)
+    return f"""
+        INSERT INTO {LATEST_TABLE} (store_id, sku_code, data_date, {col_str})
+        SELECT st.store_id, st.sku_code, st.data_date, {src_cols}
+        FROM {STOCK_TABLE} st
+        INNER JOIN (
+            SELECT sku_code, MAX(data_date) AS md FROM {STOCK_TABLE} WHERE store_id = %s GROUP BY sku_code
+        ) z ON z.sku_code = st.sku_code AND z.md = st.data_date
+        WHERE st.store_id = %s
+    """
+
+
+def _merge_sql(cols, n_dates):
+    """按日期合并：新行日期不早于已有行时覆盖（data_date 放在最后赋值，前面各列比较的是旧日期）。"""
+    col_str = ", ".join(cols)
+    ph = ", ".join(["%s"] * n_dates)
+    newer = f"VALUES(data_date) >= {LATEST_TABLE}.data_date"
+    updates = ", ".join(f"{c} = IF({newer}, VALUES({c}), {LATEST_TABLE}.{c})" for c in cols)
+    return f"""
+        INSERT INTO {LATEST_TABLE} (store_id, sku_code, data_date, {col_str})
+        SELECT store_id, sku_code, data_date, {col_str}
+        FROM {STOCK_TABLE}
+        WHERE store_id = %s AND data_date IN ({ph})
+        ORDER BY data_date
+        ON DUPLICATE KEY UPDATE {updates}, data_date = GREATEST(VALUES(data_date), {LATEST_TABLE}.data_date)
+    """
+
+
+def refresh_stock_latest(conn, store_id, dates=None, commit=True):
+    """
+    更新最新库存表。dates 为空时全量重建该门店；否则把这些日期的库存行按「日期较新者覆盖」合并进来。
+    门店从未全量构建过时，即使给了 dates 也做一次全量构建。commit=False 时不提交也不回滚（导入事务内调用），
+    调用前须已 ensure_stock_latest_table。返回写入/合并的行数（MySQL 对覆盖行计 2）。
+    """
+    cur = conn.cursor()
+    try:
+        cols = _stock_columns(cur)
+        full = not dates or not _is_full_built(cur, store_id)
+        if full:
+            cur.execute(f"DELETE FROM {LATEST_TABLE} WHERE store_id = %s", (store_id,))
+            cur.execute(_full_sql(cols), (store_id, store_id))
+            written = cur.rowcount
+            cur.execute(f"""
+                INSERT INTO {LATEST_META_TABLE} (store_id, full_built_at) VALUES (%s, NOW())
+                ON DUPLICATE KEY UPDATE full_built_at = VALUES(full_built_at)
+            """, (store_id,))
+        else:
+            ds = sorted({str(d)[:10] for d in dates if d})
+            cur.execute(_merge_sql(cols, len(ds)), (store_id, *ds))
+            written = cur.rowcount
+        if commit:
+            conn.commit()
+    except Exception:
+        if commit:
+            conn.rollback()
+        raise
+    finally:
+        cur.close()
+    _ready_cache.pop(store_id, None)
+    return written
+
+
+def invalidate_stock_latest(conn, store_id):
+    """标记该门店最新库存表需重建（读取改回库存表，下次导入全量构建）；不提交。"""
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {LATEST_META_TABLE} WHERE store_id = %s", (store_id,))
+    _ready_cache.pop(store_id, None)
+
+
+def stock_latest_ready(conn, store_id):
+    """最新库存表是否可用于该门店（已全量构建过）。结果缓存 _READY_TTL 秒；表不存在视为不可用。"""
+    if not STOCK_LATEST_ENABLED:
+        return False
+    hit = _ready_cache.get(store_id)
+    now = time.time()
+    if hit and hit[1] > now:
+        return hit[0]
+    ready = False
+    try:
+        with conn.cursor() as cur:
+            ready = _is_full_built(cur, store_id)
+    except Exception:
+        ready = False
+    _ready_cache[store_id] = (ready, now + _READY_TTL)
+    return ready
+
+
+def stock_source(conn, store_id):
+    """「当前库存」查询应读的表名：最新库存表就绪时返回 LATEST_TABLE，否则返回库存历史表 t_htma_stock。"""
+    return LATEST_TABLE if stock_latest_ready(conn, store_id) else STOCK_TABLE
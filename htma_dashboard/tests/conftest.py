@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+测试共用设置与假连接：
+- 列映射档案写到临时文件，不污染项目 data/column_profiles.json；
+- FakeConn / FakeCursor：记录执行的 SQL，供派生表（销售日汇总、最新库存、SKU 维表）、导入与批量装载等单测断言，
+  各测试文件 `from htma_dashboard.tests.conftest import FakeConn` 后按需传参或继承扩展。
+"""
+import os
+import tempfile
+
+os.environ.setdefault("HTMA_COLUMN_PROFILES_PATH", os.path.join(tempfile.mkdtemp(prefix="htma_test_"), "column_profiles.json"))
+
+
+class FakeCursor:
+    """
+    记录执行的 SQL（空白归一）与参数到 conn.sqls；fetchone 按 conn.built 返回元数据表的全量构建时间，
+    fetchall 返回 conn.rows（缺省为 conn.columns 对应的 information_schema 行）。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.sqls = conn.sqls
+        self.rowcount = conn.rowcount
+
+    def execute(self, sql, params=None):
+        self.sqls.append((" ".join(sql.split()), params))
+
+    def fetchone(self):
+        return {"full_built_at": "2026-01-01 00:00:00"} if self.conn.built else None
+
+    def fetchall(self):
+        if self.conn.rows is not None:
+            return self.conn.rows
+        return [{"COLUMN_NAME": c} for c in self.conn.columns]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        return False
+
+
+class FakeConn:
+    """假 pymysql 连接：cursor() 总是返回同一个 cursor_class 实例（conn.cur），记录 commit / rollback 次数与是否 close。"""
+
+    cursor_class = FakeCursor
+
+    def __init__(self, built=False, columns=(), rows=None, rowcount=3):
+        self.built = built
+        self.columns = columns
+        self.rows = rows
+        self.rowcount = rowcount
+        self.sqls = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.cur = self.cursor_class(self)
+
+    def cursor(self, *a, **kw):
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
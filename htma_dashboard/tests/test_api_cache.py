@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for api_cache / shared_cache (LRU bounds, TTL, data-version keyed route cache, SQLite/RESP shared tier; no MySQL)."""
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from flask import Flask, jsonify
+from htma_dashboard import api_cache
+from htma_dashboard.api_cache import LRUCache, cached_api
+from htma_dashboard.shared_cache import RedisBackend, SQLiteBackend, decode_entry, encode_entry
+
+
+def test_lru_evicts_by_entries_and_bytes():
+    c = LRUCache(max_bytes=100, max_entries=2, default_ttl=60)
+    c.set("a", b"x" * 10)
+    c.set("b", b"x" * 10)
+    assert c.get("a") is not None  # a 变为最近使用
+    c.set("c", b"x" * 10)
+    assert c.get("b") is None and c.get("a") is not None
+    c.set("big", b"x" * 95)
+    assert c.stats()["bytes"] <= 100 and c.get("big") is not None
+    assert not c.set("huge", b"x" * 101)
+
+
+def test_ttl_expiry_and_no_expiry():
+    c = LRUCache(max_bytes=1000, max_entries=10, default_ttl=0.01)
+    c.set("short", b"1")
+    c.set("forever", b"2", ttl=None)
+    time.sleep(0.02)
+    assert c.get("short") is None
+    assert c.get("forever") == b"2"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    api_cache.get_cache().clear()
+    monkeypatch.setattr(api_cache, "get_shared_backend", lambda: None)
+    app = Flask(__name__)
+    calls = {"n": 0}
+
+    @app.route("/api/demo")
+    @cached_api("s1")
+    def demo():
+        calls["n"] += 1
+        return jsonify({"n": calls["n"]})
+
+    with app.test_client() as c:
+        yield c, calls
+    api_cache.get_cache().clear()
+
+
+def test_route_cache_hits_until_data_version_changes(client):
+    c, calls = client
+    version = {"v": "1.0"}
+    with patch.object(api_cache, "get_data_version", lambda store_id: version["v"]):
+        r1 = c.get("/api/demo?period=week&category_large_code=01")
+        r2 = c.get("/api/demo?category_large_code=01&period=week")  # 参数顺序不同视为同一请求
+        assert r1.headers["X-Cache"] == "MISS" and r2.headers["X-Cache"] == "HIT"
+        assert r2.get_json() == {"n": 1}
+        version["v"] = "2.0"  # 导入后版本号变化
+        r3 = c.get("/api/demo?period=week&category_large_code=01")
+    assert r3.headers["X-Cache"] == "MISS" and r3.get_json() == {"n": 2}
+    assert calls["n"] == 2
+
+
+def test_closed_custom_range_has_no_ttl(client):
+    c, _ = client
+    past_end = (date.today() - timedelta(days=1)).isoformat()
+    with patch.object(api_cache, "get_data_version", lambda store_id: "1.0"), \
+            patch.object(api_cache, "CACHE_TTL", 0.01):
+        c.get(f"/api/demo?start_date=2025-01-01&end_date={past_end}")
+        c.get("/api/demo?period=recent30")
+        time.sleep(0.02)
+        assert c.get(f"/api/demo?start_date=2025-01-01&end_date={past_end}").headers["X-Cache"] == "HIT"
+        assert c.get("/api/demo?period=recent30").headers["X-Cache"] == "MISS"
+
+
+def test_bump_takes_effect_locally_when_db_unavailable():
+    from htma_dashboard import data_version
+
+    class BrokenConn:
+        def cursor(self):
+            raise OSError("db down")
+
+    with patch.object(data_version, "_get_conn", side_effect=OSError("db down")):
+        before = data_version.get_data_version("s-bump")
+        after = data_version.bump_data_version(BrokenConn(), "s-bump")
+    assert before != after
+
+
+def test_import_bumps_version_only_on_own_connection_when_it_fails(monkeypatch):
+    """导入成功后在导入连接上 bump；导入抛异常时改用单独连接，导入连接上的未提交行不被提交。"""
+    from htma_dashboard import data_version, import_logic
+
+    calls = []
+    monkeypatch.setattr(import_logic, "bump_data_version", lambda conn, store_id: calls.append(conn))
+
+    class Conn:
+        commits = 0
+
+        def commit(self):
+            self.commits += 1
+
+    @import_logic._bumps_data_version
+    def fake_import(path, conn, fail=False):
+        if fail:
+            raise RuntimeError("insert failed")
+        return 1
+
+    conn = Conn()
+    assert fake_import("a.xlsx", conn) == 1 and calls == [conn]
+    with pytest.raises(RuntimeError):
+        fake_import("a.xlsx", conn, fail=True)
+    assert calls == [conn, None] and conn.commits == 0
+
+    monkeypatch.setattr(data_version, "_table_ready", False)
+    ddl = []
+
+    class Cur:
+        def execute(self, sql, params=None):
+            ddl.append("CREATE TABLE" in sql)
+
+        def fetchone(self):
+            return {"version": 1}
+
+        def close(self):
+            pass
+
+    class VersionConn(Conn):
+        def cursor(self):
+            return Cur()
+
+    data_version.bump_data_version(VersionConn(), "s-ddl")
+    data_version.bump_data_version(VersionConn(), "s-ddl")
+    assert ddl.count(True) == 1  # 建表 DDL 每进程只发一次
+
+
+def test_entry_encoding_roundtrip_compresses():
+    body = b'{"rows": [' + b'{"a": 1}, ' * 500 + b']}'
+    blob = encode_entry(body, 200, "application/json")
+    assert len(blob) < len(body) // 10
+    assert decode_entry(blob) == (body, 200, "application/json")
+
+
+def test_sqlite_backend_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    a, b = SQLiteBackend(path), SQLiteBackend(path)  # 模拟同机两个 worker
+    a.set("k", b"v1", ttl=None)
+    a.set("short", b"v2", ttl=0.01)
+    assert b.get("k") == b"v1"
+    time.sleep(0.02)
+    assert b.get("short") is None
+    small = SQLiteBackend(path, max_bytes=10)
+    for i in range(5):
+        small.set("p%d" % i, b"x" * 4)
+    small.prune()
+    assert small.get("p0") is None and small.get("p4") == b"x" * 4
+
+
+def test_route_cache_reused_across_workers(tmp_path, monkeypatch):
+    """两个 worker 各自的进程内缓存为空时，第二个从共享后端命中，不再计算。"""
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(api_cache, "get_shared_backend", lambda: backend)
+    monkeypatch.setattr(api_cache, "get_data_version", lambda store_id: version["v"])
+    version = {"v": "3.0"}
+    calls = {"n": 0}
+    app = Flask(__name__)
+
+    @app.route("/api/insight", methods=["GET", "POST"])
+    @cached_api("s1", methods=("GET", "POST"))
+    def insight():
+        calls["n"] += 1
+        return jsonify({"n": calls["n"]})
+
+    with app.test_client() as c:
+        api_cache.get_cache().clear()
+        assert c.post("/api/insight?period=week").headers["X-Cache"] == "MISS"
+        api_cache.get_cache().clear()  # 另一个 worker：进程内缓存是冷的
+        r = c.get("/api/insight?period=week")
+        assert r.headers["X-Cache"] == "HIT-SHARED" and r.get_json() == {"n": 1}
+        version["v"] = "3.1"  # 本进程未落库的 bump：不读写共享后端
+        api_cache.get_cache().clear()
+        assert c.get("/api/insight?period=week").headers["X-Cache"] == "MISS"
+        version["v"] = "4.0"
+        api_cache.get_cache().clear()
+        assert c.get("/api/insight?period=week").get_json() == {"n": 3}
+    api_cache.get_cache().clear()
+
+
+class _FakeRespServer:
+    """本地 RESP 替身：支持 GET / SET [PX] / SCAN / DEL / SELECT / AUTH。"""
+
+    def __init__(self):
+        self.data = {}
+        self.sets = []  # 每次 SET 的参数
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(4)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        f = conn.makefile("rb")
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                n = int(f.readline()[1:])
+                args.append(f.read(n + 2)[:-2])
+            cmd = args[0].upper()
+            if cmd == b"GET":
+                v = self.data.get(args[1])
+                conn.sendall(b"$-1\r\n" if v is None else b"$%d\r\n%s\r\n" % (len(v), v))
+            elif cmd == b"SET":
+                self.data[args[1]] = args[2]
+                self.sets.append(args[1:])
+                conn.sendall(b"+OK\r\n")
+            elif cmd == b"SCAN":
+                keys = [k for k in self.data if k.startswith(args[3][:-1])]
+                conn.sendall(b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys) + b"".join(b"$%d\r\n%s\r\n" % (len(k), k) for k in keys))
+            elif cmd == b"DEL":
+                for k in args[1:]:
+                    self.data.pop(k, None)
+                conn.sendall(b":%d\r\n" % (len(args) - 1))
+            else:
+                conn.sendall(b"+OK\r\n")
+
+    def close(self):
+        self.sock.close()
+
+
+def test_redis_backend_against_local_stand_in():
+    server = _FakeRespServer()
+    try:
+        a = RedisBackend("redis://127.0.0.1:%d/1" % server.port)
+        b = RedisBackend("redis://127.0.0.1:%d/1" % server.port)
+        blob = encode_entry(b'{"x": 1}', 200, "application/json")
+        a.set("k1", blob, ttl=30)
+        assert b.get("k1") == blob and b.get("missing") is None
+        assert list(server.data) == [b"htma:api:k1"]
+        b.clear()
+        assert a.get("k1") is None
+        c = RedisBackend("redis://127.0.0.1:%d/1" % server.port, max_ttl=60)
+        c.set("k2", blob, ttl=None)
+        c.set("k3", blob, ttl=3600)
+        assert [args[2:] for args in server.sets[1:]] == [[b"PX", b"60000"], [b"PX", b"60000"]]  # 不过期与超长 TTL 都封顶
+    finally:
+        server.close()
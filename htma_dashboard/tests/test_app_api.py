@@ -11,6 +11,24 @@ if _root not in sys.path:
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def _raw_sale_source():
+    """mocked DB 下不查汇总表构建状态（会占用 fetchone 序列），统一走明细表 t_htma_sale。"""
+    with patch("htma_dashboard.app.sale_source", return_value="t_htma_sale"):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def _empty_api_cache(monkeypatch):
+    """每个用例前清空接口响应缓存并关闭共享二级缓存，避免上一用例（或上次运行）的 mocked 结果被命中。"""
+    import importlib
+    from htma_dashboard.app import cached_api
+    mod = importlib.import_module(cached_api.__module__)
+    mod.get_cache().clear()
+    monkeypatch.setattr(mod, "get_shared_backend", lambda: None)
+    yield
+
+
 @pytest.fixture
 def app_client():
     """Flask test client with get_conn mocked to avoid real DB."""
@@ -43,14 +61,20 @@ def test_api_date_range(app_client):
 
 def test_api_kpi(app_client):
     """GET /api/kpi returns 200 and KPI keys (with mocked DB)."""
-    with patch("htma_dashboard.app.get_conn") as mock_get_conn:
+    with patch("htma_dashboard.app.get_conn") as mock_get_conn, \
+            patch("htma_dashboard.app.stock_source", return_value="t_htma_stock"), \
+            patch("htma_dashboard.app.sku_dim_subquery", return_value="SELECT sku_code FROM t_htma_sku_dim WHERE store_id = %s"):
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_conn.cursor.return_value.__enter__ = MagicMock(return_value=mock_cursor)
         mock_conn.cursor.return_value.__exit__ = MagicMock(return_value=False)
         mock_get_conn.return_value = mock_conn
+        # 销售额/毛利来自按日销售扫描（fetchall），库存另查一次（fetchone）
+        mock_cursor.fetchall.return_value = [
+            {"data_date": __import__("datetime").date(2025, 12, 30), "sale_amount": 600.0, "profit_amount": 120.0},
+            {"data_date": __import__("datetime").date(2025, 12, 31), "sale_amount": 400.0, "profit_amount": 80.0},
+        ]
         mock_cursor.fetchone.side_effect = [
-            {"total_sale_amount": 1000.0, "total_gross_profit": 200.0},
             {"total_stock_amount": 5000.0},
         ]
         from htma_dashboard.app import app
@@ -63,6 +87,7 @@ def test_api_kpi(app_client):
     data = r.get_json()
     assert "total_sale_amount" in data and "total_gross_profit" in data
     assert "avg_profit_rate_pct" in data and "total_stock_amount" in data
+    assert (data["total_sale_amount"], data["total_gross_profit"], data["avg_profit_rate_pct"]) == (1000.0, 200.0, 20.0)
 
 
 def test_api_category_pie(app_client):
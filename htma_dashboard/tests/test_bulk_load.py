@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests for bulk_load (TSV escaping, staging-table SQL flow, bad-row reporting, fallback in import_logic; fake conn, no MySQL)."""
+import os
+import sys
+from datetime import date, datetime
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard import import_logic
+from htma_dashboard.bulk_load import BulkLoadUnavailable, bulk_upsert, tsv_field
+from htma_dashboard.tests.conftest import FakeConn, FakeCursor
+
+
+class LoadCursor(FakeCursor):
+    """LOAD DATA 读取 TSV 文件（或按 load_error 报错），SHOW WARNINGS 返回 conn.warnings，合并 INSERT 可按 merge_error 报错。"""
+
+    def execute(self, sql, params=None):
+        super().execute(sql, params)
+        sql = self.sqls[-1][0]
+        if sql.startswith("LOAD DATA"):
+            if self.conn.load_error:
+                raise self.conn.load_error
+            with open(params[0], encoding="utf-8") as fp:
+                self.conn.tsv = fp.read()
+        if sql.startswith("INSERT INTO") and "FROM _stg_" in sql and self.conn.merge_error:
+            raise self.conn.merge_error
+        self.conn.rows = self.conn.warnings if sql == "SHOW WARNINGS" else []
+
+
+class LoadConn(FakeConn):
+    cursor_class = LoadCursor
+
+    def __init__(self, warnings=(), load_error=None, merge_error=None):
+        super().__init__()
+        self.warnings = list(warnings)
+        self.load_error = load_error
+        self.merge_error = merge_error
+        self.tsv = None
+
+
+def test_tsv_field_escapes_and_formats():
+    assert tsv_field(None) == "\\N"
+    assert tsv_field("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+    assert tsv_field(1e-05) == "0.00001"
+    assert tsv_field(12.5) == "12.5" and tsv_field(float("nan")) == "\\N"
+    assert tsv_field(datetime(2026, 3, 1, 8, 5)) == "2026-03-01 08:05:00"
+    assert tsv_field(date(2026, 3, 1)) == "2026-03-01" and tsv_field(True) == "1"
+
+
+def test_bulk_upsert_loads_staging_and_merges_once():
+    warnings = [{"Level": "Warning", "Code": 1265, "Message": "Data truncated for column 'spec' at row 2"}]
+    conn = LoadConn(warnings)
+    cols = ["data_date", "sku_code", "spec", "sale_amount"]
+    rows = [["2026-03-01", "a", "x\ty", 1.5], ["2026-03-01", "b", "y" * 300, 2.0], ["2026-03-01", "c", None, 0]]
+    n, n_bad, report = bulk_upsert(conn, "t_htma_sale", cols, rows, "t_htma_sale.spec=VALUES(spec)")
+    assert (n, n_bad) == (2, 1) and report == [(1, warnings[0]["Message"])]
+    assert conn.tsv.splitlines()[0] == "2026-03-01\ta\tx\\ty\t1.5"
+    assert conn.tsv.splitlines()[2].endswith("\\N\t0")
+    sqls = [sql for sql, _ in conn.sqls]
+    assert sqls[1] == "CREATE TEMPORARY TABLE _stg_t_htma_sale AS SELECT data_date, sku_code, spec, sale_amount FROM t_htma_sale WHERE 1 = 0"
+    assert ("UPDATE _stg_t_htma_sale SET _bad = 1 WHERE _line IN (%s)", (2,)) in conn.sqls
+    merges = [sql for sql in sqls if sql.startswith("INSERT INTO t_htma_sale")]
+    assert len(merges) == 1 and "FROM _stg_t_htma_sale WHERE _bad = 0" in merges[0]
+    assert sqls[-1] == "DROP TEMPORARY TABLE IF EXISTS _stg_t_htma_sale"
+
+
+def test_bulk_upsert_unavailable_when_load_refused():
+    conn = LoadConn(load_error=RuntimeError("Loading local data is disabled"))
+    with pytest.raises(BulkLoadUnavailable):
+        bulk_upsert(conn, "t_htma_stock", ["sku_code"], [["a"]], "t_htma_stock.sku_code=VALUES(sku_code)")
+    assert not any(sql.startswith("INSERT") for sql, _ in conn.sqls)
+
+
+def test_write_sale_rows_bulk_then_fallback(monkeypatch):
+    used = sys.modules[import_logic.use_bulk_load.__module__]  # import_logic 可能以顶层 bulk_load 导入
+    monkeypatch.setattr(used, "BULK_LOAD_ENABLED", True)
+    monkeypatch.setattr(used, "BULK_LOAD_MIN_ROWS", 2)
+    cols = ["data_date", "sku_code", "store_id", "sale_qty", "sale_amount", "sale_cost", "gross_profit", "source_sheet"]
+    rows = [["2026-03-01", "s%d" % i, "x", 1, 2, 1, 1, "sale_daily"] for i in range(3)]
+    conn = LoadConn([{"Message": "Column 'sale_cost' cannot be null at row 3"}])
+    assert import_logic._write_sale_rows(conn, cols, rows) == (2, 1, "货号s2: Column 'sale_cost' cannot be null at row 3")
+    merge = [sql for sql, _ in conn.sqls if sql.startswith("INSERT INTO t_htma_sale")][0]
+    assert "t_htma_sale.sale_qty=VALUES(sale_qty)" in merge
+    # LOCAL INFILE 未开启：退回多行 INSERT
+    conn = LoadConn(load_error=RuntimeError("The used command is not allowed with this MySQL version"))
+    assert import_logic._write_sale_rows(conn, cols, rows) == (3, 0, None)
+    assert [sql for sql, _ in conn.sqls if sql.startswith("INSERT INTO t_htma_sale")][-1].startswith("INSERT INTO t_htma_sale (data_date")
+    # 合并阶段出错（非装载不可用）：照常抛出，不静默退回
+    conn = LoadConn(merge_error=RuntimeError("Deadlock found when trying to get lock"))
+    with pytest.raises(RuntimeError, match="Deadlock"):
+        import_logic._write_sale_rows(conn, cols, rows)
+    assert not any(sql.startswith("INSERT INTO t_htma_sale (data_date") and "_stg_" not in sql for sql, _ in conn.sqls)
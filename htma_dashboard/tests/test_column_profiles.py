@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Tests for column_profiles (header fingerprints, learned/pinned column mappings) through import_logic parsing."""
+import json
+import multiprocessing
+import os
+import sys
+from datetime import datetime
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import openpyxl
+import pytest
+from htma_dashboard import import_logic
+
+
+def _write_daily(path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["销售日报"])
+    ws.append(["货号", "商品名称", "销售日期", "销售数量", "销售金额", "成本金额"])
+    for sku in range(1000, 1005):
+        ws.append([sku, "商品%d" % sku, datetime(2026, 3, 1), 1, 10.0, 4.0])
+    wb.save(path)
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    mod = sys.modules[import_logic.match_profile.__module__]  # import_logic 可能以顶层 column_profiles 导入
+    monkeypatch.setattr(mod, "PROFILES_PATH", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(mod, "PROFILES_ENABLED", True)
+    monkeypatch.setattr(mod, "_cache", {"mtime": None, "profiles": {}})
+    return mod
+
+
+def _amount_cost(parsed):
+    cols = parsed["all_cols"]
+    return {(v[cols.index("sale_amount")], v[cols.index("sale_cost")]) for v in parsed["vals_list"]}
+
+
+def test_fingerprint_ignores_whitespace_and_sum_prefix(profiles):
+    a = profiles.header_fingerprint("sale_daily", ["货号", "销售 金额", "求和项:成本金额", ""], 4)
+    assert a == profiles.header_fingerprint("sale_daily", ["货号", "销售金额", "成本金额"], 4)
+    assert a != profiles.header_fingerprint("sale_summary", ["货号", "销售金额", "成本金额"], 4)
+    assert profiles.header_fingerprint("stock", ["", None], 2) is None
+
+
+def test_learned_profile_skips_detection_and_shows_in_preview(profiles, tmp_path, monkeypatch):
+    path = str(tmp_path / "销售日报.xlsx")
+    _write_daily(path)
+    first = import_logic.parse_sale_file(path)
+    assert first["profile"] is None and len(first["keys"]) == 5
+    [learned] = profiles.list_profiles("sale_daily")
+    assert learned["pinned"] is False and learned["header"][:2] == ["货号", "商品名称"]
+
+    def boom(*a, **k):
+        raise AssertionError("同版式文件不应再检测列")
+
+    monkeypatch.setattr(import_logic, "_detect_sale_cols", boom)
+    again = import_logic.parse_sale_file(path)
+    assert again["profile"] == learned["name"] and _amount_cost(again) == _amount_cost(first)
+    preview = import_logic.preview_sale_excel(path)
+    assert preview["ok"] and preview["fingerprint"] == learned["fingerprint"]
+    assert preview["profile"] == {"name": learned["name"], "pinned": False}
+
+
+def test_pinned_swap_fixes_amount_cost_and_is_not_relearned(profiles, tmp_path):
+    path = str(tmp_path / "销售日报.xlsx")
+    _write_daily(path)
+    import_logic.parse_sale_file(path)
+    fp = profiles.list_profiles("sale_daily")[0]["fingerprint"]
+    pinned = profiles.pin_profile("sale_daily", fp, swap_amount_cost=True, name="ERP 日报(金额成本对调)")
+    assert pinned["pinned"] and pinned["name"] == "ERP 日报(金额成本对调)"
+    parsed = import_logic.parse_sale_file(path)
+    assert parsed["profile"] == "ERP 日报(金额成本对调)"
+    assert {(float(a), float(c)) for a, c in _amount_cost(parsed)} == {(4.0, 10.0)}
+    assert profiles.learn_profile("sale_daily", fp, [], {"sku": 0}) is None
+    assert profiles.match_profile("sale_daily", fp)["cols"] == pinned["cols"]
+    with pytest.raises(ValueError):
+        profiles.pin_profile("stock", fp, cols={"sku": 1})
+    assert profiles.delete_profile(fp) and profiles.match_profile("sale_daily", fp) is None
+
+
+def test_upload_swap_flag_applies_per_call_and_is_not_learned(profiles, tmp_path):
+    """上传时勾选「金额/进价列对调」按参数只作用于本次解析，不写档案、不影响同时进行的其他导入。"""
+    path = str(tmp_path / "销售日报.xlsx")
+    _write_daily(path)
+    swapped = import_logic.parse_sale_file(path, swap_amount_cost=True)
+    assert swapped["profile"] == "swap_amount_cost"
+    assert {(float(a), float(c)) for a, c in _amount_cost(swapped)} == {(4.0, 10.0)}
+    assert profiles.list_profiles("sale_daily") == []
+    plain = import_logic.parse_sale_file(path)
+    assert {(float(a), float(c)) for a, c in _amount_cost(plain)} == {(10.0, 4.0)}
+    assert "HTMA_SWAP_AMOUNT_COST" not in os.environ
+
+
+def _learn_many(args):
+    path, start = args
+    from htma_dashboard import column_profiles
+    column_profiles.PROFILES_PATH = path
+    column_profiles.PROFILES_ENABLED = True
+    for i in range(start, start + 10):
+        column_profiles.learn_profile("stock", "fp%04d" % i, ["货号"], {"sku": i})
+
+
+def test_concurrent_learning_across_processes_keeps_every_profile(tmp_path):
+    """进程池子进程同时学习：文件锁 + 持锁读盘，不丢其他进程刚写入的档案。"""
+    from htma_dashboard import column_profiles
+    path = str(tmp_path / "profiles.json")
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        pool.map(_learn_many, [(path, n * 10) for n in range(4)])
+    with open(path, encoding="utf-8") as fp:
+        assert sorted(json.load(fp)["profiles"]) == ["fp%04d" % i for i in range(40)]
+    assert column_profiles.PROFILES_PATH != path  # 父进程设置不受子进程影响
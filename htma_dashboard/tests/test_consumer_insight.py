@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Tests for consumer_insight single-scan derivation (fake cursor; parity with per-panel SQL needs HTMA_TEST_MYSQL=1)."""
+import os
+import sys
+from decimal import Decimal as D
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+
+from htma_dashboard import consumer_insight
+
+
+def _group(sku, amount, profit, qty, price, list_price=None, cat="食品", brand="A", in_filter=1, n=1, **kw):
+    row = {
+        "sku_code": sku, "cat": cat, "brand": brand, "supplier": kw.get("supplier"), "product_name": kw.get("product_name", "商品" + sku),
+        "color_system": None, "style": None, "sale_price": price, "list_price": list_price,
+        "distribution_mode": kw.get("mode"), "is_new": kw.get("is_new", 0), "in_filter": in_filter,
+        "sale_amount": D(amount), "profit": D(profit), "qty": D(qty), "return_amount": D(kw.get("ret", "0")), "n": n,
+    }
+    return row
+
+
+class _Cursor:
+    """扫描语句返回预置分组，其余小查询返回固定值。"""
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.sql = []
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.sql.append((sql, params))
+        if "GROUP BY s.sku_code, s.cat" in sql:
+            self._rows = self.groups
+        elif "FROM t_htma_product_master WHERE store_id" in sql:
+            self._rows = [{"c": 10, "avg_retail": D("12.34567"), "new_total": D(2)}]
+        elif "total_stock" in sql:
+            self._rows = [{"total_stock": D(300)}]
+        elif "prev_sale" in sql:
+            self._rows = [{"prev_sale": D(100)}]
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+GROUPS = [
+    # 筛选内：食品/A 两个 SKU，S1 两档售价；S2 售价为空
+    _group("S1", "100.00", "30.00", "10", D("10.0000"), D("12.5000"), n=3, mode="购销", supplier="甲"),
+    _group("S1", "50.00", "5.00", "5", D("9.0000"), D("12.5000"), n=2, mode="购销", supplier="甲"),
+    _group("S2", "60.00", "1.00", "1", None, D("100.0000"), brand="a", mode="代销", is_new=1, ret="6.00"),
+    # 筛选外（品类筛选不含），只计入经销方式/新品/折扣类面板
+    _group("S3", "40.00", "2.00", "2", D("20.0000"), D("40.0000"), cat="日化", brand="B", in_filter=0, is_new=1, product_name="  洗衣液 "),
+]
+
+
+def _build(groups=GROUPS, **kw):
+    cur = _Cursor(groups)
+    data = consumer_insight.build_consumer_insight(
+        cur, "沈阳超级仓", "data_date BETWEEN DATE_SUB(CURDATE(), INTERVAL %s DAY) AND CURDATE()", (30,),
+        ("沈阳超级仓", 30, "食品"), " AND category_large = %s", **kw,
+    )
+    return cur, data
+
+
+def test_scan_runs_once_and_overview_uses_filtered_groups():
+    cur, data = _build()
+    scans = [s for s, _ in cur.sql if "t_htma_sale" in s and "GROUP BY s.sku_code" in s]
+    assert len(scans) == 1
+    assert cur.sql[0][1] == ("食品", "沈阳超级仓", 30, "沈阳超级仓")  # 筛选参数在派生表 SELECT 中，先于 WHERE
+    ov = data["overview"]
+    assert (ov["total_sale"], ov["total_profit"], ov["total_qty"], ov["sku_sold"], ov["sku_total"]) == (210.0, 36.0, 16.0, 2, 10)
+    assert ov["avg_retail_price"] == 12.35 and ov["inventory_turnover_days"] == round(300 / (16 / 30), 1)
+    assert data["period_over_period"] == {"prev_sale": 100.0, "pct_change": 110.0}
+    # 品牌名按不区分大小写合并（A / a）
+    assert [(b["brand"], b["sku_sold"], b["sale_amount"]) for b in data["brand"]] == [("A", 2, 210.0)]
+    cm = data["category_matrix"][0]
+    assert cm["category"] == "食品" and cm["margin_pct"] == round(36 / 210 * 100, 2)
+    assert cm["avg_sale_price"] == round((10 * 3 + 9 * 2) / 5, 2)  # AVG(sale_price) 按行，售价为空的行不计
+    assert data["return_rate_pct"] == round(6 / 210 * 100, 2)
+
+
+def test_date_only_panels_ignore_category_filter_and_match_sql_semantics():
+    _, data = _build()
+    assert {d["mode"]: d["sale_amount"] for d in data["distribution"]} == {"购销": 150.0, "代销": 60.0, "未分类": 40.0}
+    npd = data["new_product"]
+    assert (npd["new_sale"], npd["new_sku_sold"], npd["new_sku_total"]) == (100.0, 2, 2)
+    # 折扣区间：S1 售价 10/12.5 → 20%，9/12.5 → 28%；S2 售价为空落入 30%+；S3 20/40 → 50%
+    bands = {b["band"]: (b["sku_cnt"], b["sale_amount"]) for b in data["discount_band"]}
+    assert bands == {"20-30%": (1, 150.0), "30%+": (2, 100.0)}
+    # 整体折扣只算售价不高于划线价的行：(100*0.2 + 50*0.28 + 40*0.5) / 190
+    assert data["overview"]["avg_discount_pct"] == round((100 * 0.2 + 50 * 0.28 + 40 * 0.5) / 190 * 100, 2)
+    # 品类折扣分母含售价为空的行：食品 (100*0.2 + 50*0.28) / 210
+    assert data["category_matrix"][0]["avg_discount_pct"] == round((20 + 14) / 210 * 100, 2)
+    assert [r["sku_code"] for r in data["high_discount_low_margin"]] == ["S3"]
+    assert data["high_discount_low_margin"][0]["product_name"] == "  洗衣液 "
+    assert [p["band"] for p in data["price_band"]] == ["0", "1-49"]
+
+
+def test_margin_follows_mysql_decimal_division_and_drill_down():
+    assert consumer_insight._margin(D("1.00"), D("3.00")) == D("33.333300")
+    assert consumer_insight._margin(D("2.00"), D("3.00")) == D("66.666700")
+    assert consumer_insight.discount_band(D("1.0000"), D("0.9000")) == "0-10%"  # 售价高于划线价
+    _, data = _build(drill={"category": "食品", "brand": "A", "product_name": "商品s1"})
+    assert [b["brand"] for b in data["drill_brands"]] == ["A"]
+    assert data["drill_styles"] == []
+    assert [(r["sku_code"], r["sale_amount"]) for r in data["drill_sku_rank"]] == [("S1", 150.0)]
+
+
+def test_app_falls_back_to_per_panel_queries_when_scan_fails(monkeypatch, caplog):
+    from unittest.mock import MagicMock
+    from htma_dashboard.app import _get_consumer_insight_data
+    mod = sys.modules[_get_consumer_insight_data.__module__]
+
+    def _fail(*a, **kw):
+        raise RuntimeError("Unknown column 'color_system'")
+
+    monkeypatch.setattr(mod, "get_conn", lambda: MagicMock())
+    monkeypatch.setattr(mod, "build_consumer_insight", _fail)
+    monkeypatch.setattr(mod, "_get_consumer_insight_data_multi", lambda param_override=None: {"multi": param_override})
+    assert _get_consumer_insight_data({"period": "recent30"}) == {"multi": {"period": "recent30"}}
+    assert "Unknown column 'color_system'" in caplog.text  # 回退时记录原异常，不静默吞掉
+    monkeypatch.setattr(mod, "INSIGHT_SINGLE_SCAN", False)
+    monkeypatch.setattr(mod, "build_consumer_insight", lambda *a, **kw: {"single": True})
+    assert _get_consumer_insight_data({"period": "week"}) == {"multi": {"period": "week"}}
+
+
+# ---- 与逐面板查询版逐字段一致（需真实 MySQL：HTMA_TEST_MYSQL=1 且 .env 指向测试库）----
+
+_PARITY_STORE = "pytest_insight_parity"
+_SALE_ROWS = [
+    # data_date, sku, large, mid, brand, supplier, product_name, color_system, style, sale_price, qty, amount, profit, return_amount
+    ("2026-01-05", "P1", "食品", "饮料", "Alpha", "供1", "可乐 330ml", "红", "罐装", 3.5, 10, 35, 7, 0),
+    ("2026-01-06", "P1", "食品", "饮料", "ALPHA ", "供1", "可乐 330ml", "红", "罐装", 3.0, 4, 12, 1.5, 3),
+    ("2026-01-06", "P2", "食品", "零食", "Beta", None, "薯片", None, "", 8.8, 3, 26.4, 6.6, 0),
+    ("2026-01-07", "P3", " 日化", "洗护", "", "供2", "洗衣液 ", "蓝", None, 45, 2, 90, 18, 0),
+    ("2026-01-07", "P4", "", "", None, "供2", "毛巾", None, None, 120, 1, 120, -10, 0),
+    ("2026-01-08", "P5", "服饰", "上衣", "Gamma", "供3", "T恤", "白", "短袖", 0, 1, 0, 0, 0),
+    ("2025-12-20", "P1", "食品", "饮料", "Alpha", "供1", "可乐 330ml", "红", "罐装", 3.5, 6, 21, 4, 0),
+]
+_MASTER_ROWS = [
+    # sku, product_name, category_name, brand, retail_price, list_price, distribution_mode, product_status
+    ("P1", "可乐 330ml", "食品", "Alpha", 3.5, 4.0, "购销", "新品"),
+    ("P2", "薯片", "食品", "Beta", 9.9, 12.0, "代销", "正常"),
+    ("P3", "洗衣液", "日化", None, 50, 60, " ", "新品"),
+    ("P4", "毛巾", None, None, 0, None, None, None),
+    ("P6", "牙刷", "日化", "Delta", 6, 8, "购销", "正常"),  # 本期无销售
+]
+
+
+@pytest.fixture
+def parity_app(monkeypatch):
+    if os.environ.get("HTMA_TEST_MYSQL", "").strip() != "1":
+        pytest.skip("未设置 HTMA_TEST_MYSQL=1，跳过与逐面板查询版的口径对比")
+    from htma_dashboard.app import _get_consumer_insight_data
+    from htma_dashboard.db_config import DB_CONFIG
+    import pymysql
+    mod = sys.modules[_get_consumer_insight_data.__module__]
+    conn = pymysql.connect(**DB_CONFIG)
+    cur = conn.cursor()
+
+    def _clear():
+        for table in ("t_htma_sale", "t_htma_product_master", "t_htma_stock"):
+            cur.execute(f"DELETE FROM {table} WHERE store_id = %s", (_PARITY_STORE,))
+
+    _clear()
+    for d, sku, large, mid, brand, sup, pname, color, style, price, qty, amt, gp, ret in _SALE_ROWS:
+        cur.execute("""
+            INSERT INTO t_htma_sale (store_id, data_date, sku_code, category_large, category_mid, brand_name, supplier_name,
+                product_name, color_system, style, sale_price, sale_qty, sale_amount, sale_cost, gross_profit, return_amount)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (_PARITY_STORE, d, sku, large, mid, brand, sup, pname, color, style, price, qty, amt, amt - gp, gp, ret))
+    for sku, pname, cat, brand, retail, list_price, mode, status in _MASTER_ROWS:
+        cur.execute("""
+            INSERT INTO t_htma_product_master (store_id, sku_code, product_name, category_name, brand_name,
+                retail_price, list_price, distribution_mode, product_status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (_PARITY_STORE, sku, pname, cat, brand, retail, list_price, mode, status))
+    cur.execute("INSERT INTO t_htma_stock (store_id, data_date, sku_code, stock_qty) VALUES (%s, '2026-01-08', 'P1', 40), (%s, '2026-01-08', 'P3', 5)",
+                (_PARITY_STORE, _PARITY_STORE))
+    conn.commit()
+    monkeypatch.setattr(mod, "STORE_ID", _PARITY_STORE)
+    monkeypatch.setattr(mod, "INSIGHT_SINGLE_SCAN", True)
+    yield mod
+    _clear()
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("override", [
+    {"period": "custom", "start_date": "2026-01-01", "end_date": "2026-01-31"},
+    {"period": "custom", "start_date": "2026-01-01", "end_date": "2026-01-31", "category": "食品"},
+    {"period": "custom", "start_date": "2026-01-01", "end_date": "2026-01-31", "category": "食品", "brand": "alpha"},
+    {"period": "custom", "start_date": "2026-01-01", "end_date": "2026-01-31", "category": "食品", "brand": "Alpha", "product_name": "可乐 330ml"},
+])
+def test_single_scan_matches_per_panel_queries(parity_app, monkeypatch, override):
+    multi = parity_app._get_consumer_insight_data_multi
+
+    def _no_fallback(param_override=None):
+        raise AssertionError("单次扫描失败，回退到了逐面板查询")
+
+    monkeypatch.setattr(parity_app, "_get_consumer_insight_data_multi", _no_fallback)
+    single = parity_app._get_consumer_insight_data(dict(override))
+    monkeypatch.setattr(parity_app, "_get_consumer_insight_data_multi", multi)
+    expected = multi(dict(override))
+    assert sorted(single) == sorted(expected)
+    for key in expected:
+        assert single[key] == expected[key], key
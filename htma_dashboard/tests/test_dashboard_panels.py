@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Tests for dashboard_panels shared scans and /api/dashboard_bundle vs single panel endpoints (fake cursor, no MySQL)."""
+import os
+import sys
+from datetime import date
+from decimal import Decimal as D
+from unittest.mock import patch
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+
+from htma_dashboard import dashboard_panels
+
+
+def _sale(d, cat, amount, profit):
+    return {"data_date": d, "category": cat, "sale_amount": D(amount), "profit_amount": D(profit)}
+
+
+SALE = [
+    _sale(date(2025, 12, 29), "饮料", "100.00", "20.00"),  # 周一，ISO 2026-W01
+    _sale(date(2025, 12, 31), "饮料 ", "50.00", "5.00"),   # 尾部空格与上一行同组
+    _sale(date(2025, 12, 31), None, "30.00", "3.00"),
+    _sale(date(2026, 1, 1), "零食", "80.00", "16.00"),     # 跨年：YEAR 不同，单独成周
+    _sale(date(2026, 1, 4), "零食", "20.00", "4.00"),      # 周日
+] + [_sale(date(2026, 1, 5), "品类%02d" % i, "1.00", "0.10") for i in range(10)]
+
+PROFIT = [
+    {"category": "饮料", "category_large": "食品", "category_large_code": "01", "category_mid": "水饮", "category_small": "",
+     "total_sale": D("150.00"), "total_profit": D("25.00")},
+    {"category": "零食", "category_large": "食品 ", "category_large_code": "01", "category_mid": None, "category_small": "膨化",
+     "total_sale": D("100.00"), "total_profit": D("20.00")},
+    {"category": None, "category_large": "  ", "category_large_code": None, "category_mid": None, "category_small": None,
+     "total_sale": D("30.00"), "total_profit": D("3.00")},
+    {"category": "洗护", "category_large": None, "category_large_code": "02", "category_mid": "", "category_small": "",
+     "total_sale": D("40.00"), "total_profit": D("4.00")},
+]
+
+
+def test_sale_scan_derivations_follow_sql_grouping():
+    assert dashboard_panels.sale_totals(SALE) == (D("290.00"), D("49.00"))
+    pie = dashboard_panels.category_pie(SALE)
+    assert [(r["category"], r["sale_amount"]) for r in pie][:3] == [("饮料", D("150.00")), ("零食", D("100.00")), ("未分类", D("30.00"))]
+    assert pie[3] == {"category": "其他", "sale_amount": D("3.00")} and len(pie) == 11  # 13 个品类：前 10 保留，其余 3 个并为「其他」
+
+    weeks = dashboard_panels.trend_points(SALE, "week")
+    assert [(w["x_date"], w["week_start"], w["sale_amount"]) for w in weeks] == [
+        ("2025-W01", date(2025, 12, 29), D("180.00")),
+        ("2026-W01", date(2026, 1, 1), D("100.00")),
+        ("2026-W02", date(2026, 1, 5), D("10.00")),
+    ]
+    assert [(m["x_date"], m["profit_amount"]) for m in dashboard_panels.trend_points(SALE, "month")] == [("2025-12", D("28.00")), ("2026-01", D("21.00"))]
+    assert [d["x_date"] for d in dashboard_panels.trend_points(SALE, "day")] == sorted({r["data_date"] for r in SALE})
+
+    dow = dashboard_panels.dow_sales(SALE)
+    assert dow[2]["sale_amount"] == D("110.00") and dow[2]["day_count"] == 2  # 周一：12-29 与 01-05
+    assert dow[1] == {"sale_amount": D("20.00"), "profit_amount": D("4.00"), "day_count": 1} and 3 not in dow
+
+
+def test_profit_scan_derivations():
+    assert dashboard_panels.profit_totals(PROFIT) == (D("320.00"), D("52.00"))
+    assert [r["category"] for r in dashboard_panels.category_rank_rows(PROFIT, limit=3)] == ["饮料", "零食", "洗护"]
+    large = dashboard_panels.category_large_rank_rows(PROFIT)
+    assert [(r["category_large"], r["category_large_code"], r["total_sale"]) for r in large] == [("食品", "01", D("250.00")), ("02", "02", D("40.00"))]
+    summary = {r["category"]: r for r in dashboard_panels.profit_summary_rows(PROFIT)}
+    assert summary["零食"]["category_mid"] == "" and summary["零食"]["category_small"] == "膨化"
+    assert summary["未分类"]["category_large"].strip() == "" and summary["未分类"]["total_sale"] == D("30.00")
+
+
+class _Cursor:
+    def __init__(self, log):
+        self.log = log
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.log.append(sql)
+        if "GROUP BY data_date, category" in sql:
+            self._rows = SALE
+        elif "GROUP BY data_date" in sql:
+            self._rows = [{k: v for k, v in r.items() if k != "category"} for r in SALE]
+        elif "FROM t_htma_profit" in sql:
+            self._rows = PROFIT
+        elif "total_stock_amount" in sql:
+            self._rows = [{"total_stock_amount": D("5000.00")}]
+        elif "BETWEEN %s AND %s" in sql:
+            self._rows = [{"sale_amount": D("290.00"), "profit_amount": D("49.00")}]
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+class _Conn:
+    def __init__(self, log):
+        self.log = log
+
+    def cursor(self):
+        return _Cursor(self.log)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from htma_dashboard.app import app, cached_api
+    import importlib
+    cache_mod = importlib.import_module(cached_api.__module__)
+    monkeypatch.setattr(cache_mod, "CACHE_ENABLED", False)
+    log = []
+    with patch("htma_dashboard.app.sale_source", return_value="t_htma_sale_daily_agg"), \
+            patch("htma_dashboard.app.get_conn", lambda: _Conn(log)):
+        app.config["TESTING"] = True
+        with app.test_client() as c:
+            yield c, log
+
+
+def test_bundle_matches_single_endpoints_with_one_scan_per_table(client):
+    c, log = client
+    qs = "period=recent30&granularity=week"
+    single = {
+        "kpi": c.get("/api/kpi?" + qs).get_json(),
+        "category_pie": c.get("/api/category_pie?" + qs).get_json(),
+        "sales_trend": c.get("/api/sales_trend?" + qs).get_json(),
+        "trend_analysis": c.get("/api/trend_analysis?period=recent30&granularity=day").get_json(),
+        "dow_sales": c.get("/api/dow_sales?" + qs).get_json(),
+        "category_rank": c.get("/api/category_rank?" + qs).get_json(),
+        "category_rank_by_large": c.get("/api/category_rank_by_large?" + qs).get_json(),
+        "profit_summary": c.get("/api/profit_summary?" + qs).get_json(),
+    }
+    del log[:]
+    r = c.get("/api/dashboard_bundle?panels=" + ",".join(single) + "&" + qs)
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["errors"] == {} and body["panels"] == single
+    assert single["kpi"]["total_sale_amount"] == 290.0 and single["category_pie"][3]["category"] == "其他"
+    scans = [s for s in log if "GROUP BY data_date" in s or "FROM t_htma_profit" in s]
+    assert len(scans) == 2 and "t_htma_sale_daily_agg" in scans[0]
+
+
+def test_bundle_rejects_unknown_panels_and_reports_panel_errors(client, monkeypatch):
+    c, _ = client
+    r = c.get("/api/dashboard_bundle?panels=kpi,nope")
+    assert r.status_code == 400 and "nope" in r.get_json()["error"]
+
+    from htma_dashboard.app import DASHBOARD_PANELS
+
+    def _boom(scan):
+        raise RuntimeError("Table 't_htma_stock' doesn't exist")
+
+    monkeypatch.setitem(DASHBOARD_PANELS, "kpi", _boom)
+    r = c.get("/api/dashboard_bundle?panels=kpi,dow_sales")
+    body = r.get_json()
+    assert r.status_code == 500 and "t_htma_stock" in body["errors"]["kpi"]
+    assert [d["dow_name"] for d in body["panels"]["dow_sales"]][:2] == ["周日", "周一"]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for db_config.ConnectionPool (fake connections, no MySQL)."""
+import os
+import sys
+import threading
+import time
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard.db_config import ConnectionPool, PoolTimeout
+from htma_dashboard.import_jobs import store_import_lock
+
+
+class FakeRaw:
+    """模拟 pymysql 连接：记录 rollback/close，ping 可按需失败。"""
+
+    def __init__(self):
+        self.open = True
+        self.rollbacks = 0
+        self.ping_ok = True
+        self._autocommit = False
+
+    def ping(self, reconnect=False):
+        if not self.ping_ok:
+            raise OSError("gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def get_autocommit(self):
+        return self._autocommit
+
+    def autocommit(self, v):
+        self._autocommit = v
+
+    def close(self):
+        self.open = False
+
+    def cursor(self):
+        return "cursor"
+
+
+def _pool(**kw):
+    made = []
+
+    def connect(**_):
+        raw = FakeRaw()
+        made.append(raw)
+        return raw
+
+    kw.setdefault("max_size", 2)
+    kw.setdefault("min_size", 1)
+    kw.setdefault("timeout", 0.2)
+    return ConnectionPool({}, connect=connect, **kw), made
+
+
+def test_close_returns_connection_to_pool():
+    pool, made = _pool()
+    conn = pool.get()
+    assert conn.cursor() == "cursor"
+    conn.close()
+    conn.close()  # 重复 close 无副作用
+    again = pool.get()
+    assert len(made) == 1
+    assert made[0].rollbacks == 1
+    again.close()
+    st = pool.stats()
+    assert st["size"] == 1 and st["idle"] == 1 and st["in_use"] == 0
+
+
+def test_warm_prebuilds_min_size():
+    pool, made = _pool(min_size=2)
+    assert pool.warm() == 2
+    assert pool.stats()["idle"] == 2 and len(made) == 2
+
+
+def test_bounded_wait_timeout():
+    pool, _ = _pool(max_size=1)
+    held = pool.get()
+    with pytest.raises(PoolTimeout):
+        pool.get()
+    assert pool.stats()["timeouts"] == 1
+    held.close()
+
+
+def test_waiter_gets_released_connection():
+    pool, made = _pool(max_size=1, timeout=2)
+    held = pool.get()
+    threading.Timer(0.05, held.close).start()
+    conn = pool.get()
+    assert len(made) == 1
+    conn.close()
+
+
+def test_dead_and_expired_connections_are_recycled():
+    pool, made = _pool(max_lifetime=3600)
+    conn = pool.get()
+    conn.close()
+    made[0].ping_ok = False
+    conn = pool.get()
+    assert len(made) == 2 and not made[0].open
+    conn.close()
+    pool.max_lifetime = 0.01
+    time.sleep(0.02)
+    conn = pool.get()
+    assert len(made) == 3
+    conn.close()
+    assert pool.stats()["recycled"] >= 2
+
+
+class _LockCursor:
+    def __init__(self, fail_release):
+        self.fail_release = fail_release
+
+    def execute(self, sql, params=None):
+        if "RELEASE_LOCK" in sql and self.fail_release:
+            raise OSError("lost connection")
+
+    def fetchone(self):
+        return {"got": 1}
+
+
+def test_failed_lock_release_discards_connection():
+    """RELEASE_LOCK 失败时连接仍持有 GET_LOCK：断开而不是放回池中给下个借用者。"""
+    pool, made = _pool(max_size=1)
+    for fail_release, reused in ((False, True), (True, False)):
+        conn = pool.get()
+        raw = conn._raw
+        raw.cursor = lambda: _LockCursor(fail_release)
+        with store_import_lock(conn, "店"):
+            pass
+        conn.close()
+        again = pool.get()
+        assert (again._raw is raw) is reused and raw.open is reused
+        again.close()
+    assert len(made) == 2 and pool.stats()["recycled"] == 1
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Tests for /api/export streaming (server-side cursor batches, CSV BOM, write-only XLSX, product filters; fake conn, no MySQL)."""
+import io
+import os
+import sys
+from unittest.mock import patch
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import openpyxl
+import pytest
+
+
+def _product(i):
+    return {
+        "sku_code": "S%04d" % i, "product_name": "商品%d" % i, "raw_name": None, "spec": "500g", "barcode": "69%011d" % i,
+        "brand_name": "品牌A", "category": "饮料", "category_large": "食品", "category_mid": "饮品", "category_small": "饮料",
+        "unit_price": 3.5, "sale_qty": 2, "sale_amount": 7.0, "gross_profit": 1.25,
+    }
+
+
+class _Cursor:
+    def __init__(self, conn, cursorclass):
+        self.conn = conn
+        self.cursorclass = cursorclass
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.conn.log.append((sql, params))
+        if "FROM t_htma_products" in sql and self.conn.products is None:
+            raise RuntimeError("Table 't_htma_products' doesn't exist")
+        self._rows = list(self.conn.products or []) if "FROM t_htma_products" in sql else []
+
+    def fetchmany(self, size):
+        self.conn.fetches.append(size)
+        out, self._rows = self._rows[:size], self._rows[size:]
+        return out
+
+    def close(self):
+        self.conn.cursors_closed += 1
+
+
+class _Conn:
+    def __init__(self, products):
+        self.products = products
+        self.log, self.fetches = [], []
+        self.cursors_closed = 0
+        self.closed = False
+        self.cursor_classes = []
+
+    def cursor(self, cursorclass=None):
+        self.cursor_classes.append(cursorclass)
+        return _Cursor(self, cursorclass)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def export_client(monkeypatch):
+    from htma_dashboard.app import app, iter_export_rows
+    mod = sys.modules[iter_export_rows.__module__]
+    monkeypatch.setattr(mod, "EXPORT_CHUNK_ROWS", 2)
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def _get(client, conn, url):
+    import htma_dashboard.app as app_mod
+    with patch.object(app_mod, "get_conn", return_value=conn), patch.object(app_mod, "_ql_query_filters") as qf:
+        from htma_dashboard.query_layer import query_filters_from_request
+        qf.side_effect = lambda include_sku=False, conn=None: query_filters_from_request(include_sku, lookup={})
+        r = client.get(url)
+        body = r.get_data()  # 在 patch 作用域内读完流
+    return r, body
+
+
+def test_csv_streams_in_batches_with_product_filters(export_client):
+    import pymysql
+    conn = _Conn([_product(i) for i in range(5)])
+    r, body = _get(export_client, conn, "/api/export?export_type=product&category_small_code=0301&brand=品牌A&sku_code=S0001")
+    assert r.status_code == 200 and r.mimetype == "text/csv"
+    assert body.startswith(b"\xef\xbb\xbf")
+    lines = body.decode("utf-8-sig").splitlines()
+    assert lines[0].startswith("商品编码,品名") and len(lines) == 6
+    assert lines[1].split(",")[-4:] == ["3.5", "2.0", "7.0", "1.25"]
+    sql, params = next((s, p) for s, p in conn.log if "FROM t_htma_products" in s)
+    assert "category_small_code IN" in sql and "brand_name = %s" in sql and "sku_code = %s" in sql
+    assert params[0] == "沈阳超级仓" and "0301" in params and "品牌A" in params and params[-1] == "S0001"
+    assert "data_date" not in sql  # 商品主表无日期列，日期参数不得混入
+    assert pymysql.cursors.SSDictCursor in conn.cursor_classes
+    assert conn.fetches == [2, 2, 2, 2] and conn.closed
+
+
+def test_xlsx_and_fallback_to_sale_detail(export_client):
+    conn = _Conn([_product(i) for i in range(3)])
+    r, body = _get(export_client, conn, "/api/export?export_type=product&format=xlsx")
+    assert r.status_code == 200 and "spreadsheetml" in r.mimetype and "htma_products.xlsx" in r.headers["Content-Disposition"]
+    ws = openpyxl.load_workbook(io.BytesIO(body), read_only=True).active
+    rows = list(ws.iter_rows(values_only=True))
+    assert rows[0][0] == "商品编码" and len(rows) == 4 and rows[1][-2] == 7.0
+    assert conn.closed
+
+    missing = _Conn(None)  # 商品主表不存在：退回 t_htma_sale 明细，带日期条件
+    r, body = _get(export_client, missing, "/api/export?export_type=product&start_date=2026-03-01&end_date=2026-03-31")
+    assert r.status_code == 200 and body.decode("utf-8-sig").startswith("日期,商品编码")
+    sql, params = missing.log[-1]
+    assert "FROM t_htma_sale" in sql and "data_date BETWEEN" in sql and missing.closed
+    assert export_client.get("/api/export?format=pdf").status_code == 400
+
+
+def test_connection_released_when_body_never_iterated(export_client):
+    """响应体一次都没被读（如客户端只收到响应头即断开）：生成器 finally 不会执行，靠 call_on_close 归还连接。"""
+    import htma_dashboard.app as app_mod
+    conn = _Conn([_product(i) for i in range(3)])
+    with patch.object(app_mod, "get_conn", return_value=conn), patch.object(app_mod, "_ql_query_filters") as qf:
+        from htma_dashboard.query_layer import query_filters_from_request
+        qf.side_effect = lambda include_sku=False, conn=None: query_filters_from_request(include_sku, lookup={})
+        with app_mod.app.test_request_context("/api/export?export_type=product"):
+            resp = app_mod.api_export()
+    assert not conn.closed and conn.fetches == []
+    resp.close()
+    assert conn.closed and conn.cursors_closed >= 1 and conn.fetches == []
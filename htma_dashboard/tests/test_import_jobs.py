@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Tests for import_jobs (per-store serialization, stage timings, SQLite job records) and /api/import async path (mocked DB)."""
+import io
+import os
+import sys
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard import import_jobs
+from htma_dashboard.import_jobs import ImportJobRunner, JobStore
+
+
+def _wait(runner, job_id, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        doc = runner.get(job_id)
+        if doc["status"] in ("done", "failed"):
+            return doc
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_same_store_jobs_run_one_at_a_time(tmp_path):
+    runner = ImportJobRunner(workers=4, store=JobStore(str(tmp_path / "jobs.sqlite3")))
+    running, overlap, order = [], [], []
+    lock = threading.Lock()
+
+    def make(name, store):
+        def fn():
+            with lock:
+                if any(s == store for s, _ in running):
+                    overlap.append(name)
+                running.append((store, name))
+            time.sleep(0.05)
+            with lock:
+                running.remove((store, name))
+                order.append(name)
+            return {"success": True, "name": name}
+        return fn
+
+    jobs = [runner.submit("s1", "upload", make("a%d" % i, "s1")) for i in range(3)]
+    other = runner.submit("s2", "upload", make("b", "s2"))
+    docs = [_wait(runner, j.id) for j in jobs + [other]]
+    assert not overlap
+    assert [n for n in order if n.startswith("a")] == ["a0", "a1", "a2"]
+    assert order.index("b") < order.index("a2")  # 其他门店不必排在 s1 之后
+    assert all(d["status"] == "done" for d in docs) and docs[0]["result"] == {"success": True, "name": "a0"}
+
+
+def test_stage_timings_and_shared_record(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    runner = ImportJobRunner(workers=1, store=store)
+    cleaned = []
+
+    def fn():
+        import_jobs.begin_file("sale_daily")
+        for name in ("read", "detect", "parse", "insert", "backfill"):
+            import_jobs.stage(name)
+            time.sleep(0.005)
+        import_jobs.begin_file(None)
+        import_jobs.stage("refresh")
+        return {"success": True, "sale_daily": 3}
+
+    job = runner.submit("s1", "upload", fn, files=["sale_daily"], cleanup=lambda: cleaned.append(1))
+    doc = _wait(runner, job.id)
+    assert [(s["file"], s["stage"]) for s in doc["stages"]] == [("sale_daily", n) for n in ("read", "detect", "parse", "insert", "backfill")] + [(None, "refresh")]
+    assert all(s["status"] == "done" and s["elapsed_ms"] >= 0 for s in doc["stages"])
+    assert set(doc["stage_totals_ms"]) == set(import_jobs.STAGES)
+    assert cleaned == [1]
+    assert store.load(job.id)["result"] == {"success": True, "sale_daily": 3}  # 其他 worker 进程从 SQLite 读到同一结果
+    import_jobs.stage("read")  # 任务线程之外为空操作
+
+
+def test_failed_job_keeps_error_and_marks_stage(tmp_path):
+    runner = ImportJobRunner(workers=1, store=JobStore(str(tmp_path / "jobs.sqlite3")))
+
+    def boom():
+        import_jobs.stage("parse")
+        raise ValueError("坏文件")
+
+    doc = _wait(runner, runner.submit("s1", "upload", boom).id)
+    assert doc["status"] == "failed" and doc["error"] == "坏文件"
+    assert doc["result"]["success"] is False and doc["stages"][-1]["status"] == "failed"
+    doc = _wait(runner, runner.submit("s1", "upload", lambda: {"success": False, "message": "x"}).id)
+    assert doc["status"] == "failed"
+
+
+def test_finished_jobs_evicted_from_memory_but_kept_in_store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    runner = ImportJobRunner(workers=1, store=store, memory_keep=2)
+    jobs = [runner.submit("s1", "upload", lambda i=i: {"success": True, "n": i}) for i in range(5)]
+    docs = [_wait(runner, j.id) for j in jobs]
+    assert [d["result"]["n"] for d in docs] == list(range(5))
+    runner._evict()  # 最后一个任务的淘汰在其线程收尾时执行，这里同步一次
+    assert set(runner._jobs) == {j.id for j in jobs[-2:]}  # 只留最近结束的 2 个
+    assert runner.get(jobs[0].id)["result"] == {"success": True, "n": 0}  # 已淘汰的从 SQLite 读
+
+
+@pytest.fixture
+def async_client(tmp_path, monkeypatch):
+    runner = ImportJobRunner(workers=1, store=JobStore(str(tmp_path / "jobs.sqlite3")))
+    monkeypatch.setattr(import_jobs, "_runner", runner)
+    from htma_dashboard import app as app_module
+    used = sys.modules[app_module.submit_import_job.__module__]  # app 以顶层 import_jobs 导入
+    monkeypatch.setattr(used, "_runner", runner)
+    mock_conn = MagicMock()
+    mock_conn.cursor.return_value.fetchone.return_value = {"got": 1}
+    with patch("htma_dashboard.app.get_conn", return_value=mock_conn):
+        app_module.app.config["TESTING"] = True
+        with app_module.app.test_client() as client:
+            yield client, app_module
+
+
+def test_api_import_async_returns_job_and_result(async_client, monkeypatch):
+    client, app_module = async_client
+    seen = {}
+
+    def fake_run(uploads, errors=(), **opts):
+        seen["files"] = [(k, os.path.exists(p)) for k, p in uploads]
+        seen["opts"] = opts
+        return {"success": True, "sale_daily": 5}, 200
+
+    monkeypatch.setattr(app_module, "_run_upload_import", fake_run)
+    r = client.post("/api/import", data={"async": "1", "swap_amount_cost": "1", "sale_daily": (io.BytesIO(b"x"), "销售日报.xlsx")})
+    assert r.status_code == 202
+    job_id = r.get_json()["job_id"]
+    end = time.time() + 5
+    while True:
+        job = client.get(f"/api/import_jobs/{job_id}").get_json()["job"]
+        if job["status"] in ("done", "failed") or time.time() > end:
+            break
+        time.sleep(0.01)
+    assert job["status"] == "done" and job["result"] == {"success": True, "sale_daily": 5}
+    assert seen["files"] == [("sale_daily", True)] and seen["opts"]["swap"] is True
+    assert client.get("/api/import_jobs/nope").status_code == 404
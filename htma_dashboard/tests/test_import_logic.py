@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Tests for import_logic post-import refresh (incremental refresh_profit / category upsert / keyed backfill via fake conn; no MySQL)."""
+import os
+import sys
+from datetime import date, datetime
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard import import_logic
+from htma_dashboard.import_logic import (
+    SALE_DAILY_FULL,
+    SALE_SUMMARY_FULL,
+    _parse_sale_rows,
+    _sale_key_scopes,
+    backfill_sale_category_and_supplier,
+    prune_unused_categories,
+    refresh_category_from_sale,
+    refresh_profit,
+    resolve_sale_dims,
+    sale_partitions,
+)
+from htma_dashboard.tests.conftest import FakeConn
+
+
+def _conn():
+    """fetchall（销售表日期查询）返回 2026-03-01。"""
+    return FakeConn(rows=[(date(2026, 3, 1),)], rowcount=2)
+
+
+def _profit_sqls(conn):
+    return [(sql, p) for sql, p in conn.cur.sqls if "t_htma_profit" in sql and "t_htma_data_version" not in sql]
+
+
+def test_refresh_profit_only_touched_partitions():
+    conn = _conn()
+    parts = sale_partitions("s1", {date(2026, 3, 2), date(2026, 3, 1), None}) | {("s2", date(2026, 3, 1))}
+    refresh_profit(conn, parts)
+    sqls = _profit_sqls(conn)
+    assert len(sqls) == 4  # 每个门店一次 DELETE + 一次 INSERT…SELECT
+    deletes = [(sql, p) for sql, p in sqls if sql.startswith("DELETE")]
+    inserts = [(sql, p) for sql, p in sqls if sql.startswith("INSERT")]
+    assert all("NOT EXISTS" in sql for sql, _ in deletes)
+    assert all("WHERE store_id = %s AND data_date IN" in sql for sql, _ in inserts)
+    assert ("s1", date(2026, 3, 1), date(2026, 3, 2)) in [p for _, p in inserts]
+
+
+def test_refresh_profit_chunks_long_date_lists():
+    conn = _conn()
+    days = {date.fromordinal(date(2025, 1, 1).toordinal() + i) for i in range(100)}
+    refresh_profit(conn, sale_partitions("s1", days))
+    inserts = [p for sql, p in _profit_sqls(conn) if sql.startswith("INSERT")]
+    assert [len(p) - 1 for p in inserts] == [62, 38]
+
+
+def test_refresh_profit_full_and_empty():
+    conn = _conn()
+    refresh_profit(conn, full=True)
+    (sql, params), = _profit_sqls(conn)
+    assert "WHERE" not in sql.split("FROM t_htma_sale")[1] and params is None
+    conn = _conn()
+    assert refresh_profit(conn, set()) == 0
+    assert _profit_sqls(conn) == []
+
+
+def test_refresh_category_upserts_without_truncate():
+    conn = _conn()
+    refresh_category_from_sale(conn, sale_partitions("s1", {date(2026, 3, 1)}))
+    sqls = [sql for sql, _ in conn.cur.sqls]
+    assert not any("TRUNCATE" in sql or sql.startswith("DELETE") for sql in sqls)
+    upsert, params = [(sql, p) for sql, p in conn.cur.sqls if sql.startswith("INSERT INTO t_htma_category")][0]
+    assert "AND store_id = %s AND data_date IN (%s)" in upsert and params == ("s1", date(2026, 3, 1))
+    assert "IF(VALUES(category_mid) = '', category_mid" in upsert
+
+
+def test_prune_unused_categories_is_anti_join():
+    conn = _conn()
+    prune_unused_categories(conn)
+    (sql, _), = conn.cur.sqls
+    assert sql.startswith("DELETE c FROM t_htma_category c LEFT JOIN") and "WHERE u.lc IS NULL" in sql
+
+
+def test_sale_key_scopes_group_by_date_and_chunk():
+    keys = {(date(2026, 3, 1), "a"), (date(2026, 3, 1), "b"), (date(2026, 3, 2), "c")}
+    scopes = list(_sale_key_scopes(keys, "s."))
+    assert scopes == [
+        (" AND s.data_date = %s AND s.sku_code IN (%s, %s)", (date(2026, 3, 1), "a", "b")),
+        (" AND s.data_date = %s AND s.sku_code IN (%s)", (date(2026, 3, 2), "c")),
+    ]
+    assert list(_sale_key_scopes(None)) == [("", ())]
+    many = {(date(2026, 3, 1), "%05d" % i) for i in range(2500)}
+    assert [len(p) - 1 for _, p in _sale_key_scopes(many)] == [1000, 1000, 500]
+
+
+def test_backfill_touches_only_written_keys():
+    conn = _conn()
+    keys = {(date(2026, 3, 1), "a")}
+    touched = backfill_sale_category_and_supplier(conn, "s1", keys=keys)
+    sale_sqls = [(sql, p) for sql, p in conn.cur.sqls if "t_htma_sale" in sql]
+    assert sale_sqls and all("data_date = %s AND" in sql for sql, _ in sale_sqls)
+    assert all(p[:3] == ("s1", date(2026, 3, 1), "a") for _, p in sale_sqls)
+    assert touched == {date(2026, 3, 1)}
+    conn = _conn()
+    backfill_sale_category_and_supplier(conn, "s1", keys=keys, resolved=True)
+    assert not any("t_htma_product_master" in sql for sql, _ in conn.cur.sqls)
+
+
+def test_resolve_sale_dims_fills_blanks_only():
+    cols = ["data_date", "sku_code", "category", "category_large", "category_mid", "category_small", "brand_name", "supplier_name"]
+    vals = [date(2026, 3, 1), "a", "饮料", None, None, None, "自有品牌", None]
+    resolve_sale_dims(cols, vals, (" 可口可乐 ", "甲供应商"))
+    assert vals[3:] == ["饮料", "饮料", "饮料", "自有品牌", "甲供应商"]
+    vals = [date(2026, 3, 1), "a", "饮料", "食品", None, None, None, None]
+    resolve_sale_dims(cols, vals, None)
+    assert vals[3:] == ["食品", None, None, None, None]
+
+
+def _sale_rows():
+    """混合类型/汇总行/缺列的销售明细，覆盖逐行路径的各个分支。"""
+    skus = [10001, "A002", " 0042 ", 10001.0, "合计", None, "10003", "A002"]
+    dates = [datetime(2026, 3, 1), "2026-03-01", "20260302", "2026年3月2日", None]
+    amounts = [10.5, "1,000.25", 7, None, "abc", 0]
+    rows = []
+    for i in range(400):
+        row = [1, "仓", skus[i % len(skus)], "商品%d" % (i % 7), 6900000000000 + i % 5, None, "个", "500ml", "01",
+               ["饮料", "食品", "小计", None][i % 4], "1", "大", "11", "中", "111", "小", "经销", "S1", "供应商", "B1", "品牌",
+               "G", "组", "L", "库", 0.1, dates[i % len(dates)], 3.5, [1, 2.0, "3", None][i % 4], amounts[i % len(amounts)],
+               0, 0, 0, 0, 1, 10.5, 0, 2.0, [6.0, "4.5", None, 12][i % 4], 3.0, 1.5, "nan"]
+        rows.append(tuple(row[: len(row) - i % 3]))  # 行尾缺列
+    return rows
+
+
+def _parse(rows, vectorized, full_map=SALE_DAILY_FULL, is_summary=False, cols=None):
+    cols = cols or {"sku": 2, "date": 26, "amount": 29, "cost": 38, "qty": 28}
+    import_logic.SALE_IMPORT_VECTORIZED = vectorized
+    return _parse_sale_rows(iter(rows), cols, full_map, "sale_daily", is_summary=is_summary)
+
+
+def _assert_same(a, b):
+    assert a[0] == b[0] and a[2] == b[2] and a[3] == b[3]
+    assert len(a[1]) == len(b[1])
+    for va, vb in zip(a[1], b[1]):
+        assert len(va) == len(vb)
+        for x, y in zip(va, vb):
+            if isinstance(x, float) or isinstance(y, float):
+                assert x == pytest.approx(y)
+            else:
+                assert x == y
+
+
+@pytest.fixture
+def restore_vectorized(monkeypatch):
+    monkeypatch.setattr(import_logic, "SALE_IMPORT_VECTORIZED", import_logic.SALE_IMPORT_VECTORIZED)
+
+
+def test_vectorized_sale_parse_matches_row_path(restore_vectorized, monkeypatch):
+    rows = _sale_rows()
+    expected = _parse(rows, False)
+    assert expected[3]["summary"] and expected[3]["no_sku"] and expected[3]["no_date"]
+    _assert_same(_parse(rows, True), expected)
+    monkeypatch.setattr(import_logic, "_SALE_PARSE_CHUNK_ROWS", 37)  # 跨块的同键合并
+    _assert_same(_parse(rows, True), expected)
+    summary_cols = {"sku": 2, "date": 26, "amount": 29, "cost": 38, "qty": 30, "margin": 39}
+    _assert_same(_parse(rows, True, SALE_SUMMARY_FULL, True, summary_cols), _parse(rows, False, SALE_SUMMARY_FULL, True, summary_cols))
+
+
+def test_vectorized_sale_parse_falls_back_per_chunk(restore_vectorized, monkeypatch):
+    rows = _sale_rows()
+    expected = _parse(rows, False)
+    real_chunk = import_logic._sale_chunk_frame
+    calls = []
+
+    def flaky(chunk, *a):
+        calls.append(len(chunk))
+        if len(calls) == 2:
+            raise ValueError("boom")
+        return real_chunk(chunk, *a)
+
+    monkeypatch.setattr(import_logic, "_SALE_PARSE_CHUNK_ROWS", 150)
+    monkeypatch.setattr(import_logic, "_sale_chunk_frame", flaky)
+    _assert_same(_parse(rows, True), expected)
+    assert calls == [150, 150, 100]
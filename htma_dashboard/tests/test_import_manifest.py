@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Tests for import_manifest (content-hash skip, per-day checksum skip) via parallel_import (fake conn, no MySQL)."""
+import os
+import sys
+from datetime import date, datetime
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import openpyxl
+import pytest
+from htma_dashboard import import_manifest, parallel_import
+
+
+def _write_daily(path, days, skus, amount, title="销售日报"):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append([title])
+    ws.append(["货号", "商品名称", "销售日期", "销售数量", "销售金额", "成本金额"])
+    for day in days:
+        for sku in skus:
+            ws.append([sku, "商品%d" % sku, datetime(2026, 3, day), 1, amount, amount / 2])
+    wb.save(path)
+
+
+class _Cursor:
+    """只认导入清单/日校验和两张表与 COUNT(*) 查询，其余语句只记日志。"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.conn.log.append((sql, params))
+        self._rows = []
+        if sql.startswith("SELECT file_name"):
+            rec = self.conn.manifest.get(tuple(params))
+            self._rows = [rec] if rec and rec["status"] == "ok" else []
+        elif sql.startswith("INSERT INTO t_htma_import_manifest"):
+            store, kind, digest, name, _, dmin, dmax, total, written, day_sums, status, msg = params
+            self.conn.manifest[(store, kind, digest)] = {
+                "file_name": name, "rows_total": total, "rows_written": written, "date_min": dmin, "date_max": dmax,
+                "created_at": "2026-03-05 10:00:00", "day_sums": day_sums, "status": status,
+            }
+        elif sql.startswith("SELECT data_date, checksum") and "BETWEEN" in sql:
+            store, table, lo, hi = params
+            self._rows = [{"data_date": d, "checksum": cs} for (s, t, d), (cs, _) in sorted(self.conn.checksums.items())
+                          if s == store and t == table and str(lo) <= d <= str(hi)]
+        elif sql.startswith("DELETE FROM t_htma_import_day_checksum"):
+            store, table, *days = params
+            for d in days:
+                self.conn.checksums.pop((store, table, str(d)), None)
+        elif sql.startswith("SELECT data_date, checksum"):
+            store, table, *days = params
+            self._rows = [{"data_date": d, "checksum": self.conn.checksums[(store, table, str(d))][0]}
+                          for d in days if (store, table, str(d)) in self.conn.checksums]
+        elif sql.startswith("SELECT COUNT(*) AS n") and "BETWEEN" in sql:
+            self._rows = [{"n": self.conn.table_rows}]
+        elif sql.startswith("SELECT data_date, COUNT(*) AS n"):
+            self._rows = [{"data_date": d, "n": self.conn.table_rows} for d in params[1:]]
+
+    def executemany(self, sql, seq):
+        sql = " ".join(sql.split())
+        if sql.startswith("INSERT INTO t_htma_import_day_checksum"):
+            for store, table, d, cs, n in seq:
+                self.conn.checksums[(store, table, str(d))] = (cs, n)
+        else:
+            for params in seq:
+                self.conn.log.append((sql, params))
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        return False
+
+
+class _Conn:
+    def __init__(self):
+        self.log, self.manifest, self.checksums = [], {}, {}
+        self.table_rows = 10 ** 6  # 目标表中已有数据；置 0 模拟被清空
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(parallel_import, "_refresh_sale_rollup_safe", lambda conn, dates: None)
+    monkeypatch.setattr(import_manifest, "MANIFEST_ENABLED", True)
+    monkeypatch.setattr(import_manifest, "_tables_ready", False)
+    return _Conn()
+
+
+def _sale_writes(conn):
+    return sum(1 for sql, _ in conn.log if sql.startswith("INSERT INTO t_htma_sale "))
+
+
+def test_day_checksums_ignore_row_and_column_order():
+    rows = [[date(2026, 3, 1), "A", 1.0], [date(2026, 3, 1), "B", 2.0], [date(2026, 3, 2), "A", 3.0]]
+    a = import_manifest.day_checksums(["data_date", "sku_code", "sale_amount"], rows)
+    b = import_manifest.day_checksums(["sale_amount", "data_date", "sku_code"], [[r[2], r[0], r[1]] for r in reversed(rows)])
+    assert a == b and a[date(2026, 3, 1)][1] == 2
+    assert import_manifest.day_checksums(["data_date", "sku_code", "sale_amount"], rows[:1] + [[date(2026, 3, 1), "B", 2.5]] + rows[2:])[date(2026, 3, 1)] != a[date(2026, 3, 1)]
+
+
+def test_same_file_is_skipped_unless_forced_or_cleared(conn, tmp_path):
+    path = str(tmp_path / "销售日报.xlsx")
+    _write_daily(path, (1, 2), range(1000, 1010), 10.0)
+    first = parallel_import.import_excel_files(conn, [("sale_daily", path)], workers=1)
+    assert first["counts"]["sale_daily"] == 20 and not first["skipped"]
+    writes = _sale_writes(conn)
+    again = parallel_import.import_excel_files(conn, [("sale_daily", path)], workers=1)
+    assert again["skipped"] == [("sale_daily", path)] and again["counts"]["sale_daily"] == 0
+    assert _sale_writes(conn) == writes and not again["partitions"]
+    conn.table_rows = 0  # 销售表被清空：清单记录不再作数
+    cleared = parallel_import.import_excel_files(conn, [("sale_daily", path)], workers=1)
+    assert not cleared["skipped"] and cleared["counts"]["sale_daily"] == 20
+    conn.table_rows = 10 ** 6
+    forced = parallel_import.import_excel_files(conn, [("sale_daily", path)], workers=1, force=True)
+    assert not forced["skipped"] and forced["counts"]["sale_daily"] == 20
+
+
+def test_overlapping_file_writes_only_changed_days(conn, tmp_path):
+    first, second = str(tmp_path / "销售日报_1.xlsx"), str(tmp_path / "销售日报_2.xlsx")
+    _write_daily(first, (1, 2, 3), range(1000, 1010), 10.0)
+    _write_daily(second, (2, 3, 4), range(1000, 1010), 10.0)  # 2、3 日与第一份相同，4 日为新数据
+    parallel_import.import_excel_files(conn, [("sale_daily", first)], workers=1)
+    out = parallel_import.import_excel_files(conn, [("sale_daily", second)], workers=1)
+    assert out["counts"]["sale_daily"] == 10
+    assert {str(d) for _, d in out["partitions"]} == {"2026-03-04"}
+    assert "2 天数据未变化已跳过" in out["files"][0][3]
+    rec = next(r for (_, kind, _), r in conn.manifest.items() if r["file_name"] == "销售日报_2.xlsx")
+    assert rec["status"] == "ok" and rec["rows_total"] == 30 and rec["rows_written"] == 10
+    assert (str(rec["date_min"]), str(rec["date_max"])) == ("2026-03-02", "2026-03-04")
+
+
+def test_file_with_failed_rows_is_retried(conn, tmp_path, monkeypatch):
+    """写库有失败行时不记为已导入、不存逐日校验和：同一文件再次导入会重写这些日期。"""
+    import_logic = sys.modules[parallel_import.write_parsed_sale.__module__]  # 可能以顶层 import_logic 导入
+    path = str(tmp_path / "销售日报.xlsx")
+    _write_daily(path, (1, 2), range(1000, 1010), 10.0)
+    real = import_logic._write_sale_rows
+    monkeypatch.setattr(import_logic, "_write_sale_rows", lambda conn, cols, rows, *a: (len(rows) - 3, 3, "Lock wait timeout"))
+    first = parallel_import.import_excel_files(conn, [("sale_daily", path)], workers=1)
+    assert first["counts"]["sale_daily"] == 17 and "导入失败3行" in first["files"][0][3]
+    assert [r["status"] for r in conn.manifest.values()] == ["failed"] and not conn.checksums
+    monkeypatch.setattr(import_logic, "_write_sale_rows", real)
+    again = parallel_import.import_excel_files(conn, [("sale_daily", path)], workers=1)
+    assert not again["skipped"] and again["counts"]["sale_daily"] == 20
+    assert [r["status"] for r in conn.manifest.values()] == ["ok"] and len(conn.checksums) == 2
+
+
+def test_daily_rewritten_by_summary_or_upload_is_imported_again(conn, tmp_path):
+    """日报写过的日期被汇总或 /api/import 覆盖后，再放入同一份日报：不能按清单跳过，要把日报数据写回去。"""
+    import_logic = sys.modules[parallel_import.write_parsed_sale.__module__]
+    daily, summary = str(tmp_path / "销售日报.xlsx"), str(tmp_path / "销售汇总.xlsx")
+    _write_daily(daily, (1, 2), range(1000, 1010), 10.0)
+    _write_daily(summary, (2,), range(1000, 1010), 99.0, title="销售汇总")
+    parallel_import.import_excel_files(conn, [("sale_daily", daily)], workers=1)
+    assert parallel_import.import_excel_files(conn, [("sale_daily", daily)], workers=1)["skipped"]
+    parallel_import.import_excel_files(conn, [("sale_summary", summary)], workers=1)
+    again = parallel_import.import_excel_files(conn, [("sale_daily", daily)], workers=1)
+    assert not again["skipped"] and again["counts"]["sale_daily"] == 10  # 只重写被汇总覆盖的 2 日
+    assert {str(d) for _, d in again["partitions"]} == {"2026-03-02"}
+    assert parallel_import.import_excel_files(conn, [("sale_daily", daily)], workers=1)["skipped"]
+
+    # 接口上传（不记清单）覆盖 1 日：写入时删掉该日校验和，日报同样重新导入
+    upload = str(tmp_path / "上传.xlsx")
+    _write_daily(upload, (1,), range(1000, 1010), 55.0)
+    import_logic.write_parsed_sale(conn, import_logic.parse_sale_file(upload), refresh_rollup=False)
+    assert (parallel_import.STORE_ID, "t_htma_sale", "2026-03-01") not in conn.checksums
+    out = parallel_import.import_excel_files(conn, [("sale_daily", daily)], workers=1)
+    assert not out["skipped"] and {str(d) for _, d in out["partitions"]} >= {"2026-03-01"}
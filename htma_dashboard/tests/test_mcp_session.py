@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Tests for mcp_session against a local fake MCP SSE server (session reuse, id multiplexing, reconnect; no network)."""
+import json
+import os
+import queue
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+
+from htma_dashboard import baidu_fetcher
+from htma_dashboard.mcp_session import McpSseSession
+
+
+class FakeMcpServer:
+    """
+    最小 MCP SSE 服务：GET /mcp/sse 发 endpoint 事件后保持连接，把响应以 message 事件推送；
+    reply_in_body=True 时 POST 直接在响应体返回 JSON-RPC 结果（百度优选的做法），否则回 202 再经 SSE 推送。
+    """
+
+    def __init__(self, reply_in_body=False):
+        self.reply_in_body = reply_in_body
+        self.sse_connects = 0
+        self.calls = []  # (id, 工具名, 参数)
+        self.streams = {}  # session -> Queue（None 表示断开）
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *a):
+                pass
+
+            def do_GET(self):
+                server.sse_connects += 1
+                sid = str(server.sse_connects)
+                q = server.streams[sid] = queue.Queue()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(f"event: endpoint\ndata: /mcp/message?sessionId={sid}\n\n".encode())
+                self.wfile.flush()
+                while True:
+                    msg = q.get()
+                    if msg is None:
+                        return
+                    self.wfile.write(f": ping\n\nevent: message\ndata: {json.dumps(msg)}\n\n".encode())
+                    self.wfile.flush()
+
+            def do_POST(self):
+                sid = parse_qs(urlparse(self.path).query)["sessionId"][0]
+                req = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.calls.append((req["id"], req["params"]["name"], req["params"]["arguments"]))
+                if server.streams.get(sid) is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                items = [{"productName": req["params"]["arguments"]["query"], "spuPrice": str(len(server.calls))}]
+                msg = {"jsonrpc": "2.0", "id": req["id"], "result": {"content": [{"type": "text", "text": json.dumps({"spuList": items})}]}}
+                body = json.dumps(msg).encode() if server.reply_in_body else b""
+                self.send_response(200 if server.reply_in_body else 202)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if not server.reply_in_body:
+                    server.streams[sid].put(msg)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def drop_streams(self):
+        for sid, q in list(self.streams.items()):
+            if q is not None:
+                q.put(None)
+                self.streams[sid] = None
+
+    def stop(self):
+        self.drop_streams()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    s = FakeMcpServer()
+    yield s
+    s.stop()
+
+
+def _text(result):
+    return json.loads(result["content"][0]["text"])["spuList"][0]["productName"]
+
+
+def test_session_reuses_sse_and_multiplexes_ids(server):
+    session = McpSseSession(f"{server.base}/mcp/sse?key=t")
+    try:
+        assert _text(session.call_tool("spu_list", {"query": "可乐"}, timeout=5)) == "可乐"
+        results = {}
+
+        def call(q):
+            results[q] = session.call_tool("spu_list", {"query": q}, timeout=5)
+
+        threads = [threading.Thread(target=call, args=(f"q{i}",)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert {q: _text(r) for q, r in results.items()} == {f"q{i}": f"q{i}" for i in range(8)}
+        assert server.sse_connects == 1 and session.connects == 1
+        assert sorted(c[0] for c in server.calls) == list(range(1, 10))
+    finally:
+        session.close()
+
+
+def test_session_reconnects_after_stream_drop(server):
+    session = McpSseSession(f"{server.base}/mcp/sse?key=t")
+    try:
+        assert session.call_tool("spu_list", {"query": "a"}, timeout=5) is not None
+        server.drop_streams()  # 服务端断开 SSE：旧 endpoint 失效
+        assert _text(session.call_tool("spu_list", {"query": "b"}, timeout=5)) == "b"
+        assert server.sse_connects == 2
+    finally:
+        session.close()
+
+
+def test_youxuan_fetchers_share_one_session(monkeypatch):
+    srv = FakeMcpServer(reply_in_body=True)
+    try:
+        monkeypatch.setattr(baidu_fetcher, "BAIDU_YOUXUAN_SSE_BASE", srv.base)
+        monkeypatch.setattr(baidu_fetcher, "BAIDU_YOUXUAN_TOKEN", "tok")
+        monkeypatch.setattr(baidu_fetcher, "_youxuan_sessions", {})
+        assert baidu_fetcher.baidu_youxuan_price_fetcher("牛奶 250ml") == {"min_price": 1.0, "platform": "百度优选", "is_same_spec": True}
+        assert baidu_fetcher.baidu_youxuan_search_items("牛奶") == [{"title": "牛奶", "price": 2.0, "platform": "百度优选"}]
+        assert srv.sse_connects == 1 and [c[1:] for c in srv.calls] == [("spu_list", {"query": "牛奶 250ml"}), ("spu_list", {"query": "牛奶"})]
+    finally:
+        for s in baidu_fetcher._youxuan_sessions.values():
+            s.close()
+        srv.stop()
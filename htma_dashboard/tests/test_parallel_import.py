@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Tests for parallel_import (process-pool parse, ordered serialized writes, one rollup refresh; fake conn, no MySQL)."""
+import os
+import sys
+from datetime import datetime
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import openpyxl
+import pytest
+from htma_dashboard import parallel_import
+
+
+def _write_daily(path, day, skus, amount):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["销售日报"])
+    ws.append(["货号", "商品名称", "销售日期", "销售数量", "销售金额", "成本金额"])
+    for sku in skus:
+        ws.append([sku, "商品%d" % sku, datetime(2026, 3, day), 1, amount, amount / 2])
+    ws.append(["合计", None, None, len(skus), amount * len(skus), amount * len(skus) / 2])
+    wb.save(path)
+
+
+class _Cursor:
+    def __init__(self, log):
+        self.log = log
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.log.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        return False
+
+
+class _Conn:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return _Cursor(self.log)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def daily_files(tmp_path):
+    files = []
+    for i, day in enumerate((1, 2, 2, 3)):  # 第 2、3 个文件同一天，后者覆盖前者
+        path = str(tmp_path / ("销售日报_%d.xlsx" % i))
+        _write_daily(path, day, range(1000 + i, 1010 + i), 10.0 + i)
+        files.append(("sale_daily", path))
+    return files
+
+
+def _sale_inserts(conn):
+    return [p for sql, p in conn.log if sql.startswith("INSERT INTO t_htma_sale ")]
+
+
+def test_parallel_matches_sequential_and_refreshes_once(daily_files, monkeypatch):
+    rollups = []
+    monkeypatch.setattr(parallel_import, "_refresh_sale_rollup_safe", lambda conn, dates: rollups.append(sorted(dates)))
+    seq_conn, par_conn = _Conn(), _Conn()
+    seq = parallel_import.import_excel_files(seq_conn, daily_files, workers=1)
+    par = parallel_import.import_excel_files(par_conn, daily_files, workers=3)
+    assert par["counts"] == seq["counts"] and par["counts"]["sale_daily"] == 40
+    assert [f[1] for f in par["files"]] == [p for _, p in daily_files]  # 按文件原顺序写入
+    assert _sale_inserts(par_conn) == _sale_inserts(seq_conn)
+    assert par["partitions"] == seq["partitions"] and len(par["partitions"]) == 3
+    assert len(rollups) == 2 and rollups[0] == rollups[1] and len(rollups[0]) == 3  # 每次批量导入只刷新一次日汇总
+
+
+def test_bad_file_is_reported_without_stopping_batch(daily_files, tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_import, "_refresh_sale_rollup_safe", lambda conn, dates: None)
+    bad = str(tmp_path / "销售日报_坏.xlsx")
+    with open(bad, "wb") as fp:
+        fp.write(b"not an excel file")
+    out = parallel_import.import_excel_files(_Conn(), daily_files[:1] + [("sale_daily", bad)] + daily_files[1:2], workers=2)
+    assert out["counts"]["sale_daily"] == 20
+    assert len(out["errors"]) == 1 and out["errors"][0].startswith("sale_daily 销售日报_坏.xlsx")
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Tests for parsed_cache (columnar npz round trip, preview_token reuse by /api/import; mocked DB)."""
+import io
+import os
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import openpyxl
+import pytest
+from htma_dashboard import import_logic, parsed_cache
+
+
+def _daily_bytes():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["销售日报"])
+    ws.append(["货号", "商品名称", "销售日期", "销售数量", "销售金额", "成本金额"])
+    for sku in range(1000, 1020):
+        ws.append([sku, "商品%d" % sku if sku % 3 else None, datetime(2026, 3, 1 + sku % 2), 1, 10.5, 4.25])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def test_round_trip_matches_parse(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsed_cache, "PARSED_CACHE_DIR", str(tmp_path))
+    path = tmp_path / "销售日报.xlsx"
+    path.write_bytes(_daily_bytes())
+    parsed = import_logic.parse_sale_file(str(path))
+    preview = import_logic.preview_sale_excel(str(path), parse=True)
+    assert preview["ok"] and preview["data_rows"] == 20
+    assert preview["parsed"]["vals_list"] == parsed["vals_list"]  # 预览顺带的解析与单独解析一致
+    token = parsed_cache.store_parsed("sale_daily", "ab" * 32, parsed, "销售日报.xlsx")
+    assert token == "sale_daily-" + "ab" * 16 and parsed_cache.parsed_token_kind(token) == "sale_daily"
+    kind, back, name = parsed_cache.load_parsed(token)
+    assert (kind, name) == ("sale_daily", "销售日报.xlsx")
+    for k in ("all_cols", "vals_list", "keys", "stats", "is_summary"):
+        assert back[k] == parsed[k], k
+    assert parsed_cache.load_parsed("../../etc/passwd") is None
+    monkeypatch.setattr(parsed_cache, "PARSED_CACHE_TTL", -1)
+    assert parsed_cache.parsed_token_kind(token) is None and parsed_cache.load_parsed(token) is None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from htma_dashboard import app as app_module
+    cache_mod = sys.modules[app_module.load_parsed.__module__]  # app 以顶层 parsed_cache 导入
+    monkeypatch.setattr(cache_mod, "PARSED_CACHE_DIR", str(tmp_path))
+    mock_conn = MagicMock()
+    mock_conn.cursor.return_value.fetchone.return_value = {"got": 1}
+    with patch("htma_dashboard.app.get_conn", return_value=mock_conn):
+        app_module.app.config["TESTING"] = True
+        with app_module.app.test_client() as c:
+            yield c, app_module, cache_mod
+
+
+def test_preview_token_replaces_reupload(client, monkeypatch):
+    c, app_module, cache_mod = client
+    r = c.post("/api/import", data={"preview_only": "1", "sale_daily": (io.BytesIO(_daily_bytes()), "销售日报.xlsx")})
+    preview = r.get_json()["preview"]
+    assert preview["ok"] and preview["preview_token"].startswith("sale_daily-") and "parsed" not in preview
+    seen = {}
+
+    def fake_run(uploads, errors=(), tokens=(), **opts):
+        seen["uploads"], seen["tokens"] = uploads, tokens
+        return {"success": True}, 200
+
+    monkeypatch.setattr(app_module, "_run_upload_import", fake_run)
+    r = c.post("/api/import", data={"async": "0", "preview_token": preview["preview_token"]})
+    assert r.status_code == 200 and seen["uploads"] == [] and seen["tokens"] == [("sale_daily", preview["preview_token"])]
+    kind, parsed, _ = cache_mod.load_parsed(preview["preview_token"])
+    assert kind == "sale_daily" and len(parsed["keys"]) == 20
+    r = c.post("/api/import", data={"async": "0", "preview_token": "sale_daily-" + "0" * 32})
+    assert r.status_code == 400
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Tests for price_cache (two-tier competitor-price cache) and its use in stage3 (fake conn emulating the table, no MySQL)."""
+import json
+import os
+import sys
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+
+from htma_dashboard import price_cache, price_compare
+from htma_dashboard.price_cache import PriceCache, cache_key
+from htma_dashboard.tests.conftest import FakeConn, FakeCursor
+
+
+class CacheCursor(FakeCursor):
+    """模拟 t_htma_price_cache：conn.rows[(key, provider)] = [payload, age 秒]；fail=True 时所有语句报错。"""
+
+    def execute(self, sql, params=None):
+        if self.conn.fail:
+            raise RuntimeError("Table 't_htma_price_cache' doesn't exist")
+        super().execute(sql, params)
+        self._rows = []
+        if sql.lstrip().startswith("SELECT"):
+            provider, keys = params[0], params[1:]
+            self._rows = [
+                {"cache_key": k, "payload": self.conn.rows[(k, provider)][0], "age": self.conn.rows[(k, provider)][1]}
+                for k in keys if (k, provider) in self.conn.rows
+            ]
+
+    def executemany(self, sql, rows):
+        super().execute(sql, None)
+        for key, provider, _price, _platform, _match, payload in rows:
+            self.conn.rows[(key, provider)] = [payload, 0]
+
+    def fetchall(self):
+        return self._rows
+
+
+class CacheConn(FakeConn):
+    cursor_class = CacheCursor
+
+    def __init__(self, fail=False):
+        super().__init__(rows={})
+        self.fail = fail
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache(monkeypatch):
+    price_cache.clear_memory_cache()
+    monkeypatch.setattr(price_cache, "_table_ready", False)
+    monkeypatch.setattr(price_compare, "PRICE_FETCH_WORKERS", 1)
+    yield
+    price_cache.clear_memory_cache()
+
+
+def test_cache_key_prefers_normalized_barcode():
+    assert cache_key(" 6901234567892 ", "可口可乐") == "bc:6901234567892"
+    assert cache_key("12-34", "  可口可乐   330ML ") == "kw:可口可乐 330ml"
+    assert cache_key(None, "  ") is None
+
+
+def test_ttl_negative_ttl_and_max_age():
+    conn = CacheConn()
+    conn.rows[("kw:a", "f")] = [json.dumps({"min_price": 9.9, "platform": "京东"}), 3600]
+    conn.rows[("kw:b", "f")] = [None, 3600]  # 负缓存
+    cache = PriceCache(conn, "f", ttl=7200, negative_ttl=600)
+    assert cache.get_many(["kw:a", "kw:b", "kw:c"]) == {"kw:a": {"min_price": 9.9, "platform": "京东"}}
+    price_cache.clear_memory_cache()
+    assert PriceCache(conn, "f", ttl=60, negative_ttl=60, max_age=86400).get_many(["kw:a", "kw:b"]) == {
+        "kw:a": {"min_price": 9.9, "platform": "京东"}, "kw:b": None,
+    }
+    # 进程内 LRU 已记下两条，库不可用时仍可命中
+    conn.fail = True
+    assert set(PriceCache(conn, "f", max_age=86400).get_many(["kw:a", "kw:b"])) == {"kw:a", "kw:b"}
+    assert PriceCache(conn, "other", max_age=86400).get_many(["kw:a"]) == {}  # 数据源互不复用
+
+
+def test_stage3_serves_hits_without_fetching_and_writes_back_misses():
+    conn = CacheConn()
+    items = [{"sku_code": f"S{i}", "raw_name": f"商品{i}", "barcode": f"690000000000{i}", "unit_price": 10} for i in range(4)]
+    conn.rows[("bc:6900000000003", "fetcher")] = [json.dumps({"min_price": 12.5, "platform": "淘宝"}), 10]
+    calls = []
+
+    def fetcher(item):
+        calls.append(item["sku_code"])
+        return {"min_price": 20, "platform": "京东"} if item["sku_code"] == "S0" else None
+
+    cache = PriceCache(conn, "fetcher")
+    out = price_compare.stage3_calc_advantage(items, fetcher=fetcher, use_mock=False, fetch_limit=2, cache=cache)
+    assert calls == ["S0", "S1"]  # S3 超出 fetch_limit 但命中缓存，不调用接口
+    assert [it["competitor_min"] for it in out] == [20.0, None, None, 12.5]
+    assert json.loads(conn.rows[("bc:6900000000000", "fetcher")][0])["min_price"] == 20
+    assert conn.rows[("bc:6900000000001", "fetcher")][0] is None  # 无结果写负缓存
+    assert ("bc:6900000000002", "fetcher") not in conn.rows and conn.commits == 0  # 提交留给流水线
+    assert not any(sql.startswith("CREATE") for sql, _ in conn.sqls)
+
+    del calls[:]
+    again = price_compare.stage3_calc_advantage(
+        [dict(it) for it in items], fetcher=fetcher, use_mock=False, fetch_limit=0, cache=PriceCache(conn, "fetcher"),
+    )
+    assert calls == [] and [it["competitor_min"] for it in again] == [20.0, None, None, 12.5]
+
+
+def test_cache_errors_fall_back_to_fetching():
+    conn = CacheConn(fail=True)
+    out = price_compare.stage3_calc_advantage(
+        [{"sku_code": "S0", "raw_name": "商品", "unit_price": 10}], fetcher=lambda it: {"min_price": 11},
+        use_mock=False, cache=PriceCache(conn, "f"),
+    )
+    assert out[0]["competitor_min"] == 11.0
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_fetch_errors_are_not_negatively_cached(monkeypatch, workers):
+    monkeypatch.setattr(price_compare, "PRICE_FETCH_WORKERS", workers)
+    cache_mod = sys.modules[price_compare.fetch_with_status.__module__]  # price_compare 实际导入的模块
+    conn = CacheConn()
+    items = [{"sku_code": f"S{i}", "raw_name": f"商品{i}", "barcode": f"690000000000{i}", "unit_price": 10} for i in range(3)]
+
+    def fetcher(item):
+        if item["sku_code"] != "S2":
+            cache_mod.note_fetch_error()  # 某个数据源超时/报错
+        return {"min_price": 15, "platform": "京东"} if item["sku_code"] == "S1" else None
+
+    price_compare.stage3_calc_advantage(items, fetcher=fetcher, use_mock=False, cache=PriceCache(conn, "f"))
+    assert ("bc:6900000000000", "f") not in conn.rows  # 出错且无价：不负缓存，下次重查
+    assert json.loads(conn.rows[("bc:6900000000001", "f")][0])["min_price"] == 15  # 部分数据源出错但拿到了价格
+    assert conn.rows[("bc:6900000000002", "f")][0] is None  # 各数据源都正常应答且无结果：负缓存
+
+
+def test_http_failures_mark_fetch_errored(monkeypatch):
+    from htma_dashboard import baidu_fetcher
+
+    def boom(*a, **kw):
+        raise OSError("timed out")
+
+    monkeypatch.setattr(baidu_fetcher, "_urlopen", boom)
+    cache_mod = sys.modules[baidu_fetcher.note_fetch_error.__module__]
+    assert cache_mod.fetch_with_status(baidu_fetcher._http_get, "http://example.invalid/q") == (None, True)
+    assert cache_mod.fetch_with_status(lambda: None) == (None, False)
+
+
+def test_provider_key_follows_configured_sources(monkeypatch):
+    from htma_dashboard import baidu_fetcher
+    for name in ("BAIDU_APISTORE_KEY", "BAIDU_YOUXUAN_TOKEN", "ONEBOUND_KEY", "ONEBOUND_SECRET", "PDD_HOJINGKE_APIKEY", "JUHE_PRICE_KEY"):
+        monkeypatch.setattr(baidu_fetcher, name, "")
+    monkeypatch.setattr(baidu_fetcher, "JUHE_PRICE_KEY", "k")
+    juhe_only = price_cache.provider_name(baidu_fetcher.item_fetcher)
+    monkeypatch.setattr(baidu_fetcher, "BAIDU_YOUXUAN_TOKEN", "t")
+    with_youxuan = price_cache.provider_name(baidu_fetcher.item_fetcher)
+    assert juhe_only.startswith("item_fetcher:") and juhe_only != with_youxuan
+    assert with_youxuan != price_cache.provider_name(baidu_fetcher.item_fetcher_jd_taobao)
+    assert len(price_cache.provider_name(baidu_fetcher.item_fetcher_jd_taobao)) <= 64
+    assert price_cache.provider_name(price_compare.stage2_mock_fetcher) == "stage2_mock_fetcher"
+
+
+def test_daily_compare_keeps_fetch_limit_zero(monkeypatch):
+    seen = []
+
+    def stage3(items, fetch_limit=None, **kw):
+        seen.append(fetch_limit)
+        raise StopIteration
+
+    monkeypatch.setattr(price_compare, "stage1_standardize_single_day", lambda *a, **kw: [{"sku_code": "S0", "unit_price": 10}])
+    monkeypatch.setattr(price_compare, "stage3_calc_advantage", stage3)
+    for fetch_limit in (0, None):
+        with pytest.raises(StopIteration):
+            price_compare.run_daily_top_compare(CacheConn(), data_date="2026-01-01", limit=20, fetcher=lambda it: None, save_to_db=False, fetch_limit=fetch_limit)
+    assert seen == [0, 20]  # 0 表示只读缓存，不能被当成「未传」改成 limit
+
+
+def test_pipeline_creates_table_before_work_and_commits_cache_itself(monkeypatch):
+    """建表在流水线开头（DDL 隐式提交），缓存写入由流水线提交，PriceCache 不动调用方事务。"""
+    monkeypatch.setattr(sys.modules[price_compare.open_price_cache.__module__], "_table_ready", False)
+    conn = CacheConn()
+    monkeypatch.setattr(price_compare, "stage1_standardize", lambda c, *a, **kw: c.sqls.append(("STAGE1", None)) or [
+        {"sku_code": "S0", "raw_name": "商品", "barcode": "6900000000000", "unit_price": 10},
+    ])
+
+    def fetcher(item):
+        return {"min_price": 12, "platform": "京东"}
+
+    price_compare.run_full_pipeline(conn, use_mock_fetcher=False, fetcher=fetcher, save_to_db=False)
+    create = [i for i, (sql, _) in enumerate(conn.sqls) if sql.startswith("CREATE TABLE IF NOT EXISTS t_htma_price_cache")]
+    assert create and create[0] < conn.sqls.index(("STAGE1", None))
+    assert ("bc:6900000000000", "fetcher") in conn.rows and conn.commits == 1
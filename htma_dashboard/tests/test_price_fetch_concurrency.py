@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Tests for rate_limit token buckets and concurrent stage3 competitor-price fetching (fake fetchers, no network)."""
+import os
+import sys
+import threading
+import time
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+
+from htma_dashboard import price_compare, rate_limit
+from htma_dashboard.rate_limit import ProviderLimiter, TokenBucket
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, s):
+        self.sleeps.append(round(s, 6))
+        self.now += s
+
+
+def test_token_bucket_bursts_then_paces():
+    clock = _Clock()
+    bucket = TokenBucket(2, capacity=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5] and clock.now == 1.0  # 攒满 2 个令牌先放行，之后每 0.5 秒一个
+    TokenBucket(0, clock=clock, sleep=clock.sleep).acquire()  # QPS<=0 不限速
+    assert len(clock.sleeps) == 2
+
+
+def test_provider_limit_reads_env_and_caps_concurrency(monkeypatch):
+    rate_limit.reset_limiters()
+    monkeypatch.setenv("HTMA_PRICE_QPS_ONEBOUND", "0")
+    monkeypatch.setenv("HTMA_PRICE_CONCURRENCY_ONEBOUND", "2")
+    lim = rate_limit.provider_limit("onebound")
+    assert (lim.qps, lim.concurrency) == (0.0, 2) and rate_limit.provider_limit("onebound") is lim
+    assert rate_limit.provider_limit("baidu_skill").concurrency == rate_limit.PROVIDER_DEFAULTS["baidu_skill"][1]
+    rate_limit.reset_limiters()
+
+    active, peak, lock = [0], [0], threading.Lock()
+    lim = ProviderLimiter("t", 0, 2)
+
+    def work():
+        with lim:
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2
+
+
+def _items(n):
+    items = [{"sku_code": f"S{i}", "raw_name": f"商品{i}", "unit_price": 10} for i in range(n)]
+    items[2]["unit_price"] = 0  # 无售价：跳过，但仍占 fetch_limit 的序号
+    return items
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_stage3_concurrent_fetch_keeps_order_and_fetch_limit(monkeypatch, workers):
+    monkeypatch.setattr(price_compare, "PRICE_FETCH_WORKERS", workers)
+    fetched = []
+
+    def fetcher(item):
+        i = int(item["sku_code"][1:])
+        time.sleep(0.01 * (5 - i))  # 靠前的商品更晚返回
+        fetched.append(item["sku_code"])
+        return {"min_price": 10 + i, "platform": f"P{i}"}
+
+    out = price_compare.stage3_calc_advantage(_items(6), fetcher=fetcher, use_mock=False, fetch_limit=4)
+    assert [it["sku_code"] for it in out] == ["S0", "S1", "S3", "S4", "S5"]
+    assert sorted(fetched) == ["S0", "S1", "S3"]  # 前 4 个序号中有售价的商品
+    assert [it["platform"] for it in out] == ["P0", "P1", "P3", None, None]
+    assert [it["tier"] for it in out][-2:] == ["独家款", "独家款"] and out[1]["advantage_pct"] == 9.1
+
+
+def test_stage3_reraises_fetch_error_in_item_order(monkeypatch):
+    monkeypatch.setattr(price_compare, "PRICE_FETCH_WORKERS", 4)
+
+    def fetcher(item):
+        if item["sku_code"] in ("S1", "S4"):
+            raise RuntimeError(item["sku_code"])
+        return None
+
+    with pytest.raises(RuntimeError, match="S1"):
+        price_compare.stage3_calc_advantage(_items(6), fetcher=fetcher, use_mock=False)
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-"""Unit tests for query_layer (date_condition, no Flask/DB)."""
+"""Unit tests for query_layer (date_condition, category filters; EXPLAIN check needs HTMA_TEST_MYSQL=1)."""
 import os
 import sys
 
@@ -10,6 +10,7 @@ if _root not in sys.path:
 
 import pytest
 from htma_dashboard.query_layer import date_condition, DEFAULT_DAYS
+from htma_dashboard.tests.conftest import FakeConn
 
 
 class TestDateCondition:
@@ -53,3 +54,133 @@ class TestDateCondition:
         cond, params = date_condition("custom", None, None)
         assert "INTERVAL" in cond
         assert len(params) == 1
+
+
+_CATEGORY_ROWS = [
+    {"level": "large", "code": "01", "name": "食品"},
+    {"level": "mid", "code": "0101", "name": "饮料"},
+    {"level": "small", "code": "010101", "name": "碳酸饮料"},
+    {"level": "large", "code": "0", "name": "日化"},
+    {"level": "mid", "code": "", "name": "洗护"},
+]
+
+
+class TestCategoryFilters:
+    """sale_filter_conds：有品类查找表时生成不带函数包裹的编码谓词，无查找表时保持原写法。"""
+
+    def setup_method(self):
+        from htma_dashboard.query_layer import build_category_lookup
+        self.lookup = build_category_lookup(_CATEGORY_ROWS)
+
+    def test_name_resolves_to_code(self):
+        from htma_dashboard.query_layer import sale_filter_conds
+        cond, params = sale_filter_conds(category_large_code="食品", lookup=self.lookup)
+        assert cond == " AND (category_large_code IN (%s, %s) OR (category_large_code IS NULL AND (category_large = %s)))"
+        assert params == ["食品", "01", "食品"]
+        assert "TRIM" not in cond
+
+    def test_code_passes_through(self):
+        from htma_dashboard.query_layer import sale_filter_conds
+        cond, params = sale_filter_conds(category_mid_code="0101", category_small_code="010101", lookup=self.lookup)
+        assert cond.startswith(" AND (category_mid_code IN (%s) OR (category_mid_code IS NULL AND (category_mid = %s)))")
+        assert params == ["0101", "0101", "010101", "010101", "010101"]
+
+    def test_name_without_code_keeps_name_branch(self):
+        from htma_dashboard.query_layer import sale_filter_conds
+        cond, params = sale_filter_conds(category_large_code="日化", lookup=self.lookup)
+        assert "category_large_code IS NULL AND (category_large = %s)" in cond
+        assert params[0] == "日化" and params[-1] == "日化"
+        cond, params = sale_filter_conds(category_name="洗护", lookup=self.lookup)
+        assert "(category_mid_code IS NULL AND category_mid = %s)" in cond and "category = %s" in cond
+
+    def test_code_less_rows_match_names_missing_from_category_table(self):
+        """品类表按编码分组只留 MAX(name)：无编码行的其它名称不在查找表里，仍须按名称匹配。"""
+        from htma_dashboard.query_layer import sale_filter_conds
+        cond, params = sale_filter_conds(category_large_code="粮油", lookup=self.lookup)
+        assert cond == " AND (category_large_code IN (%s) OR (category_large_code IS NULL AND (category_large = %s)))"
+        assert params == ["粮油", "粮油"]
+        cond, params = sale_filter_conds(category_name="粮油", lookup=self.lookup)
+        assert "(category_large_code IS NULL AND category_large = %s)" in cond
+        assert "(category_mid_code IS NULL AND category_mid = %s)" in cond and params.count("粮油") == 3
+
+    def test_brand_equality(self):
+        from htma_dashboard.query_layer import sale_filter_conds
+        assert sale_filter_conds(brand_name="甲", lookup=self.lookup) == (" AND brand_name = %s", ["甲"])
+
+    def test_without_lookup_falls_back(self, monkeypatch):
+        from htma_dashboard import query_layer
+        monkeypatch.setattr(query_layer, "load_category_lookup", lambda conn=None: None)
+        _, _, params, cond, _ = query_layer.query_filters_from_params(category_large_code="01")
+        assert "COALESCE(TRIM(category_large_code), '') = %s" in cond
+        assert params[-2:] == ("01", "01")
+
+    def test_every_name_of_a_code_resolves(self):
+        """同一编码在销售数据里有多个名称（品类表只留 MAX(name)）时，各名称都解析到该编码；小类兼容 category 名称。"""
+        from htma_dashboard.query_layer import build_category_lookup, sale_filter_conds
+        lookup = build_category_lookup(_CATEGORY_ROWS + [
+            {"level": "large", "code": "01", "name": "食品类"},
+            {"level": "small", "code": "010101", "name": "汽水"},
+        ])
+        for name in ("食品", "食品类"):
+            _, params = sale_filter_conds(category_large_code=name, lookup=lookup)
+            assert params == [name, "01", name]
+        _, params = sale_filter_conds(category_small_code="汽水", lookup=lookup)
+        assert params[:2] == ["汽水", "010101"]
+
+
+def test_load_category_lookup_uses_caller_conn_and_data_version(monkeypatch):
+    """查找表取自销售数据的编码/名称组合，复用调用方连接，按数据版本缓存。"""
+    from htma_dashboard import query_layer
+    mod = sys.modules[query_layer.load_category_lookup.__module__]
+    version = {"v": "1.0"}
+    monkeypatch.setattr(mod, "get_data_version", lambda store_id, conn=None: version["v"])
+    monkeypatch.setattr(mod, "sale_source", lambda conn, store_id: "t_htma_sale_daily_agg")
+    monkeypatch.setattr(mod, "_get_conn", lambda: pytest.fail("不应另取连接"))
+    monkeypatch.setattr(mod, "_category_lookup_cache", {})
+    conn = FakeConn(rows=_CATEGORY_ROWS)
+    lookup = mod.load_category_lookup(conn, "店")
+    assert lookup["large"]["食品"] == {"01"}
+    sql, params = conn.sqls[0]
+    assert "FROM t_htma_sale_daily_agg" in sql and "t_htma_category " not in sql
+    assert "category_small_code AS code, category AS name" in sql and set(params) == {"店"}
+    assert not conn.closed
+    assert mod.load_category_lookup(conn, "店") is lookup and len(conn.sqls) == 1
+    version["v"] = "2.0"
+    mod.load_category_lookup(conn, "店")
+    assert len(conn.sqls) == 2
+
+
+@pytest.fixture
+def mysql_conn():
+    if os.environ.get("HTMA_TEST_MYSQL", "").strip() != "1":
+        pytest.skip("未设置 HTMA_TEST_MYSQL=1，跳过 EXPLAIN 索引检查")
+    import pymysql
+    from htma_dashboard.db_config import DB_CONFIG
+    conn = pymysql.connect(**DB_CONFIG)
+    with conn.cursor() as cur:
+        cur.execute("SHOW INDEX FROM t_htma_sale WHERE Key_name LIKE 'idx\\_store\\_%\\_date'")
+        if len({r["Key_name"] for r in cur.fetchall()}) < 3:
+            conn.close()
+            pytest.skip("t_htma_sale 缺少筛选索引，先执行 scripts/28_add_sale_filter_indexes.sql")
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("kwargs, index", [
+    ({"category_large_code": "食品"}, "idx_store_large_date"),
+    ({"category_mid_code": "0101"}, "idx_store_mid_date"),
+    ({"category_small_code": "碳酸饮料"}, "idx_store_small_date"),
+])
+def test_explain_uses_category_index(mysql_conn, kwargs, index):
+    from htma_dashboard.query_layer import build_category_lookup, query_filters_from_params
+    date_cond, _, params, cond, _ = query_filters_from_params(
+        start_date="2025-01-01", end_date="2025-01-31", lookup=build_category_lookup(_CATEGORY_ROWS), **kwargs
+    )
+    with mysql_conn.cursor() as cur:
+        cur.execute(
+            f"EXPLAIN SELECT SUM(sale_amount) FROM t_htma_sale WHERE store_id = %s AND {date_cond}{cond}",
+            ("沈阳超级仓",) + tuple(params[1:]),
+        )
+        plan = cur.fetchall()
+    assert plan[0]["type"] != "ALL"
+    assert plan[0]["key"] == index
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Tests for query_plan (concurrent independent sub-queries on pooled connections; fake conns, no MySQL)."""
+import os
+import sys
+import threading
+import time
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+
+from htma_dashboard import query_plan
+from htma_dashboard.query_plan import QueryPlan, QueryPlanTimeout
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._sql = None
+
+    def execute(self, sql, params=None):
+        self.conn.log.append((sql, params))
+        if "boom" in sql:
+            raise RuntimeError("Table 'boom' doesn't exist")
+        time.sleep(self.conn.delay)
+        self._sql = sql
+
+    def fetchall(self):
+        return [{"sql": self._sql, "conn": self.conn.name}]
+
+    def fetchone(self):
+        return {"cnt": 1, "conn": self.conn.name}
+
+    def close(self):
+        pass
+
+
+class _Conn:
+    def __init__(self, name, delay=0.0):
+        self.name, self.delay = name, delay
+        self.log = []
+        self.closed = False
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+def _pool(delay=0.0):
+    made, lock = [], threading.Lock()
+
+    def connect():
+        with lock:
+            conn = _Conn("pooled%d" % len(made), delay)
+            made.append(conn)
+        return conn
+    return made, connect
+
+
+def test_concurrent_run_is_bounded_by_slowest_query():
+    made, connect = _pool(delay=0.2)
+    caller = _Conn("caller")
+    plan = QueryPlan(caller, concurrency=4, timeout=5, connect=connect)
+    for i in range(4):
+        plan.query("q%d" % i, "SELECT %d" % i)
+    plan.query("one", "SELECT COUNT(*)", one=True)
+    t0 = time.perf_counter()
+    res = plan.run()
+    elapsed = time.perf_counter() - t0
+    assert list(res) == ["q0", "q1", "q2", "q3", "one"]
+    assert res["q2"][0]["sql"] == "SELECT 2" and res["one"]["cnt"] == 1
+    assert elapsed < 0.8  # 串行需 1.0s；上限 4 并发为两轮 0.4s
+    assert len(made) == 5 and all(c.closed for c in made) and not caller.log and not caller.closed
+
+
+def test_serial_mode_uses_caller_connection_in_order(monkeypatch):
+    made, connect = _pool()
+    caller = _Conn("caller")
+    monkeypatch.setattr(query_plan, "QUERY_PLAN_CONCURRENCY", 1)
+    plan = QueryPlan(caller, connect=connect)
+    plan.query("a", "SELECT 1").query("b", "SELECT 2").call("c", lambda conn, x: (conn.name, x), 7)
+    assert plan.run() == {"a": [{"sql": "SELECT 1", "conn": "caller"}], "b": [{"sql": "SELECT 2", "conn": "caller"}], "c": ("caller", 7)}
+    assert [s for s, _ in caller.log] == ["SELECT 1", "SELECT 2"] and not made
+
+
+def test_pool_exhaustion_falls_back_to_caller_and_errors_follow_declaration_order():
+    caller = _Conn("caller")
+
+    def no_conn():
+        raise RuntimeError("pool full")
+
+    plan = QueryPlan(caller, concurrency=3, connect=no_conn)
+    plan.query("a", "SELECT 1").query("missing", "SELECT boom", fallback=[]).call("own", lambda: "self-managed", use_conn=False)
+    assert plan.run() == {"a": [{"sql": "SELECT 1", "conn": "caller"}], "missing": [], "own": "self-managed"}
+
+    made, connect = _pool()
+    plan = QueryPlan(caller, concurrency=3, connect=connect)
+    plan.query("a", "SELECT 1").query("bad", "SELECT boom").query("c", "SELECT 3")
+    with pytest.raises(RuntimeError, match="boom"):
+        plan.run()
+    with pytest.raises(ValueError):
+        plan.query("a", "SELECT 1")
+
+
+def test_self_managed_task_pool_timeout_reruns_serially():
+    """use_conn=False 的任务在工作线程里自行取连接时连接池超时：视同借连接失败，并发阶段结束后串行补跑，而不是整体报错。"""
+    made, connect = _pool()
+    calls = []
+
+    def own():
+        calls.append(getattr(query_plan._local, "in_worker", False))
+        if len(calls) == 1:
+            raise query_plan._pool_timeout()("pool full")
+        return "self-managed"
+
+    plan = QueryPlan(_Conn("caller"), concurrency=3, connect=connect)
+    plan.query("a", "SELECT 1").call("own", own, use_conn=False).query("c", "SELECT 3")
+    res = plan.run()
+    assert res["own"] == "self-managed" and calls == [True, False]
+    assert res["a"][0]["conn"] != "caller" and res["c"][0]["conn"] != "caller"
+
+    def boom():
+        raise RuntimeError("not a pool error")
+
+    plan = QueryPlan(_Conn("caller"), concurrency=3, connect=connect)
+    plan.query("a", "SELECT 1").call("own", boom, use_conn=False)
+    with pytest.raises(RuntimeError, match="not a pool error"):
+        plan.run()
+
+
+def test_timeout_and_nested_plans_run_serially_inside_workers():
+    made, connect = _pool(delay=0.5)
+    plan = QueryPlan(_Conn("caller"), concurrency=2, timeout=0.1, connect=connect)
+    plan.query("slow1", "SELECT 1").query("slow2", "SELECT 2")
+    with pytest.raises(QueryPlanTimeout, match="slow1"):
+        plan.run()
+
+    made, connect = _pool()
+
+    def nested(conn):
+        inner = QueryPlan(conn, concurrency=4, connect=connect)
+        inner.query("x", "SELECT x").query("y", "SELECT y")
+        return {k: v[0]["conn"] for k, v in inner.run().items()}
+
+    outer = QueryPlan(_Conn("caller"), concurrency=2, connect=connect)
+    outer.call("nested", nested).query("z", "SELECT z")
+    res = outer.run()
+    assert len(set(res["nested"].values())) == 1  # 内层两条查询在外层任务的同一连接上串行
+    assert len(made) == 2
+
+
+def test_marketing_report_same_text_serial_and_concurrent(monkeypatch):
+    from htma_dashboard import analytics
+
+    class _ReportCursor(_Cursor):
+        def fetchall(self):
+            return []
+
+        def fetchone(self):
+            return {"total_sale": 1000, "total_profit": 200, "total_qty": 50, "sku_cnt": 7, "total_stock": 300}
+
+    class _ReportConn(_Conn):
+        def cursor(self):
+            return _ReportCursor(self)
+
+    mod = sys.modules[analytics.QueryPlan.__module__]  # analytics 可能以顶层模块名导入 query_plan
+    pooled = []
+    monkeypatch.setattr(mod, "_default_connect", lambda: pooled.append(_ReportConn("pooled")) or pooled[-1])
+    texts = []
+    for concurrency in (1, 4):
+        monkeypatch.setattr(mod, "QUERY_PLAN_CONCURRENCY", concurrency)
+        texts.append(analytics.build_marketing_report(_ReportConn("caller"), days=30, mode="internal").rsplit("---", 2)[0])
+    assert len(pooled) == 12  # 仅并发那一轮借连接
+    assert texts[0] == texts[1] and "销售额 1,000 · 毛利 200" in texts[0] and "动销 SKU 7 个" in texts[0]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Tests for sale_rollup: source selection (fake conn) and rollup/raw parity (real MySQL, opt-in)."""
+import os
+import sys
+from datetime import date
+from decimal import Decimal
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard import sale_rollup
+from htma_dashboard.sale_rollup import ROLLUP_TABLE, SALE_TABLE, profit_filled_expr, refresh_sale_rollup, sale_source
+from htma_dashboard.tests.conftest import FakeConn
+
+
+@pytest.fixture(autouse=True)
+def _clear_ready_cache():
+    sale_rollup._ready_cache.clear()
+    yield
+    sale_rollup._ready_cache.clear()
+
+
+def test_sale_source_uses_rollup_only_when_built_and_no_sku():
+    assert sale_source(FakeConn(built=True), "s1") == ROLLUP_TABLE
+    assert sale_source(FakeConn(built=True), "s1", " AND sku_code = %s") == SALE_TABLE
+    sale_rollup._ready_cache.clear()
+    assert sale_source(FakeConn(built=False), "s1") == SALE_TABLE
+
+
+def test_profit_filled_expr():
+    assert profit_filled_expr(ROLLUP_TABLE) == "gross_profit_filled"
+    assert "sale_amount - sale_cost" in profit_filled_expr(SALE_TABLE)
+
+
+def test_incremental_refresh_only_touches_given_dates():
+    conn = FakeConn(built=True)
+    refresh_sale_rollup(conn, "s1", {date(2026, 1, 2), "2026-01-01", None})
+    deletes = [(q, p) for q, p in conn.cur.sqls if q.startswith(f"DELETE FROM {ROLLUP_TABLE}")]
+    assert len(deletes) == 1
+    assert "data_date IN" in deletes[0][0]
+    assert deletes[0][1] == ("s1", "2026-01-01", "2026-01-02")
+    assert not any("full_built_at" in q and q.startswith("INSERT") for q, _ in conn.cur.sqls)
+
+
+def test_first_refresh_falls_back_to_full_build():
+    conn = FakeConn(built=False)
+    refresh_sale_rollup(conn, "s1", {"2026-01-01"})
+    deletes = [(q, p) for q, p in conn.cur.sqls if q.startswith(f"DELETE FROM {ROLLUP_TABLE}")]
+    assert deletes == [(f"DELETE FROM {ROLLUP_TABLE} WHERE store_id = %s", ("s1",))]
+    assert any(q.startswith(f"INSERT INTO {sale_rollup.ROLLUP_META_TABLE}") for q, _ in conn.cur.sqls)
+
+
+# ---- 与明细表口径一致性（需真实 MySQL：HTMA_TEST_MYSQL=1 且 .env 指向测试库）----
+
+_PARITY_STORE = "pytest_rollup_parity"
+_SALE_ROWS = [
+    # data_date, sku, large_code, large, brand, supplier, amount, cost, gross_profit
+    ("2026-01-01", "A1", "01", "食品", "甲", "供1", 100, 60, 40),
+    ("2026-01-01", "A2", "01", "食品", "甲", None, 50, 30, None),
+    ("2026-01-01", "B1", " 02", "日化", "", "供2", 80, 50, 30),
+    ("2026-01-02", "A1", "01", "食品", "甲", "供1", 120, 70, 50),
+    ("2026-01-02", "C1", None, None, None, None, 10, None, None),
+]
+
+
+@pytest.fixture
+def mysql_conn():
+    if os.environ.get("HTMA_TEST_MYSQL", "").strip() != "1":
+        pytest.skip("未设置 HTMA_TEST_MYSQL=1，跳过真实 MySQL 口径对比")
+    from htma_dashboard.db_config import DB_CONFIG
+    import pymysql
+    conn = pymysql.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM {SALE_TABLE} WHERE store_id = %s", (_PARITY_STORE,))
+    for d, sku, lc, ln, brand, sup, amt, cost, gp in _SALE_ROWS:
+        cur.execute(f"""
+            INSERT INTO {SALE_TABLE} (store_id, data_date, sku_code, category_large_code, category_large,
+                brand_name, supplier_name, sale_qty, sale_amount, sale_cost, gross_profit)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, 1, %s, %s, %s)
+        """, (_PARITY_STORE, d, sku, lc, ln, brand, sup, amt, cost, gp))
+    conn.commit()
+    yield conn
+    cur.execute(f"DELETE FROM {SALE_TABLE} WHERE store_id = %s", (_PARITY_STORE,))
+    cur.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE store_id = %s", (_PARITY_STORE,))
+    cur.execute(f"DELETE FROM {sale_rollup.ROLLUP_META_TABLE} WHERE store_id = %s", (_PARITY_STORE,))
+    conn.commit()
+    conn.close()
+
+
+def _rows(conn, table, select, where="", group=""):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT {select} FROM {table} WHERE store_id = %s{where} {group}", (_PARITY_STORE,))
+        return sorted(tuple(float(v) if isinstance(v, (Decimal, float, int)) else v for v in r.values())
+                      for r in cur.fetchall())
+
+
+@pytest.mark.parametrize("select, group", [
+    ("data_date, COALESCE(SUM(sale_amount), 0), COALESCE(SUM(COALESCE(gross_profit, 0)), 0)", "GROUP BY data_date"),
+    ("COALESCE(NULLIF(TRIM(brand_name), ''), '未填') AS b, SUM(sale_amount), COALESCE(SUM(gross_profit), 0)", "GROUP BY brand_name"),
+    ("COALESCE(NULLIF(TRIM(supplier_name), ''), '未填') AS s, SUM(sale_amount), SUM(sale_qty)", "GROUP BY supplier_name"),
+    ("COALESCE(category, '未分类') AS c, SUM(sale_amount)", "GROUP BY category"),
+    ("SUM(sale_amount), SUM({profit})", ""),
+])
+def test_rollup_matches_raw(mysql_conn, select, group):
+    refresh_sale_rollup(mysql_conn, _PARITY_STORE)
+    where = " AND COALESCE(TRIM(category_large_code), '') IN ('01', '02', '')"
+    raw = _rows(mysql_conn, SALE_TABLE, select.format(profit=profit_filled_expr(SALE_TABLE)), where, group)
+    agg = _rows(mysql_conn, ROLLUP_TABLE, select.format(profit=profit_filled_expr(ROLLUP_TABLE)), where, group)
+    assert raw == agg
+
+
+def test_incremental_refresh_matches_full(mysql_conn):
+    refresh_sale_rollup(mysql_conn, _PARITY_STORE)
+    with mysql_conn.cursor() as cur:
+        cur.execute(f"UPDATE {SALE_TABLE} SET sale_amount = sale_amount + 1 WHERE store_id = %s AND data_date = '2026-01-02'",
+                    (_PARITY_STORE,))
+    mysql_conn.commit()
+    refresh_sale_rollup(mysql_conn, _PARITY_STORE, {"2026-01-02"})
+    select = "data_date, SUM(sale_amount)"
+    assert _rows(mysql_conn, SALE_TABLE, select, group="GROUP BY data_date") == \
+        _rows(mysql_conn, ROLLUP_TABLE, select, group="GROUP BY data_date")
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Tests for sku_dim: merge/fill SQL, full-build fallback, subquery source selection and import hooks (fake conn, no MySQL)."""
+import os
+import sys
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard import import_logic, sku_dim, stock_latest
+from htma_dashboard.sku_dim import (
+    SKU_CATEGORY_COLUMNS, SKU_DIM_META_TABLE, SKU_DIM_TABLE, fill_sku_dim, refresh_sku_dim, sku_dim_subquery,
+)
+from htma_dashboard.tests.conftest import FakeConn
+
+_COLUMNS = ("product_name", "brand_name", "category", "category_large_code", "category_name")  # information_schema 返回的源表列
+
+
+def _conn(built):
+    return FakeConn(built, columns=_COLUMNS, rowcount=2)
+
+
+@pytest.fixture(autouse=True)
+def _clear_ready_cache():
+    sku_dim._ready_cache.clear()
+    stock_latest._ready_cache.clear()
+    yield
+    sku_dim._ready_cache.clear()
+    stock_latest._ready_cache.clear()
+
+
+def _inserts(conn):
+    return [(q, p) for q, p in conn.cur.sqls if q.startswith(f"INSERT INTO {SKU_DIM_TABLE} ")]
+
+
+def test_incremental_refresh_merges_newer_sales_and_sets_sale_date_last():
+    conn = _conn(built=True)
+    refresh_sku_dim(conn, "s1", ["2026-01-02", "2026-01-01", None])
+    merges = _inserts(conn)
+    assert len(merges) == 1 and conn.commits == 1
+    sql, params = merges[0]
+    assert params == ("s1", "s1", "2026-01-01", "2026-01-02")
+    assert "MAX(NULLIF(TRIM(category_large_code), ''))" in sql and "data_date IN (%s, %s) GROUP BY sku_code" in sql
+    assert "category_name" not in sql  # 销售表列之外的不写
+    update = sql.split("ON DUPLICATE KEY UPDATE", 1)[1]
+    newer = f"VALUES(sale_date) >= COALESCE({SKU_DIM_TABLE}.sale_date, VALUES(sale_date))"
+    assert f"brand_name = IF({newer}, COALESCE(VALUES(brand_name), {SKU_DIM_TABLE}.brand_name), {SKU_DIM_TABLE}.brand_name)" in update
+    assert update.strip().startswith("product_name =")
+    assert update.rsplit("category_large_code), ", 1)[1].startswith("sale_date = GREATEST(")
+    assert not any(q.startswith("DELETE") for q, _ in conn.cur.sqls)
+
+
+def test_first_refresh_builds_from_sales_then_fills_gaps():
+    conn = _conn(built=False)
+    fill_sku_dim(conn, "s1", "stock", "2026-01-02")
+    sqls = [q for q, _ in conn.cur.sqls]
+    assert f"DELETE FROM {SKU_DIM_TABLE} WHERE store_id = %s" in sqls
+    inserts = [q for q, _ in _inserts(conn)]
+    assert len(inserts) == 3 and "FROM t_htma_sale" in inserts[0] and "ON DUPLICATE" not in inserts[0]
+    # 未构建时库存补空读最新快照（最新库存表未就绪则为库存历史表），商品档案的 category_name 记为 category
+    assert "FROM t_htma_stock WHERE store_id = %s AND data_date = (SELECT MAX(data_date) FROM t_htma_stock" in inserts[1]
+    assert "NULLIF(TRIM(category_name), '')" in inserts[2] and "FROM t_htma_product_master" in inserts[2]
+    assert f"category = COALESCE({SKU_DIM_TABLE}.category, VALUES(category))" in inserts[2]
+    assert any(q.startswith(f"INSERT INTO {SKU_DIM_META_TABLE}") for q in sqls) and conn.commits == 1
+
+
+def test_subquery_reads_dim_only_when_built(monkeypatch):
+    sql = sku_dim_subquery(_conn(built=True), "s1", ("store_id",) + SKU_CATEGORY_COLUMNS, " AND category_large_code = %s")
+    assert sql.startswith("SELECT sku_code, store_id, category_large_code") and f"FROM {SKU_DIM_TABLE} WHERE store_id = %s AND" in sql
+    assert "GROUP BY" not in sql
+    sku_dim._ready_cache.clear()
+    sql = sku_dim_subquery(_conn(built=False), "s1", ("category_mid",))
+    assert sql == "SELECT sku_code, MAX(category_mid) AS category_mid FROM t_htma_sale WHERE store_id = %s GROUP BY sku_code"
+    sku_dim._ready_cache.clear()
+    monkeypatch.setattr(sku_dim, "SKU_DIM_ENABLED", False)
+    assert "FROM t_htma_sale" in sku_dim_subquery(_conn(built=True), "s1", ())
+
+
+def test_import_hooks_report_dim_errors_without_failing_import(monkeypatch):
+    def _fail(*a, **k):
+        raise RuntimeError("Lock wait timeout exceeded")
+
+    monkeypatch.setattr(import_logic, "refresh_sku_dim", _fail)
+    monkeypatch.setattr(import_logic, "fill_sku_dim", _fail)
+    assert import_logic._refresh_sku_dim_safe(_conn(built=True), []) is None  # 无日期不刷新
+    assert "SKU维表刷新失败" in import_logic._refresh_sku_dim_safe(_conn(built=True), ["2026-01-02"])
+    assert "SKU维表补齐失败" in import_logic._fill_sku_dim_safe(_conn(built=True), "product_master", store_id="s1")
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Tests for stock_latest: merge/full-build SQL, source selection and import_stock integration (fake conn, no MySQL)."""
+import os
+import sys
+from datetime import date
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+import pytest
+from htma_dashboard import import_logic, stock_latest
+from htma_dashboard.channel_hongbeilou import build_catalog_sql
+from htma_dashboard.stock_latest import LATEST_META_TABLE, LATEST_TABLE, STOCK_TABLE, refresh_stock_latest, stock_source
+from htma_dashboard.tests.conftest import FakeConn
+
+_COLUMNS = ("category", "product_name", "stock_qty", "stock_amount")  # information_schema 返回的源表列
+
+
+def _conn(built):
+    return FakeConn(built, columns=_COLUMNS)
+
+
+@pytest.fixture(autouse=True)
+def _clear_ready_cache():
+    stock_latest._ready_cache.clear()
+    yield
+    stock_latest._ready_cache.clear()
+
+
+def test_stock_source_uses_latest_only_when_built(monkeypatch):
+    assert stock_source(_conn(built=True), "s1") == LATEST_TABLE
+    stock_latest._ready_cache.clear()
+    assert stock_source(_conn(built=False), "s1") == STOCK_TABLE
+    stock_latest._ready_cache.clear()
+    monkeypatch.setattr(stock_latest, "STOCK_LATEST_ENABLED", False)
+    assert stock_source(_conn(built=True), "s1") == STOCK_TABLE
+
+
+def test_incremental_merge_keeps_newer_rows():
+    conn = _conn(built=True)
+    refresh_stock_latest(conn, "s1", [date(2026, 1, 2), "2026-01-01", None], commit=False)
+    merges = [(q, p) for q, p in conn.cur.sqls if q.startswith(f"INSERT INTO {LATEST_TABLE}")]
+    assert len(merges) == 1
+    sql, params = merges[0]
+    assert params == ("s1", "2026-01-01", "2026-01-02")
+    assert f"FROM {STOCK_TABLE} WHERE store_id = %s AND data_date IN (%s, %s) ORDER BY data_date" in sql
+    # 各列按「新行日期不早于已有行」覆盖，data_date 最后赋值，否则前面的比较会读到新日期
+    update = sql.split("ON DUPLICATE KEY UPDATE", 1)[1]
+    assert f"stock_qty = IF(VALUES(data_date) >= {LATEST_TABLE}.data_date, VALUES(stock_qty), {LATEST_TABLE}.stock_qty)" in update
+    assert update.strip().endswith(f"data_date = GREATEST(VALUES(data_date), {LATEST_TABLE}.data_date)")
+    assert "warehouse_code" not in sql  # 库存表没有的列不复制
+    assert not any(q.startswith("DELETE") for q, _ in conn.cur.sqls) and conn.commits == 0
+
+
+def test_first_refresh_falls_back_to_full_build():
+    conn = _conn(built=False)
+    refresh_stock_latest(conn, "s1", ["2026-01-01"])
+    sqls = [q for q, _ in conn.cur.sqls]
+    assert f"DELETE FROM {LATEST_TABLE} WHERE store_id = %s" in sqls
+    full = next(q for q in sqls if q.startswith(f"INSERT INTO {LATEST_TABLE}"))
+    assert "MAX(data_date) AS md" in full and "GROUP BY sku_code" in full
+    assert any(q.startswith(f"INSERT INTO {LATEST_META_TABLE}") for q in sqls) and conn.commits == 1
+
+
+def _parsed():
+    return {
+        "col_list": ["data_date", "sku_code", "stock_qty"], "vals_list": [("2026-01-02", "A1", 5)], "src_rows": [None],
+        "data_date": "2026-01-02", "cols": {}, "full_map": {}, "total_qty": 5, "total_amt": 50,
+    }
+
+
+def test_import_stock_merges_inside_import_transaction(monkeypatch):
+    calls = []
+    conn = _conn(built=True)
+    conn.commit = lambda: calls.append("commit")
+    monkeypatch.setattr(import_logic, "ensure_stock_latest_table", lambda c: calls.append("ensure"))
+    monkeypatch.setattr(import_logic, "_fill_sku_dim_safe", lambda *a, **k: None)
+    monkeypatch.setattr(import_logic, "_write_stock_rows", lambda *a: calls.append("write") or (1, 0, None))
+    monkeypatch.setattr(import_logic, "refresh_stock_latest", lambda c, s, dates, commit=True: calls.append(("merge", dates, commit)))
+    n, diag, _ = import_logic.write_parsed_stock(conn, _parsed())
+    assert n == 1 and "最新库存" not in diag
+    assert calls == ["ensure", "write", ("merge", ["2026-01-02"], False), "commit"]
+
+
+def test_import_stock_invalidates_latest_when_merge_fails(monkeypatch):
+    conn = _conn(built=True)
+    monkeypatch.setattr(import_logic, "ensure_stock_latest_table", lambda c: None)
+    monkeypatch.setattr(import_logic, "_fill_sku_dim_safe", lambda *a, **k: None)
+    monkeypatch.setattr(import_logic, "_write_stock_rows", lambda *a: (1, 0, None))
+
+    def _fail(*a, **k):
+        raise RuntimeError("Lock wait timeout exceeded")
+
+    monkeypatch.setattr(import_logic, "refresh_stock_latest", _fail)
+    n, diag, _ = import_logic.write_parsed_stock(conn, _parsed())
+    assert n == 1 and "最新库存表更新失败" in diag and conn.commits == 1
+    assert (f"DELETE FROM {LATEST_META_TABLE} WHERE store_id = %s", (import_logic.STORE_ID,)) in conn.cur.sqls
+
+
+def test_catalog_reads_latest_table_without_per_sku_group_by():
+    for table in (STOCK_TABLE, LATEST_TABLE):
+        for has_batch in (True, False):
+            sql, params = build_catalog_sql("s1", "01", None, "03", 0.01, True, True, has_batch, stock_table=table)
+            assert sql.count("%s") == len(params)
+            assert ("GROUP BY sku_code\n    ) z" in sql) == (table == STOCK_TABLE)
+    sql, params = build_catalog_sql("s1", None, None, None, 0.01, False, False, False, stock_table=LATEST_TABLE)
+    assert f"FROM {LATEST_TABLE} ls" in sql and "WHERE ls.store_id = %s AND ls.stock_qty > %s" in sql
+    assert params == ["s1", "s1", 0.01]
@@ -0,0 +1,46 @@
+-- =====================================================
+-- 销售日汇总表：按 门店+日期+大/中/小类+品牌+供应商 预聚合 t_htma_sale
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/27_create_sale_daily_agg.sql
+-- 说明: 看板 KPI/趋势/品类占比/品牌与供应商贡献优先读此表；导入销售日报/汇总时按涉及日期增量重算。
+--       首次部署后任一次销售导入会自动全量构建（门店未构建过时按全量处理）
+-- =====================================================
+
+USE htma_dashboard;
+
+CREATE TABLE IF NOT EXISTS t_htma_sale_daily_agg (
+  id                  BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+  store_id            VARCHAR(32)     DEFAULT NULL COMMENT '门店ID',
+  data_date           DATE            NOT NULL COMMENT '销售日期',
+  category_large_code VARCHAR(32)     DEFAULT NULL,
+  category_large      VARCHAR(64)     DEFAULT NULL,
+  category_mid_code   VARCHAR(32)     DEFAULT NULL,
+  category_mid        VARCHAR(64)     DEFAULT NULL,
+  category_small_code VARCHAR(32)     DEFAULT NULL,
+  category_small      VARCHAR(64)     DEFAULT NULL,
+  category            VARCHAR(64)     DEFAULT NULL,
+  category_code       VARCHAR(32)     DEFAULT NULL,
+  brand_name          VARCHAR(64)     DEFAULT NULL,
+  supplier_name       VARCHAR(128)    DEFAULT NULL,
+  sale_amount         DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  gross_profit        DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  gross_profit_filled DECIMAL(16, 2)  NOT NULL DEFAULT 0 COMMENT '毛利为空时按销售额-成本补齐',
+  sale_qty            DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  sale_cost           DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  return_qty          DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  return_amount       DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  gift_qty            DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  gift_amount         DECIMAL(16, 2)  NOT NULL DEFAULT 0,
+  row_count           INT             NOT NULL DEFAULT 0 COMMENT '明细行数',
+  KEY idx_store_date (store_id, data_date),
+  KEY idx_store_large_date (store_id, category_large_code, data_date),
+  KEY idx_store_brand (store_id, brand_name),
+  KEY idx_store_supplier (store_id, supplier_name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='销售日汇总(门店/日期/品类/品牌/供应商)';
+
+CREATE TABLE IF NOT EXISTS t_htma_sale_daily_agg_meta (
+  store_id      VARCHAR(32) NOT NULL PRIMARY KEY,
+  full_built_at DATETIME    DEFAULT NULL COMMENT '最近一次全量构建时间',
+  updated_at    DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='销售日汇总构建状态';
+
+SELECT 'Done. t_htma_sale_daily_agg 已创建' AS msg;
@@ -0,0 +1,52 @@
+-- 品类/品牌筛选性能优化：规范化 t_htma_sale 品类编码/名称与品牌列，并添加复合索引
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/28_add_sale_filter_indexes.sql
+-- 说明: query_layer 经 t_htma_category 把名称解析为编码后生成 category_*_code IN (...) 谓词，
+--       依赖列值已 TRIM、空串为 NULL；导入/回填会自动维护列值，此脚本规范化存量数据并建索引（导入不再建索引）。索引已存在则跳过。
+
+USE htma_dashboard;
+
+UPDATE t_htma_sale SET
+  category_large_code = NULLIF(TRIM(category_large_code), ''),
+  category_large      = NULLIF(TRIM(category_large), ''),
+  category_mid_code   = NULLIF(TRIM(category_mid_code), ''),
+  category_mid        = NULLIF(TRIM(category_mid), ''),
+  category_small_code = NULLIF(TRIM(category_small_code), ''),
+  category_small      = NULLIF(TRIM(category_small), ''),
+  category            = NULLIF(TRIM(category), ''),
+  brand_name          = NULLIF(TRIM(brand_name), '')
+WHERE category_large_code = '' OR CHAR_LENGTH(category_large_code) <> CHAR_LENGTH(TRIM(category_large_code))
+   OR category_large = '' OR CHAR_LENGTH(category_large) <> CHAR_LENGTH(TRIM(category_large))
+   OR category_mid_code = '' OR CHAR_LENGTH(category_mid_code) <> CHAR_LENGTH(TRIM(category_mid_code))
+   OR category_mid = '' OR CHAR_LENGTH(category_mid) <> CHAR_LENGTH(TRIM(category_mid))
+   OR category_small_code = '' OR CHAR_LENGTH(category_small_code) <> CHAR_LENGTH(TRIM(category_small_code))
+   OR category_small = '' OR CHAR_LENGTH(category_small) <> CHAR_LENGTH(TRIM(category_small))
+   OR category = '' OR CHAR_LENGTH(category) <> CHAR_LENGTH(TRIM(category))
+   OR brand_name = '' OR CHAR_LENGTH(brand_name) <> CHAR_LENGTH(TRIM(brand_name));
+
+-- (store_id, category_large_code, data_date)
+SET @idx1 = (SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 't_htma_sale' AND INDEX_NAME = 'idx_store_large_date');
+SET @sql1 = IF(@idx1 = 0, 'CREATE INDEX idx_store_large_date ON t_htma_sale (store_id, category_large_code, data_date)', 'SELECT ''idx_store_large_date 已存在'' AS msg');
+PREPARE stmt1 FROM @sql1;
+EXECUTE stmt1;
+DEALLOCATE PREPARE stmt1;
+
+-- (store_id, category_mid_code, data_date)
+SET @idx2 = (SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 't_htma_sale' AND INDEX_NAME = 'idx_store_mid_date');
+SET @sql2 = IF(@idx2 = 0, 'CREATE INDEX idx_store_mid_date ON t_htma_sale (store_id, category_mid_code, data_date)', 'SELECT ''idx_store_mid_date 已存在'' AS msg');
+PREPARE stmt2 FROM @sql2;
+EXECUTE stmt2;
+DEALLOCATE PREPARE stmt2;
+
+-- (store_id, category_small_code, data_date)
+SET @idx3 = (SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 't_htma_sale' AND INDEX_NAME = 'idx_store_small_date');
+SET @sql3 = IF(@idx3 = 0, 'CREATE INDEX idx_store_small_date ON t_htma_sale (store_id, category_small_code, data_date)', 'SELECT ''idx_store_small_date 已存在'' AS msg');
+PREPARE stmt3 FROM @sql3;
+EXECUTE stmt3;
+DEALLOCATE PREPARE stmt3;
+
+-- (store_id, brand_name, data_date)
+SET @idx4 = (SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 't_htma_sale' AND INDEX_NAME = 'idx_store_brand_date');
+SET @sql4 = IF(@idx4 = 0, 'CREATE INDEX idx_store_brand_date ON t_htma_sale (store_id, brand_name, data_date)', 'SELECT ''idx_store_brand_date 已存在'' AS msg');
+PREPARE stmt4 FROM @sql4;
+EXECUTE stmt4;
+DEALLOCATE PREPARE stmt4;
@@ -0,0 +1,13 @@
+-- 门店数据版本号：每次导入/修复成功提交后 +1，看板接口缓存 key 带版本号，导入后旧缓存自然失效
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/29_create_data_version.sql
+-- 说明: 导入时不再每次执行建表 DDL；未执行此脚本时应用每进程首次 bump 建表一次
+
+USE htma_dashboard;
+
+CREATE TABLE IF NOT EXISTS t_htma_data_version (
+  store_id   VARCHAR(32)     NOT NULL PRIMARY KEY,
+  version    BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  updated_at DATETIME        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='门店数据版本号(接口缓存失效)';
+
+SELECT 'Done. t_htma_data_version 已创建' AS msg;
@@ -0,0 +1,36 @@
+-- 导入清单：按文件内容哈希记录每次导入，重复放入下载目录的同一 Excel 直接跳过；按日行校验和跳过未变化的日期
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/30_create_import_manifest.sql
+-- 说明: 导入时也会自动建表（import_manifest.ensure_manifest_tables），此脚本便于新环境预建
+
+USE htma_dashboard;
+
+CREATE TABLE IF NOT EXISTS t_htma_import_manifest (
+  id           BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  store_id     VARCHAR(32)     NOT NULL,
+  file_kind    VARCHAR(32)     NOT NULL,
+  file_hash    CHAR(64)        NOT NULL,
+  file_name    VARCHAR(255)    DEFAULT NULL,
+  file_size    BIGINT          DEFAULT NULL,
+  date_min     DATE            DEFAULT NULL,
+  date_max     DATE            DEFAULT NULL,
+  rows_total   INT             DEFAULT NULL,
+  rows_written INT             DEFAULT NULL,
+  day_sums     CHAR(64)        DEFAULT NULL COMMENT '导入完成时日期范围内各日校验和的指纹',
+  status       VARCHAR(16)     NOT NULL,
+  message      VARCHAR(500)    DEFAULT NULL,
+  created_at   DATETIME        DEFAULT CURRENT_TIMESTAMP,
+  updated_at   DATETIME        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  UNIQUE KEY uk_manifest (store_id, file_kind, file_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='导入清单(按文件内容哈希去重)';
+
+CREATE TABLE IF NOT EXISTS t_htma_import_day_checksum (
+  store_id     VARCHAR(32) NOT NULL,
+  target_table VARCHAR(64) NOT NULL,
+  data_date    DATE        NOT NULL,
+  checksum     CHAR(64)    NOT NULL,
+  row_count    INT         NOT NULL,
+  updated_at   DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (store_id, target_table, data_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='导入按日行校验和(跳过未变化日期)';
+
+SELECT 'Done. t_htma_import_manifest / t_htma_import_day_checksum 已创建' AS msg;
@@ -0,0 +1,59 @@
+-- =====================================================
+-- 最新库存表：每个 门店+货号 一行，存该货号在 t_htma_stock 中 data_date 最大的一行
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/31_create_stock_latest.sql
+-- 说明: 库存预警/周转/KPI 库存金额、鸿蓓楼选品等「当前库存」查询优先读此表；导入库存时按导入日期合并。
+--       首次部署后任一次库存导入会自动全量构建（门店未构建过时按全量处理）
+-- =====================================================
+
+USE htma_dashboard;
+
+CREATE TABLE IF NOT EXISTS t_htma_stock_latest (
+  store_id            VARCHAR(32) NOT NULL COMMENT '门店ID',
+  sku_code            VARCHAR(64) NOT NULL COMMENT '货号',
+  data_date           DATE        NOT NULL COMMENT '该货号最新库存日期',
+  warehouse_code      VARCHAR(32) DEFAULT NULL,
+  warehouse_name      VARCHAR(128) DEFAULT NULL,
+  category            VARCHAR(64) DEFAULT NULL,
+  category_name       VARCHAR(64) DEFAULT NULL,
+  category_large_code VARCHAR(32) DEFAULT NULL,
+  category_large      VARCHAR(64) DEFAULT NULL,
+  category_mid_code   VARCHAR(32) DEFAULT NULL,
+  category_mid        VARCHAR(64) DEFAULT NULL,
+  category_small_code VARCHAR(32) DEFAULT NULL,
+  category_small      VARCHAR(64) DEFAULT NULL,
+  product_name        VARCHAR(128) DEFAULT NULL,
+  short_name          VARCHAR(64) DEFAULT NULL,
+  product_code        VARCHAR(64) DEFAULT NULL,
+  barcode             VARCHAR(64) DEFAULT NULL,
+  spec                VARCHAR(64) DEFAULT NULL,
+  unit                VARCHAR(16) DEFAULT NULL,
+  brand_code          VARCHAR(32) DEFAULT NULL,
+  brand_name          VARCHAR(64) DEFAULT NULL,
+  supplier_code       VARCHAR(64) DEFAULT NULL,
+  supplier_name       VARCHAR(128) DEFAULT NULL,
+  contact             VARCHAR(64) DEFAULT NULL,
+  biz_mode            VARCHAR(32) DEFAULT NULL,
+  branch_manage       VARCHAR(32) DEFAULT NULL,
+  location_code       VARCHAR(32) DEFAULT NULL,
+  location_name       VARCHAR(64) DEFAULT NULL,
+  product_status      VARCHAR(32) DEFAULT NULL,
+  stock_qty           DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  stock_boxes         DECIMAL(12, 2) DEFAULT NULL,
+  stock_amount        DECIMAL(14, 2) DEFAULT 0,
+  stock_amount_retail DECIMAL(14, 2) DEFAULT NULL,
+  avg_price           DECIMAL(14, 4) DEFAULT NULL,
+  avg_inbound_price   DECIMAL(14, 4) DEFAULT NULL,
+  sale_price          DECIMAL(14, 4) DEFAULT NULL,
+  aging               DECIMAL(10, 4) DEFAULT NULL,
+  last_change_date    DATETIME DEFAULT NULL,
+  PRIMARY KEY (store_id, sku_code),
+  KEY idx_store_date (store_id, data_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='最新库存(每门店每货号取库存表最新一行)';
+
+CREATE TABLE IF NOT EXISTS t_htma_stock_latest_meta (
+  store_id      VARCHAR(32) NOT NULL PRIMARY KEY,
+  full_built_at DATETIME    DEFAULT NULL COMMENT '最近一次全量构建时间',
+  updated_at    DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='最新库存构建状态';
+
+SELECT 'Done. t_htma_stock_latest 已创建' AS msg;
@@ -0,0 +1,40 @@
+-- =====================================================
+-- SKU 属性维表：每个 门店+货号 一行，存品名、条码、规格、品牌、供应商与大/中/小类编码和名称
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/32_create_sku_dim.sql
+-- 说明: 库存预警/KPI 库存按品类筛选、商品档案品类下钻等按货号取属性的查询优先读此表，不再每次对销售表 GROUP BY sku_code；
+--       导入销售时按日期合并，导入库存/商品档案时补空。首次部署后任一次导入会自动全量构建（门店未构建过时按全量处理）
+-- =====================================================
+
+USE htma_dashboard;
+
+CREATE TABLE IF NOT EXISTS t_htma_sku_dim (
+  store_id            VARCHAR(32) NOT NULL COMMENT '门店ID',
+  sku_code            VARCHAR(64) NOT NULL COMMENT '货号',
+  product_name        VARCHAR(128) DEFAULT NULL,
+  barcode             VARCHAR(64) DEFAULT NULL,
+  spec                VARCHAR(64) DEFAULT NULL,
+  brand_name          VARCHAR(64) DEFAULT NULL,
+  supplier_name       VARCHAR(128) DEFAULT NULL,
+  category            VARCHAR(64) DEFAULT NULL,
+  category_large_code VARCHAR(32) DEFAULT NULL,
+  category_large      VARCHAR(64) DEFAULT NULL,
+  category_mid_code   VARCHAR(32) DEFAULT NULL,
+  category_mid        VARCHAR(64) DEFAULT NULL,
+  category_small_code VARCHAR(32) DEFAULT NULL,
+  category_small      VARCHAR(64) DEFAULT NULL,
+  sale_date           DATE        DEFAULT NULL COMMENT '属性取自的最近销售日期（库存/档案补齐的为 NULL）',
+  updated_at          DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (store_id, sku_code),
+  KEY idx_store_large (store_id, category_large_code),
+  KEY idx_store_mid (store_id, category_mid_code),
+  KEY idx_store_small (store_id, category_small_code),
+  KEY idx_store_brand (store_id, brand_name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='SKU属性维表(品名/条码/规格/品牌/供应商/品类)';
+
+CREATE TABLE IF NOT EXISTS t_htma_sku_dim_meta (
+  store_id      VARCHAR(32) NOT NULL PRIMARY KEY,
+  full_built_at DATETIME    DEFAULT NULL COMMENT '最近一次全量构建时间',
+  updated_at    DATETIME    DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='SKU属性维表构建状态';
+
+SELECT 'Done. t_htma_sku_dim 已创建' AS msg;
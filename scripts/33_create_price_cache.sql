@@ -0,0 +1,22 @@
+-- =====================================================
+-- 竞品价格缓存：按 条码/规范化关键词 + 数据源 存最近一次检索结果（含无结果的负缓存）
+-- 执行: mysql -h 127.0.0.1 -u root -p htma_dashboard < scripts/33_create_price_cache.sql
+-- 说明: 货盘比价、每日 TOP 比价、/api/price_compare 与 scripts/batch_price_compare.py 先查此表，
+--       在 HTMA_PRICE_CACHE_TTL（负缓存 HTMA_PRICE_CACHE_NEGATIVE_TTL）内不再调用第三方接口。应用首次使用时也会自动建表
+-- =====================================================
+
+USE htma_dashboard;
+
+CREATE TABLE IF NOT EXISTS t_htma_price_cache (
+  cache_key   VARCHAR(191)  NOT NULL COMMENT 'bc:条码 或 kw:规范化关键词',
+  provider    VARCHAR(64)   NOT NULL COMMENT '数据源（fetcher 名）',
+  min_price   DECIMAL(12, 2) DEFAULT NULL COMMENT '竞品最低价，NULL 为无结果（负缓存）',
+  platform    VARCHAR(255)  DEFAULT NULL,
+  match_type  VARCHAR(32)   DEFAULT NULL,
+  payload     TEXT          DEFAULT NULL COMMENT '完整检索结果 JSON',
+  fetched_at  DATETIME      NOT NULL COMMENT '检索时间',
+  PRIMARY KEY (cache_key, provider),
+  KEY idx_fetched (fetched_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='竞品价格缓存';
+
+SELECT 'Done. t_htma_price_cache 已创建' AS msg;
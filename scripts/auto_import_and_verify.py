@@ -64,20 +64,23 @@ def main():
     # 若需全量重建，请使用 scripts/run_full_import.py。
 
     sale_daily_cnt = sale_summary_cnt = stock_cnt = 0
+    sale_parts = set()
     # 销售汇总覆盖销售日报中重叠的(date,sku)，优先导入销售日报再导入销售汇总
     if "sale_daily" in files:
-        sale_daily_cnt, diag = import_sale_daily(files["sale_daily"], conn)
+        sale_daily_cnt, diag, parts = import_sale_daily(files["sale_daily"], conn)
+        sale_parts |= parts
         print(f"销售日报: {sale_daily_cnt} 条", diag or "")
     if "sale_summary" in files:
-        sale_summary_cnt, diag = import_sale_summary(files["sale_summary"], conn)
+        sale_summary_cnt, diag, parts = import_sale_summary(files["sale_summary"], conn)
+        sale_parts |= parts
         print(f"销售汇总: {sale_summary_cnt} 条", diag or "")
     if "stock" in files:
         stock_cnt, stock_diag = import_stock(files["stock"], conn)
         print(f"实时库存: {stock_cnt} 条", stock_diag or "")
 
     if sale_daily_cnt > 0 or sale_summary_cnt > 0:
-        refresh_profit(conn)
-        refresh_category_from_sale(conn)
+        refresh_profit(conn, sale_parts)
+        refresh_category_from_sale(conn, sale_parts)
 
     # 查询统计（本期=2026年1月，与附表一致）
     period_start, period_end = "2026-01-01", "2026-01-31"
@@ -5,11 +5,14 @@
 - 目录：默认 ~/Downloads，可通过环境变量 DOWNLOADS 或 IMPORT_DOWNLOADS_DIR 或命令行参数指定
 - 查找：销售日报、销售汇总、实时库存/库存查询（取同名最新文件）
 - 流程：清空表 → 导入 → 去重 → 刷新毛利/品类/商品 → 数据质量简要输出
+- 销售日报/汇总/库存多文件时进程池并行解析、按文件顺序串行写库，毛利/品类/商品等派生表在全部文件写完后只刷新一次
 
 用法:
   python scripts/auto_import_from_downloads.py [目录]
   python scripts/auto_import_from_downloads.py [目录] --multi   # 导入目录内所有销售日报（多份）+ 销售汇总 + 库存
+  HTMA_IMPORT_PARSE_WORKERS=1 python scripts/auto_import_from_downloads.py --multi   # 关闭并行解析，逐个文件解析
   python scripts/auto_import_from_downloads.py --today          # 仅处理本机「今天」修改过的上述 Excel（默认 ~/Downloads）
+  python scripts/auto_import_from_downloads.py --force          # 内容已导入过的文件也重新导入（默认按导入清单跳过）
   DOWNLOADS=/path/to/excel python scripts/auto_import_from_downloads.py
   bash scripts/run_auto_import.sh   # 使用 .venv 并默认 ~/Downloads
 """
@@ -152,7 +155,8 @@ def data_quality_summary(conn, store_id):
 
 
 def main():
-    argv = [a for a in sys.argv[1:] if a not in ("--multi", "--today")]
+    argv = [a for a in sys.argv[1:] if a not in ("--multi", "--today", "--force")]
+    force = "--force" in sys.argv[1:]
     use_multi = "--multi" in sys.argv[1:]
     only_today = "--today" in sys.argv[1:]
     only_date = date.today() if only_today else None
@@ -178,10 +182,9 @@ def main():
     sys.path.insert(0, project_root)
     import pymysql
     from htma_dashboard.db_config import get_conn
+    from htma_dashboard.import_manifest import file_digest, find_import, record_import
+    from htma_dashboard.parallel_import import import_excel_files
     from htma_dashboard.import_logic import (
-        import_sale_daily,
-        import_sale_summary,
-        import_stock,
         import_product_master,
         refresh_profit,
         refresh_category_from_sale,
@@ -191,9 +194,7 @@ def main():
 
     conn = get_conn()
     cur = conn.cursor()
-    sale_daily_cnt = sale_summary_cnt = stock_cnt = product_master_cnt = 0
-    has_sale_daily = False
-    has_sale_summary = False
+    product_master_cnt = 0
 
     if use_multi:
         multi = find_excel_files_multi_sale_daily(directory, only_date=only_date)
@@ -210,23 +211,12 @@ def main():
             print("找到 库存:", os.path.basename(multi["stock"]), flush=True)
         if multi.get("product_master"):
             print("找到 分店商品档案:", os.path.basename(multi["product_master"]), flush=True)
-        for i, path in enumerate(sale_daily_list, 1):
-            cnt, diag = import_sale_daily(path, conn)
-            sale_daily_cnt += cnt
-            print(f"  销售日报 [{i}/{len(sale_daily_list)}] {os.path.basename(path)}: {cnt} 条", diag or "", flush=True)
-        has_sale_daily = sale_daily_cnt > 0
+        batch_files = [("sale_daily", p) for p in sale_daily_list]
         if multi["sale_summary"]:
-            sale_summary_cnt, diag = import_sale_summary(
-                multi["sale_summary"], conn, overwrite_on_duplicate=True
-            )
-            print(f"销售汇总: {sale_summary_cnt} 条", diag or "", flush=True)
-            has_sale_summary = True
+            batch_files.append(("sale_summary", multi["sale_summary"]))
         if multi["stock"]:
-            stock_cnt, stock_diag = import_stock(multi["stock"], conn)
-            print(f"库存: {stock_cnt} 条", stock_diag or "", flush=True)
-        if multi.get("product_master"):
-            product_master_cnt, diag = import_product_master(multi["product_master"], conn)
-            print(f"分店商品档案: {product_master_cnt} 条", diag or "", flush=True)
+            batch_files.append(("stock", multi["stock"]))
+        product_master_path = multi.get("product_master")
     else:
         files = find_excel_files(directory, only_date=only_date)
         if not files:
@@ -234,27 +224,53 @@ def main():
             conn.close()
             sys.exit(0)
         print("找到文件:", {k: os.path.basename(v) for k, v in files.items()}, flush=True)
-        has_sale_daily = "sale_daily" in files
-        has_sale_summary = "sale_summary" in files
-        if has_sale_daily:
-            sale_daily_cnt, diag = import_sale_daily(files["sale_daily"], conn)
-            print(f"销售日报: {sale_daily_cnt} 条", diag or "", flush=True)
-        if has_sale_summary:
-            sale_summary_cnt, diag = import_sale_summary(
-                files["sale_summary"], conn, overwrite_on_duplicate=True
-            )
-            print(f"销售汇总: {sale_summary_cnt} 条", diag or "", flush=True)
-        if "stock" in files:
-            stock_cnt, stock_diag = import_stock(files["stock"], conn)
-            print(f"库存: {stock_cnt} 条", stock_diag or "", flush=True)
-        if "product_master" in files:
-            product_master_cnt, diag = import_product_master(files["product_master"], conn)
+        batch_files = [(k, files[k]) for k in ("sale_daily", "sale_summary", "stock") if k in files]
+        product_master_path = files.get("product_master")
+
+    # 销售日报/汇总/库存：进程池并行解析，按文件顺序串行写库（同键后者覆盖前者），日汇总在全部写完后刷新一次
+    batch = import_excel_files(conn, batch_files, force=force)
+    labels = {"sale_daily": "销售日报", "sale_summary": "销售汇总", "stock": "库存"}
+    n_daily = sum(1 for k, _ in batch_files if k == "sale_daily")
+    i_daily = 0
+    for kind, path, cnt, diag in batch["files"]:
+        if kind == "sale_daily" and n_daily > 1:
+            i_daily += 1
+            print(f"  销售日报 [{i_daily}/{n_daily}] {os.path.basename(path)}: {cnt} 条", diag or "", flush=True)
+        else:
+            print(f"{labels[kind]}: {cnt} 条", diag or "", flush=True)
+    for kind, path in batch["skipped"]:
+        print(f"{labels[kind]} {os.path.basename(path)}: 内容已导入过，跳过（--force 强制重新导入）", flush=True)
+    for err in batch["errors"]:
+        print(f"导入失败: {err}", flush=True)
+    if batch["rollup_err"]:
+        print(batch["rollup_err"], flush=True)
+    sale_daily_cnt = batch["counts"]["sale_daily"]
+    sale_summary_cnt = batch["counts"]["sale_summary"]
+    stock_cnt = batch["counts"]["stock"]
+    sale_parts = batch["partitions"]  # 本次写入的 (store_id, data_date)，毛利表只重算这些日期
+    pm_skipped = False
+    if product_master_path:
+        pm_digest = file_digest(product_master_path)
+        if not force and find_import(conn, pm_digest, "product_master", STORE_ID):
+            pm_skipped = True
+            print(f"分店商品档案 {os.path.basename(product_master_path)}: 内容已导入过，跳过", flush=True)
+        else:
+            product_master_cnt, diag = import_product_master(product_master_path, conn)
             print(f"分店商品档案: {product_master_cnt} 条", diag or "", flush=True)
+            record_import(
+                conn, pm_digest, "product_master", product_master_path, STORE_ID, product_master_cnt,
+                status="ok" if product_master_cnt else "failed", message=diag and str(diag),
+            )
+    if len(batch["skipped"]) == len(batch_files) and (pm_skipped or not product_master_path):
+        # 全部文件都已导入过：不再刷新、去重、清理
+        conn.close()
+        print("所有文件均已导入过，未做任何改动。", flush=True)
+        sys.exit(0)
 
     if sale_daily_cnt > 0 or sale_summary_cnt > 0:
-        refresh_profit(conn)
+        refresh_profit(conn, sale_parts)
         print("毛利表已刷新", flush=True)
-        cat_cnt = refresh_category_from_sale(conn)
+        cat_cnt = refresh_category_from_sale(conn, sale_parts)
         print(f"品类表(从销售透视): {cat_cnt} 条", flush=True)
         try:
             n = sync_products_table(conn, store_id=STORE_ID)
@@ -278,26 +294,27 @@ def main():
         else:
             print("去重跳过或失败，数据仍以当前导入为准", flush=True)
 
-    print("清理误导入的合计/汇总行...", flush=True)
-    del_py = os.path.join(project_root, "scripts", "delete_summary_rows.py")
-    try:
-        r = subprocess.run(
-            [sys.executable, del_py],
-            cwd=project_root,
-            timeout=180,
-            capture_output=True,
-            text=True,
-        )
-        if r.stdout:
-            print(r.stdout, end="", flush=True)
-        if r.returncode != 0:
-            print(
-                "清理脚本异常（可手动执行: bash scripts/run_delete_summary_rows.sh）",
-                r.stderr or "",
-                flush=True,
+    if sale_daily_cnt > 0 or sale_summary_cnt > 0 or stock_cnt > 0:
+        print("清理误导入的合计/汇总行...", flush=True)
+        del_py = os.path.join(project_root, "scripts", "delete_summary_rows.py")
+        try:
+            r = subprocess.run(
+                [sys.executable, del_py],
+                cwd=project_root,
+                timeout=180,
+                capture_output=True,
+                text=True,
             )
-    except (subprocess.TimeoutExpired, OSError) as e:
-        print(f"清理合计行失败: {e}", flush=True)
+            if r.stdout:
+                print(r.stdout, end="", flush=True)
+            if r.returncode != 0:
+                print(
+                    "清理脚本异常（可手动执行: bash scripts/run_delete_summary_rows.sh）",
+                    r.stderr or "",
+                    flush=True,
+                )
+        except (subprocess.TimeoutExpired, OSError) as e:
+            print(f"清理合计行失败: {e}", flush=True)
 
     # 再次连接输出最终统计与数据质量
     conn2 = get_conn()
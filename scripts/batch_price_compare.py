@@ -12,6 +12,7 @@ from datetime import datetime
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from htma_dashboard.db_config import get_conn
 from htma_dashboard.baidu_skill_compare import call_baidu_skill
+from htma_dashboard.price_cache import PRICE_CACHE_ENABLED, PriceCache, cache_key, fetch_with_status
 
 STORE_ID = os.environ.get("HTMA_STORE_ID", "沈阳超级仓")
 
@@ -94,10 +95,26 @@ def save_price_result(conn, sku_code, product_name, brand, platform_data):
     cur.close()
 
 
+def _min_price(platform_data):
+    """Skill 返回各平台价格中的最低价（写入缓存的 min_price 列）。"""
+    prices = []
+    for info in (platform_data or {}).values():
+        try:
+            p = float(info.get("price")) if isinstance(info, dict) and info.get("price") is not None else None
+        except (TypeError, ValueError):
+            p = None
+        if p and p > 0:
+            prices.append(p)
+    return min(prices) if prices else None
+
+
 def main():
     top_n = int(os.environ.get("PRICE_COMPARE_TOP_N", "50"))
     min_price = float(os.environ.get("PRICE_COMPARE_MIN_PRICE", "5000"))
     delay = float(os.environ.get("PRICE_COMPARE_DELAY", "1"))
+    # 缓存可接受的最长秒数（缺省按 HTMA_PRICE_CACHE_TTL）；近期查过的商品直接用缓存，不再调用 Skill
+    max_age = os.environ.get("PRICE_COMPARE_MAX_AGE")
+    max_age = int(max_age) if max_age else None
 
     conn = get_conn()
     try:
@@ -106,13 +123,28 @@ def main():
             print("没有符合条件的大额商品（近30天销售单价>=%s）" % min_price)
             return
         print("待比价 %s 个商品（单价>=%s 元）" % (len(products), min_price))
+        cache = PriceCache(conn, "call_baidu_skill", max_age=max_age) if PRICE_CACHE_ENABLED else None
+        keys = {item["sku_code"]: cache_key(None, f"{item.get('brand') or ''} {item['product_name']}") for item in products}
+        cached = cache.get_many(keys.values()) if cache else {}
         for item in products:
             print("  比价: %s (最高单价: %s)" % (item["product_name"] or item["sku_code"], item.get("max_price")))
-            result = call_baidu_skill(
-                item["product_name"],
-                brand=item.get("brand") or None,
-                max_price=item.get("max_price"),
-            )
+            key = keys[item["sku_code"]]
+            from_cache = key in cached
+            if from_cache:
+                print("    命中缓存")
+                result = {"status": "success", "data": cached[key]["data"]} if cached[key] else {"status": "error"}
+            else:
+                result, errored = fetch_with_status(
+                    lambda: call_baidu_skill(
+                        item["product_name"],
+                        brand=item.get("brand") or None,
+                        max_price=item.get("max_price"),
+                    )
+                )
+                ok = result.get("status") == "success" and result.get("data")
+                if cache and (ok or not errored):  # 网关/runner 故障导致的无结果不做负缓存
+                    entry = {"min_price": _min_price(result["data"]), "data": result["data"], "match_type": result.get("match_type")} if ok else None
+                    cache.put_many([(key, entry)])
             if result.get("status") == "success" and result.get("data"):
                 save_price_result(
                     conn,
@@ -121,7 +153,7 @@ def main():
                     item.get("brand") or "",
                     result["data"],
                 )
-            if delay > 0:
+            if delay > 0 and not from_cache:
                 import time
                 time.sleep(delay)
         print("批量比价完成")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消费洞察基准：对比逐面板查询版（_get_consumer_insight_data_multi）与单次扫描版（consumer_insight.build_consumer_insight）
+的耗时与 SQL 条数，并逐字段核对两者输出一致（不一致时打印首个差异路径并以 1 退出）。
+直接调用数据函数，不经接口缓存。需 .env 中 MYSQL_* 指向有数据的库。
+
+用法：在项目根目录执行
+  python scripts/bench_consumer_insight.py                              # 近30天，各跑 5 轮
+  python scripts/bench_consumer_insight.py --start 2026-01-01 --end 2026-03-31 --rounds 10
+  python scripts/bench_consumer_insight.py --category 食品 --brand 某品牌   # 带筛选与下钻
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "htma_dashboard"))
+sys.path.insert(0, _ROOT)
+
+
+def _diff(a, b, path="$"):
+    """返回首个不一致的路径，一致返回 None。"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in sorted(set(a) | set(b), key=str):
+            if k not in a or k not in b:
+                return f"{path}.{k}（仅一侧存在）"
+            d = _diff(a[k], b[k], f"{path}.{k}")
+            if d:
+                return d
+        return None
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return f"{path}（长度 {len(a)} != {len(b)}）"
+        for i, (x, y) in enumerate(zip(a, b)):
+            d = _diff(x, y, f"{path}[{i}]")
+            if d:
+                return d
+        return None
+    return None if a == b else f"{path}: {a!r} != {b!r}"
+
+
+def _count_queries():
+    """给 pymysql 游标的 execute 计数，返回计数器 dict。"""
+    import pymysql.cursors
+
+    counter = {"n": 0}
+    orig = pymysql.cursors.Cursor.execute
+
+    def execute(self, query, args=None):
+        counter["n"] += 1
+        return orig(self, query, args)
+
+    pymysql.cursors.Cursor.execute = execute
+    return counter
+
+
+def _run(fn, override, rounds, counter):
+    times, result, queries = [], None, 0
+    for _ in range(rounds):
+        counter["n"] = 0
+        t0 = time.perf_counter()
+        result = fn(param_override=override)
+        times.append((time.perf_counter() - t0) * 1000)
+        queries = counter["n"]
+    return result, times, queries
+
+
+def main():
+    ap = argparse.ArgumentParser(description="消费洞察逐面板查询 vs 单次扫描 基准")
+    ap.add_argument("--period", default="recent30")
+    ap.add_argument("--start", dest="start_date")
+    ap.add_argument("--end", dest="end_date")
+    ap.add_argument("--category")
+    ap.add_argument("--brand")
+    ap.add_argument("--product-name", dest="product_name")
+    ap.add_argument("--rounds", type=int, default=5)
+    args = ap.parse_args()
+    override = {k: v for k, v in vars(args).items() if k != "rounds" and v}
+    override.setdefault("period", "recent30")
+
+    counter = _count_queries()
+    import app as dashboard
+
+    scan_errors = []
+    build = dashboard.build_consumer_insight
+
+    def _build(*a, **kw):
+        try:
+            return build(*a, **kw)
+        except Exception as e:  # 单次扫描失败时接口会退回逐面板查询，基准需报告出来
+            scan_errors.append(e)
+            raise
+
+    dashboard.build_consumer_insight = _build
+
+    multi, multi_ms, multi_q = _run(dashboard._get_consumer_insight_data_multi, override, args.rounds, counter)
+    single, single_ms, single_q = _run(dashboard._get_consumer_insight_data, override, args.rounds, counter)
+
+    if scan_errors:
+        print(f"单次扫描失败，已退回逐面板查询: {scan_errors[0]!r}")
+        sys.exit(1)
+    print(f"参数: {override}，每种 {args.rounds} 轮")
+    for name, ms, q in (("逐面板查询", multi_ms, multi_q), ("单次扫描", single_ms, single_q)):
+        print(f"  {name:<6} SQL {q:>3} 条  中位 {statistics.median(ms):8.1f} ms  最小 {min(ms):8.1f} ms  最大 {max(ms):8.1f} ms")
+    print(f"  加速比（中位）: {statistics.median(multi_ms) / max(statistics.median(single_ms), 1e-9):.2f}x")
+
+    d = _diff(multi, single)
+    if d:
+        print(f"输出不一致: {d}")
+        sys.exit(1)
+    print("输出一致")
+
+
+if __name__ == "__main__":
+    main()
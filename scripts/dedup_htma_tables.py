@@ -164,11 +164,24 @@ def main():
     # 整理后自动更新衍生表：销售去重后重算毛利并同步品类；库存/销售去重后同步商品表；毛利去重后同步品类表
     if sale_dupe_rows > 0 or stock_dupe_rows > 0 or profit_dupe_rows > 0:
         sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "htma_dashboard"))
-        from import_logic import refresh_profit, sync_products_table, sync_category_table
+        from import_logic import STORE_ID, refresh_profit, sync_products_table, sync_category_table
+        from sale_rollup import refresh_sale_rollup
+        from stock_latest import refresh_stock_latest
         if sale_dupe_rows > 0:
-            refresh_profit(conn)
+            refresh_profit(conn, full=True)
             conn.commit()
             print("已刷新毛利表（按销售表重新汇总）。", flush=True)
+            try:
+                refresh_sale_rollup(conn, STORE_ID)
+                print("已重建销售日汇总表。", flush=True)
+            except Exception as e:
+                print(f"销售日汇总表重建跳过: {e}", flush=True)
+        if stock_dupe_rows > 0:
+            try:
+                refresh_stock_latest(conn, STORE_ID)
+                print("已重建最新库存表。", flush=True)
+            except Exception as e:
+                print(f"最新库存表重建跳过: {e}", flush=True)
         if sale_dupe_rows > 0 or stock_dupe_rows > 0:
             try:
                 n = sync_products_table(conn)
@@ -216,10 +216,34 @@ def main():
     # 若删除了销售表数据，按日期+品类汇总的毛利表应重新从销售表生成
     if deleted_sale > 0:
         sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "htma_dashboard"))
-        from import_logic import refresh_profit
-        refresh_profit(conn)
+        from import_logic import STORE_ID, refresh_profit
+        from sale_rollup import refresh_sale_rollup
+        from sku_dim import refresh_sku_dim
+        refresh_profit(conn, full=True)
         conn.commit()
         print("已根据销售表重新刷新毛利表。", flush=True)
+        try:
+            refresh_sale_rollup(conn, STORE_ID)
+            print("已重建销售日汇总表。", flush=True)
+        except Exception as e:
+            print(f"销售日汇总表重建跳过: {e}", flush=True)
+        # 汇总/合计行的「货号」已从销售表删除，SKU 维表全量重建去掉这些行
+        try:
+            refresh_sku_dim(conn, STORE_ID)
+            print("已重建 SKU 维表。", flush=True)
+        except Exception as e:
+            print(f"SKU 维表重建跳过: {e}", flush=True)
+
+    # 若删除了库存表数据，最新库存表可能仍指向已删除的行，全量重建
+    if deleted_stock > 0:
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "htma_dashboard"))
+        from import_logic import STORE_ID
+        from stock_latest import refresh_stock_latest
+        try:
+            refresh_stock_latest(conn, STORE_ID)
+            print("已重建最新库存表。", flush=True)
+        except Exception as e:
+            print(f"最新库存表重建跳过: {e}", flush=True)
 
     conn.close()
     print("完成。", flush=True)
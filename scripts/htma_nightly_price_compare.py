@@ -38,7 +38,7 @@ def main():
             limit=limit,
             use_mock_fetcher=False,
             save_to_db=True,
-            fetch_limit=fetch_limit or limit,
+            fetch_limit=limit if fetch_limit is None else fetch_limit,
         )
         report = format_report(result)
         items = result.get("items", [])
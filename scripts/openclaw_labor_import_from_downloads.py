@@ -7,6 +7,7 @@
   .venv/bin/python scripts/openclaw_labor_import_from_downloads.py --clear -f "~/Downloads/1月薪资.xlsx" -f "~/Downloads/12月薪资表-沈阳金融中心(1).xlsx" 2026-01 2025-12
   .venv/bin/python scripts/openclaw_labor_import_from_downloads.py --rebuild --clear 2026-01 2025-12 --dir ~/Downloads
   或一键: bash scripts/openclaw_labor_rebuild_and_import.sh 2026-01 2025-12
+同一月份已成功导入过内容相同的 Excel 时跳过该月（见导入清单 t_htma_import_manifest）；--force、--clear、--rebuild 时照常导入。
 """
 import os
 import sys
@@ -146,6 +147,7 @@ def main():
     ap.add_argument("--clear", action="store_true", help="导入前清空人力成本明细与汇总表")
     ap.add_argument("--dir", "-d", default=None, help="下载目录，默认 IMPORT_DOWNLOADS_DIR 或 ~/Downloads")
     ap.add_argument("--file", "-f", action="append", dest="files", help="指定 Excel 路径，可多次使用以按月份一一对应；不指定则从 --dir 中查找一个")
+    ap.add_argument("--force", action="store_true", help="内容已导入过的 Excel 也重新导入（--clear/--rebuild 时自动生效）")
     ap.add_argument("--yes", "-y", action="store_true", help="跳过确认")
     args = ap.parse_args()
 
@@ -227,7 +229,10 @@ def main():
         print("")
 
     from htma_dashboard.db_config import get_conn
-    from htma_dashboard.import_logic import import_labor_cost, refresh_labor_cost_analysis
+    from htma_dashboard.import_logic import STORE_ID, import_labor_cost, refresh_labor_cost_analysis
+    from htma_dashboard.import_manifest import file_digest, find_import, record_import
+
+    force = args.force or args.clear or args.rebuild
 
     conn = get_conn()
     try:
@@ -236,9 +241,25 @@ def main():
         all_dupes = []
         # 单文件时对所有月份用同一文件；多文件时与 report_months 一一对应
         month_file_pairs = list(zip(report_months, files)) if len(files) == len(report_months) else [(m, files[0]) for m in report_months]
+        imported = 0
         for report_month, excel_path in month_file_pairs:
+            kind = "labor_cost:" + report_month
+            digest = file_digest(excel_path)
+            if not force and find_import(conn, digest, kind, STORE_ID):
+                cur = conn.cursor()
+                cur.execute("SELECT COUNT(*) AS c FROM t_htma_labor_cost WHERE report_month=%s", (report_month,))
+                row = cur.fetchone()
+                cur.close()
+                if (row.get("c") if isinstance(row, dict) else row[0]) if row else 0:
+                    print(">>> 跳过", report_month, " <- ", excel_path, "（内容已导入过，--force 强制重新导入）")
+                    continue
             print(">>> 导入", report_month, " <- ", excel_path, "...")
             counts, diag, dupes = import_labor_cost(excel_path, report_month, conn)
+            imported += 1
+            record_import(
+                conn, digest, kind, excel_path, STORE_ID, sum(counts.values()),
+                status="ok" if any(counts.values()) else "failed", message="; ".join(map(str, diag or []))[:500] or None,
+            )
             if dupes:
                 all_dupes.extend(dupes)
             parts = [f"{labels.get(k, k)} {v} 条" for k, v in counts.items() if v]
@@ -246,9 +267,10 @@ def main():
             if diag:
                 for d in diag:
                     print("   ", d)
-        print("\n>>> 刷新 t_htma_labor_cost_analysis ...")
-        n = refresh_labor_cost_analysis(conn)
-        print("   已刷新", n, "个月份")
+        if imported:
+            print("\n>>> 刷新 t_htma_labor_cost_analysis ...")
+            n = refresh_labor_cost_analysis(conn)
+            print("   已刷新", n, "个月份")
 
         # 期望值优先级：expected_labor.json > Excel 合计 sheet 解析 > 内置默认。零容差校验（人数与汇总金额必须一致）
         EXPECTED_FALLBACK = {
@@ -7,6 +7,7 @@
   python scripts/openclaw_product_master_import_from_downloads.py
   python scripts/openclaw_product_master_import_from_downloads.py --dir ~/Downloads
   python scripts/openclaw_product_master_import_from_downloads.py -f /path/to/分店商品档案_20260306-_101750.xlsx
+  python scripts/openclaw_product_master_import_from_downloads.py --force   # 内容已导入过的文件也重新导入
 """
 import os
 import sys
@@ -48,6 +49,7 @@ def main():
     ap = argparse.ArgumentParser(description="从下载目录或指定文件导入分店商品档案")
     ap.add_argument("--dir", "-d", default=None, help="扫描目录，默认 IMPORT_DOWNLOADS_DIR 或 ~/Downloads")
     ap.add_argument("-f", "--file", action="append", dest="files", default=[], help="指定 Excel 文件，可多次")
+    ap.add_argument("--force", action="store_true", help="内容已导入过的文件也重新导入（默认按导入清单跳过）")
     args = ap.parse_args()
     directory = args.dir or _downloads_dir()
     if not os.path.isdir(directory) and not args.files:
@@ -55,7 +57,8 @@ def main():
         sys.exit(1)
 
     from htma_dashboard.db_config import get_conn
-    from htma_dashboard.import_logic import import_product_master
+    from htma_dashboard.import_logic import STORE_ID, import_product_master
+    from htma_dashboard.import_manifest import file_digest, find_import, record_import
 
     files_to_import = list(args.files) if args.files else []
     if not files_to_import and os.path.isdir(directory):
@@ -76,7 +79,12 @@ def main():
             if not os.path.isfile(path):
                 print("  跳过（不存在）: %s" % path, flush=True)
                 continue
+            digest = file_digest(path)
+            if not args.force and find_import(conn, digest, "product_master", STORE_ID):
+                print("  跳过（内容已导入过，--force 强制重新导入）: %s" % os.path.basename(path), flush=True)
+                continue
             cnt, msg = import_product_master(path, conn)
+            record_import(conn, digest, "product_master", path, STORE_ID, cnt, status="ok" if cnt else "failed", message=msg and str(msg))
             total += cnt
             print("  %s: %s" % (os.path.basename(path), msg), flush=True)
         print("合计导入: %d 条" % total, flush=True)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定期清理品类主数据表 t_htma_category 中销售表已不再出现的品类编码组合。
+导入后品类表只做增量 upsert（不清空），旧品类由本脚本（或 run_full_import.py）清理。
+用法: python3 scripts/prune_unused_categories.py
+数据库配置从项目根目录 .env 的 MYSQL_* 读取。
+"""
+import os
+import sys
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(_ROOT, ".env"))
+except ImportError:
+    pass
+sys.path.insert(0, _ROOT)
+from htma_dashboard.db_config import get_conn
+from htma_dashboard.import_logic import prune_unused_categories
+
+
+def main():
+    conn = get_conn()
+    try:
+        n = prune_unused_categories(conn)
+        print(f"品类表清理已无销售的品类: {n} 条", flush=True)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
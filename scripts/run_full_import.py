@@ -51,9 +51,13 @@ def main():
         import_stock,
         refresh_profit,
         refresh_category_from_sale,
+        prune_unused_categories,
         sync_products_table,
         sync_category_table,
     )
+    from htma_dashboard.sale_rollup import refresh_sale_rollup
+    from htma_dashboard.sku_dim import refresh_sku_dim
+    from htma_dashboard.stock_latest import refresh_stock_latest
 
     conn = get_conn()
 
@@ -78,23 +82,44 @@ def main():
 
     sale_daily_cnt = sale_summary_cnt = stock_cnt = 0
     if has_sale_daily:
-        sale_daily_cnt, diag = import_sale_daily(files["sale_daily"], conn)
+        sale_daily_cnt, diag, _ = import_sale_daily(files["sale_daily"], conn)
         print(f"销售日报: {sale_daily_cnt} 条", diag or "", flush=True)
     if has_sale_summary:
         # 与日报同传时：同(日期,货号)覆盖不累加，避免销售额翻倍
-        sale_summary_cnt, diag = import_sale_summary(
+        sale_summary_cnt, diag, _ = import_sale_summary(
             files["sale_summary"], conn, overwrite_on_duplicate=has_sale_daily
         )
         print(f"销售汇总: {sale_summary_cnt} 条", diag or "", flush=True)
     if "stock" in files:
         stock_cnt, stock_diag = import_stock(files["stock"], conn)
         print(f"库存: {stock_cnt} 条", stock_diag or "", flush=True)
+        # 库存表已清空重导，导入时只按新文件日期合并，需全量重建最新库存表以清掉旧货号
+        try:
+            n = refresh_stock_latest(conn, STORE_ID)
+            print(f"最新库存表已重建: {n} 条", flush=True)
+        except Exception as e:
+            print(f"最新库存表重建失败: {e}", flush=True)
 
+    if has_sale_daily and has_sale_summary:
+        # 销售表已清空重导，导入时只按新文件日期增量重算，需全量重建销售日汇总表以清掉旧日期
+        try:
+            n = refresh_sale_rollup(conn, STORE_ID)
+            print(f"销售日汇总表已重建: {n} 条", flush=True)
+        except Exception as e:
+            print(f"销售日汇总表重建失败: {e}", flush=True)
+        # SKU 维表同理：全量重建以去掉已不在销售表中的货号，并按最新库存/商品档案补齐
+        try:
+            n = refresh_sku_dim(conn, STORE_ID)
+            print(f"SKU 维表已重建: {n} 条", flush=True)
+        except Exception as e:
+            print(f"SKU 维表重建失败: {e}", flush=True)
     if sale_daily_cnt > 0 or sale_summary_cnt > 0:
-        refresh_profit(conn)
+        refresh_profit(conn, full=True)
         print("毛利表已刷新", flush=True)
         cat_cnt = refresh_category_from_sale(conn)
         print(f"品类表(从销售透视): {cat_cnt} 条", flush=True)
+        pruned = prune_unused_categories(conn)
+        print(f"品类表清理已无销售的品类: {pruned} 条", flush=True)
         try:
             products_synced = sync_products_table(conn, store_id=STORE_ID)
             print(f"商品表同步: {products_synced} 条", flush=True)